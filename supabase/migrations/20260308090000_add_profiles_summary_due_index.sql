@@ -0,0 +1,80 @@
+-- Indice de "usuarios devidos" para o Summi da Hora:
+-- - profiles.proximo_summi_em = ultimo_summi_em + summi_frequencia, mantido por trigger
+--   sempre que o envio ou as preferencias de frequencia/horario mudam
+-- - RPC summi_due_profiles devolve apenas assinantes ativos com envio vencido,
+--   para o job horario nao varrer toda a base de assinantes
+
+ALTER TABLE public.profiles
+  ADD COLUMN IF NOT EXISTS proximo_summi_em TIMESTAMPTZ DEFAULT NULL;
+
+COMMENT ON COLUMN public.profiles.proximo_summi_em IS 'Proximo envio do Summi da Hora (NULL = nunca enviado, devido imediatamente)';
+
+CREATE OR REPLACE FUNCTION public.summi_frequency_interval(p_frequencia text)
+RETURNS interval
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT CASE COALESCE(btrim(p_frequencia), '1h')
+    WHEN '3h' THEN interval '3 hours'
+    WHEN '6h' THEN interval '6 hours'
+    WHEN '12h' THEN interval '12 hours'
+    WHEN '24h' THEN interval '24 hours'
+    ELSE interval '1 hour'
+  END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.set_profiles_proximo_summi_em()
+RETURNS trigger
+LANGUAGE plpgsql
+SET search_path = public
+AS $$
+BEGIN
+  IF NEW.ultimo_summi_em IS NULL THEN
+    NEW.proximo_summi_em := NULL;
+  ELSE
+    NEW.proximo_summi_em := NEW.ultimo_summi_em + public.summi_frequency_interval(NEW.summi_frequencia);
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_profiles_proximo_summi_em ON public.profiles;
+CREATE TRIGGER trg_profiles_proximo_summi_em
+  BEFORE INSERT OR UPDATE OF ultimo_summi_em, summi_frequencia, apenas_horario_comercial
+  ON public.profiles
+  FOR EACH ROW
+  EXECUTE FUNCTION public.set_profiles_proximo_summi_em();
+
+UPDATE public.profiles
+SET proximo_summi_em = ultimo_summi_em + public.summi_frequency_interval(summi_frequencia)
+WHERE ultimo_summi_em IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_profiles_proximo_summi_em
+  ON public.profiles (proximo_summi_em NULLS FIRST);
+
+CREATE OR REPLACE FUNCTION public.summi_due_profiles(
+  p_now timestamptz DEFAULT now(),
+  p_limit integer DEFAULT 1000
+)
+RETURNS SETOF public.profiles
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT p.*
+  FROM public.profiles p
+  WHERE (p.proximo_summi_em IS NULL OR p.proximo_summi_em <= p_now)
+    AND EXISTS (
+      SELECT 1
+      FROM public.subscribers s
+      WHERE s.user_id = p.id
+        AND s.subscribed = true
+        AND s.subscription_end >= p_now
+    )
+  ORDER BY p.proximo_summi_em ASC NULLS FIRST
+  LIMIT GREATEST(COALESCE(p_limit, 1000), 1);
+$$;
+
+REVOKE ALL ON FUNCTION public.summi_due_profiles(timestamptz, integer) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.summi_due_profiles(timestamptz, integer) TO service_role;
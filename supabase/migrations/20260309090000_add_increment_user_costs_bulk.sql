@@ -0,0 +1,87 @@
+-- Incremento em lote de user_costs para o ledger de custos do worker:
+-- - recebe um array jsonb de agregados {user_id, date, operation_col, cost, calls, tokens, audio_minutes}
+-- - reagrega por (user_id, date) e faz um unico INSERT ... ON CONFLICT por flush,
+--   em vez de uma chamada increment_user_cost por chamada de IA
+
+CREATE OR REPLACE FUNCTION public.increment_user_costs_bulk(p_rows jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_count integer;
+BEGIN
+  WITH input AS (
+    SELECT
+      (r->>'user_id')::uuid AS user_id,
+      (r->>'date')::date AS date,
+      r->>'operation_col' AS operation_col,
+      COALESCE((r->>'cost')::numeric, 0) AS cost,
+      COALESCE((r->>'calls')::integer, 0) AS calls,
+      COALESCE((r->>'tokens')::bigint, 0) AS tokens,
+      COALESCE((r->>'audio_minutes')::numeric, 0) AS audio_minutes
+    FROM jsonb_array_elements(COALESCE(p_rows, '[]'::jsonb)) AS r
+  ),
+  agg AS (
+    SELECT
+      user_id,
+      date,
+      COALESCE(SUM(cost) FILTER (WHERE operation_col = 'transcription_cost_usd'), 0) AS transcription_cost_usd,
+      COALESCE(SUM(cost) FILTER (WHERE operation_col = 'analysis_cost_usd'), 0) AS analysis_cost_usd,
+      COALESCE(SUM(cost) FILTER (WHERE operation_col = 'summary_cost_usd'), 0) AS summary_cost_usd,
+      COALESCE(SUM(cost) FILTER (WHERE operation_col = 'tts_cost_usd'), 0) AS tts_cost_usd,
+      SUM(cost) AS cost,
+      SUM(calls) AS calls,
+      SUM(tokens) AS tokens,
+      SUM(audio_minutes) AS audio_minutes
+    FROM input
+    WHERE user_id IS NOT NULL AND date IS NOT NULL
+    GROUP BY user_id, date
+  )
+  INSERT INTO public.user_costs (
+    user_id,
+    date,
+    transcription_cost_usd,
+    analysis_cost_usd,
+    summary_cost_usd,
+    tts_cost_usd,
+    cost_openai_usd,
+    cost_total_usd,
+    call_count,
+    tokens_used,
+    audio_minutes
+  )
+  SELECT
+    user_id,
+    date,
+    transcription_cost_usd,
+    analysis_cost_usd,
+    summary_cost_usd,
+    tts_cost_usd,
+    cost,
+    cost,
+    calls,
+    tokens,
+    audio_minutes
+  FROM agg
+  ON CONFLICT (user_id, date)
+  DO UPDATE SET
+    transcription_cost_usd = public.user_costs.transcription_cost_usd + EXCLUDED.transcription_cost_usd,
+    analysis_cost_usd = public.user_costs.analysis_cost_usd + EXCLUDED.analysis_cost_usd,
+    summary_cost_usd = public.user_costs.summary_cost_usd + EXCLUDED.summary_cost_usd,
+    tts_cost_usd = public.user_costs.tts_cost_usd + EXCLUDED.tts_cost_usd,
+    cost_openai_usd = public.user_costs.cost_openai_usd + EXCLUDED.cost_openai_usd,
+    cost_total_usd = public.user_costs.cost_total_usd + EXCLUDED.cost_total_usd,
+    call_count = public.user_costs.call_count + EXCLUDED.call_count,
+    tokens_used = public.user_costs.tokens_used + EXCLUDED.tokens_used,
+    audio_minutes = public.user_costs.audio_minutes + EXCLUDED.audio_minutes,
+    updated_at = now();
+
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  RETURN v_count;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.increment_user_costs_bulk(jsonb) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.increment_user_costs_bulk(jsonb) TO service_role;
@@ -0,0 +1,4 @@
+-- Tokens de input servidos do cache de prefixo do provedor (OpenAI prompt caching /
+-- cache implicito do Gemini). Ja incluidos em tokens_input; cobrados com desconto.
+ALTER TABLE public.cost_logs
+  ADD COLUMN IF NOT EXISTS tokens_cached INT DEFAULT 0;
@@ -0,0 +1,73 @@
+-- Candidatos a analise em uma unica consulta indexada:
+-- - RPC chats_needing_analysis devolve so os chats com evento novo desde a ultima analise
+--   (analisado_em IS NULL OR ultimo_evento_em > analisado_em), comparacao coluna-coluna
+--   que o PostgREST nao faz; antes o worker fazia 2 consultas e filtrava em memoria
+-- - conversa (payload grande) so vem quando p_include_conversa = true
+-- - indices compostos por usuario substituem o indice simples em chats(id_usuario)
+
+CREATE INDEX IF NOT EXISTS idx_chats_id_usuario_remote_jid
+  ON public.chats (id_usuario, remote_jid);
+
+CREATE INDEX IF NOT EXISTS idx_chats_id_usuario_analisado_em
+  ON public.chats (id_usuario, analisado_em);
+
+CREATE INDEX IF NOT EXISTS idx_chats_id_usuario_nao_analisados
+  ON public.chats (id_usuario, modificado_em DESC)
+  WHERE analisado_em IS NULL;
+
+-- Coberto pelo prefixo dos indices compostos acima.
+DROP INDEX IF EXISTS public.idx_chats_id_usuario;
+
+CREATE OR REPLACE FUNCTION public.chats_needing_analysis(
+  p_user_id uuid,
+  p_ignore_remote_jid text DEFAULT NULL,
+  p_remote_jids text[] DEFAULT NULL,
+  p_include_conversa boolean DEFAULT false,
+  p_limit integer DEFAULT 250
+)
+RETURNS TABLE (
+  id uuid,
+  id_usuario uuid,
+  remote_jid text,
+  nome text,
+  criado_em timestamptz,
+  modificado_em timestamptz,
+  ultimo_evento_em timestamptz,
+  contexto text,
+  analisado_em timestamptz,
+  prioridade text,
+  conversa jsonb
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT
+    c.id,
+    c.id_usuario,
+    c.remote_jid,
+    c.nome,
+    c.criado_em,
+    c.modificado_em,
+    c.ultimo_evento_em,
+    c.contexto,
+    c.analisado_em,
+    c.prioridade,
+    CASE WHEN p_include_conversa THEN c.conversa ELSE NULL END
+  FROM public.chats c
+  WHERE c.id_usuario = p_user_id
+    AND (p_ignore_remote_jid IS NULL OR c.remote_jid <> p_ignore_remote_jid)
+    AND (p_remote_jids IS NULL OR c.remote_jid = ANY (p_remote_jids))
+    AND (
+      c.analisado_em IS NULL
+      OR COALESCE(c.ultimo_evento_em, c.modificado_em) > c.analisado_em
+    )
+  ORDER BY
+    (c.analisado_em IS NULL) DESC,
+    COALESCE(c.ultimo_evento_em, c.modificado_em) DESC NULLS LAST
+  LIMIT GREATEST(COALESCE(p_limit, 250), 1);
+$$;
+
+REVOKE ALL ON FUNCTION public.chats_needing_analysis(uuid, text, text[], boolean, integer) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.chats_needing_analysis(uuid, text, text[], boolean, integer) TO service_role;
@@ -0,0 +1,111 @@
+-- Ingestao de mensagens em um unico statement:
+-- - funde chats duplicados (mesmo id_usuario + remote_jid), criados pela corrida
+--   SELECT -> INSERT entre webhooks simultaneos; o chat mais antigo fica com as
+--   conversas concatenadas em ordem de criacao
+-- - UNIQUE (id_usuario, remote_jid) impede novas duplicatas
+-- - RPC append_chat_event faz insert-ou-append via ON CONFLICT e devolve o id do chat
+
+WITH ranked AS (
+  SELECT
+    c.id,
+    c.conversa,
+    c.ultimo_evento_em,
+    row_number() OVER w AS rn,
+    first_value(c.id) OVER w AS keeper_id,
+    count(*) OVER (PARTITION BY c.id_usuario, c.remote_jid) AS copies
+  FROM public.chats c
+  WINDOW w AS (PARTITION BY c.id_usuario, c.remote_jid ORDER BY c.criado_em ASC NULLS LAST, c.id)
+),
+merged AS (
+  SELECT
+    r.keeper_id,
+    COALESCE(
+      jsonb_agg(e.elem ORDER BY r.rn, e.ord) FILTER (WHERE e.elem IS NOT NULL),
+      '[]'::jsonb
+    ) AS conversa,
+    max(r.ultimo_evento_em) AS ultimo_evento_em
+  FROM ranked r
+  LEFT JOIN LATERAL jsonb_array_elements(
+    CASE WHEN jsonb_typeof(r.conversa) = 'array' THEN r.conversa ELSE '[]'::jsonb END
+  ) WITH ORDINALITY AS e(elem, ord) ON true
+  WHERE r.copies > 1
+  GROUP BY r.keeper_id
+)
+UPDATE public.chats c
+SET
+  conversa = CASE WHEN jsonb_typeof(c.conversa) = 'string' THEN c.conversa ELSE m.conversa END,
+  ultimo_evento_em = GREATEST(c.ultimo_evento_em, m.ultimo_evento_em),
+  analisado_em = NULL
+FROM merged m
+WHERE c.id = m.keeper_id;
+
+DELETE FROM public.chats c
+USING (
+  SELECT
+    id,
+    row_number() OVER (PARTITION BY id_usuario, remote_jid ORDER BY criado_em ASC NULLS LAST, id) AS rn
+  FROM public.chats
+) d
+WHERE c.id = d.id
+  AND d.rn > 1;
+
+ALTER TABLE public.chats
+  DROP CONSTRAINT IF EXISTS chats_id_usuario_remote_jid_key;
+ALTER TABLE public.chats
+  ADD CONSTRAINT chats_id_usuario_remote_jid_key UNIQUE (id_usuario, remote_jid);
+
+-- O indice da constraint cobre (id_usuario, remote_jid).
+DROP INDEX IF EXISTS public.idx_chats_id_usuario_remote_jid;
+
+CREATE OR REPLACE FUNCTION public.append_chat_event(
+  p_user_id uuid,
+  p_remote_jid text,
+  p_nome text,
+  p_grupo text,
+  p_event jsonb,
+  p_legacy_line text DEFAULT NULL,
+  p_event_at timestamptz DEFAULT now()
+)
+RETURNS uuid
+LANGUAGE sql
+VOLATILE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  INSERT INTO public.chats AS c (
+    id_usuario,
+    remote_jid,
+    nome,
+    grupo,
+    prioridade,
+    conversa,
+    ultimo_evento_em
+  )
+  VALUES (
+    p_user_id,
+    p_remote_jid,
+    COALESCE(NULLIF(btrim(p_nome), ''), p_remote_jid),
+    p_grupo,
+    '0',
+    jsonb_build_array(p_event),
+    COALESCE(p_event_at, now())
+  )
+  ON CONFLICT (id_usuario, remote_jid)
+  DO UPDATE SET
+    conversa = CASE jsonb_typeof(c.conversa)
+      WHEN 'array' THEN c.conversa || jsonb_build_array(p_event)
+      -- Formato legado: conversa como texto "- autor: mensagem" por linha.
+      WHEN 'string' THEN to_jsonb(
+        CASE
+          WHEN btrim(c.conversa #>> '{}') = '' THEN COALESCE(p_legacy_line, p_event->>'text', '')
+          ELSE rtrim(c.conversa #>> '{}', E' \t\r\n') || E'\n' || COALESCE(p_legacy_line, p_event->>'text', '')
+        END
+      )
+      ELSE jsonb_build_array(p_event)
+    END,
+    ultimo_evento_em = EXCLUDED.ultimo_evento_em
+  RETURNING c.id;
+$$;
+
+REVOKE ALL ON FUNCTION public.append_chat_event(uuid, text, text, text, jsonb, text, timestamptz) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.append_chat_event(uuid, text, text, text, jsonb, text, timestamptz) TO service_role;
@@ -0,0 +1,181 @@
+-- Compactacao de chats.conversa (tamanho de linha e banda de leitura limitados):
+-- - remove o campo `raw` (payload bruto do webhook, so para debug) de todos os eventos
+-- - mantem os ultimos p_keep_events eventos como estao e dobra os mais antigos em
+--   chats.conversa_resumo, uma linha "- autor: texto" por evento (resumo rolante,
+--   limitado aos ultimos p_summary_max_chars caracteres)
+-- - reduz ainda mais os eventos mantidos enquanto a conversa passar de p_max_bytes
+-- - RPC compact_chat_conversations devolve os bytes antes/depois para o job reportar
+-- - chats_needing_analysis passa a devolver conversa_resumo
+
+ALTER TABLE public.chats
+  ADD COLUMN IF NOT EXISTS conversa_resumo TEXT DEFAULT NULL,
+  ADD COLUMN IF NOT EXISTS compactado_em TIMESTAMPTZ DEFAULT NULL;
+
+COMMENT ON COLUMN public.chats.conversa_resumo IS 'Eventos antigos dobrados pela compactacao (uma linha "- autor: texto" por evento)';
+COMMENT ON COLUMN public.chats.compactado_em IS 'Ultima compactacao de conversa; chats sem evento novo desde entao sao pulados';
+
+CREATE OR REPLACE FUNCTION public.compact_chat_conversations(
+  p_keep_events integer DEFAULT 50,
+  p_max_bytes integer DEFAULT 65536,
+  p_summary_max_chars integer DEFAULT 8000,
+  p_limit integer DEFAULT 500
+)
+RETURNS TABLE (
+  chats_compacted integer,
+  events_folded bigint,
+  bytes_before bigint,
+  bytes_after bigint
+)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  r record;
+  v_events jsonb;
+  v_kept jsonb;
+  v_total integer;
+  v_keep integer;
+  v_kept_bytes integer;
+  v_folded text;
+  v_resumo text;
+  v_max_bytes integer := GREATEST(COALESCE(p_max_bytes, 65536), 1024);
+BEGIN
+  chats_compacted := 0;
+  events_folded := 0;
+  bytes_before := 0;
+  bytes_after := 0;
+
+  FOR r IN
+    SELECT c.id, c.conversa, c.conversa_resumo
+    FROM public.chats c
+    WHERE jsonb_typeof(c.conversa) = 'array'
+      AND (c.compactado_em IS NULL OR c.ultimo_evento_em > c.compactado_em)
+      AND (
+        jsonb_array_length(c.conversa) > GREATEST(COALESCE(p_keep_events, 50), 1)
+        OR octet_length(c.conversa::text) > v_max_bytes
+        OR c.conversa @? '$[*].raw'
+      )
+    ORDER BY octet_length(c.conversa::text) DESC
+    LIMIT GREATEST(COALESCE(p_limit, 500), 1)
+    FOR UPDATE SKIP LOCKED
+  LOOP
+    SELECT COALESCE(jsonb_agg(e.elem - 'raw' ORDER BY e.ord), '[]'::jsonb)
+    INTO v_events
+    FROM jsonb_array_elements(r.conversa) WITH ORDINALITY AS e(elem, ord);
+
+    v_total := jsonb_array_length(v_events);
+    v_keep := LEAST(v_total, GREATEST(COALESCE(p_keep_events, 50), 1));
+
+    LOOP
+      SELECT COALESCE(jsonb_agg(e.elem ORDER BY e.ord), '[]'::jsonb)
+      INTO v_kept
+      FROM jsonb_array_elements(v_events) WITH ORDINALITY AS e(elem, ord)
+      WHERE e.ord > v_total - v_keep;
+
+      v_kept_bytes := octet_length(v_kept::text);
+      EXIT WHEN v_keep <= 1 OR v_kept_bytes <= v_max_bytes;
+      -- Encolhe proporcionalmente ao excesso (sempre pelo menos 1 evento a menos).
+      v_keep := GREATEST(1, LEAST(v_keep - 1, (v_keep::bigint * v_max_bytes / v_kept_bytes)::integer));
+    END LOOP;
+
+    SELECT string_agg(
+      format(
+        '- %s: %s',
+        CASE
+          WHEN e.elem->'from_me' = 'true'::jsonb THEN 'Eu'
+          ELSE COALESCE(NULLIF(btrim(e.elem->>'push_name'), ''), 'Contato')
+        END,
+        btrim(e.elem->>'text')
+      ),
+      E'\n' ORDER BY e.ord
+    ) FILTER (WHERE NULLIF(btrim(e.elem->>'text'), '') IS NOT NULL)
+    INTO v_folded
+    FROM jsonb_array_elements(v_events) WITH ORDINALITY AS e(elem, ord)
+    WHERE e.ord <= v_total - v_keep;
+
+    v_resumo := r.conversa_resumo;
+    IF v_folded IS NOT NULL THEN
+      v_resumo := concat_ws(E'\n', NULLIF(rtrim(v_resumo, E' \t\r\n'), ''), v_folded);
+      IF char_length(v_resumo) > GREATEST(COALESCE(p_summary_max_chars, 8000), 0) THEN
+        v_resumo := right(v_resumo, GREATEST(COALESCE(p_summary_max_chars, 8000), 0));
+      END IF;
+    END IF;
+
+    UPDATE public.chats
+    SET conversa = v_kept,
+        conversa_resumo = v_resumo,
+        compactado_em = now()
+    WHERE id = r.id;
+
+    chats_compacted := chats_compacted + 1;
+    events_folded := events_folded + (v_total - v_keep);
+    bytes_before := bytes_before + octet_length(r.conversa::text) + COALESCE(octet_length(r.conversa_resumo), 0);
+    bytes_after := bytes_after + v_kept_bytes + COALESCE(octet_length(v_resumo), 0);
+  END LOOP;
+
+  RETURN NEXT;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.compact_chat_conversations(integer, integer, integer, integer) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.compact_chat_conversations(integer, integer, integer, integer) TO service_role;
+
+-- Tipo de retorno mudou (conversa_resumo): precisa recriar.
+DROP FUNCTION IF EXISTS public.chats_needing_analysis(uuid, text, text[], boolean, integer);
+
+CREATE FUNCTION public.chats_needing_analysis(
+  p_user_id uuid,
+  p_ignore_remote_jid text DEFAULT NULL,
+  p_remote_jids text[] DEFAULT NULL,
+  p_include_conversa boolean DEFAULT false,
+  p_limit integer DEFAULT 250
+)
+RETURNS TABLE (
+  id uuid,
+  id_usuario uuid,
+  remote_jid text,
+  nome text,
+  criado_em timestamptz,
+  modificado_em timestamptz,
+  ultimo_evento_em timestamptz,
+  contexto text,
+  analisado_em timestamptz,
+  prioridade text,
+  conversa jsonb,
+  conversa_resumo text
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT
+    c.id,
+    c.id_usuario,
+    c.remote_jid,
+    c.nome,
+    c.criado_em,
+    c.modificado_em,
+    c.ultimo_evento_em,
+    c.contexto,
+    c.analisado_em,
+    c.prioridade,
+    CASE WHEN p_include_conversa THEN c.conversa ELSE NULL END,
+    CASE WHEN p_include_conversa THEN c.conversa_resumo ELSE NULL END
+  FROM public.chats c
+  WHERE c.id_usuario = p_user_id
+    AND (p_ignore_remote_jid IS NULL OR c.remote_jid <> p_ignore_remote_jid)
+    AND (p_remote_jids IS NULL OR c.remote_jid = ANY (p_remote_jids))
+    AND (
+      c.analisado_em IS NULL
+      OR COALESCE(c.ultimo_evento_em, c.modificado_em) > c.analisado_em
+    )
+  ORDER BY
+    (c.analisado_em IS NULL) DESC,
+    COALESCE(c.ultimo_evento_em, c.modificado_em) DESC NULLS LAST
+  LIMIT GREATEST(COALESCE(p_limit, 250), 1);
+$$;
+
+REVOKE ALL ON FUNCTION public.chats_needing_analysis(uuid, text, text[], boolean, integer) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.chats_needing_analysis(uuid, text, text[], boolean, integer) TO service_role;
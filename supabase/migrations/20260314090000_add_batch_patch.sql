@@ -0,0 +1,50 @@
+-- PATCH em lote para os jobs do worker (SupabaseRest.patch_many):
+-- - recebe um array jsonb de linhas com as mesmas colunas, incluindo a chave
+-- - um UPDATE ... FROM jsonb_populate_recordset por chamada, em vez de um PATCH por linha
+-- - so tabelas da lista abaixo; colunas passam por %I e pelo tipo da tabela
+
+CREATE OR REPLACE FUNCTION public.batch_patch(
+  p_table text,
+  p_key text,
+  p_rows jsonb
+)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_set text;
+  v_count integer;
+BEGIN
+  IF p_table NOT IN ('chats', 'profiles') THEN
+    RAISE EXCEPTION 'batch_patch: table % not allowed', p_table;
+  END IF;
+  IF jsonb_typeof(p_rows) IS DISTINCT FROM 'array' OR jsonb_array_length(p_rows) = 0 THEN
+    RETURN 0;
+  END IF;
+
+  SELECT string_agg(format('%I = r.%I', k, k), ', ' ORDER BY k)
+  INTO v_set
+  FROM jsonb_object_keys(p_rows->0) AS k
+  WHERE k <> p_key;
+
+  IF v_set IS NULL THEN
+    RETURN 0;
+  END IF;
+
+  EXECUTE format(
+    'UPDATE public.%1$I t SET %2$s FROM jsonb_populate_recordset(NULL::public.%1$I, $1) r WHERE t.%3$I = r.%3$I',
+    p_table,
+    v_set,
+    p_key
+  )
+  USING p_rows;
+
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  RETURN v_count;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.batch_patch(text, text, jsonb) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.batch_patch(text, text, jsonb) TO service_role;
@@ -0,0 +1,45 @@
+-- Paginacao keyset do indice de usuarios devidos (summi_due_profiles):
+-- - ordem estavel por (COALESCE(proximo_summi_em, '-infinity'), id), para nunca-enviados
+--   (NULL) continuarem primeiro sem quebrar a comparacao de tupla
+-- - cursor (p_after_due, p_after_id) = ultima linha da pagina anterior; o worker le
+--   todas as paginas em vez de um unico LIMIT 1000
+-- - indice de expressao na mesma ordem
+
+CREATE INDEX IF NOT EXISTS idx_profiles_summi_due_keyset
+  ON public.profiles ((COALESCE(proximo_summi_em, '-infinity'::timestamptz)), id);
+
+DROP FUNCTION IF EXISTS public.summi_due_profiles(timestamptz, integer);
+
+CREATE OR REPLACE FUNCTION public.summi_due_profiles(
+  p_now timestamptz DEFAULT now(),
+  p_limit integer DEFAULT 1000,
+  p_after_due timestamptz DEFAULT NULL,
+  p_after_id uuid DEFAULT NULL
+)
+RETURNS SETOF public.profiles
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT p.*
+  FROM public.profiles p
+  WHERE COALESCE(p.proximo_summi_em, '-infinity'::timestamptz) <= p_now
+    AND (
+      p_after_id IS NULL
+      OR (COALESCE(p.proximo_summi_em, '-infinity'::timestamptz), p.id)
+         > (COALESCE(p_after_due, '-infinity'::timestamptz), p_after_id)
+    )
+    AND EXISTS (
+      SELECT 1
+      FROM public.subscribers s
+      WHERE s.user_id = p.id
+        AND s.subscribed = true
+        AND s.subscription_end >= p_now
+    )
+  ORDER BY COALESCE(p.proximo_summi_em, '-infinity'::timestamptz), p.id
+  LIMIT GREATEST(COALESCE(p_limit, 1000), 1);
+$$;
+
+REVOKE ALL ON FUNCTION public.summi_due_profiles(timestamptz, integer, timestamptz, uuid) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.summi_due_profiles(timestamptz, integer, timestamptz, uuid) TO service_role;
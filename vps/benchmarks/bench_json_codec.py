@@ -0,0 +1,107 @@
+"""
+Benchmark de CPU de JSON por webhook: stdlib (como era) x json_codec.
+
+Uso:
+    python benchmarks/bench_json_codec.py [audio_kb] [conversa_events]   (a partir de vps/)
+
+Simula o JSON de um webhook de audio:
+- parse do corpo com base64 inline
+- serializacao do evento para a RPC append_chat_event
+- parse da resposta do PostgREST com uma conversa de N eventos
+- serializacao dessa conversa no prompt de analise
+"""
+from __future__ import annotations
+
+import base64
+import json
+import os
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker import json_codec
+
+
+def _webhook_body(audio_kb: int) -> bytes:
+    audio_b64 = base64.b64encode(os.urandom(audio_kb * 1024)).decode("ascii")
+    payload = {
+        "event": "messages.upsert",
+        "instance": "lucasborges_5286",
+        "data": {
+            "key": {"remoteJid": "556299999999@s.whatsapp.net", "fromMe": False, "id": "3EB0C7A1"},
+            "pushName": "Contato",
+            "message": {"audioMessage": {"seconds": 42, "ptt": True}, "base64": audio_b64},
+            "messageType": "audioMessage",
+            "messageTimestamp": 1709000000,
+        },
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def _conversa(events: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "received_at": "2026-03-14T09:00:00+00:00",
+            "event": "messages.upsert",
+            "remote_jid": "556299999999",
+            "push_name": "Contato",
+            "from_me": index % 3 == 0,
+            "message_id": f"3EB0{index:06d}",
+            "message_type": "conversation",
+            "text": "Bom dia! Confirma o orçamento do pedido 4512 com entrega até sexta? " * 2,
+        }
+        for index in range(events)
+    ]
+
+
+def _steps(body: bytes, response: bytes) -> Tuple[Callable[[], Any], Callable[[], Any]]:
+    def stdlib() -> None:
+        payload = json.loads(body.decode("utf-8"))
+        json.dumps({"p_event": {"raw": payload, "text": "transcricao"}})
+        rows = json.loads(response.decode("utf-8"))
+        json.dumps(rows[0]["conversa"], ensure_ascii=False)
+
+    def codec() -> None:
+        payload = json_codec.loads(body)
+        json_codec.dumps_bytes({"p_event": {"raw": payload, "text": "transcricao"}})
+        rows = json_codec.loads(response)
+        json_codec.dumps(rows[0]["conversa"])
+
+    return stdlib, codec
+
+
+def run(audio_kb: int = 512, conversa_events: int = 200, number: int = 50) -> Dict[str, float]:
+    body = _webhook_body(audio_kb)
+    response = json.dumps([{"id": "c1", "conversa": _conversa(conversa_events)}]).encode("utf-8")
+    stdlib, codec = _steps(body, response)
+    stdlib_s = min(timeit.repeat(stdlib, number=number, repeat=3)) / number
+    codec_s = min(timeit.repeat(codec, number=number, repeat=3)) / number
+    return {
+        "backend": json_codec.BACKEND,
+        "body_bytes": len(body),
+        "response_bytes": len(response),
+        "stdlib_ms": stdlib_s * 1000,
+        "codec_ms": codec_s * 1000,
+        "saved_ms_per_webhook": (stdlib_s - codec_s) * 1000,
+    }
+
+
+def main() -> None:
+    audio_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    result = run(audio_kb, events)
+    print(
+        f"backend={result['backend']} body_bytes={result['body_bytes']} response_bytes={result['response_bytes']} "
+        f"stdlib_ms={result['stdlib_ms']:.3f} codec_ms={result['codec_ms']:.3f} "
+        f"saved_ms_per_webhook={result['saved_ms_per_webhook']:.3f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark do parser do webhook (WebhookEvent).
+
+Uso:
+    python benchmarks/bench_webhook_parse.py                 # payloads de exemplo (a partir de vps/)
+    python benchmarks/bench_webhook_parse.py payloads.jsonl  # payloads gravados, 1 JSON por linha
+
+Para gravar payloads reais, salve o corpo de POST /webhooks/evolution (um por
+linha) e remova o base64 se nao quiser medir payloads grandes.
+"""
+from __future__ import annotations
+
+import json
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker.evolution_webhook import parse_webhook_event
+from summi_worker.webhook_samples import sample_payloads
+
+
+def _load_payloads(path: str) -> List[Tuple[str, Any]]:
+    payloads = []
+    with open(path, encoding="utf-8") as handle:
+        for index, line in enumerate(handle):
+            if line.strip():
+                payloads.append((f"line_{index + 1}", json.loads(line)))
+    return payloads
+
+
+def run(payloads: List[Tuple[str, Any]], *, number: int = 20000) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for name, payload in payloads:
+        parse_s = min(timeit.repeat(lambda: parse_webhook_event(payload), number=number, repeat=3))
+        full_s = min(timeit.repeat(lambda: parse_webhook_event(payload).normalized(), number=number, repeat=3))
+        results[name] = {
+            "parse_us": parse_s / number * 1e6,
+            "parse_and_normalize_us": full_s / number * 1e6,
+        }
+    return results
+
+
+def main() -> None:
+    payloads = _load_payloads(sys.argv[1]) if len(sys.argv) > 1 else sample_payloads()
+    for name, row in run(payloads).items():
+        print(f"{name:<24} parse={row['parse_us']:.2f}us parse+normalize={row['parse_and_normalize_us']:.2f}us")
+
+
+if __name__ == "__main__":
+    main()
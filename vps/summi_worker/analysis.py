@@ -1,11 +1,13 @@
 from __future__ import annotations
 
 import datetime as dt
-import json
+import logging
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Tuple
 
-from .openai_client import OpenAIClient, OpenAIUsage
+from . import json_codec
+from .openai_client import OpenAIClient, OpenAIUsage, chat_text_maybe_stream
+from .prompt_budget import PromptSection, fit_prompt
 from .prompt_builders import (
     SUMMI_HOUR_FALLBACK_TEXT,
     build_footer,
@@ -13,6 +15,50 @@ from .prompt_builders import (
     render_summi_hour_audio_fallback,
 )
 
+logger = logging.getLogger("summi_worker.analysis")
+
+# Teto operacional do prompt de analise (~18k caracteres de conversa + instrucoes).
+ANALYSIS_MAX_INPUT_TOKENS = 6000
+CONVERSA_MIN_TOKENS = 500
+THEMES_MIN_TOKENS = 60
+
+# Prefixo estatico (byte a byte identico entre chamadas e usuarios); tudo que varia
+# por usuario/chat vem depois dele. O cache de prefixo do provedor (OpenAI e Gemini)
+# so entra a partir de 1024 tokens iguais no inicio do prompt, e sistema + instrucoes
+# ficam abaixo disso: o cache so vale para prompts mais longos, em que o inicio da
+# conversa tambem se repete (ex.: o mesmo chat reanalisado depois de novas mensagens,
+# ja que os eventos novos entram no fim). O log analysis.prompt_cache mostra os acertos.
+_ANALYSIS_SYSTEM_PROMPT = "Voce e um assistente de WhatsApp. Responda SOMENTE em JSON valido."
+_ANALYSIS_STATIC_PROMPT = (
+    "Voce agora e um assistente de WhatsApp e sua missao e analisar as conversas em um banco de dados "
+    "para me passar o que eu preciso fazer.\n\n"
+    "Para isso preciso que voce faca uma analise do contexto da conversa para entender se eu realmente "
+    "preciso responder aquilo agora ou posso esperar, alem de setar as prioridades de resposta.\n\n"
+    "Muitas mensagens (mais de 5) podem signifcar uma urgencia.\n\n"
+    "Seja bem criterioso pois meu tempo e valioso, se achar que nao vale a pena, nao classifique como urgente, "
+    "melhor errar pra menos do que pra mais.\n\n"
+    "Se perceber que tem mensagens repetidas e o tempo entre a primeira e a ultima e grande, por favor tambem "
+    "classifique como que e preciso responder, dai a urgencia vai depender do contexto.\n\n"
+    "Use os temas de URGÊNCIA, IMPORTÂNCIA e BLACKLIST do usuario, informados abaixo junto com a conversa.\n\n"
+    "Escala de prioridade (0 a 3):\n"
+    "- 3: urgente, precisa ser respondido o quanto antes\n"
+    "- 2: precisa ser respondido hoje\n"
+    "- 1: precisa responder, mas nao hoje\n"
+    "- 0: nao precisa responder OU ja foi respondido pelo vendedor\n\n"
+    "REGRA IMPORTANTE: Se a ultima mensagem da conversa foi enviada pelo vendedor (from_me=true ou from_me=True), "
+    "isso significa que o vendedor JA respondeu. Nesse caso a prioridade DEVE ser 0 "
+    "(a menos que o contexto indique claramente que ainda ha pendencia).\n\n"
+    "Formato EXATO de saida (JSON):\n"
+    "{\n"
+    '  "id": "123",\n'
+    '  "Prioridade": "2",\n'
+    '  "Nome": "(nome de quem mandou)",\n'
+    '  "Telefone": "+(telefone)",\n'
+    '  "Contexto": "(resultado da analise com no maximo 250 caracteres)",\n'
+    '  "Horario": "(horario da primeira mensagem)"\n'
+    "}\n\n"
+)
+
 
 @dataclass(frozen=True)
 class AnalyzedChat:
@@ -30,22 +76,12 @@ def _format_keywords(csv: str | None) -> str:
     return ", ".join([p.strip() for p in csv.split(",") if p.strip()])
 
 
-def _trim_conversa_for_prompt(conversa: Any, max_chars: int = 18000) -> str:
-    """
-    Evita estourar contexto em chats longos. Mantemos o trecho final, que tende a ser
-    o mais relevante para priorizacao.
-    """
+def _conversa_for_prompt(conversa: Any) -> str:
     try:
-        raw = json.dumps(conversa, ensure_ascii=False)
+        # Compacto (sem espacos apos , e :): menos tokens no prompt.
+        return json_codec.dumps(conversa)
     except Exception:
-        raw = str(conversa)
-
-    if len(raw) <= max_chars:
-        return raw
-
-    # Mantem sufixo e marca truncamento de forma explicita para o modelo.
-    suffix = raw[-max_chars:]
-    return f"[CONVERSA_TRUNCADA_TOTAL={len(raw)}]\\n...{suffix}"
+        return str(conversa)
 
 
 def analyze_single_chat(
@@ -61,51 +97,76 @@ def analyze_single_chat(
     temas_urgentes: str | None,
     temas_importantes: str | None,
     blacklist: str | None,
+    max_input_tokens: int | None = ANALYSIS_MAX_INPUT_TOKENS,
 ) -> tuple[AnalyzedChat, Optional[OpenAIUsage]]:
     # Conversa e um JSONB array no banco. Mantemos como string para o prompt.
-    conversa_text = _trim_conversa_for_prompt(conversa)
-
-    system = "Voce e um assistente de WhatsApp. Responda SOMENTE em JSON valido."
-    user = (
-        "Voce agora e um assistente de WhatsApp e sua missao e analisar as conversas em um banco de dados "
-        "para me passar o que eu preciso fazer.\n\n"
-        "Para isso preciso que voce faca uma analise do contexto da conversa para entender se eu realmente "
-        "preciso responder aquilo agora ou posso esperar, alem de setar as prioridades de resposta.\n\n"
-        "Muitas mensagens (mais de 5) podem signifcar uma urgencia.\n\n"
-        "Seja bem criterioso pois meu tempo e valioso, se achar que nao vale a pena, nao classifique como urgente, "
-        "melhor errar pra menos do que pra mais.\n\n"
-        "Se perceber que tem mensagens repetidas e o tempo entre a primeira e a ultima e grande, por favor tambem "
-        "classifique como que e preciso responder, dai a urgencia vai depender do contexto.\n\n"
-        f"CONTEXTO DE URGÊNCIA (Temas que eu considero Urgentes): {temas_urgentes or 'Nenhum definido'}\n\n"
-        f"CONTEXTO DE IMPORTÂNCIA (Temas que eu considero Importantes): {temas_importantes or 'Nenhum definido'}\n\n"
-        f"BLACKLIST (Temas para Ignorar): {blacklist or 'Nenhuma definida'}\n\n"
-        "Escala de prioridade (0 a 3):\n"
-        "- 3: urgente, precisa ser respondido o quanto antes\n"
-        "- 2: precisa ser respondido hoje\n"
-        "- 1: precisa responder, mas nao hoje\n"
-        "- 0: nao precisa responder OU ja foi respondido pelo vendedor\n\n"
-        "REGRA IMPORTANTE: Se a ultima mensagem da conversa foi enviada pelo vendedor (from_me=true ou from_me=True), "
-        "isso significa que o vendedor JA respondeu. Nesse caso a prioridade DEVE ser 0 "
-        "(a menos que o contexto indique claramente que ainda ha pendencia).\n\n"
-        "Formato EXATO de saida (JSON):\n"
-        "{\n"
-        '  "id": "123",\n'
-        '  "Prioridade": "2",\n'
-        '  "Nome": "(nome de quem mandou)",\n'
-        '  "Telefone": "+(telefone)",\n'
-        '  "Contexto": "(resultado da analise com no maximo 250 caracteres)",\n'
-        '  "Horario": "(horario da primeira mensagem)"\n'
-        "}\n\n"
-        f"Id: {chat_id}\n"
-        f"Conversa: {conversa_text}\n"
-        f"Quem Mandou: {nome}\n"
-        f"Telefone: {remote_jid}\n"
-        f"Primeira Mensagem: {criado_em}\n"
-        f"Ultima Mensagem: {modificado_em}\n"
-    )
+    conversa_text = _conversa_for_prompt(conversa)
+
+    sections = [
+        PromptSection("instrucoes", "", label=_ANALYSIS_STATIC_PROMPT),
+        PromptSection(
+            "temas_urgentes",
+            temas_urgentes or "Nenhum definido",
+            label="CONTEXTO DE URGÊNCIA (Temas que eu considero Urgentes): ",
+            priority=40,
+            trim="head",
+            min_tokens=THEMES_MIN_TOKENS,
+        ),
+        PromptSection(
+            "temas_importantes",
+            temas_importantes or "Nenhum definido",
+            label="\n\nCONTEXTO DE IMPORTÂNCIA (Temas que eu considero Importantes): ",
+            priority=30,
+            trim="head",
+            min_tokens=THEMES_MIN_TOKENS,
+        ),
+        PromptSection(
+            "blacklist",
+            blacklist or "Nenhuma definida",
+            label="\n\nBLACKLIST (Temas para Ignorar): ",
+            priority=20,
+            trim="head",
+            min_tokens=THEMES_MIN_TOKENS,
+        ),
+        PromptSection(
+            "conversa",
+            conversa_text,
+            label=f"\n\nId: {chat_id}\nConversa: ",
+            # Chats longos: mantem o final da conversa, que tende a ser o mais relevante.
+            priority=10,
+            trim="tail",
+            min_tokens=CONVERSA_MIN_TOKENS,
+            marker=f"[CONVERSA_TRUNCADA_TOTAL={len(conversa_text)}]...",
+        ),
+        PromptSection(
+            "metadados",
+            "",
+            label=(
+                f"\nQuem Mandou: {nome}\n"
+                f"Telefone: {remote_jid}\n"
+                f"Primeira Mensagem: {criado_em}\n"
+                f"Ultima Mensagem: {modificado_em}\n"
+            ),
+        ),
+    ]
+    user = fit_prompt(
+        sections,
+        model=model,
+        name="analyze_chat",
+        system=_ANALYSIS_SYSTEM_PROMPT,
+        max_input_tokens=max_input_tokens,
+    ).text
 
-    response = openai.chat_json_response(model=model, system=system, user=user, temperature=0.2)
+    response = openai.chat_json_response(model=model, system=_ANALYSIS_SYSTEM_PROMPT, user=user, temperature=0.2)
     out = response.data
+    if response.usage is not None:
+        # cached_tokens > 0: o inicio do prompt foi servido do cache de prefixo do provedor.
+        logger.debug(
+            "analysis.prompt_cache model=%s prompt_tokens=%s cached_tokens=%s",
+            model,
+            response.usage.prompt_tokens,
+            response.usage.cached_tokens,
+        )
 
     # Normalizacao defensiva
     prioridade = str(out.get("Prioridade", "0")).strip()
@@ -193,13 +254,14 @@ def build_audio_script_with_usage(
     model: str,
     *,
     summary_text: str,
+    stream: bool = False,
 ) -> tuple[str, Optional[OpenAIUsage]]:
     fallback_script = render_summi_hour_audio_fallback(summary_text)
     if fallback_script:
         return fallback_script, None
 
-    system, user = build_summi_audio_prompt(summary_text)
+    system, user = build_summi_audio_prompt(summary_text, model=model)
     if hasattr(openai, "chat_text_response"):
-        response = openai.chat_text_response(model=model, system=system, user=user, temperature=0.2)
+        response = chat_text_maybe_stream(openai, model, system, user, temperature=0.2, stream=stream)
         return response.text, response.usage
     return openai.chat_text(model=model, system=system, user=user, temperature=0.2), None
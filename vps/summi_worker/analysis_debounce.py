@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .redis_pool import get_redis
+
+try:
+    import redis
+except Exception:  # pragma: no cover
+    redis = None  # type: ignore
+
+
+logger = logging.getLogger("summi_worker.analysis_debounce")
+
+PENDING_KEY = "summi:analysis:pending"
+# Chats reivindicados por um worker (score = fim do lease); so saem com ack/release.
+CLAIMED_KEY = "summi:analysis:claimed"
+FIRST_SEEN_KEY_PREFIX = "summi:analysis:first:"
+LAST_RUN_KEY_PREFIX = "summi:analysis:last:"
+CLAIM_LEASE_SECONDS = 300
+FAILED_RETRY_SECONDS = 60
+
+# KEYS: pending zset, first-seen key, last-run key
+# ARGV: member, now, settle, max_wait, min_interval
+_SCHEDULE_SCRIPT = """
+local now = tonumber(ARGV[2])
+local settle = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+local min_interval = tonumber(ARGV[5])
+redis.call('SET', KEYS[2], ARGV[2], 'NX', 'EX', math.max(60, math.ceil(max_wait * 2)))
+local first = tonumber(redis.call('GET', KEYS[2]) or ARGV[2])
+local due = math.min(now + settle, first + max_wait)
+local last = tonumber(redis.call('GET', KEYS[3]) or '0')
+if last > 0 then
+  due = math.max(due, last + min_interval)
+end
+redis.call('ZADD', KEYS[1], due, ARGV[1])
+return tostring(due)
+"""
+
+# KEYS: pending zset, claimed zset
+# ARGV: now, limit, lease_seconds
+# Leases vencidos (worker caiu) voltam para pending; vencidos de pending vao para claimed.
+_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, member in ipairs(expired) do
+  redis.call('ZREM', KEYS[2], member)
+  redis.call('ZADD', KEYS[1], 'NX', now, member)
+end
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[2]))
+local lease_until = now + tonumber(ARGV[3])
+for _, member in ipairs(due) do
+  redis.call('ZREM', KEYS[1], member)
+  redis.call('ZADD', KEYS[2], lease_until, member)
+end
+return due
+"""
+
+
+def _member(user_id: str, remote_jid: str) -> str:
+    return f"{user_id}|{remote_jid}"
+
+
+class AnalysisDebouncer:
+    """
+    Coalesce mensagens em rajada numa unica analise por (usuario, chat).
+
+    Cada mensagem empurra o vencimento do chat para `now + settle` (debounce),
+    limitado a `first_seen + max_wait` para conversas que nunca silenciam.
+    Depois de analisado, o chat nao volta a vencer antes de `min_interval`.
+    O estado fica num sorted set do Redis (score = vencimento), entao varios
+    workers podem drenar sem analisar o mesmo chat duas vezes. Chats reivindicados
+    ficam em `summi:analysis:claimed` ate `ack` (sucesso) ou `release` (falha, volta
+    para pending); se o worker cair, o lease vence e o chat volta sozinho.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        *,
+        settle_seconds: int,
+        max_wait_seconds: int,
+        min_interval_seconds: int,
+        lease_seconds: int = CLAIM_LEASE_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._client = client
+        self._settle = max(0, int(settle_seconds))
+        self._max_wait = max(self._settle, int(max_wait_seconds))
+        self._min_interval = max(0, int(min_interval_seconds))
+        self._lease = max(1, int(lease_seconds))
+        self._clock = clock
+        self._schedule = client.register_script(_SCHEDULE_SCRIPT)
+        self._claim = client.register_script(_CLAIM_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> Optional["AnalysisDebouncer"]:
+        redis_url = getattr(settings, "redis_url", None)
+        if not getattr(settings, "enable_analysis_debounce", False) or not redis_url or redis is None:
+            return None
+        # Cliente compartilhado do processo (este objeto e criado a cada webhook).
+        client = get_redis(redis_url)
+        if client is None:
+            return None
+        return cls(
+            client,
+            settle_seconds=getattr(settings, "analysis_debounce_settle_seconds", 45),
+            max_wait_seconds=getattr(settings, "analysis_debounce_max_wait_seconds", 300),
+            min_interval_seconds=getattr(settings, "analysis_min_interval_seconds", 600),
+        )
+
+    def schedule(self, *, user_id: str, remote_jid: str) -> float:
+        member = _member(user_id, remote_jid)
+        due = self._schedule(
+            keys=[PENDING_KEY, f"{FIRST_SEEN_KEY_PREFIX}{member}", f"{LAST_RUN_KEY_PREFIX}{member}"],
+            args=[member, self._clock(), self._settle, self._max_wait, self._min_interval],
+        )
+        return float(due)
+
+    def claim_due(self, *, limit: int = 100) -> Dict[str, List[str]]:
+        """
+        Reivindica atomicamente os chats vencidos e devolve {user_id: [remote_jid, ...]}.
+        Cada usuario devolvido precisa de `ack` ou `release` depois da analise.
+        """
+        now = self._clock()
+        members = self._claim(keys=[PENDING_KEY, CLAIMED_KEY], args=[now, max(1, int(limit)), self._lease]) or []
+        if not members:
+            return {}
+
+        pipe = self._client.pipeline(transaction=False)
+        by_user: Dict[str, List[str]] = {}
+        for member in members:
+            user_id, _, remote_jid = str(member).partition("|")
+            if not user_id or not remote_jid:
+                continue
+            by_user.setdefault(user_id, []).append(remote_jid)
+            pipe.delete(f"{FIRST_SEEN_KEY_PREFIX}{member}")
+            if self._min_interval:
+                pipe.set(f"{LAST_RUN_KEY_PREFIX}{member}", now, ex=self._min_interval)
+        pipe.execute()
+        return by_user
+
+    def ack(self, *, user_id: str, remote_jids: List[str]) -> None:
+        """Analise concluida: tira os chats de claimed."""
+        members = [_member(user_id, remote_jid) for remote_jid in remote_jids]
+        if members:
+            self._client.zrem(CLAIMED_KEY, *members)
+
+    def release(self, *, user_id: str, remote_jids: List[str], retry_seconds: int = FAILED_RETRY_SECONDS) -> None:
+        """
+        Analise falhou: devolve os chats para pending em `retry_seconds` (sem adiar
+        um vencimento que uma mensagem nova ja tenha agendado).
+        """
+        members = [_member(user_id, remote_jid) for remote_jid in remote_jids]
+        if not members:
+            return
+        due = self._clock() + max(0, int(retry_seconds))
+        pipe = self._client.pipeline(transaction=True)
+        pipe.zrem(CLAIMED_KEY, *members)
+        pipe.zadd(PENDING_KEY, {member: due for member in members}, nx=True)
+        pipe.execute()
+
+    def pending_count(self) -> int:
+        return int(self._client.zcard(PENDING_KEY) or 0)
@@ -8,19 +8,33 @@ import os
 import threading
 import time
 import uuid
-from typing import Any, Dict, Optional, Tuple
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from dotenv import load_dotenv
 from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
 
-from .budget_guard import get_user_budget_state
+from .analysis_debounce import AnalysisDebouncer
+from .audio_prep import prepare_audio_from_settings
+from .budget_gate import (
+    BudgetExceededError,
+    BudgetReservation,
+    estimate_transcription_cost,
+    estimate_vision_cost,
+    reserve_budget,
+)
+from .budget_guard import get_budget_counter, get_user_budget_state
 from .config import Settings, get_summary_model, get_vision_model, load_settings
+from .cost_ledger import start_cost_ledger
 from .cost_tracking import log_chat_cost, log_transcription_cost
 from .evolution_client import EvolutionClient, EvolutionError
-from .evolution_webhook import normalize_message_event
+from .evolution_webhook import WebhookEvent, parse_webhook_event
 from .growth_tracking import record_trial_budget_events
+from .image_prep import prepare_image_from_settings
+from .json_codec import loads as json_loads
+from .local_dedupe import get_local_dedupe
 from .openai_client import (
     GeminiTranscriptionClient,
     GeminiClient,
@@ -28,8 +42,12 @@ from .openai_client import (
     OpenAIError,
     OpenAIUsage,
     TranscriptionResult,
+    VisionResult,
+    chat_text_maybe_stream,
     strip_transcription_timestamps,
 )
+from .outbound_queue import OutboundSender
+from .projections import CHAT_AUDIO_REPLAY, PROFILE_WEBHOOK
 from .prompt_builders import (
     build_footer,
     build_transcription_hint_terms,
@@ -39,7 +57,13 @@ from .prompt_builders import (
     is_internal_summi_thread,
 )
 from .redis_dedupe import RedisDedupe
-from .redis_queue import RedisQueueClient, run_now_result_key
+from .redis_pool import latency_snapshot
+from .redis_queue import (
+    ANALYSIS_ENQUEUE_DEDUPE_KEY_PREFIX,
+    ANALYSIS_ENQUEUE_DEDUPE_TTL_SECONDS,
+    RedisQueueClient,
+    run_now_result_key,
+)
 from .summi_jobs import (
     analyze_user_chats,
     run_daily_summary_job,
@@ -47,7 +71,16 @@ from .summi_jobs import (
     run_user_summi_now,
     send_checkout_reminder,
 )
-from .supabase_rest import SupabaseRest, to_postgrest_filter_eq
+from .supabase_auth import SupabaseTokenError, get_jwt_verifier, get_token_cache
+from .supabase_rest import (
+    SupabaseError,
+    SupabaseRest,
+    is_missing_function,
+    to_postgrest_filter_contains,
+    to_postgrest_filter_eq,
+)
+from .vision_cache import get_vision_cache
+from .webhook_prefilter import get_unmonitored_group_cache, read_and_prefilter
 
 
 load_dotenv()
@@ -64,7 +97,9 @@ _RUN_NOW_RESULT_CACHE_LOCK = threading.Lock()
 
 @app.on_event("startup")
 def validate_runtime_settings() -> None:
-    load_settings()
+    settings = load_settings()
+    start_cost_ledger(settings)
+    get_budget_counter(settings)
 
 
 def _settings() -> Settings:
@@ -73,7 +108,11 @@ def _settings() -> Settings:
 
 
 def _supabase(settings: Settings) -> SupabaseRest:
-    return SupabaseRest(settings.supabase_url, settings.supabase_service_role_key)
+    return SupabaseRest(
+        settings.supabase_url,
+        settings.supabase_service_role_key,
+        audit_response_sizes=settings.supabase_response_audit,
+    )
 
 
 def _openai(settings: Settings):
@@ -82,12 +121,23 @@ def _openai(settings: Settings):
     return OpenAIClient(settings.openai_api_key or "")
 
 
-def _evolution(settings: Settings) -> EvolutionClient:
-    return EvolutionClient(settings.evolution_api_url, settings.evolution_api_key)
+def _evolution(settings: Settings) -> EvolutionClient | OutboundSender:
+    evolution = EvolutionClient(settings.evolution_api_url, settings.evolution_api_key)
+    if settings.enable_outbound_queue:
+        return OutboundSender.from_settings(settings, evolution)
+    return evolution
 
 
 def _redis_dedupe(settings: Settings) -> RedisDedupe:
-    return RedisDedupe(settings.redis_url)
+    return RedisDedupe(settings.redis_url, local=get_local_dedupe(settings))
+
+
+def _analysis_debouncer(settings: Settings) -> Optional[AnalysisDebouncer]:
+    try:
+        return AnalysisDebouncer.from_settings(settings)
+    except Exception:
+        logger.exception("analysis_debounce.init_failed")
+        return None
 
 
 def _redis_queue(settings: Settings) -> Optional[RedisQueueClient]:
@@ -186,6 +236,21 @@ def _extract_user_id_from_authorization(settings: Settings, authorization: Optio
 
     token = authorization.split(" ", 1)[1].strip()
 
+    token_cache = get_token_cache(settings)
+    cached_user_id = token_cache.get(token)
+    if cached_user_id:
+        return cached_user_id
+
+    # Validacao local (secret/JWKS): evita um round-trip ao Auth em cada poll do frontend.
+    try:
+        claims = get_jwt_verifier(settings).verify(token)
+    except SupabaseTokenError as exc:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {exc}") from exc
+    if claims is not None:
+        user_id = str(claims["sub"])
+        token_cache.put(token, user_id, token_exp=claims.get("exp"))
+        return user_id
+
     apikey = settings.supabase_anon_key or settings.supabase_service_role_key
     auth_url = f"{settings.supabase_url}/auth/v1/user"
     import requests
@@ -201,6 +266,7 @@ def _extract_user_id_from_authorization(settings: Settings, authorization: Optio
     user_id = user.get("id")
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token (no user id)")
+    token_cache.put(token, str(user_id))
     return str(user_id)
 
 
@@ -307,19 +373,55 @@ def _dispatch_analysis(
     analysis_deferred = False
     analyze_error: Optional[str] = None
 
-    queue = _redis_queue(settings)
-    if settings.enable_analysis_queue and queue is not None:
+    debouncer = _analysis_debouncer(settings) if settings.enable_analysis_queue else None
+    if debouncer is not None:
         try:
-            queue.enqueue(
-                settings.queue_analysis_name,
-                {
-                    "type": "analyze_user",
-                    "user_id": user_id,
-                    "instance_name": instance_name,
-                    "remote_jid": remote_jid,
-                    "message_id": message_id,
-                },
+            due_at = debouncer.schedule(user_id=user_id, remote_jid=remote_jid)
+            analysis_enqueued = True
+            logger.info(
+                "evolution_webhook.analysis_debounced instance=%s user_id=%s remote_jid=%s message_id=%s due_in_s=%.1f",
+                instance_name,
+                user_id,
+                remote_jid,
+                message_id,
+                due_at - time.time(),
             )
+        except Exception as exc:
+            logger.exception(
+                "evolution_webhook.analysis_debounce_error instance=%s user_id=%s remote_jid=%s message_id=%s error=%s",
+                instance_name,
+                user_id,
+                remote_jid,
+                message_id,
+                exc,
+            )
+
+    queue = _redis_queue(settings) if not analysis_enqueued else None
+    if settings.enable_analysis_queue and queue is not None:
+        job = {
+            "type": "analyze_user",
+            "user_id": user_id,
+            "instance_name": instance_name,
+            "remote_jid": remote_jid,
+            "message_id": message_id,
+        }
+        try:
+            if hasattr(queue, "enqueue_once"):
+                # Rajada no mesmo chat vira um job so: dedupe + RPUSH no mesmo script Lua.
+                if not queue.enqueue_once(
+                    f"{ANALYSIS_ENQUEUE_DEDUPE_KEY_PREFIX}{user_id}:{remote_jid}",
+                    ANALYSIS_ENQUEUE_DEDUPE_TTL_SECONDS,
+                    settings.queue_analysis_name,
+                    job,
+                ):
+                    logger.info(
+                        "evolution_webhook.analysis_already_queued user_id=%s remote_jid=%s message_id=%s",
+                        user_id,
+                        remote_jid,
+                        message_id,
+                    )
+            else:
+                queue.enqueue(settings.queue_analysis_name, job)
             analysis_enqueued = True
         except Exception as exc:
             analyze_error = f"analysis_queue_enqueue_failed: {str(exc)[:240]}"
@@ -447,6 +549,81 @@ def _should_skip_audio_summary_for_budget(
     )
 
 
+def _transcription_model(settings: Settings) -> str:
+    if settings.transcription_provider == "google":
+        return settings.google_transcription_model
+    return settings.openai_transcription_model
+
+
+def _reserve_ai_budget(
+    settings: Settings,
+    supabase: SupabaseRest,
+    *,
+    user_id: str,
+    operation: str,
+    estimate: Callable[[], Decimal],
+) -> tuple[BudgetReservation, Optional[str]]:
+    """
+    Reserva o custo estimado contra o hard cap. Retorna (reserva, motivo_do_bloqueio).
+    """
+    if not settings.enforce_budget_hard_cap:
+        return BudgetReservation(), None
+    try:
+        return reserve_budget(settings, supabase, user_id=user_id, operation=operation, estimated_usd=estimate), None
+    except BudgetExceededError as exc:
+        return BudgetReservation(), str(exc)
+
+
+def _describe_image_for_chat(
+    settings: Settings,
+    supabase: SupabaseRest,
+    openai: Any,
+    *,
+    user_id: str,
+    image_bytes: bytes,
+) -> Tuple[Optional[VisionResult], Dict[str, Any]]:
+    """
+    Cache por conteudo -> preparo da imagem -> hard cap -> provedor de visao. Retorna (resultado, extra);
+    resultado None quando o budget bloqueou a chamada.
+    """
+    model = get_vision_model(settings)
+    cache = get_vision_cache(settings)
+    cached = cache.get(model, image_bytes) if cache is not None else None
+    if cached is not None:
+        return cached, {"image_description_cached": True}
+
+    prepared = prepare_image_from_settings(settings, image_bytes)
+    if prepared.skip_reason:
+        return None, {"image_ai_skipped": prepared.skip_reason}
+    extra: Dict[str, Any] = {}
+    if prepared.reencoded:
+        extra["image_prep_bytes"] = {"original": prepared.original_size, "sent": len(prepared.data)}
+
+    budget_reservation, budget_block_reason = _reserve_ai_budget(
+        settings,
+        supabase,
+        user_id=user_id,
+        operation="vision",
+        estimate=lambda: estimate_vision_cost(model=model),
+    )
+    if budget_block_reason:
+        extra["image_ai_skipped_budget"] = budget_block_reason
+        return None, extra
+
+    with budget_reservation:
+        result = openai.describe_image_base64_response(model, prepared.data, mime_type=prepared.mime_type)
+    _maybe_log_chat_usage(
+        supabase,
+        user_id=user_id,
+        operation="vision",
+        model=model,
+        usage=result.usage,
+    )
+    if cache is not None:
+        cache.put(model, image_bytes, result)
+    return result, extra
+
+
 def _maybe_log_chat_usage(
     supabase: SupabaseRest,
     *,
@@ -464,6 +641,7 @@ def _maybe_log_chat_usage(
         model=model,
         input_tokens=usage.prompt_tokens,
         output_tokens=usage.completion_tokens,
+        cached_tokens=usage.cached_tokens,
     )
 
 
@@ -495,6 +673,7 @@ def _summarize_transcription(
     profile: Dict[str, Any],
     *,
     audio_seconds: Optional[int] = None,
+    stream: bool = False,
 ) -> tuple[str, Optional[OpenAIUsage]]:
     temas_urgentes = profile.get("temas_urgentes") or "Nenhum específico"
     temas_importantes = profile.get("temas_importantes") or "Nenhum específico"
@@ -504,14 +683,12 @@ def _summarize_transcription(
         temas_urgentes=temas_urgentes,
         temas_importantes=temas_importantes,
         audio_seconds=audio_seconds,
-    )
-
-    response = openai.chat_text_response(
         model=model,
-        system=system,
-        user=user,
-        temperature=0.2,
     )
+
+    # Com streaming o texto chega em trechos; o retorno continua sendo o texto
+    # completo, para o TTS/envio comecar assim que a geracao termina.
+    response = chat_text_maybe_stream(openai, model, system, user, temperature=0.2, stream=stream)
     return response.text, response.usage
 
 
@@ -523,6 +700,8 @@ def _transcribe_audio_with_fallback(
     audio_bytes: bytes,
     filename: str = "audio.mp3",
 ) -> tuple[TranscriptionResult, Dict[str, Any]]:
+    prepared_audio = prepare_audio_from_settings(settings, audio_bytes, filename=filename)
+    audio_bytes, filename = prepared_audio.data, prepared_audio.filename
     prompt_extra = settings.openai_transcription_prompt_extra
     transcription_prompt = build_transcription_prompt(profile, extra_context=prompt_extra)
     hint_terms = build_transcription_hint_terms(profile, extra_context=prompt_extra)
@@ -542,6 +721,7 @@ def _transcribe_audio_with_fallback(
             "audio_transcription_confidence": result.average_confidence,
             "audio_transcription_used_fallback": False,
         }
+        metadata.update(prepared_audio.metadata())
         return result, metadata
 
     base_result = openai.transcribe_audio(
@@ -559,6 +739,7 @@ def _transcribe_audio_with_fallback(
         "audio_transcription_confidence": base_result.average_confidence,
         "audio_transcription_used_fallback": False,
     }
+    metadata.update(prepared_audio.metadata())
     if base_result.average_logprob is not None:
         metadata["audio_transcription_avg_logprob"] = base_result.average_logprob
 
@@ -645,34 +826,12 @@ def _normalize_jid(value: Any) -> Optional[str]:
     return f"{digits}@s.whatsapp.net"
 
 
-def _extract_quoted_remote_jid(payload: Dict[str, Any]) -> Optional[str]:
-    return _normalize_jid(
-        _get_in(payload, "body", "data", "key", "remoteJidAlt")
-        or _get_in(payload, "data", "key", "remoteJidAlt")
-        or _get_in(payload, "body", "data", "key", "remoteJid")
-        or _get_in(payload, "data", "key", "remoteJid")
-        or _get_in(payload, "key", "remoteJid")
-    )
+def _extract_quoted_remote_jid(event: WebhookEvent) -> Optional[str]:
+    return _normalize_jid(event.quoted_remote_jid)
 
 
-def _extract_quoted_participant(payload: Dict[str, Any]) -> Optional[str]:
-    return _normalize_jid(
-        _get_in(payload, "body", "data", "key", "participant")
-        or _get_in(payload, "data", "key", "participant")
-        or _get_in(payload, "key", "participant")
-    )
-
-
-def _extract_quoted_from_me(payload: Dict[str, Any]) -> Optional[bool]:
-    for path in (
-        ("body", "data", "key", "fromMe"),
-        ("data", "key", "fromMe"),
-        ("key", "fromMe"),
-    ):
-        value = _get_in(payload, *path)
-        if isinstance(value, bool):
-            return value
-    return None
+def _extract_quoted_participant(event: WebhookEvent) -> Optional[str]:
+    return _normalize_jid(event.quoted_participant)
 
 
 def _upsert_chat_message(
@@ -687,6 +846,35 @@ def _upsert_chat_message(
     message_text_for_chat: str,
 ) -> str:
     now_event_iso = _now_utc_iso()
+    grupo = f"{remote_jid}@g.us" if is_group and not str(remote_jid).endswith("@g.us") else (remote_jid if is_group else None)
+    rpc_event = dict(normalized_event)
+    rpc_event["text"] = message_text_for_chat
+    try:
+        # Insert-ou-append atomico (unique id_usuario+remote_jid): 1 round-trip e sem
+        # chat duplicado quando dois webhooks do mesmo contato novo chegam juntos.
+        chat_id = supabase.rpc(
+            "append_chat_event",
+            {
+                "p_user_id": user_id,
+                "p_remote_jid": remote_jid,
+                "p_nome": display_name,
+                "p_grupo": grupo,
+                "p_event": rpc_event,
+                "p_legacy_line": _append_legacy_line("", author_name, message_text_for_chat),
+                "p_event_at": now_event_iso,
+            },
+        )
+    except SupabaseError as exc:
+        # So cai no SELECT+PATCH se a RPC nao existe; 5xx/timeout apos o append pode
+        # ja ter gravado o evento, e repetir pelo fallback duplicaria a mensagem.
+        if not is_missing_function(exc):
+            raise
+        logger.warning("evolution_webhook.append_chat_event_unavailable remote_jid=%s error=%s", remote_jid, exc)
+    else:
+        if chat_id:
+            return str(chat_id)
+
+    # Fallback (RPC ainda nao aplicada): SELECT + PATCH/INSERT.
     chats = supabase.select(
         "chats",
         select="id,id_usuario,remote_jid,nome,conversa",
@@ -735,7 +923,7 @@ def _upsert_chat_message(
                 "id_usuario": user_id,
                 "remote_jid": remote_jid,
                 "nome": display_name,
-                "grupo": f"{remote_jid}@g.us" if is_group and not str(remote_jid).endswith("@g.us") else (remote_jid if is_group else None),
+                "grupo": grupo,
                 "prioridade": "0",
                 "conversa": [event_copy],
                 "ultimo_evento_em": now_event_iso,
@@ -750,7 +938,7 @@ def _send_aux_message(
     evolution: EvolutionClient,
     settings: Settings,
     profile: Dict[str, Any],
-    payload: Dict[str, Any],
+    event: WebhookEvent,
     instance_name: str,
     remote_jid_digits: str,
     text: str,
@@ -765,7 +953,7 @@ def _send_aux_message(
     target_number = remote_jid_digits
 
     if send_private_only:
-        sender_jid = _get_in(payload, "body", "sender") or payload.get("sender") or profile.get("numero")
+        sender_jid = event.sender or profile.get("numero")
         sender_digits = _digits(sender_jid)
         profile_number = _digits(profile.get("numero"))
         target_number = sender_digits or profile_number or target_number
@@ -786,9 +974,9 @@ def _send_aux_message(
         outbound_text,
         quoted_message_id=quoted_message_id,
         quoted_text=quoted_text,
-        quoted_remote_jid=_extract_quoted_remote_jid(payload),
-        quoted_from_me=_extract_quoted_from_me(payload),
-        quoted_participant=_extract_quoted_participant(payload),
+        quoted_remote_jid=_extract_quoted_remote_jid(event),
+        quoted_from_me=event.from_me,
+        quoted_participant=_extract_quoted_participant(event),
     )
     return {
         "sent": True,
@@ -796,47 +984,22 @@ def _send_aux_message(
         "target_instance": target_instance,
         "target_number": target_number,
         "quoted_message_id": quoted_message_id,
-        "quoted_remote_jid": _extract_quoted_remote_jid(payload),
+        "quoted_remote_jid": _extract_quoted_remote_jid(event),
     }
 
 
+# Atalhos sobre WebhookEvent para scripts de debug; o webhook le o evento direto.
 def _detect_message_shape(payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
-    payload = _unwrap(payload) if isinstance(payload, list) else payload
-    msg = (
-        _get_in(payload, "body", "data", "message") 
-        or _get_in(payload, "data", "message") 
-        or _get_in(payload, "data", "update", "message")
-        or payload.get("message") 
-        or {}
-    )
-    if not isinstance(msg, dict):
-        msg = {}
-    if "audioMessage" in msg:
-        return "audio", msg
-    if "imageMessage" in msg:
-        return "image", msg
-    if "reactionMessage" in msg:
-        return "reaction", msg
-    if "extendedTextMessage" in msg or "conversation" in msg:
-        return "text", msg
-    return "unknown", msg
+    event = parse_webhook_event(payload)
+    return event.kind, event.message
 
 
 def _get_reaction_target_message_id(payload: Dict[str, Any]) -> Optional[str]:
-    return (
-        _get_in(payload, "body", "data", "message", "reactionMessage", "key", "id") 
-        or _get_in(payload, "data", "message", "reactionMessage", "key", "id")
-        or _get_in(payload, "data", "update", "message", "reactionMessage", "key", "id")
-    )
+    return parse_webhook_event(payload).reaction_target_id
 
 
 def _get_reaction_text(payload: Dict[str, Any]) -> str:
-    return str(
-        _get_in(payload, "body", "data", "message", "reactionMessage", "text")
-        or _get_in(payload, "data", "message", "reactionMessage", "text")
-        or _get_in(payload, "data", "update", "message", "reactionMessage", "text")
-        or ""
-    )
+    return parse_webhook_event(payload).reaction_text
 
 
 def _decode_b64_media(media_b64: str) -> bytes:
@@ -846,6 +1009,40 @@ def _decode_b64_media(media_b64: str) -> bytes:
     return base64.b64decode(raw)
 
 
+def _transcribed_audio_event(
+    supabase: SupabaseRest,
+    *,
+    user_id: str,
+    remote_jid: str,
+    message_id: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    Evento do audio ja transcrito (mesma regra de `_should_skip_transcription`),
+    com `text` e os campos `audio_*`; None se nao houver. O filtro roda no
+    Postgres, entao a conversa so e baixada quando o webhook e um replay.
+    """
+    rows = supabase.select(
+        "chats",
+        select=CHAT_AUDIO_REPLAY,
+        filters=[
+            to_postgrest_filter_eq("id_usuario", user_id),
+            to_postgrest_filter_eq("remote_jid", remote_jid),
+            to_postgrest_filter_contains("conversa", [{"message_id": message_id, "audio_transcribed": True}]),
+        ],
+        limit=1,
+    )
+    for row in rows:
+        conversa = row.get("conversa")
+        if not _should_skip_transcription(conversa, message_id):
+            continue
+        for event in conversa:
+            if isinstance(event, dict) and event.get("message_id") == message_id and event.get("audio_transcribed"):
+                found = {key: value for key, value in event.items() if key.startswith("audio_")}
+                found["text"] = event.get("text")
+                return found
+    return None
+
+
 def _should_skip_transcription(conversa: Any, message_id: Optional[str]) -> bool:
     """
     Verifica se a transcrição do áudio deve ser pulada.
@@ -882,14 +1079,7 @@ def _is_audio(media_bytes: bytes) -> bool:
 
 
 def _get_inline_media_base64(payload: Dict[str, Any]) -> Optional[str]:
-    value = (
-        _get_in(payload, "body", "data", "message", "base64")
-        or _get_in(payload, "data", "message", "base64")
-        or _get_in(payload, "message", "base64")
-    )
-    if isinstance(value, str) and value.strip():
-        return value.strip()
-    return None
+    return parse_webhook_event(payload).inline_base64
 
 
 @app.get("/health")
@@ -996,13 +1186,15 @@ async def api_analyze_messages(
         "reason": "queued",
         "queued_at": _now_utc_iso(),
     }
-    _set_run_now_result(settings=settings, job_id=job_id, payload=processing_payload)
-
     queue = _redis_queue(settings)
     started_mode = "local_thread"
     if settings.enable_summary_queue and queue is not None:
         try:
-            queue.enqueue(
+            # Resultado "processing" + job em uma unica ida ao Redis (MULTI).
+            queue.set_json_and_enqueue(
+                run_now_result_key(job_id),
+                processing_payload,
+                settings.run_now_result_ttl_seconds,
                 settings.queue_summary_name,
                 {
                     "type": "run_user_summi_now",
@@ -1013,8 +1205,10 @@ async def api_analyze_messages(
             started_mode = "queue"
         except Exception:
             logger.exception("run_now.enqueue_failed user_id=%s job_id=%s", user_id, job_id)
+            _set_run_now_result(settings=settings, job_id=job_id, payload=processing_payload)
             _spawn_local_run_now_thread(settings=settings, user_id=user_id, job_id=job_id)
     else:
+        _set_run_now_result(settings=settings, job_id=job_id, payload=processing_payload)
         _spawn_local_run_now_thread(settings=settings, user_id=user_id, job_id=job_id)
 
     logger.info("run_now.started user_id=%s job_id=%s mode=%s", user_id, job_id, started_mode)
@@ -1072,6 +1266,35 @@ def internal_run_hourly(x_internal_token: Optional[str] = Header(default=None))
     return run_hourly_job(settings, supabase, openai, evolution)
 
 
+@app.get("/internal/redis-stats")
+def internal_redis_stats(x_internal_token: Optional[str] = Header(default=None)) -> Dict[str, Any]:
+    """
+    Histogramas de latencia das operacoes Redis deste processo.
+    """
+    internal_token = os.getenv("INTERNAL_TOKEN")
+    if internal_token and x_internal_token != internal_token:
+        raise HTTPException(status_code=401, detail="unauthorized")
+
+    return {"latency": latency_snapshot()}
+
+
+@app.get("/internal/outbound-stats")
+def internal_outbound_stats(x_internal_token: Optional[str] = Header(default=None)) -> Dict[str, Any]:
+    """
+    Profundidade da fila de envio por instancia remetente.
+    """
+    internal_token = os.getenv("INTERNAL_TOKEN")
+    if internal_token and x_internal_token != internal_token:
+        raise HTTPException(status_code=401, detail="unauthorized")
+
+    settings = _settings()
+    evolution = _evolution(settings)
+    if not isinstance(evolution, OutboundSender) or not evolution.queued:
+        return {"enabled": False, "depths": {}}
+    depths = evolution.queue_depths()
+    return {"enabled": True, "depths": depths, "total": sum(depths.values())}
+
+
 class OnboardingReminderRequest(BaseModel):
     phone: str
     name: Optional[str] = None
@@ -1113,13 +1336,40 @@ async def _handle_evolution_webhook(
 ) -> Dict[str, Any]:
     request_started_at = time.perf_counter()
     settings = _settings()
+    unmonitored_groups = get_unmonitored_group_cache(settings)
+    if getattr(settings, "enable_webhook_prefilter", False):
+        # Ruido (eventos ignorados, thread interna, grupos nao monitorados) sai aqui,
+        # classificado pelo prefixo do corpo, sem parse do JSON.
+        scanned = await read_and_prefilter(
+            request.stream(),
+            ignore_remote_jid=settings.ignore_remote_jid,
+            unmonitored=unmonitored_groups,
+        )
+        if scanned.reason:
+            hint = scanned.hint
+            logger.info(
+                "evolution_webhook.prefiltered reason=%s event=%s instance=%s remote_jid=%s bytes_read=%s",
+                scanned.reason,
+                hint.event_norm if hint else None,
+                hint.instance_name if hint else None,
+                hint.remote_jid if hint else None,
+                scanned.bytes_read,
+            )
+            return {"ok": True, "stored": False, "reason": scanned.reason, "prefiltered": True}
+        raw_body = scanned.body
+    else:
+        raw_body = await request.body()
+
     supabase = _supabase(settings)
     openai = _openai(settings)
     evolution = _evolution(settings)
     dedupe = _redis_dedupe(settings)
 
-    payload = await request.json()
-    normalized = normalize_message_event(payload)
+    # Corpo bruto direto para o codec (orjson quando instalado): evita bytes -> str -> dict.
+    payload = json_loads(raw_body)
+    # Uma passada pelo envelope; as etapas abaixo leem do evento, nao do payload.
+    event = parse_webhook_event(payload)
+    normalized = event.normalized()
     logger.info(
         "evolution_webhook.received path=%s event=%s instance=%s remote_jid=%s message_id=%s message_type=%s from_me=%s analysis_disabled=%s",
         request.url.path,
@@ -1139,7 +1389,7 @@ async def _handle_evolution_webhook(
     event_norm = event_name.replace("_", ".")
 
     # Detectar cedo o tipo da mensagem para ignorar updates de status (ruído).
-    message_kind, _msg = _detect_message_shape(payload)
+    message_kind = event.kind
 
     allowed_events = {"messages.upsert", "messages.update"}
     if event_norm and event_norm not in allowed_events:
@@ -1151,10 +1401,8 @@ async def _handle_evolution_webhook(
         logger.info("evolution_webhook.ignored reason=ignored_update_event kind=%s", message_kind)
         return {"ok": True, "stored": False, "reason": "ignored_update_event", "event": event_norm, "kind": message_kind}
 
-    raw_remote_jid = str(_get_in(payload, "body", "data", "key", "remoteJid") or _get_in(payload, "data", "key", "remoteJid") or "")
-    raw_remote_jid_alt = str(
-        _get_in(payload, "body", "data", "key", "remoteJidAlt") or _get_in(payload, "data", "key", "remoteJidAlt") or ""
-    )
+    raw_remote_jid = str(event.key_remote_jid or "")
+    raw_remote_jid_alt = str(event.remote_jid_alt or "")
     is_group = raw_remote_jid.endswith("@g.us")
     remote_jid = normalized.get("remote_jid")
     chat_remote_jid = raw_remote_jid if is_group and raw_remote_jid else str(remote_jid or "")
@@ -1188,7 +1436,7 @@ async def _handle_evolution_webhook(
     # Procuramos o perfil ignorando case para evitar falhas se a Evolution enviar LucasBorges vs lucasborges
     profiles = supabase.select(
         "profiles",
-        select="*",
+        select=PROFILE_WEBHOOK,
         filters=[to_postgrest_filter_eq("instance_name", instance_name.lower())],
         limit=1,
     )
@@ -1196,7 +1444,7 @@ async def _handle_evolution_webhook(
         # Fallback para o case original se o lower falhar (caso o DB tenha algo misto)
         profiles = supabase.select(
             "profiles",
-            select="*",
+            select=PROFILE_WEBHOOK,
             filters=[to_postgrest_filter_eq("instance_name", instance_name)],
             limit=1,
         )
@@ -1224,6 +1472,11 @@ async def _handle_evolution_webhook(
             ],
             limit=1,
         )
+        if unmonitored_groups is not None:
+            if monitored:
+                unmonitored_groups.discard(instance_name, raw_remote_jid)
+            else:
+                unmonitored_groups.add(instance_name, raw_remote_jid)
         if not monitored and message_kind != "reaction":
             logger.info("evolution_webhook.ignored reason=group_not_monitored group_id=%s user_id=%s", raw_remote_jid, user_id)
             return {"ok": True, "stored": False, "reason": "group_not_monitored"}
@@ -1239,51 +1492,48 @@ async def _handle_evolution_webhook(
     processed_audio_seconds: Optional[int] = None
     extra: Dict[str, Any] = {}
 
-    # Fetch existing chat early if we need to check for audio playback status
-    # This helps us skip re-transcribing audio that user has already played
-    existing_chat = None
-    if message_kind == "audio":
-        chats = supabase.select(
-            "chats",
-            select="id,conversa",
-            filters=[
-                to_postgrest_filter_eq("id_usuario", user_id),
-                to_postgrest_filter_eq("remote_jid", chat_remote_jid),
-            ],
-            limit=1,
+    # Audio ja transcrito em webhook anterior (replay)? Respondido no servidor via
+    # JSONB @> em chats.conversa; a conversa so desce quando ha match.
+    transcribed_event: Optional[Dict[str, Any]] = None
+    if message_kind == "audio" and message_id:
+        transcribed_event = _transcribed_audio_event(
+            supabase,
+            user_id=user_id,
+            remote_jid=chat_remote_jid,
+            message_id=message_id,
         )
-        if chats:
-            existing_chat = chats[0]
 
     try:
         if message_kind == "text":
             text_for_chat = _derive_message_content(payload, normalized)
 
         elif message_kind == "image":
-            media_b64 = _get_inline_media_base64(payload)
+            media_b64 = event.inline_base64
             media_source = "inline" if media_b64 else "evolution"
             if not media_b64 and message_id:
                 media_b64 = evolution.get_media_base64(instance_name, message_id)
             if media_b64:
                 if settings.enable_image_description:
-                    image_bytes = _decode_b64_media(media_b64)
-                    vision_result = openai.describe_image_base64_response(get_vision_model(settings), image_bytes)
-                    _maybe_log_chat_usage(
+                    vision_result, vision_extra = _describe_image_for_chat(
+                        settings,
                         supabase,
+                        openai,
                         user_id=user_id,
-                        operation="vision",
-                        model=get_vision_model(settings),
-                        usage=vision_result.usage,
+                        image_bytes=_decode_b64_media(media_b64),
                     )
-                    text_for_chat = _derive_message_content(payload, normalized, image_description=vision_result.text)
-                    extra["image_described"] = True
+                    extra.update(vision_extra)
+                    if vision_result is not None:
+                        text_for_chat = _derive_message_content(payload, normalized, image_description=vision_result.text)
+                        extra["image_described"] = True
+                    else:
+                        text_for_chat = _derive_message_content(payload, normalized)
                 else:
                     text_for_chat = _derive_message_content(payload, normalized)
                     extra["image_ai_disabled"] = True
                 extra["image_media_source"] = media_source
 
         elif message_kind == "audio":
-            media_b64 = _get_inline_media_base64(payload)
+            media_b64 = event.inline_base64
             media_source = "inline" if media_b64 else "evolution"
             if not media_b64 and message_id:
                 media_started_at = time.perf_counter()
@@ -1319,8 +1569,7 @@ async def _handle_evolution_webhook(
                         )
 
                 # --- Camada 2: Verificar se já foi transcrito anteriormente (webhook duplicado) ---
-                conversa = existing_chat.get("conversa") if existing_chat else None
-                already_transcribed = _should_skip_transcription(conversa, message_id)
+                already_transcribed = transcribed_event is not None
 
                 should_skip = evo_audio_played or already_transcribed
 
@@ -1345,18 +1594,14 @@ async def _handle_evolution_webhook(
                     # Mark that we skipped transcription
                     extra["audio_transcription_skipped"] = True
                     extra["audio_transcription_skip_reason"] = skip_reason
-                    # Try to find the existing transcription in conversa to use it
-                    if conversa and isinstance(conversa, list):
-                        for event in conversa:
-                            if isinstance(event, dict) and event.get("message_id") == message_id:
-                                existing_text = event.get("text")
-                                if existing_text:
-                                    transcript = strip_transcription_timestamps(str(existing_text))
-                                    # Reuse audio metadata from existing event
-                                    for key, value in event.items():
-                                        if key.startswith("audio_"):
-                                            transcription_meta[key] = value
-                                break
+                    # Reaproveita a transcricao e os metadados audio_* do evento existente
+                    if transcribed_event is not None:
+                        existing_text = transcribed_event.get("text")
+                        if existing_text:
+                            transcript = strip_transcription_timestamps(str(existing_text))
+                            for key, value in transcribed_event.items():
+                                if key.startswith("audio_"):
+                                    transcription_meta[key] = value
                     if not transcript:
                         transcript = ""
                 else:
@@ -1375,38 +1620,48 @@ async def _handle_evolution_webhook(
                             _profile_bool(profile, "transcreve_audio_recebido", True) if not from_me else "N/A",
                         )
                     else:
-                        transcribe_started_at = time.perf_counter()
-                        transcription, transcription_meta = _transcribe_audio_with_fallback(
-                            openai=openai,
-                            settings=settings,
-                            profile=profile,
-                            audio_bytes=mp3_bytes,
-                        )
-                        transcript = strip_transcription_timestamps(transcription.text)
-                        duration_seconds = transcription.duration_seconds
-                        logger.info(
-                            "evolution_webhook.audio_transcribed instance=%s message_id=%s elapsed_ms=%s transcript_chars=%s model=%s fallback=%s confidence=%s",
-                            instance_name,
-                            message_id,
-                            _elapsed_ms(transcribe_started_at),
-                            len(transcript),
-                            transcription.model,
-                            transcription_meta.get("audio_transcription_used_fallback"),
-                            transcription.average_confidence,
-                        )
-                        # Log custo da transcrição (fire-and-forget)
-                        log_transcription_cost(
-                            supabase, user_id,
-                            model=transcription.model,
-                            duration_seconds=duration_seconds,
+                        budget_reservation, budget_block_reason = _reserve_ai_budget(
+                            settings,
+                            supabase,
+                            user_id=user_id,
+                            operation="transcribe",
+                            estimate=lambda: estimate_transcription_cost(mp3_bytes, model=_transcription_model(settings)),
                         )
+                        if budget_block_reason:
+                            transcript = ""
+                            extra["audio_transcription_skipped"] = True
+                            extra["audio_transcription_skip_reason"] = "budget_hard_cap"
+                            extra["audio_transcription_budget_reason"] = budget_block_reason
+                        else:
+                            transcribe_started_at = time.perf_counter()
+                            with budget_reservation:
+                                transcription, transcription_meta = _transcribe_audio_with_fallback(
+                                    openai=openai,
+                                    settings=settings,
+                                    profile=profile,
+                                    audio_bytes=mp3_bytes,
+                                )
+                            transcript = strip_transcription_timestamps(transcription.text)
+                            duration_seconds = transcription.duration_seconds
+                            logger.info(
+                                "evolution_webhook.audio_transcribed instance=%s message_id=%s elapsed_ms=%s transcript_chars=%s model=%s fallback=%s confidence=%s",
+                                instance_name,
+                                message_id,
+                                _elapsed_ms(transcribe_started_at),
+                                len(transcript),
+                                transcription.model,
+                                transcription_meta.get("audio_transcription_used_fallback"),
+                                transcription.average_confidence,
+                            )
+                            # Log custo da transcrição (fire-and-forget)
+                            log_transcription_cost(
+                                supabase, user_id,
+                                model=transcription.model,
+                                duration_seconds=duration_seconds,
+                            )
 
-                # Extrai duração do payload em múltiplos caminhos (versões diferentes da Evolution)
-                seconds_from_payload = (
-                    _get_in(payload, "body", "data", "message", "audioMessage", "seconds")
-                    or _get_in(payload, "data", "message", "audioMessage", "seconds")
-                    or _get_in(payload, "message", "audioMessage", "seconds")
-                )
+                # Duração enviada pela Evolution (audioMessage.seconds, em qualquer envelope)
+                seconds_from_payload = event.audio_seconds
                 audio_seconds: Optional[int] = None
                 if seconds_from_payload is not None:
                     audio_seconds = _safe_positive_int(seconds_from_payload)
@@ -1451,6 +1706,7 @@ async def _handle_evolution_webhook(
                             transcript,
                             profile,
                             audio_seconds=audio_seconds,
+                            stream=settings.enable_llm_streaming,
                         )
                         _maybe_log_chat_usage(
                             supabase,
@@ -1491,7 +1747,7 @@ async def _handle_evolution_webhook(
                         evolution=evolution,
                         settings=settings,
                         profile=profile,
-                        payload=payload,
+                        event=event,
                         instance_name=instance_name,
                         remote_jid_digits=remote_jid_digits,
                         text=text_for_chat,
@@ -1510,8 +1766,8 @@ async def _handle_evolution_webhook(
                     )
 
         elif message_kind == "reaction":
-            reaction_text = _get_reaction_text(payload)
-            target_id = _get_reaction_target_message_id(payload)
+            reaction_text = event.reaction_text
+            target_id = event.reaction_target_id
             extra["reaction_text"] = reaction_text
             extra["reaction_target_message_id"] = target_id
 
@@ -1520,7 +1776,7 @@ async def _handle_evolution_webhook(
             # pois adapters diferentes podem enviar from_me=False para reacoes proprias.
             # A condicao de seguranca e: send_on_reaction ativo + emoji ⚡ + target_id presente.
             if send_on_reaction and _lightning_reaction(reaction_text) and target_id:
-                author_jid = str(normalized.get("author_jid") or _get_in(payload, "body", "sender") or "")
+                author_jid = str(normalized.get("author_jid") or event.body_sender or "")
                 profile_number = _digits(profile.get("numero", ""))
                 reaction_is_from_owner = from_me or bool(profile_number and profile_number in _digits(author_jid))
                 
@@ -1533,17 +1789,37 @@ async def _handle_evolution_webhook(
                     media_b64 = evolution.get_media_base64(instance_name, target_id)
                     if media_b64:
                         mp3_bytes = _decode_b64_media(media_b64)
-                        if not _is_audio(mp3_bytes):
+                        media_is_audio = _is_audio(mp3_bytes)
+                        budget_reservation, budget_block_reason = (
+                            _reserve_ai_budget(
+                                settings,
+                                supabase,
+                                user_id=user_id,
+                                operation="transcribe",
+                                estimate=lambda: estimate_transcription_cost(mp3_bytes, model=_transcription_model(settings)),
+                            )
+                            if media_is_audio
+                            else (BudgetReservation(), None)
+                        )
+                        if not media_is_audio:
                             logger.warning("evolution_webhook.reaction_ignored reason=media_not_audio instance=%s target_id=%s", instance_name, target_id)
                             extra["reaction_media_not_audio"] = True
+                        elif budget_block_reason:
+                            extra["reaction_transcription_skipped_budget"] = budget_block_reason
+                            logger.info(
+                                "evolution_webhook.reaction_ignored reason=budget_hard_cap instance=%s target_id=%s",
+                                instance_name,
+                                target_id,
+                            )
                         else:
                             transcribe_started_at = time.perf_counter()
-                            transcription, transcription_meta = _transcribe_audio_with_fallback(
-                                openai=openai,
-                                settings=settings,
-                                profile=profile,
-                                audio_bytes=mp3_bytes,
-                            )
+                            with budget_reservation:
+                                transcription, transcription_meta = _transcribe_audio_with_fallback(
+                                    openai=openai,
+                                    settings=settings,
+                                    profile=profile,
+                                    audio_bytes=mp3_bytes,
+                                )
                             transcript = strip_transcription_timestamps(transcription.text)
                             duration_seconds = transcription.duration_seconds
                             logger.info(
@@ -1596,6 +1872,7 @@ async def _handle_evolution_webhook(
                                         transcript,
                                         profile,
                                         audio_seconds=audio_seconds,
+                                        stream=settings.enable_llm_streaming,
                                     )
                                     _maybe_log_chat_usage(
                                         supabase,
@@ -1622,7 +1899,7 @@ async def _handle_evolution_webhook(
                                     evolution=evolution,
                                     settings=settings,
                                     profile=profile,
-                                    payload=payload,
+                                    event=event,
                                     instance_name=instance_name,
                                     remote_jid_digits=remote_jid_digits,
                                     text=final_text.strip(),
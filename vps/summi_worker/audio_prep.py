@@ -0,0 +1,332 @@
+"""
+audio_prep.py — Normalizacao do audio antes da transcricao.
+
+A Evolution entrega OGG/Opus, MP3 ou M4A no bitrate de origem, e o Gemini
+ainda infla o upload em 1/3 com base64. Com ffmpeg disponivel, o audio e
+convertido para mono, 16 kHz, Opus (ou MP3) de baixo bitrate otimizado para
+voz, e o silencio do inicio e do fim e cortado. Duracao antes/depois fica
+registrada; a duracao cobrada passa a ser a do audio enviado.
+
+Com ENABLE_AUDIO_VAD, silencios longos no meio do audio tambem sao cortados
+(audio_vad); o mapa de timestamps e os segundos economizados vao no metadata.
+
+ffmpeg e opcional: sem ele (ou em qualquer falha) o audio segue como chegou
+(WAV PCM ainda passa pelo VAD).
+"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+from array import array
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+from .audio_vad import DEFAULT_MIN_SILENCE_SECONDS, SpeechSegment, trim_silences
+from .openai_client import _detect_audio_upload_meta, _probe_audio_duration_seconds
+
+
+logger = logging.getLogger("summi_worker.audio_prep")
+
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_BITRATE_KBPS = {"opus": 20, "mp3": 32}
+FFMPEG_TIMEOUT_SECONDS = 60
+SILENCE_THRESHOLD_DB = -45
+SILENCE_MIN_SECONDS = 0.3
+MIN_SECONDS_SAVED = 0.5
+
+_CODECS = {
+    "opus": (["-c:a", "libopus", "-application", "voip", "-f", "ogg"], "audio.ogg"),
+    "mp3": (["-c:a", "libmp3lame", "-f", "mp3"], "audio.mp3"),
+}
+
+
+@dataclass(frozen=True)
+class PreparedAudio:
+    data: bytes
+    filename: str
+    original_size: int
+    original_seconds: Optional[float]
+    seconds: Optional[float]
+    normalized: bool = False
+    speech_segments: Tuple[SpeechSegment, ...] = ()
+    vad_seconds_saved: Optional[float] = None
+
+    def metadata(self) -> Dict[str, Any]:
+        if not self.normalized:
+            return {}
+        meta: Dict[str, Any] = {
+            "audio_prep_original_bytes": self.original_size,
+            "audio_prep_bytes": len(self.data),
+            "audio_prep_original_seconds": self.original_seconds,
+            "audio_prep_seconds": self.seconds,
+        }
+        if self.vad_seconds_saved is not None:
+            meta["audio_vad_seconds_saved"] = round(self.vad_seconds_saved, 2)
+            # [inicio no audio enviado, inicio no original, fim no original]
+            meta["audio_vad_segments"] = [
+                [round(seg.output_start, 2), round(seg.source_start, 2), round(seg.source_end, 2)]
+                for seg in self.speech_segments
+            ]
+        return meta
+
+
+def _ffmpeg_binary() -> Optional[str]:
+    return shutil.which("ffmpeg")
+
+
+def _bitrate_kbps(codec: str, bitrate_kbps: Optional[int]) -> int:
+    return int(bitrate_kbps or DEFAULT_BITRATE_KBPS.get(codec, 24))
+
+
+def build_ffmpeg_args(
+    ffmpeg_bin: str,
+    input_path: str,
+    output_path: str,
+    *,
+    codec: str = "opus",
+    sample_rate: int = DEFAULT_SAMPLE_RATE,
+    bitrate_kbps: Optional[int] = None,
+    trim_silence: bool = True,
+) -> List[str]:
+    codec_args, _ = _CODECS.get(codec, _CODECS["opus"])
+    bitrate = _bitrate_kbps(codec, bitrate_kbps)
+    args = [ffmpeg_bin, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", "-i", input_path, "-vn", "-ac", "1", "-ar", str(int(sample_rate))]
+    if trim_silence:
+        # Corta silencio do inicio; inverter + cortar de novo + inverter corta o do fim.
+        trim = (
+            f"silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD_DB}dB"
+            f":start_silence={SILENCE_MIN_SECONDS}"
+        )
+        args += ["-af", f"{trim},areverse,{trim},areverse"]
+    args += codec_args + ["-b:a", f"{bitrate}k", output_path]
+    return args
+
+
+def _run_ffmpeg(args: List[str], stdin: Optional[bytes] = None) -> bytes:
+    return subprocess.run(args, input=stdin, check=True, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS).stdout
+
+
+def _passthrough(audio_bytes: bytes, filename: str, original_seconds: Optional[float]) -> PreparedAudio:
+    return PreparedAudio(
+        data=audio_bytes,
+        filename=filename,
+        original_size=len(audio_bytes),
+        original_seconds=original_seconds,
+        seconds=original_seconds,
+    )
+
+
+def normalize_audio(
+    audio_bytes: bytes,
+    *,
+    codec: str = "opus",
+    sample_rate: int = DEFAULT_SAMPLE_RATE,
+    bitrate_kbps: Optional[int] = None,
+    trim_silence: bool = True,
+    filename: str = "audio.mp3",
+) -> PreparedAudio:
+    """
+    Converte o audio para voz mono de baixo bitrate. So troca os bytes quando o
+    resultado e menor ou mais curto (>= MIN_SECONDS_SAVED) que o original.
+    """
+    original_seconds = _probe_audio_duration_seconds(audio_bytes)
+    ffmpeg_bin = _ffmpeg_binary()
+    if not ffmpeg_bin or not audio_bytes:
+        return _passthrough(audio_bytes, filename, original_seconds)
+
+    input_name, _ = _detect_audio_upload_meta(audio_bytes, default_filename=filename)
+    _, output_name = _CODECS.get(codec, _CODECS["opus"])
+    try:
+        with tempfile.TemporaryDirectory(prefix="summi-audio-") as tmp:
+            input_path = os.path.join(tmp, f"in-{input_name}")
+            output_path = os.path.join(tmp, f"out-{output_name}")
+            with open(input_path, "wb") as fh:
+                fh.write(audio_bytes)
+            _run_ffmpeg(
+                build_ffmpeg_args(
+                    ffmpeg_bin,
+                    input_path,
+                    output_path,
+                    codec=codec,
+                    sample_rate=sample_rate,
+                    bitrate_kbps=bitrate_kbps,
+                    trim_silence=trim_silence,
+                )
+            )
+            with open(output_path, "rb") as fh:
+                data = fh.read()
+    except (OSError, subprocess.SubprocessError) as exc:
+        stderr = getattr(exc, "stderr", None) or b""
+        logger.warning("audio_prep.ffmpeg_failed bytes=%s error=%s stderr=%s", len(audio_bytes), exc, stderr[-300:])
+        return _passthrough(audio_bytes, filename, original_seconds)
+
+    if not data:
+        return _passthrough(audio_bytes, filename, original_seconds)
+    seconds = _probe_audio_duration_seconds(data)
+    trimmed = (
+        original_seconds is not None
+        and seconds is not None
+        and original_seconds - seconds >= MIN_SECONDS_SAVED
+    )
+    if len(data) >= len(audio_bytes) and not trimmed:
+        return _passthrough(audio_bytes, filename, original_seconds)
+
+    logger.info(
+        "audio_prep.normalized original_bytes=%s bytes=%s original_seconds=%s seconds=%s codec=%s",
+        len(audio_bytes),
+        len(data),
+        original_seconds,
+        seconds,
+        codec,
+    )
+    return PreparedAudio(
+        data=data,
+        filename=output_name,
+        original_size=len(audio_bytes),
+        original_seconds=original_seconds,
+        seconds=seconds,
+        normalized=True,
+    )
+
+
+def _decode_pcm16(audio_bytes: bytes, filename: str) -> Optional[Tuple[array, int]]:
+    """
+    PCM 16-bit mono: WAV direto pelo modulo wave, demais formatos via ffmpeg.
+    """
+    if audio_bytes[:4] == b"RIFF" and b"WAVE" in audio_bytes[:16]:
+        try:
+            with wave.open(BytesIO(audio_bytes)) as wav:
+                if wav.getsampwidth() == 2:
+                    channels, rate = wav.getnchannels(), wav.getframerate()
+                    samples = array("h", wav.readframes(wav.getnframes()))
+                    if sys.byteorder == "big":
+                        samples.byteswap()
+                    if channels > 1:
+                        samples = array(
+                            "h",
+                            (sum(samples[i : i + channels]) // channels for i in range(0, len(samples), channels)),
+                        )
+                    return samples, rate
+        except (wave.Error, EOFError) as exc:
+            logger.info("audio_prep.wav_decode_failed error=%s", exc)
+
+    ffmpeg_bin = _ffmpeg_binary()
+    if not ffmpeg_bin:
+        return None
+    input_name, _ = _detect_audio_upload_meta(audio_bytes, default_filename=filename)
+    with tempfile.TemporaryDirectory(prefix="summi-audio-") as tmp:
+        input_path = os.path.join(tmp, f"in-{input_name}")
+        with open(input_path, "wb") as fh:
+            fh.write(audio_bytes)
+        raw = _run_ffmpeg(
+            [ffmpeg_bin, "-hide_banner", "-loglevel", "error", "-nostdin", "-i", input_path, "-vn", "-ac", "1", "-ar", str(DEFAULT_SAMPLE_RATE), "-f", "s16le", "pipe:1"]
+        )
+    samples = array("h")
+    samples.frombytes(raw[: len(raw) - len(raw) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples, DEFAULT_SAMPLE_RATE
+
+
+def _encode_pcm16(samples: array, sample_rate: int, *, codec: str, bitrate_kbps: Optional[int]) -> Tuple[bytes, str]:
+    pcm = array("h", samples)
+    if sys.byteorder == "big":
+        pcm.byteswap()
+    ffmpeg_bin = _ffmpeg_binary()
+    if not ffmpeg_bin:
+        out = BytesIO()
+        with wave.open(out, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(pcm.tobytes())
+        return out.getvalue(), "audio.wav"
+
+    codec_args, output_name = _CODECS.get(codec, _CODECS["opus"])
+    with tempfile.TemporaryDirectory(prefix="summi-audio-") as tmp:
+        output_path = os.path.join(tmp, f"out-{output_name}")
+        _run_ffmpeg(
+            [ffmpeg_bin, "-hide_banner", "-loglevel", "error", "-y", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0"]
+            + codec_args
+            + ["-b:a", f"{_bitrate_kbps(codec, bitrate_kbps)}k", output_path],
+            stdin=pcm.tobytes(),
+        )
+        with open(output_path, "rb") as fh:
+            return fh.read(), output_name
+
+
+def trim_long_silences(
+    audio_bytes: bytes,
+    *,
+    filename: str = "audio.mp3",
+    codec: str = "opus",
+    bitrate_kbps: Optional[int] = None,
+    min_silence_seconds: float = DEFAULT_MIN_SILENCE_SECONDS,
+) -> Optional[PreparedAudio]:
+    """
+    Corta silencios longos via VAD (audio_vad) e recodifica so os trechos de fala.
+    Retorna None quando nao da para decodificar ou quando o corte economiza menos
+    que MIN_SECONDS_SAVED.
+    """
+    try:
+        decoded = _decode_pcm16(audio_bytes, filename)
+        if decoded is None:
+            return None
+        samples, sample_rate = decoded
+        result = trim_silences(samples, sample_rate, min_silence_seconds=min_silence_seconds)
+        if result is None or result.seconds_saved < MIN_SECONDS_SAVED:
+            return None
+        data, output_name = _encode_pcm16(result.samples, sample_rate, codec=codec, bitrate_kbps=bitrate_kbps)
+    except (OSError, subprocess.SubprocessError) as exc:
+        logger.warning("audio_prep.vad_failed bytes=%s error=%s", len(audio_bytes), exc)
+        return None
+
+    logger.info(
+        "audio_prep.vad_trimmed original_seconds=%.2f seconds=%.2f segments=%s bytes=%s->%s",
+        result.original_seconds,
+        result.seconds,
+        len(result.segments),
+        len(audio_bytes),
+        len(data),
+    )
+    return PreparedAudio(
+        data=data,
+        filename=output_name,
+        original_size=len(audio_bytes),
+        original_seconds=result.original_seconds,
+        seconds=result.seconds,
+        normalized=True,
+        speech_segments=result.segments,
+        vad_seconds_saved=result.seconds_saved,
+    )
+
+
+def prepare_audio_from_settings(settings: Any, audio_bytes: bytes, *, filename: str = "audio.mp3") -> PreparedAudio:
+    codec = str(getattr(settings, "audio_prep_codec", "opus"))
+    bitrate_kbps = getattr(settings, "audio_prep_bitrate_kbps", 0) or None
+    if getattr(settings, "enable_audio_vad", False):
+        # O VAD ja recodifica em mono/baixo bitrate; a normalizacao so roda se ele nao cortou nada.
+        trimmed = trim_long_silences(
+            audio_bytes,
+            filename=filename,
+            codec=codec,
+            bitrate_kbps=bitrate_kbps,
+            min_silence_seconds=float(getattr(settings, "audio_vad_min_silence_seconds", DEFAULT_MIN_SILENCE_SECONDS)),
+        )
+        if trimmed is not None:
+            return trimmed
+    if not getattr(settings, "enable_audio_prep", False):
+        return PreparedAudio(
+            data=audio_bytes,
+            filename=filename,
+            original_size=len(audio_bytes),
+            original_seconds=None,
+            seconds=None,
+        )
+    return normalize_audio(audio_bytes, codec=codec, bitrate_kbps=bitrate_kbps, filename=filename)
@@ -0,0 +1,157 @@
+"""
+audio_vad.py — Deteccao de fala por energia para cortar silencios longos.
+
+Opera sobre PCM 16-bit mono (o decode/encode fica em audio_prep). Quadros de
+30 ms acima do limiar de energia viram fala; pausas curtas entre falas sao
+mantidas e pausas longas sao encurtadas. O mapa de timestamps permite levar um
+instante do audio cortado de volta ao audio original.
+
+NumPy e opcional: sem ele a energia dos quadros e calculada em Python puro.
+"""
+from __future__ import annotations
+
+import math
+from array import array
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+
+FRAME_MS = 30
+MIN_SPEECH_RMS = 300.0
+NOISE_PERCENTILE = 0.2
+NOISE_FACTOR = 3.0
+PEAK_FACTOR = 0.25
+DEFAULT_MIN_SILENCE_SECONDS = 0.8
+DEFAULT_PAD_SECONDS = 0.2
+
+
+@dataclass(frozen=True)
+class SpeechSegment:
+    output_start: float
+    source_start: float
+    source_end: float
+
+    @property
+    def duration(self) -> float:
+        return self.source_end - self.source_start
+
+
+@dataclass(frozen=True)
+class VadResult:
+    samples: array
+    segments: Tuple[SpeechSegment, ...]
+    original_seconds: float
+    seconds: float
+
+    @property
+    def seconds_saved(self) -> float:
+        return max(0.0, self.original_seconds - self.seconds)
+
+
+def _frame_rms(samples: Sequence[int], frame_len: int) -> List[float]:
+    if np is not None:
+        data = np.asarray(samples, dtype=np.float64)
+        usable = len(data) - len(data) % frame_len
+        if usable == 0:
+            return []
+        frames = data[:usable].reshape(-1, frame_len)
+        return [float(v) for v in np.sqrt(np.mean(frames * frames, axis=1))]
+    out: List[float] = []
+    for start in range(0, len(samples) - frame_len + 1, frame_len):
+        frame = samples[start : start + frame_len]
+        out.append(math.sqrt(sum(s * s for s in frame) / frame_len))
+    return out
+
+
+def _speech_threshold(rms: List[float]) -> float:
+    ordered = sorted(rms)
+    noise_floor = ordered[int(len(ordered) * NOISE_PERCENTILE)]
+    # Audio so de fala: o "ruido" e a propria voz, entao o pico limita o limiar.
+    return max(MIN_SPEECH_RMS, min(noise_floor * NOISE_FACTOR, ordered[-1] * PEAK_FACTOR))
+
+
+def detect_speech_segments(
+    samples: Sequence[int],
+    sample_rate: int,
+    *,
+    min_silence_seconds: float = DEFAULT_MIN_SILENCE_SECONDS,
+    pad_seconds: float = DEFAULT_PAD_SECONDS,
+) -> List[Tuple[float, float]]:
+    """
+    Retorna trechos de fala (inicio, fim) em segundos no audio original.
+    Pausas menores que `min_silence_seconds` ficam dentro do trecho.
+    """
+    frame_len = max(1, int(sample_rate * FRAME_MS / 1000))
+    rms = _frame_rms(samples, frame_len)
+    if not rms:
+        return []
+    threshold = _speech_threshold(rms)
+    frame_seconds = frame_len / sample_rate
+    total_seconds = len(samples) / sample_rate
+
+    runs: List[List[float]] = []
+    for index, value in enumerate(rms):
+        if value < threshold:
+            continue
+        start, end = index * frame_seconds, (index + 1) * frame_seconds
+        if runs and start - runs[-1][1] < min_silence_seconds:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+
+    segments: List[Tuple[float, float]] = []
+    for start, end in runs:
+        start, end = max(0.0, start - pad_seconds), min(total_seconds, end + pad_seconds)
+        if segments and start <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+    return segments
+
+
+def trim_silences(
+    samples: Sequence[int],
+    sample_rate: int,
+    *,
+    min_silence_seconds: float = DEFAULT_MIN_SILENCE_SECONDS,
+    pad_seconds: float = DEFAULT_PAD_SECONDS,
+) -> Optional[VadResult]:
+    """
+    Concatena so os trechos de fala. Retorna None quando nada foi detectado como
+    fala (melhor transcrever o original do que descartar conteudo).
+    """
+    found = detect_speech_segments(
+        samples,
+        sample_rate,
+        min_silence_seconds=min_silence_seconds,
+        pad_seconds=pad_seconds,
+    )
+    if not found:
+        return None
+    out = array("h")
+    segments: List[SpeechSegment] = []
+    for start, end in found:
+        first, last = int(start * sample_rate), int(end * sample_rate)
+        segments.append(SpeechSegment(output_start=len(out) / sample_rate, source_start=start, source_end=end))
+        out.extend(array("h", samples[first:last]))
+    return VadResult(
+        samples=out,
+        segments=tuple(segments),
+        original_seconds=len(samples) / sample_rate,
+        seconds=len(out) / sample_rate,
+    )
+
+
+def map_to_source(segments: Sequence[SpeechSegment], output_seconds: float) -> float:
+    """
+    Converte um instante do audio cortado para o instante no audio original.
+    """
+    for segment in reversed(segments):
+        if output_seconds >= segment.output_start:
+            return min(segment.source_end, segment.source_start + (output_seconds - segment.output_start))
+    return output_seconds
@@ -21,6 +21,7 @@ from typing import Optional
 import requests
 
 from .openai_client import GeminiClient
+from .prompt_budget import PromptSection, fit_prompt
 from .supabase_rest import SupabaseRest
 
 logger = logging.getLogger("summi_worker.blog_writer")
@@ -103,6 +104,9 @@ Formato de saída — retorne JSON com:
 }
 """
 
+# Artigo de 1800-2500 palavras em JSON.
+BLOG_OUTPUT_RESERVE_TOKENS = 8192
+
 _USER_PROMPT_TEMPLATE = """\
 Escreva um artigo completo e otimizado sobre o tema:
 "{keyword}"
@@ -168,10 +172,17 @@ def _generate_post_gemini(keyword: str, api_key: str, model: str) -> Optional[di
     """Call Gemini to generate a blog post JSON."""
     try:
         client = GeminiClient(api_key)
+        user = fit_prompt(
+            [PromptSection("tema", _USER_PROMPT_TEMPLATE.format(keyword=keyword))],
+            model=model,
+            name="blog_post",
+            system=_SYSTEM_PROMPT,
+            reserve_output_tokens=BLOG_OUTPUT_RESERVE_TOKENS,
+        ).text
         return client.chat_json_response(
             model=model,
             system=_SYSTEM_PROMPT,
-            user=_USER_PROMPT_TEMPLATE.format(keyword=keyword),
+            user=user,
             temperature=0.7,
         ).data
     except Exception as exc:
@@ -0,0 +1,299 @@
+"""
+budget_gate.py — Teto rigido de gasto aplicado antes das chamadas de IA.
+
+Fluxo: estima o custo da chamada (tabelas de cost_tracking + duracao do audio
+via mutagen ou tokens do prompt via prompt_budget), reserva a estimativa contra o
+hard cap do usuario e libera a reserva ao final — o custo real entra pelo
+`log_*_cost` normal. Se gasto do mes + reservas + estimativa passam do hard cap,
+`BudgetExceededError` e levantado e a chamada nao acontece.
+
+Reservas ficam no Redis do contador de budget (compartilhadas entre workers)
+ou, sem ele, em memoria do processo.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Callable, Dict, Optional, Union
+
+from .budget_guard import UserBudgetState, get_budget_counter, get_user_budget_state
+from .cost_tracking import calculate_chat_cost, calculate_transcription_cost, calculate_tts_cost
+from .openai_client import _probe_audio_duration_seconds
+from .prompt_budget import estimate_tokens
+from .redis_pool import timed
+
+logger = logging.getLogger("summi_worker.budget_gate")
+
+RESERVED_KEY_PREFIX = "summi:budget:reserved:"
+RESERVATION_TTL_SECONDS = 600
+
+# Heuristicas de estimativa (conservadoras: melhor bloquear um pouco antes do que depois).
+AUDIO_BYTES_PER_SECOND_FALLBACK = 2000  # ~16 kbps (Opus/PTT do WhatsApp)
+VISION_INPUT_TOKENS = 1300
+VISION_OUTPUT_TOKENS = 300
+DEFAULT_OUTPUT_TOKENS = 512
+
+_USD_QUANTIZE = Decimal("0.00000001")
+
+# KEYS: reserved; ARGV: amount, current_usd, cap_usd, ttl
+_RESERVE_SCRIPT = """
+local amount = tonumber(ARGV[1])
+local reserved = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[2]) + reserved + amount > tonumber(ARGV[3]) then
+  return 0
+end
+redis.call('INCRBYFLOAT', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return 1
+"""
+
+
+class BudgetExceededError(RuntimeError):
+    def __init__(self, message: str, *, state: UserBudgetState, estimated_usd: Decimal):
+        super().__init__(message)
+        self.state = state
+        self.estimated_usd = estimated_usd
+
+
+# ---------------------------------------------------------------------------
+# Estimativas
+# ---------------------------------------------------------------------------
+
+def estimate_transcription_cost(audio_bytes: bytes, *, model: str) -> Decimal:
+    duration = _probe_audio_duration_seconds(audio_bytes)
+    if duration is None:
+        duration = len(audio_bytes) / AUDIO_BYTES_PER_SECOND_FALLBACK
+    return calculate_transcription_cost(max(1.0, duration), model=model)
+
+
+def estimate_chat_cost(prompt_text: str, *, model: str, max_output_tokens: int = DEFAULT_OUTPUT_TOKENS) -> Decimal:
+    return calculate_chat_cost(estimate_tokens(prompt_text), max_output_tokens, model=model)
+
+
+def estimate_vision_cost(*, model: str) -> Decimal:
+    return calculate_chat_cost(VISION_INPUT_TOKENS, VISION_OUTPUT_TOKENS, model=model)
+
+
+def estimate_tts_cost(text: str) -> Decimal:
+    return calculate_tts_cost(len(text or ""))
+
+
+# ---------------------------------------------------------------------------
+# Reservas
+# ---------------------------------------------------------------------------
+
+class _LocalReservations:
+    def __init__(self) -> None:
+        self._reserved: Dict[str, Decimal] = {}
+        self._lock = threading.Lock()
+
+    def try_reserve(self, user_id: str, amount: Decimal, current_usd: Decimal, cap_usd: Decimal) -> bool:
+        with self._lock:
+            reserved = self._reserved.get(user_id, Decimal("0"))
+            if current_usd + reserved + amount > cap_usd:
+                return False
+            self._reserved[user_id] = reserved + amount
+            return True
+
+    def release(self, user_id: str, amount: Decimal) -> None:
+        with self._lock:
+            remaining = self._reserved.get(user_id, Decimal("0")) - amount
+            if remaining > 0:
+                self._reserved[user_id] = remaining
+            else:
+                self._reserved.pop(user_id, None)
+
+
+class _RedisReservations:
+    def __init__(self, client: Any) -> None:
+        self._client = client
+        self._reserve = client.register_script(_RESERVE_SCRIPT)
+
+    def try_reserve(self, user_id: str, amount: Decimal, current_usd: Decimal, cap_usd: Decimal) -> bool:
+        with timed("budget.reserve"):
+            ok = self._reserve(
+                keys=[f"{RESERVED_KEY_PREFIX}{user_id}"],
+                args=[str(amount), str(current_usd), str(cap_usd), RESERVATION_TTL_SECONDS],
+            )
+        return bool(int(ok or 0))
+
+    def release(self, user_id: str, amount: Decimal) -> None:
+        with timed("budget.release"):
+            self._client.incrbyfloat(f"{RESERVED_KEY_PREFIX}{user_id}", str(-amount))
+
+
+_LOCAL_RESERVATIONS = _LocalReservations()
+_REDIS_RESERVATIONS: Dict[int, _RedisReservations] = {}
+
+
+def _reservation_store(settings: Any) -> Any:
+    counter = get_budget_counter(settings)
+    if counter is None:
+        return _LOCAL_RESERVATIONS
+    store = _REDIS_RESERVATIONS.get(id(counter))
+    if store is None:
+        store = _RedisReservations(counter.client)
+        _REDIS_RESERVATIONS[id(counter)] = store
+    return store
+
+
+class BudgetReservation:
+    """
+    Reserva de gasto estimado; `settle()` (ou o fim do `with`) devolve a reserva.
+    """
+
+    def __init__(self, store: Any = None, user_id: str = "", amount: Decimal = Decimal("0")):
+        self._store = store
+        self._user_id = user_id
+        self.amount = amount
+        self._settled = store is None
+
+    def settle(self) -> None:
+        if self._settled:
+            return
+        self._settled = True
+        try:
+            self._store.release(self._user_id, self.amount)
+        except Exception as exc:
+            logger.warning("budget_gate.release_failed user_id=%s error=%s", self._user_id, exc)
+
+    def __enter__(self) -> "BudgetReservation":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.settle()
+
+
+def _load_state(
+    settings: Any,
+    supabase: Any,
+    *,
+    user_id: str,
+    operation: str,
+    now_utc: Optional[dt.datetime],
+) -> Optional[UserBudgetState]:
+    try:
+        return get_user_budget_state(settings, supabase, user_id=user_id, now_utc=now_utc)
+    except Exception as exc:
+        logger.warning("budget_gate.state_failed user_id=%s operation=%s error=%s", user_id, operation, exc)
+        return None
+
+
+def _reserve_against(
+    settings: Any,
+    state: UserBudgetState,
+    *,
+    user_id: str,
+    operation: str,
+    estimated_usd: Union[Decimal, Callable[[], Decimal]],
+    spent_usd: Decimal = Decimal("0"),
+) -> BudgetReservation:
+    rate = Decimal(str(settings.usd_brl_exchange_rate))
+    cap_usd = (state.hard_cap_brl / rate).quantize(_USD_QUANTIZE, rounding=ROUND_HALF_UP)
+    try:
+        amount = max(Decimal("0"), Decimal(estimated_usd() if callable(estimated_usd) else estimated_usd))
+    except Exception as exc:
+        logger.warning("budget_gate.estimate_failed user_id=%s operation=%s error=%s", user_id, operation, exc)
+        return BudgetReservation()
+    store = _reservation_store(settings)
+    try:
+        reserved = store.try_reserve(user_id, amount, state.current_cost_usd + spent_usd, cap_usd)
+    except Exception as exc:
+        logger.warning("budget_gate.reserve_failed user_id=%s operation=%s error=%s", user_id, operation, exc)
+        return BudgetReservation()
+
+    if not reserved:
+        logger.info(
+            "budget_gate.blocked user_id=%s operation=%s plan=%s current_brl=%s hard_cap_brl=%s estimated_usd=%s",
+            user_id,
+            operation,
+            state.plan_kind,
+            state.current_cost_brl,
+            state.hard_cap_brl,
+            amount,
+        )
+        raise BudgetExceededError(
+            f"budget_hard_cap_reached:{state.plan_kind}:{state.current_cost_brl:.2f}/{state.hard_cap_brl:.2f}",
+            state=state,
+            estimated_usd=amount,
+        )
+    return BudgetReservation(store, user_id, amount)
+
+
+def reserve_budget(
+    settings: Any,
+    supabase: Any,
+    *,
+    user_id: str,
+    operation: str,
+    estimated_usd: Union[Decimal, Callable[[], Decimal]],
+    now_utc: Optional[dt.datetime] = None,
+) -> BudgetReservation:
+    """
+    Reserva `estimated_usd` contra o hard cap do usuario (aceita um callable para
+    so estimar quando o gate esta ligado).
+
+    No-op com ENFORCE_BUDGET_HARD_CAP=false. Falhas de leitura do budget sao
+    fail-open (a chamada segue sem reserva); so o teto atingido bloqueia.
+    """
+    if not getattr(settings, "enforce_budget_hard_cap", False) or not user_id:
+        return BudgetReservation()
+
+    state = _load_state(settings, supabase, user_id=user_id, operation=operation, now_utc=now_utc)
+    if state is None:
+        return BudgetReservation()
+    return _reserve_against(settings, state, user_id=user_id, operation=operation, estimated_usd=estimated_usd)
+
+
+class BudgetRun:
+    """
+    Gate de uma rodada com varias chamadas do mesmo usuario (ex.: os chats de
+    analyze_user_chats).
+
+    Sem contador Redis, ler o estado custa 2 selects no Supabase: ele e lido uma vez
+    e cada reserva soma em memoria as estimativas ja reservadas na rodada. Com o
+    contador a leitura e um MGET, entao cada reserva rele e ve o gasto dos outros workers.
+    """
+
+    def __init__(self, settings: Any, supabase: Any, *, user_id: str, now_utc: Optional[dt.datetime] = None):
+        self._settings = settings
+        self._supabase = supabase
+        self._user_id = user_id
+        self._now_utc = now_utc
+        self._state: Optional[UserBudgetState] = None
+        self._loaded = False
+        self._spent = Decimal("0")
+
+    def reserve(self, *, operation: str, estimated_usd: Union[Decimal, Callable[[], Decimal]]) -> BudgetReservation:
+        settings = self._settings
+        if not getattr(settings, "enforce_budget_hard_cap", False) or not self._user_id:
+            return BudgetReservation()
+        if get_budget_counter(settings) is not None:
+            return reserve_budget(
+                settings,
+                self._supabase,
+                user_id=self._user_id,
+                operation=operation,
+                estimated_usd=estimated_usd,
+                now_utc=self._now_utc,
+            )
+        if not self._loaded:
+            self._loaded = True
+            self._state = _load_state(
+                settings, self._supabase, user_id=self._user_id, operation=operation, now_utc=self._now_utc
+            )
+        if self._state is None:
+            return BudgetReservation()
+        reservation = _reserve_against(
+            settings,
+            self._state,
+            user_id=self._user_id,
+            operation=operation,
+            estimated_usd=estimated_usd,
+            spent_usd=self._spent,
+        )
+        # O custo real so entra no Supabase depois: conta a estimativa como gasta na rodada.
+        self._spent += reservation.amount
+        return reservation
@@ -1,15 +1,55 @@
 from __future__ import annotations
 
 import datetime as dt
+import logging
+import threading
 from dataclasses import dataclass
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Any
+from typing import Any, Dict, Optional, Tuple
 
 from .config import Settings
+from .redis_pool import get_redis, timed
 from .supabase_rest import SupabaseRest, to_postgrest_filter_eq, to_postgrest_filter_gte
 
+logger = logging.getLogger("summi_worker.budget_guard")
+
 _BRL_QUANTIZE = Decimal("0.01")
 
+MTD_KEY_PREFIX = "summi:budget:mtd:"
+SEEDING_KEY_PREFIX = "summi:budget:seeding:"
+PLAN_KEY_PREFIX = "summi:budget:plan:"
+PLAN_CACHE_TTL_SECONDS = 300
+# Janela maxima de uma semeadura (leitura do user_costs) antes do acumulador expirar.
+SEEDING_TTL_SECONDS = 60
+
+# KEYS: mtd, seeding; ARGV: custo
+# Contador semeado: incrementa. Semeadura em andamento: acumula no seeding para o
+# seed somar ao valor lido. Sem nenhum dos dois: a proxima leitura semeia do Supabase.
+_ADD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  return redis.call('INCRBYFLOAT', KEYS[1], ARGV[1])
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+  return redis.call('INCRBYFLOAT', KEYS[2], ARGV[1])
+end
+return false
+"""
+
+# KEYS: mtd, seeding; ARGV: custo lido do Supabase, ttl
+# Compare-and-set: se outro leitor ja semeou, devolve o valor dele; senao grava
+# leitura + gastos acumulados durante a leitura.
+_FINISH_SEED_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+  return current
+end
+local pending = tonumber(redis.call('GET', KEYS[2]) or '0') or 0
+local total = tonumber(ARGV[1]) + pending
+redis.call('SET', KEYS[1], tostring(total), 'EX', tonumber(ARGV[2]))
+redis.call('DEL', KEYS[2])
+return tostring(total)
+"""
+
 
 @dataclass(frozen=True)
 class UserBudgetState:
@@ -29,7 +69,12 @@ class UserBudgetState:
 
 
 def _month_start_date(now_utc: dt.datetime) -> str:
-    return now_utc.date().replace(day=1).isoformat()
+    return now_utc.astimezone(dt.timezone.utc).date().replace(day=1).isoformat()
+
+
+def utc_date_str(now_utc: dt.datetime | None = None) -> str:
+    """Dia (UTC) usado em user_costs e nas chaves do contador mensal."""
+    return (now_utc or dt.datetime.now(dt.timezone.utc)).astimezone(dt.timezone.utc).date().isoformat()
 
 
 def _is_trialing(subscriber: dict[str, Any] | None, now_utc: dt.datetime) -> bool:
@@ -76,6 +121,127 @@ def _load_current_cost_usd(
     return total
 
 
+def _mtd_key(user_id: str, month: str) -> str:
+    return f"{MTD_KEY_PREFIX}{user_id}:{month}"
+
+
+def _seeding_key(user_id: str, month: str) -> str:
+    return f"{SEEDING_KEY_PREFIX}{user_id}:{month}"
+
+
+class BudgetCounter:
+    """
+    Gasto do mes corrente por usuario num contador Redis (`summi:budget:mtd:{user}:{YYYY-MM}`).
+
+    - leitura O(1): um MGET do contador + plano (trial/paid) em cache;
+    - o contador e semeado a partir de `user_costs` com TTL de reconciliacao:
+      quando expira, a proxima leitura volta a somar no Supabase e corrige desvios;
+    - semeadura em duas etapas: `begin_seed` abre um acumulador antes da leitura do
+      Supabase e `finish_seed` grava leitura + acumulado (Lua), entao gasto registrado
+      durante a leitura nao se perde;
+    - cada custo registrado incrementa o contador (ou o acumulador da semeadura).
+    """
+
+    def __init__(self, client: Any, *, reconcile_seconds: int = 900):
+        self._client = client
+        self._reconcile_seconds = max(60, int(reconcile_seconds))
+        self._add = client.register_script(_ADD_SCRIPT)
+        self._finish_seed = client.register_script(_FINISH_SEED_SCRIPT)
+
+    @property
+    def client(self) -> Any:
+        return self._client
+
+    def read(self, user_id: str, month: str) -> Tuple[Optional[Decimal], Optional[str]]:
+        try:
+            with timed("budget.read"):
+                cost_raw, plan = self._client.mget(_mtd_key(user_id, month), f"{PLAN_KEY_PREFIX}{user_id}")
+        except Exception as exc:
+            logger.warning("budget_guard.counter_read_failed user_id=%s error=%s", user_id, exc)
+            return None, None
+        cost = Decimal(str(cost_raw)) if cost_raw is not None else None
+        return cost, (str(plan) if plan else None)
+
+    def begin_seed(self, user_id: str, month: str) -> None:
+        try:
+            with timed("budget.seed_begin"):
+                self._client.set(_seeding_key(user_id, month), "0", nx=True, ex=SEEDING_TTL_SECONDS)
+        except Exception as exc:
+            logger.warning("budget_guard.counter_seed_failed user_id=%s error=%s", user_id, exc)
+
+    def finish_seed(self, user_id: str, month: str, cost_usd: Decimal) -> Decimal:
+        """
+        Grava o valor lido do Supabase somado ao que chegou durante a leitura e
+        devolve o valor efetivo do contador (o de outro leitor, se ele semeou antes).
+        """
+        try:
+            with timed("budget.seed_finish"):
+                total = self._finish_seed(
+                    keys=[_mtd_key(user_id, month), _seeding_key(user_id, month)],
+                    args=[str(cost_usd), self._reconcile_seconds],
+                )
+        except Exception as exc:
+            logger.warning("budget_guard.counter_seed_failed user_id=%s error=%s", user_id, exc)
+            return cost_usd
+        return Decimal(str(total)) if total is not None else cost_usd
+
+    def cache_plan(self, user_id: str, plan_kind: str) -> None:
+        try:
+            with timed("budget.plan_set"):
+                self._client.set(f"{PLAN_KEY_PREFIX}{user_id}", plan_kind, ex=PLAN_CACHE_TTL_SECONDS)
+        except Exception as exc:
+            logger.warning("budget_guard.plan_cache_failed user_id=%s error=%s", user_id, exc)
+
+    def add(self, user_id: str, month: str, cost_usd: Decimal) -> None:
+        try:
+            with timed("budget.add"):
+                self._add(keys=[_mtd_key(user_id, month), _seeding_key(user_id, month)], args=[str(cost_usd)])
+        except Exception as exc:
+            logger.warning("budget_guard.counter_incr_failed user_id=%s error=%s", user_id, exc)
+
+
+_COUNTERS: Dict[Tuple[str, int], BudgetCounter] = {}
+_ACTIVE_COUNTER: Optional[BudgetCounter] = None
+_COUNTER_LOCK = threading.Lock()
+
+
+def get_budget_counter(settings: Any) -> Optional[BudgetCounter]:
+    """
+    Contador do processo (None quando ENABLE_BUDGET_COUNTER=false ou sem Redis).
+    Tambem o torna o destino de `record_spend`.
+    """
+    global _ACTIVE_COUNTER
+    redis_url = getattr(settings, "redis_url", None)
+    if not getattr(settings, "enable_budget_counter", False) or not redis_url:
+        return None
+    key = (str(redis_url), int(getattr(settings, "budget_counter_reconcile_seconds", 900)))
+    with _COUNTER_LOCK:
+        counter = _COUNTERS.get(key)
+        if counter is None:
+            client = get_redis(key[0])
+            if client is None:
+                return None
+            try:
+                counter = BudgetCounter(client, reconcile_seconds=key[1])
+            except Exception as exc:
+                logger.warning("budget_guard.counter_init_failed error=%s", exc)
+                return None
+            _COUNTERS[key] = counter
+        _ACTIVE_COUNTER = counter
+        return counter
+
+
+def record_spend(user_id: str, cost_usd: Decimal, *, date_str: str | None = None) -> None:
+    """
+    Soma um custo ao contador do mes de `date_str` (dia UTC; padrao: hoje em UTC),
+    a mesma chave que `get_user_budget_state` le. No-op sem contador ativo.
+    """
+    counter = _ACTIVE_COUNTER
+    if counter is None or not user_id:
+        return
+    counter.add(user_id, (date_str or utc_date_str())[:7], cost_usd)
+
+
 def get_user_budget_state(
     settings: Settings,
     supabase: SupabaseRest,
@@ -85,16 +251,33 @@ def get_user_budget_state(
 ) -> UserBudgetState:
     now_utc = now_utc or dt.datetime.now(dt.timezone.utc)
     since_date = _month_start_date(now_utc)
-    subscriber_rows = supabase.select(
-        "subscribers",
-        select="subscription_status,trial_ends_at,subscribed",
-        filters=[to_postgrest_filter_eq("user_id", user_id)],
-        order="updated_at.desc",
-        limit=1,
-    )
-    subscriber = subscriber_rows[0] if subscriber_rows else None
-    is_trial = _is_trialing(subscriber, now_utc)
-    current_cost_usd = _load_current_cost_usd(supabase, user_id=user_id, since_date=since_date)
+    month = since_date[:7]
+    counter = get_budget_counter(settings)
+    cached_cost, cached_plan = counter.read(user_id, month) if counter is not None else (None, None)
+
+    if cached_plan in ("trial", "paid"):
+        is_trial = cached_plan == "trial"
+    else:
+        subscriber_rows = supabase.select(
+            "subscribers",
+            select="subscription_status,trial_ends_at,subscribed",
+            filters=[to_postgrest_filter_eq("user_id", user_id)],
+            order="updated_at.desc",
+            limit=1,
+        )
+        subscriber = subscriber_rows[0] if subscriber_rows else None
+        is_trial = _is_trialing(subscriber, now_utc)
+        if counter is not None:
+            counter.cache_plan(user_id, "trial" if is_trial else "paid")
+
+    if cached_cost is not None:
+        current_cost_usd = cached_cost
+    else:
+        if counter is not None:
+            counter.begin_seed(user_id, month)
+        current_cost_usd = _load_current_cost_usd(supabase, user_id=user_id, since_date=since_date)
+        if counter is not None:
+            current_cost_usd = counter.finish_seed(user_id, month, current_cost_usd)
     current_cost_brl = (current_cost_usd * Decimal(str(settings.usd_brl_exchange_rate))).quantize(
         _BRL_QUANTIZE,
         rounding=ROUND_HALF_UP,
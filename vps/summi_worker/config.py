@@ -110,6 +110,62 @@ class Settings:
     unsplash_access_key: str
     site_url: str
 
+    # Auth local (JWT do Supabase validado sem round-trip)
+    supabase_jwt_secret: str | None = None
+    supabase_jwks_cache_ttl_seconds: int = 600
+    auth_token_cache_ttl_seconds: int = 60
+
+    # Debounce da analise por chat (requer fila de analise + Redis)
+    enable_analysis_debounce: bool = False
+    analysis_debounce_settle_seconds: int = 45
+    analysis_debounce_max_wait_seconds: int = 300
+    analysis_min_interval_seconds: int = 600
+
+    # Job diario fatiado: shards espalhados pela janela, com concorrencia por shard
+    daily_summary_shards: int = 1
+    daily_summary_window_minutes: int = 60
+    daily_summary_concurrency: int = 4
+
+    # Envio para a Evolution com token bucket por instancia (requer Redis + worker outbound)
+    enable_outbound_queue: bool = False
+    outbound_rate_per_second: float = 1.0
+    outbound_burst: int = 5
+    outbound_max_attempts: int = 5
+
+    # Custos de IA gravados em lote (buffer em Redis/memoria + flush periodico)
+    enable_cost_ledger: bool = False
+    cost_ledger_flush_seconds: float = 5.0
+    cost_ledger_max_batch: int = 200
+
+    # Gasto do mes em contador Redis (leitura O(1) no budget guard)
+    enable_budget_counter: bool = False
+    budget_counter_reconcile_seconds: int = 900
+
+    # Bloqueia transcricao/visao/analise/TTS quando a estimativa estoura o hard cap
+    enforce_budget_hard_cap: bool = False
+    enable_vision_cache: bool = False
+    vision_cache_ttl_seconds: int = 604800
+    enable_image_prep: bool = False
+    image_prep_max_edge: int = 1024
+    image_prep_format: str = "jpeg"
+    image_prep_quality: int = 80
+    enable_audio_prep: bool = False
+    audio_prep_codec: str = "opus"
+    audio_prep_bitrate_kbps: int = 0
+    enable_audio_vad: bool = False
+    audio_vad_min_silence_seconds: float = 0.8
+    enable_llm_streaming: bool = False
+    enable_conversation_compaction: bool = False
+    conversa_keep_events: int = 50
+    conversa_max_bytes: int = 65536
+    conversa_summary_max_chars: int = 8000
+    supabase_response_audit: bool = False
+    enable_local_dedupe: bool = True
+    local_dedupe_capacity: int = 1_000_000
+    local_dedupe_fp_rate: float = 1e-6
+    enable_webhook_prefilter: bool = True
+    webhook_prefilter_group_ttl_seconds: int = 60
+
 
 def load_settings() -> Settings:
     settings = Settings(
@@ -176,12 +232,54 @@ def load_settings() -> Settings:
         blog_use_pytrends=_bool("BLOG_USE_PYTRENDS", True),
         unsplash_access_key=os.getenv("UNSPLASH_ACCESS_KEY", ""),
         site_url=os.getenv("SITE_URL", "https://summi.gera-leads.com"),
+        supabase_jwt_secret=os.getenv("SUPABASE_JWT_SECRET") or None,
+        supabase_jwks_cache_ttl_seconds=_int("SUPABASE_JWKS_CACHE_TTL_SECONDS", 600),
+        auth_token_cache_ttl_seconds=_int("AUTH_TOKEN_CACHE_TTL_SECONDS", 60),
+        enable_analysis_debounce=_bool("ENABLE_ANALYSIS_DEBOUNCE", False),
+        analysis_debounce_settle_seconds=_int("ANALYSIS_DEBOUNCE_SETTLE_SECONDS", 45),
+        analysis_debounce_max_wait_seconds=_int("ANALYSIS_DEBOUNCE_MAX_WAIT_SECONDS", 300),
+        analysis_min_interval_seconds=_int("ANALYSIS_MIN_INTERVAL_SECONDS", 600),
+        daily_summary_shards=max(1, _int("DAILY_SUMMARY_SHARDS", 1)),
+        daily_summary_window_minutes=min(max(0, _int("DAILY_SUMMARY_WINDOW_MINUTES", 60)), 23 * 60),
+        daily_summary_concurrency=max(1, _int("DAILY_SUMMARY_CONCURRENCY", 4)),
+        enable_outbound_queue=_bool("ENABLE_OUTBOUND_QUEUE", False),
+        outbound_rate_per_second=max(0.01, _float("OUTBOUND_RATE_PER_SECOND", 1.0)),
+        outbound_burst=max(1, _int("OUTBOUND_BURST", 5)),
+        outbound_max_attempts=max(1, _int("OUTBOUND_MAX_ATTEMPTS", 5)),
+        enable_cost_ledger=_bool("ENABLE_COST_LEDGER", False),
+        cost_ledger_flush_seconds=max(0.5, _float("COST_LEDGER_FLUSH_SECONDS", 5.0)),
+        cost_ledger_max_batch=max(1, _int("COST_LEDGER_MAX_BATCH", 200)),
+        enable_budget_counter=_bool("ENABLE_BUDGET_COUNTER", False),
+        budget_counter_reconcile_seconds=max(60, _int("BUDGET_COUNTER_RECONCILE_SECONDS", 900)),
+        enforce_budget_hard_cap=_bool("ENFORCE_BUDGET_HARD_CAP", False),
+        enable_vision_cache=_bool("ENABLE_VISION_CACHE", False),
+        vision_cache_ttl_seconds=max(60, _int("VISION_CACHE_TTL_SECONDS", 604800)),
+        enable_image_prep=_bool("ENABLE_IMAGE_PREP", False),
+        image_prep_max_edge=max(128, _int("IMAGE_PREP_MAX_EDGE", 1024)),
+        image_prep_format=os.getenv("IMAGE_PREP_FORMAT", "jpeg").strip().lower(),
+        image_prep_quality=min(95, max(30, _int("IMAGE_PREP_QUALITY", 80))),
+        enable_audio_prep=_bool("ENABLE_AUDIO_PREP", False),
+        audio_prep_codec=os.getenv("AUDIO_PREP_CODEC", "opus").strip().lower(),
+        audio_prep_bitrate_kbps=max(0, _int("AUDIO_PREP_BITRATE_KBPS", 0)),
+        enable_audio_vad=_bool("ENABLE_AUDIO_VAD", False),
+        audio_vad_min_silence_seconds=max(0.3, _float("AUDIO_VAD_MIN_SILENCE_SECONDS", 0.8)),
+        enable_llm_streaming=_bool("ENABLE_LLM_STREAMING", False),
+        enable_conversation_compaction=_bool("ENABLE_CONVERSATION_COMPACTION", False),
+        conversa_keep_events=max(1, _int("CONVERSA_KEEP_EVENTS", 50)),
+        conversa_max_bytes=max(1024, _int("CONVERSA_MAX_BYTES", 65536)),
+        conversa_summary_max_chars=max(0, _int("CONVERSA_SUMMARY_MAX_CHARS", 8000)),
+        supabase_response_audit=_bool("SUPABASE_RESPONSE_AUDIT", False),
+        enable_local_dedupe=_bool("ENABLE_LOCAL_DEDUPE", True),
+        local_dedupe_capacity=max(1000, _int("LOCAL_DEDUPE_CAPACITY", 1_000_000)),
+        local_dedupe_fp_rate=min(0.01, max(1e-9, _float("LOCAL_DEDUPE_FP_RATE", 1e-6))),
+        enable_webhook_prefilter=_bool("ENABLE_WEBHOOK_PREFILTER", True),
+        webhook_prefilter_group_ttl_seconds=max(0, _int("WEBHOOK_PREFILTER_GROUP_TTL_SECONDS", 60)),
     )
 
     if settings.require_redis and not settings.redis_url:
         raise RuntimeError("REDIS_URL is required when REQUIRE_REDIS=true")
 
-    if (settings.enable_analysis_queue or settings.enable_summary_queue) and not settings.redis_url:
+    if (settings.enable_analysis_queue or settings.enable_summary_queue or settings.enable_outbound_queue) and not settings.redis_url:
         raise RuntimeError("REDIS_URL is required when queue support is enabled")
 
     if settings.llm_provider not in {"google", "openai"}:
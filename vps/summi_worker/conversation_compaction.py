@@ -0,0 +1,125 @@
+"""
+conversation_compaction.py — Compactacao periodica de chats.conversa.
+
+A compactacao roda no banco (RPC compact_chat_conversations): tira o `raw` dos
+eventos, mantem os ultimos N eventos e dobra os antigos em chats.conversa_resumo,
+respeitando o teto de bytes por chat. Aqui so disparamos em lotes e reportamos
+os bytes recuperados.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+from .supabase_rest import SupabaseError, SupabaseRest
+
+logger = logging.getLogger("summi_worker.conversation_compaction")
+
+DEFAULT_KEEP_EVENTS = 50
+DEFAULT_MAX_BYTES = 64 * 1024
+DEFAULT_SUMMARY_MAX_CHARS = 8000
+COMPACTION_BATCH_LIMIT = 500
+COMPACTION_MAX_BATCHES = 20
+
+
+@dataclass(frozen=True)
+class CompactionReport:
+    chats_compacted: int = 0
+    events_folded: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return max(0, self.bytes_before - self.bytes_after)
+
+    def __add__(self, other: "CompactionReport") -> "CompactionReport":
+        return CompactionReport(
+            chats_compacted=self.chats_compacted + other.chats_compacted,
+            events_folded=self.events_folded + other.events_folded,
+            bytes_before=self.bytes_before + other.bytes_before,
+            bytes_after=self.bytes_after + other.bytes_after,
+        )
+
+
+def _report_from_rpc(rows: Any) -> CompactionReport:
+    row = rows[0] if isinstance(rows, list) and rows else rows
+    if not isinstance(row, dict):
+        return CompactionReport()
+    return CompactionReport(
+        chats_compacted=int(row.get("chats_compacted") or 0),
+        events_folded=int(row.get("events_folded") or 0),
+        bytes_before=int(row.get("bytes_before") or 0),
+        bytes_after=int(row.get("bytes_after") or 0),
+    )
+
+
+def compact_conversations(
+    supabase: SupabaseRest,
+    *,
+    keep_events: int = DEFAULT_KEEP_EVENTS,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    summary_max_chars: int = DEFAULT_SUMMARY_MAX_CHARS,
+    batch_limit: int = COMPACTION_BATCH_LIMIT,
+    max_batches: int = COMPACTION_MAX_BATCHES,
+) -> CompactionReport:
+    """
+    Chama a RPC em lotes ate um lote vir incompleto (nada mais a compactar).
+    """
+    total = CompactionReport()
+    for _ in range(max(1, max_batches)):
+        batch = _report_from_rpc(
+            supabase.rpc(
+                "compact_chat_conversations",
+                {
+                    "p_keep_events": keep_events,
+                    "p_max_bytes": max_bytes,
+                    "p_summary_max_chars": summary_max_chars,
+                    "p_limit": batch_limit,
+                },
+            )
+        )
+        total += batch
+        if batch.chats_compacted < batch_limit:
+            break
+    return total
+
+
+def run_conversation_compaction_job(settings: Any, supabase: SupabaseRest) -> Dict[str, Any]:
+    try:
+        report = compact_conversations(
+            supabase,
+            keep_events=int(getattr(settings, "conversa_keep_events", DEFAULT_KEEP_EVENTS)),
+            max_bytes=int(getattr(settings, "conversa_max_bytes", DEFAULT_MAX_BYTES)),
+            summary_max_chars=int(getattr(settings, "conversa_summary_max_chars", DEFAULT_SUMMARY_MAX_CHARS)),
+        )
+    except SupabaseError as exc:
+        logger.warning("conversation_compaction.failed error=%s", exc)
+        return {"success": False, "error": str(exc)[:200]}
+
+    logger.info(
+        "conversation_compaction.done chats=%s events_folded=%s bytes_before=%s bytes_after=%s bytes_reclaimed=%s",
+        report.chats_compacted,
+        report.events_folded,
+        report.bytes_before,
+        report.bytes_after,
+        report.bytes_reclaimed,
+    )
+    return {
+        "success": True,
+        "chats_compacted": report.chats_compacted,
+        "events_folded": report.events_folded,
+        "bytes_reclaimed": report.bytes_reclaimed,
+    }
+
+
+def conversa_with_summary(conversa: Any, resumo: Any) -> Any:
+    """
+    Para prompts: coloca o resumo dos eventos dobrados antes dos eventos mantidos.
+    """
+    text = str(resumo or "").strip()
+    if not text:
+        return conversa
+    events: List[Any] = list(conversa) if isinstance(conversa, list) else ([conversa] if conversa else [])
+    return [{"resumo_anterior": text}, *events]
@@ -0,0 +1,368 @@
+"""
+cost_ledger.py — Escrita em lote dos custos de IA.
+
+Os `log_*_cost` de cost_tracking apenas registram a entrada aqui; uma thread
+de fundo agrega por (usuario, dia, coluna de operacao) e grava em lote:
+um insert em `cost_logs` e uma RPC `increment_user_costs_bulk` por flush,
+em vez de um insert + uma RPC por chamada de IA.
+
+Com Redis, cada entrada vai primeiro para uma lista (write-ahead) e o flush
+reivindica a lista inteira via RENAME; lotes de um processo que morreu no meio
+do flush sao retomados quando o lease expira. Sem Redis, o buffer e em memoria.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from .redis_pool import get_redis, timed
+from .supabase_rest import SupabaseError, SupabaseRest, is_missing_function
+
+
+logger = logging.getLogger("summi_worker.cost_ledger")
+
+WAL_KEY = "summi:cost:wal"
+BATCH_KEY_PREFIX = "summi:cost:wal:batch:"
+INFLIGHT_KEY = "summi:cost:wal:inflight"
+LEASE_KEY_PREFIX = "summi:cost:wal:lease:"
+STAGE_KEY_PREFIX = "summi:cost:wal:stage:"
+
+BATCH_LEASE_SECONDS = 120
+COST_LOGS_CHUNK_SIZE = 500
+LOCAL_BUFFER_MAX_ENTRIES = 20000
+
+# Bulk insert do PostgREST exige o mesmo conjunto de chaves em todas as linhas.
+COST_LOG_COLUMNS = (
+    "user_id",
+    "operation",
+    "model",
+    "cost_usd",
+    "tokens_input",
+    "tokens_output",
+    "tokens_total",
+    "tokens_cached",
+    "audio_seconds",
+    "char_count",
+    "created_at",
+)
+# Colunas de migrations mais novas: so entram no insert quando alguma linha do lote
+# tem valor, entao um banco sem a migration continua aceitando os lotes comuns.
+OPTIONAL_COST_LOG_COLUMNS = ("tokens_cached",)
+
+# KEYS: wal, batch, inflight set, lease; ARGV: token, lease_seconds
+_CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('SADD', KEYS[3], ARGV[1])
+redis.call('SET', KEYS[4], '1', 'EX', tonumber(ARGV[2]))
+return 1
+"""
+
+
+def _cost_log_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    drop = [col for col in OPTIONAL_COST_LOG_COLUMNS if all(row.get(col) is None for row in rows)]
+    if not drop:
+        return rows
+    return [{key: value for key, value in row.items() if key not in drop} for row in rows]
+
+
+def _strip_written_logs(entries: List[Dict[str, Any]], logs_done: int) -> List[Dict[str, Any]]:
+    stripped: List[Dict[str, Any]] = []
+    seen = 0
+    for entry in entries:
+        if entry.get("log") and seen < logs_done:
+            seen += 1
+            entry = {"daily": entry["daily"]}
+        stripped.append(entry)
+    return stripped
+
+
+def _aggregate_daily(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    totals: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for entry in entries:
+        daily = entry.get("daily") or {}
+        key = (str(daily.get("user_id")), str(daily.get("date")), str(daily.get("operation_col")))
+        row = totals.get(key)
+        if row is None:
+            row = {"user_id": key[0], "date": key[1], "operation_col": key[2], "cost": 0.0, "calls": 0, "tokens": 0, "audio_minutes": 0.0}
+            totals[key] = row
+        row["cost"] += float(daily.get("cost") or 0)
+        row["calls"] += int(daily.get("calls") or 0)
+        row["tokens"] += int(daily.get("tokens") or 0)
+        row["audio_minutes"] += float(daily.get("audio_minutes") or 0)
+    return list(totals.values())
+
+
+class CostLedger:
+    def __init__(
+        self,
+        supabase: Any,
+        client: Any = None,
+        *,
+        flush_interval_seconds: float = 5.0,
+        max_batch: int = 200,
+    ):
+        self._supabase = supabase
+        self._client = client
+        self._flush_interval = max(0.5, float(flush_interval_seconds))
+        self._max_batch = max(1, int(max_batch))
+        self._claim = client.register_script(_CLAIM_SCRIPT) if client is not None else None
+        self._buffer: List[Dict[str, Any]] = []
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> Optional["CostLedger"]:
+        if not getattr(settings, "enable_cost_ledger", False):
+            return None
+        return cls(
+            SupabaseRest(settings.supabase_url, settings.supabase_service_role_key),
+            get_redis(getattr(settings, "redis_url", None)),
+            flush_interval_seconds=getattr(settings, "cost_ledger_flush_seconds", 5.0),
+            max_batch=getattr(settings, "cost_ledger_max_batch", 200),
+        )
+
+    # --- Registro (caminho quente) -----------------------------------
+
+    def record(
+        self,
+        log_row: Dict[str, Any],
+        *,
+        date_str: str,
+        operation_col: str,
+        cost: float,
+        calls: int,
+        tokens: int,
+        audio_minutes: float,
+    ) -> None:
+        entry = {
+            "log": {col: log_row.get(col) for col in COST_LOG_COLUMNS},
+            "daily": {
+                "user_id": log_row.get("user_id"),
+                "date": date_str,
+                "operation_col": operation_col,
+                "cost": cost,
+                "calls": calls,
+                "tokens": tokens,
+                "audio_minutes": audio_minutes,
+            },
+        }
+        if self._client is not None:
+            try:
+                with timed("cost_ledger.wal_append"):
+                    self._client.rpush(WAL_KEY, json.dumps(entry))
+            except Exception as exc:
+                logger.warning("cost_ledger.wal_append_failed error=%s", exc)
+                self._append_local(entry)
+        else:
+            self._append_local(entry)
+
+        with self._lock:
+            self._pending += 1
+            if self._pending >= self._max_batch:
+                self._wake.set()
+
+    def _append_local(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            if len(self._buffer) >= LOCAL_BUFFER_MAX_ENTRIES:
+                logger.error("cost_ledger.local_buffer_full dropped=1")
+                return
+            self._buffer.append(entry)
+
+    # --- Flush ---------------------------------------------------------
+
+    def flush(self) -> int:
+        """
+        Grava tudo o que esta pendente. Retorna quantas entradas foram gravadas.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._pending = 0
+                local, self._buffer = self._buffer, []
+            written = 0
+            if local:
+                logs_written = [0]
+                try:
+                    self._write(local, on_logs_written=lambda done: logs_written.__setitem__(0, done))
+                    written += len(local)
+                except Exception as exc:
+                    logger.warning("cost_ledger.flush_failed entries=%s error=%s", len(local), exc)
+                    # Linhas de cost_logs ja gravadas (chunks completos): a nova tentativa
+                    # so refaz o restante e os agregados diarios.
+                    local = _strip_written_logs(local, logs_written[0])
+                    with self._lock:
+                        self._buffer = (local + self._buffer)[:LOCAL_BUFFER_MAX_ENTRIES]
+            if self._client is not None:
+                written += self._flush_redis()
+            return written
+
+    def _flush_redis(self) -> int:
+        written = 0
+        try:
+            token = uuid.uuid4().hex
+            with timed("cost_ledger.claim"):
+                claimed = self._claim(
+                    keys=[WAL_KEY, f"{BATCH_KEY_PREFIX}{token}", INFLIGHT_KEY, f"{LEASE_KEY_PREFIX}{token}"],
+                    args=[token, BATCH_LEASE_SECONDS],
+                )
+            tokens = [token] if int(claimed or 0) else []
+            # Lotes orfaos: lease expirou (processo caiu no meio do flush).
+            with timed("cost_ledger.inflight_scan"):
+                inflight = self._client.smembers(INFLIGHT_KEY) or []
+            for orphan in inflight:
+                if orphan == token:
+                    continue
+                with timed("cost_ledger.lease_renew"):
+                    leased = self._client.set(f"{LEASE_KEY_PREFIX}{orphan}", "1", nx=True, ex=BATCH_LEASE_SECONDS)
+                if leased:
+                    logger.warning("cost_ledger.orphan_batch_recovered token=%s", orphan)
+                    tokens.append(orphan)
+        except Exception as exc:
+            logger.warning("cost_ledger.claim_failed error=%s", exc)
+            return 0
+
+        for batch in tokens:
+            try:
+                written += self._flush_batch(batch)
+            except Exception as exc:
+                logger.warning("cost_ledger.flush_failed batch=%s error=%s", batch, exc)
+        return written
+
+    def _flush_batch(self, token: str) -> int:
+        batch_key = f"{BATCH_KEY_PREFIX}{token}"
+        stage_key = f"{STAGE_KEY_PREFIX}{token}"
+        with timed("cost_ledger.batch_read"):
+            raw_entries = self._client.lrange(batch_key, 0, -1) or []
+            # Quantas linhas de cost_logs do lote ja foram gravadas (atualizado a cada chunk).
+            logs_done = int(self._client.get(stage_key) or 0)
+        entries = [json.loads(raw) for raw in raw_entries]
+
+        def _mark_logs_written(done: int) -> None:
+            with timed("cost_ledger.stage_set"):
+                self._client.set(stage_key, str(done), ex=BATCH_LEASE_SECONDS * 10)
+
+        if entries:
+            self._write(entries, logs_done=logs_done, on_logs_written=_mark_logs_written)
+
+        with timed("cost_ledger.batch_done"):
+            pipe = self._client.pipeline(transaction=True)
+            pipe.delete(batch_key, stage_key, f"{LEASE_KEY_PREFIX}{token}")
+            pipe.srem(INFLIGHT_KEY, token)
+            pipe.execute()
+        return len(entries)
+
+    def _write(
+        self,
+        entries: List[Dict[str, Any]],
+        *,
+        logs_done: int = 0,
+        on_logs_written: Any = None,
+    ) -> None:
+        """
+        `logs_done` linhas de cost_logs ja gravadas numa tentativa anterior sao puladas;
+        `on_logs_written(n)` registra o progresso depois de cada chunk, entao uma falha
+        no meio nao duplica os chunks anteriores na nova tentativa.
+        """
+        started_at = time.perf_counter()
+        rows = [entry["log"] for entry in entries if entry.get("log")]
+        for start in range(max(0, logs_done), len(rows), COST_LOGS_CHUNK_SIZE):
+            end = min(start + COST_LOGS_CHUNK_SIZE, len(rows))
+            self._supabase.insert("cost_logs", _cost_log_rows(rows[start:end]))
+            if on_logs_written is not None:
+                on_logs_written(end)
+
+        daily_rows = _aggregate_daily(entries)
+        try:
+            self._supabase.rpc("increment_user_costs_bulk", {"p_rows": daily_rows})
+        except SupabaseError as exc:
+            # So com a funcao ausente (migration nao aplicada). Outro erro pode ter
+            # commitado: propaga e o lote fica no WAL para a proxima tentativa.
+            if not is_missing_function(exc):
+                raise
+            logger.info("cost_ledger.bulk_rpc_unavailable error=%s", str(exc)[:200])
+            from .cost_tracking import _upsert_daily_cost_column
+
+            for row in daily_rows:
+                _upsert_daily_cost_column(
+                    self._supabase,
+                    user_id=row["user_id"],
+                    date_str=row["date"],
+                    op_col=row["operation_col"],
+                    cost_usd=Decimal(str(row["cost"])),
+                    call_count=row["calls"],
+                    tokens_total=row["tokens"],
+                    audio_minutes=Decimal(str(row["audio_minutes"])),
+                    raise_errors=True,
+                )
+        logger.info(
+            "cost_ledger.flushed entries=%s daily_rows=%s elapsed_ms=%s",
+            len(entries),
+            len(daily_rows),
+            int((time.perf_counter() - started_at) * 1000),
+        )
+
+    # --- Thread de fundo ----------------------------------------------
+
+    def start(self) -> "CostLedger":
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._thread = threading.Thread(target=self._run, name="cost-ledger", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("cost_ledger.final_flush_failed")
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(timeout=self._flush_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("cost_ledger.loop_error")
+
+
+_LEDGER: Optional[CostLedger] = None
+
+
+def install_cost_ledger(ledger: Optional[CostLedger]) -> None:
+    global _LEDGER
+    _LEDGER = ledger
+
+
+def get_cost_ledger() -> Optional[CostLedger]:
+    return _LEDGER
+
+
+def start_cost_ledger(settings: Any) -> Optional[CostLedger]:
+    """
+    Cria, inicia e instala o ledger do processo (no-op quando ENABLE_COST_LEDGER=false).
+    """
+    if _LEDGER is not None:
+        return _LEDGER
+    ledger = CostLedger.from_settings(settings)
+    if ledger is not None:
+        install_cost_ledger(ledger.start())
+        logger.info("cost_ledger.started redis=%s", ledger._client is not None)
+    return ledger
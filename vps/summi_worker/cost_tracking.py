@@ -3,7 +3,8 @@ cost_tracking.py — Rastreamento de custos de IA por usuário.
 
 Calcula e registra custos em tempo real após cada chamada a provedores de IA.
 Logging é assíncrono (fire-and-forget): erros de logging nunca bloqueiam
-o fluxo principal de transcrição/análise.
+o fluxo principal de transcrição/análise. Com ENABLE_COST_LEDGER=true a
+gravação vai para o ledger em lote (cost_ledger.py).
 
 Pricing sources (2025):
   - Whisper-1:              $0.006/min
@@ -15,6 +16,7 @@ Pricing sources (2025):
   - gpt-4o-mini (input):    $0.00015/1K tokens
   - gpt-4o-mini (output):   $0.0006/1K tokens
   - gpt-4o-mini-tts:        $0.000015/char
+  - Input em cache (prefixo): gpt-4o-mini 50%, Gemini 2.5 25% do preco de input
 """
 from __future__ import annotations
 
@@ -23,6 +25,9 @@ import logging
 from decimal import ROUND_HALF_UP, Decimal
 from typing import Any, Dict, Optional
 
+from .budget_guard import record_spend, utc_date_str
+from .cost_ledger import get_cost_ledger
+
 logger = logging.getLogger("summi_worker.cost_tracking")
 
 # ---------------------------------------------------------------------------
@@ -43,6 +48,11 @@ GEMINI_FLASH_LITE_OUTPUT_PER_1K = Decimal("0.0004")
 GEMINI_FLASH_INPUT_PER_1K = Decimal("0.0003")
 GEMINI_FLASH_OUTPUT_PER_1K = Decimal("0.0025")
 
+# Input servido do cache de prefixo do provedor: por 1K tokens
+GPT4O_MINI_CACHED_INPUT_PER_1K = Decimal("0.000075")
+GEMINI_FLASH_LITE_CACHED_INPUT_PER_1K = Decimal("0.000025")
+GEMINI_FLASH_CACHED_INPUT_PER_1K = Decimal("0.000075")
+
 # TTS: por caractere
 GPT4O_MINI_TTS_COST_PER_CHAR = Decimal("0.000015")
 
@@ -62,6 +72,13 @@ _CHAT_COST_MAP: Dict[str, tuple[Decimal, Decimal]] = {
     "gemini-2.5-flash": (GEMINI_FLASH_INPUT_PER_1K, GEMINI_FLASH_OUTPUT_PER_1K),
 }
 
+_CACHED_INPUT_COST_MAP: Dict[str, Decimal] = {
+    "gpt-4o-mini": GPT4O_MINI_CACHED_INPUT_PER_1K,
+    "gemini-2.5-flash-lite": GEMINI_FLASH_LITE_CACHED_INPUT_PER_1K,
+    "gemini-2.5-flash-lite-preview-09-2025": GEMINI_FLASH_LITE_CACHED_INPUT_PER_1K,
+    "gemini-2.5-flash": GEMINI_FLASH_CACHED_INPUT_PER_1K,
+}
+
 _QUANTIZE = Decimal("0.00000001")  # 8 casas decimais
 
 
@@ -86,10 +103,13 @@ def calculate_chat_cost(
     input_tokens: int,
     output_tokens: int,
     model: str = "gpt-4o-mini",
+    cached_tokens: int = 0,
 ) -> Decimal:
-    """Custo de chamada chat/completions (input + output tokens)."""
+    """Custo de chamada chat/completions (input + output tokens; cached_tokens ja incluso no input)."""
     input_rate, output_rate = _CHAT_COST_MAP.get(model, (GPT4O_MINI_INPUT_PER_1K, GPT4O_MINI_OUTPUT_PER_1K))
-    input_cost = Decimal(input_tokens) * input_rate / Decimal("1000")
+    cached = min(max(0, cached_tokens), input_tokens)
+    cached_rate = _CACHED_INPUT_COST_MAP.get(model, input_rate)
+    input_cost = (Decimal(input_tokens - cached) * input_rate + Decimal(cached) * cached_rate) / Decimal("1000")
     output_cost = Decimal(output_tokens) * output_rate / Decimal("1000")
     return (input_cost + output_cost).quantize(_QUANTIZE, rounding=ROUND_HALF_UP)
 
@@ -105,6 +125,15 @@ def calculate_tts_cost(char_count: int) -> Decimal:
 # Logging no Supabase
 # ---------------------------------------------------------------------------
 
+_OPERATION_COST_COLUMNS: Dict[str, str] = {
+    "transcribe": "transcription_cost_usd",
+    "analyze": "analysis_cost_usd",
+    "vision": "analysis_cost_usd",
+    "summary": "summary_cost_usd",
+    "tts": "tts_cost_usd",
+}
+
+
 def _safe_upsert_daily_cost(
     supabase: Any,
     user_id: str,
@@ -119,14 +148,30 @@ def _safe_upsert_daily_cost(
     Upsert no user_costs agregado por dia.
     Usa RPC do Supabase para incremento atômico.
     """
-    col_map = {
-        "transcribe": "transcription_cost_usd",
-        "analyze": "analysis_cost_usd",
-        "vision": "analysis_cost_usd",
-        "summary": "summary_cost_usd",
-        "tts": "tts_cost_usd",
-    }
-    op_col = col_map.get(operation, "analysis_cost_usd")
+    _upsert_daily_cost_column(
+        supabase,
+        user_id=user_id,
+        date_str=date_str,
+        op_col=_OPERATION_COST_COLUMNS.get(operation, "analysis_cost_usd"),
+        cost_usd=cost_usd,
+        call_count=call_count,
+        tokens_total=tokens_total,
+        audio_minutes=audio_minutes,
+    )
+
+
+def _upsert_daily_cost_column(
+    supabase: Any,
+    *,
+    user_id: str,
+    date_str: str,
+    op_col: str,
+    cost_usd: Decimal,
+    call_count: int,
+    tokens_total: int,
+    audio_minutes: Decimal,
+    raise_errors: bool = False,
+) -> None:
     cost_float = float(cost_usd)
 
     # Tenta chamar a RPC de incremento (se não existir, faz insert/update manual)
@@ -187,9 +232,56 @@ def _safe_upsert_daily_cost(
                     }],
                 )
         except Exception as exc:
+            if raise_errors:
+                raise
             logger.debug("cost_tracking.upsert_daily_failed user=%s error=%s", user_id, exc)
 
 
+def _record_cost(
+    supabase: Any,
+    log_row: Dict[str, Any],
+    *,
+    date_str: str,
+    cost_usd: Decimal,
+    tokens_total: int,
+    audio_minutes: Decimal,
+) -> None:
+    """
+    Com o ledger do processo instalado, so enfileira (flush em lote em background);
+    sem ele, grava cost_logs + user_costs na hora.
+    """
+    operation = str(log_row.get("operation") or "")
+    record_spend(str(log_row.get("user_id") or ""), cost_usd, date_str=date_str)
+    ledger = get_cost_ledger()
+    if ledger is not None:
+        ledger.record(
+            {**log_row, "created_at": dt.datetime.now(dt.timezone.utc).isoformat()},
+            date_str=date_str,
+            operation_col=_OPERATION_COST_COLUMNS.get(operation, "analysis_cost_usd"),
+            cost=float(cost_usd),
+            calls=1,
+            tokens=tokens_total,
+            audio_minutes=float(audio_minutes),
+        )
+        return
+
+    try:
+        supabase.insert("cost_logs", [log_row])
+    except Exception as exc:
+        logger.debug("cost_tracking.log_insert_failed user=%s error=%s", log_row.get("user_id"), exc)
+
+    _safe_upsert_daily_cost(
+        supabase,
+        user_id=str(log_row.get("user_id")),
+        date_str=date_str,
+        operation=operation,
+        cost_usd=cost_usd,
+        call_count=1,
+        tokens_total=tokens_total,
+        audio_minutes=audio_minutes,
+    )
+
+
 def log_transcription_cost(
     supabase: Any,
     user_id: str,
@@ -208,31 +300,20 @@ def log_transcription_cost(
         if cost <= Decimal("0"):
             return
 
-        date_str = dt.date.today().isoformat()
+        date_str = utc_date_str()
         audio_minutes = Decimal(str(duration_seconds)) / Decimal("60")
 
-        # Log detalhado
-        try:
-            supabase.insert(
-                "cost_logs",
-                [{
-                    "user_id": user_id,
-                    "operation": "transcribe",
-                    "model": model,
-                    "cost_usd": float(cost),
-                    "audio_seconds": duration_seconds,
-                }],
-            )
-        except Exception as exc:
-            logger.debug("cost_tracking.log_insert_failed user=%s error=%s", user_id, exc)
-
-        _safe_upsert_daily_cost(
+        _record_cost(
             supabase,
-            user_id=user_id,
+            {
+                "user_id": user_id,
+                "operation": "transcribe",
+                "model": model,
+                "cost_usd": float(cost),
+                "audio_seconds": duration_seconds,
+            },
             date_str=date_str,
-            operation="transcribe",
             cost_usd=cost,
-            call_count=1,
             tokens_total=0,
             audio_minutes=audio_minutes,
         )
@@ -252,6 +333,7 @@ def log_chat_cost(
     model: str,
     input_tokens: int = 0,
     output_tokens: int = 0,
+    cached_tokens: int = 0,
 ) -> None:
     """
     Registra custo de chamada chat (analyze, summary).
@@ -260,42 +342,36 @@ def log_chat_cost(
     if not input_tokens and not output_tokens:
         return
     try:
-        cost = calculate_chat_cost(input_tokens, output_tokens, model=model)
+        cost = calculate_chat_cost(input_tokens, output_tokens, model=model, cached_tokens=cached_tokens)
         if cost <= Decimal("0"):
             return
 
-        date_str = dt.date.today().isoformat()
+        date_str = utc_date_str()
         tokens_total = input_tokens + output_tokens
-
-        try:
-            supabase.insert(
-                "cost_logs",
-                [{
-                    "user_id": user_id,
-                    "operation": operation,
-                    "model": model,
-                    "cost_usd": float(cost),
-                    "tokens_input": input_tokens,
-                    "tokens_output": output_tokens,
-                    "tokens_total": tokens_total,
-                }],
-            )
-        except Exception as exc:
-            logger.debug("cost_tracking.log_insert_failed user=%s error=%s", user_id, exc)
-
-        _safe_upsert_daily_cost(
+        log_row: Dict[str, Any] = {
+            "user_id": user_id,
+            "operation": operation,
+            "model": model,
+            "cost_usd": float(cost),
+            "tokens_input": input_tokens,
+            "tokens_output": output_tokens,
+            "tokens_total": tokens_total,
+        }
+        if cached_tokens:
+            # Coluna da migration add_cost_logs_tokens_cached: so enviada quando ha cache.
+            log_row["tokens_cached"] = cached_tokens
+
+        _record_cost(
             supabase,
-            user_id=user_id,
+            log_row,
             date_str=date_str,
-            operation=operation,
             cost_usd=cost,
-            call_count=1,
             tokens_total=tokens_total,
             audio_minutes=Decimal("0"),
         )
         logger.debug(
-            "cost_tracking.chat user=%s op=%s model=%s tokens=%d cost_usd=%.8f",
-            user_id, operation, model, tokens_total, float(cost),
+            "cost_tracking.chat user=%s op=%s model=%s tokens=%d cached=%d cost_usd=%.8f",
+            user_id, operation, model, tokens_total, cached_tokens, float(cost),
         )
     except Exception as exc:
         logger.debug("cost_tracking.log_chat_failed user=%s error=%s", user_id, exc)
@@ -315,28 +391,18 @@ def log_tts_cost(
         if cost <= Decimal("0"):
             return
 
-        date_str = dt.date.today().isoformat()
-        try:
-            supabase.insert(
-                "cost_logs",
-                [{
-                    "user_id": user_id,
-                    "operation": "tts",
-                    "model": model,
-                    "cost_usd": float(cost),
-                    "char_count": char_count,
-                }],
-            )
-        except Exception as exc:
-            logger.debug("cost_tracking.log_insert_failed user=%s error=%s", user_id, exc)
-
-        _safe_upsert_daily_cost(
+        date_str = utc_date_str()
+        _record_cost(
             supabase,
-            user_id=user_id,
+            {
+                "user_id": user_id,
+                "operation": "tts",
+                "model": model,
+                "cost_usd": float(cost),
+                "char_count": char_count,
+            },
             date_str=date_str,
-            operation="tts",
             cost_usd=cost,
-            call_count=1,
             tokens_total=0,
             audio_minutes=Decimal("0"),
         )
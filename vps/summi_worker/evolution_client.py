@@ -9,7 +9,10 @@ import requests
 
 
 class EvolutionError(RuntimeError):
-    pass
+    def __init__(self, message: str, *, status_code: Optional[int] = None):
+        super().__init__(message)
+        # Ultimo status HTTP recebido (None = erro de rede/sem resposta); usado para decidir retry.
+        self.status_code = status_code
 
 
 class EvolutionClient:
@@ -88,6 +91,7 @@ class EvolutionClient:
             quoted_participant=quoted_participant,
         )
         attempts: list[str] = []
+        last_status: Optional[int] = None
 
         for path in (f"/message/sendText/{instance}", f"/messages/sendText/{instance}"):
             url = f"{self._url}{path}"
@@ -113,9 +117,10 @@ class EvolutionClient:
                 _log.info("send_text response: path=%s status=%s body=%s", path, resp.status_code, resp.text[:300])
                 if resp.ok:
                     return
+                last_status = resp.status_code
                 attempts.append(f"{path} {resp.status_code} {resp.text}")
 
-        raise EvolutionError(f"send_text failed: {' / '.join(attempts)}")
+        raise EvolutionError(f"send_text failed: {' / '.join(attempts)}", status_code=last_status)
 
     def _build_text_payloads(
         self,
@@ -196,16 +201,18 @@ class EvolutionClient:
             f"/messages/sendAudio/{instance}",
         ]
         attempts: list[str] = []
+        last_status: Optional[int] = None
 
         for path in paths:
             url = f"{self._url}{path}"
             resp = requests.post(url, headers=self._headers(), data=json.dumps(payload), timeout=60)
+            last_status = resp.status_code
             attempts.append(f"{resp.status_code} {resp.text}")
             _log.info("send_audio response: path=%s status=%s body=%s", path, resp.status_code, resp.text[:300])
             if resp.ok:
                 return
 
-        raise EvolutionError(f"send_audio failed: {' / '.join(attempts)}")
+        raise EvolutionError(f"send_audio failed: {' / '.join(attempts)}", status_code=last_status)
 
     def get_media_base64(self, instance: str, message_id: str) -> str:
         """
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import datetime as dt
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Optional, Tuple
 
 
 def _now_utc_iso() -> str:
@@ -14,278 +14,227 @@ def _unwrap(val: Any) -> Any:
         return val[0]
     return val
 
-def _extract_from_path(payload: Dict[str, Any], path: tuple[str, ...]) -> Any:
-    cur: Any = payload
-    for k in path:
-        cur = _unwrap(cur)
-        if isinstance(cur, dict) and k in cur:
-            cur = cur[k]
-        else:
-            return None
-    return cur
-
-def _extract_remote_jid(payload: Dict[str, Any]) -> Optional[str]:
-    # Tentativas comuns (varia por versao/adapter)
-    for path in (
-        ("body", "data", "key", "remoteJid"),
-        ("body", "data", "remoteJid"),
-        ("data", "key", "remoteJid"),
-        ("data", "remoteJid"),
-        ("remoteJid",),
-        ("key", "remoteJid"),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, str) and cur.strip():
-            jid = cur.strip()
-            # Normaliza formatos comuns: "551199...@s.whatsapp.net"
-            if "@" in jid:
-                jid = jid.split("@", 1)[0]
-            return jid
-    return None
 
+def _node(parent: Optional[Dict[str, Any]], key: str) -> Optional[Dict[str, Any]]:
+    # Filho dict (lista -> primeiro item), ou None.
+    if parent is None:
+        return None
+    value = _unwrap(parent.get(key))
+    return value if isinstance(value, dict) else None
 
-def _extract_remote_jid_full(payload: Dict[str, Any]) -> Optional[str]:
-    for path in (
-        ("body", "data", "key", "remoteJid"),
-        ("body", "data", "remoteJid"),
-        ("data", "key", "remoteJid"),
-        ("data", "remoteJid"),
-        ("remoteJid",),
-        ("key", "remoteJid"),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, str) and cur.strip():
-            return cur.strip()
-    return None
 
-
-def _extract_push_name(payload: Dict[str, Any]) -> Optional[str]:
-    for path in (
-        ("body", "data", "pushName"),
-        ("data", "pushName"),
-        ("data", "sender", "pushName"),
-        ("pushName",),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, str) and cur.strip():
-            return cur.strip()
+def _str_at(node: Optional[Dict[str, Any]], field: str) -> Optional[str]:
+    if node is None:
+        return None
+    value = node.get(field)
+    if isinstance(value, str) and value.strip():
+        return value.strip()
     return None
 
 
-def _extract_instance_name(payload: Dict[str, Any]) -> Optional[str]:
-    for path in (
-        ("body", "instance"),
-        ("body", "instanceName"),
-        ("instance",),
-        ("instanceName",),
-        ("data", "instance"),
-        ("data", "instanceName"),
-        ("data", "instance", "instanceName"),
-        ("data", "instance", "name"),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, str) and cur.strip():
-            return cur.strip()
+def _first_str(nodes: Tuple[Optional[Dict[str, Any]], ...], field: str) -> Optional[str]:
+    for node in nodes:
+        if node is not None:
+            value = node.get(field)
+            if isinstance(value, str) and value.strip():
+                return value.strip()
     return None
 
 
-def _extract_text(payload: Dict[str, Any]) -> Optional[str]:
-    # Baileys-like payloads
-    for path in (
-        ("body", "data", "message", "conversation"),
-        ("body", "data", "message", "extendedTextMessage", "text"),
-        ("body", "data", "message", "imageMessage", "caption"),
-        ("data", "message", "conversation"),
-        ("data", "message", "extendedTextMessage", "text"),
-        ("data", "message", "imageMessage", "caption"),
-        ("message", "conversation"),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, str) and cur.strip():
-            return cur.strip()
+def _first_truthy(nodes: Tuple[Optional[Dict[str, Any]], ...], field: str) -> Any:
+    for node in nodes:
+        if node is not None:
+            value = node.get(field)
+            if value:
+                return value
     return None
 
 
-def _extract_message_id(payload: Dict[str, Any]) -> Optional[str]:
-    for path in (
-        ("body", "data", "key", "id"),
-        ("data", "key", "id"),
-        ("key", "id"),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, str) and cur.strip():
-            return cur.strip()
-    return None
+def _bare_jid(jid: Optional[str]) -> Optional[str]:
+    # Normaliza formatos comuns: "551199...@s.whatsapp.net" -> "551199..."
+    if jid and "@" in jid:
+        return jid.split("@", 1)[0]
+    return jid
 
 
-def _extract_message_timestamp(payload: Dict[str, Any]) -> Optional[Any]:
-    for path in (
-        ("body", "data", "messageTimestamp"),
-        ("data", "messageTimestamp"),
-        ("messageTimestamp",),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and cur is not None:
-            return cur
-    return None
+_INFERRED_MESSAGE_TYPES = ("audioMessage", "imageMessage", "reactionMessage", "extendedTextMessage", "conversation")
 
 
-def _extract_participant(payload: Dict[str, Any]) -> Optional[str]:
-    for path in (
-        ("body", "data", "key", "participant"),
-        ("data", "key", "participant"),
-        ("key", "participant"),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, str) and cur.strip():
-            jid = cur.strip()
-            if "@" in jid:
-                jid = jid.split("@", 1)[0]
-            return jid
-    return None
+def _message_kind(message: Dict[str, Any]) -> str:
+    if "audioMessage" in message:
+        return "audio"
+    if "imageMessage" in message:
+        return "image"
+    if "reactionMessage" in message:
+        return "reaction"
+    if "extendedTextMessage" in message or "conversation" in message:
+        return "text"
+    return "unknown"
 
 
-def _extract_message_type(payload: Dict[str, Any]) -> Optional[str]:
-    # Campo explicitamente enviado pela Evolution
-    for path in (
-        ("body", "data", "messageType"),
-        ("data", "messageType"),
-        ("messageType",),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, str) and cur.strip():
-            return cur.strip()
-
-    # Inferencia por shape do payload
-    for path in (
-        ("body", "data", "message"),
-        ("data", "message"),
-        ("message",),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, dict):
-            for key in ("audioMessage", "imageMessage", "reactionMessage", "extendedTextMessage", "conversation"):
-                if key in cur:
-                    return key
-    return None
+class WebhookEvent:
+    """
+    Evento da Evolution lido em uma passada: os nos data/key/message sao
+    localizados uma vez para a variante de envelope recebida (n8n `body`, v2
+    direto, `data` em lista, `data.update` de messages.update) e cada campo e
+    resolvido na mesma ordem de prioridade dos extratores antigos.
+    """
 
+    __slots__ = (
+        "raw",
+        "event",
+        "instance_name",
+        "remote_jid",
+        "remote_jid_full",
+        "remote_jid_alt",
+        "key_remote_jid",
+        "push_name",
+        "from_me",
+        "message_id",
+        "message_type",
+        "message_timestamp",
+        "is_group",
+        "chat_key",
+        "author_jid",
+        "text",
+        "kind",
+        "message",
+        "inline_base64",
+        "audio_seconds",
+        "reaction_text",
+        "reaction_target_id",
+        "sender",
+        "body_sender",
+        "quoted_remote_jid",
+        "quoted_participant",
+    )
 
-def _extract_event(payload: Dict[str, Any]) -> Optional[str]:
-    for path in (
-        ("body", "event"),
-        ("event",),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            cur = _unwrap(cur)
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
+    def __init__(self, payload: Any) -> None:
+        self.raw = payload
+        root = _unwrap(payload)
+        if not isinstance(root, dict):
+            root = {}
+        body = _node(root, "body")
+        body_data = _node(body, "data")
+        data = _node(root, "data")
+        body_key = _node(body_data, "key")
+        data_key = _node(data, "key")
+        root_key = _node(root, "key")
+        body_msg = _node(body_data, "message")
+        data_msg = _node(data, "message")
+        update_msg = _node(_node(data, "update"), "message")
+        root_msg = _node(root, "message")
+        keys = (body_key, data_key, root_key)
+
+        self.event = _str_at(body, "event") or _str_at(root, "event")
+        data_instance = _node(data, "instance")
+        self.instance_name = (
+            _str_at(body, "instance")
+            or _str_at(body, "instanceName")
+            or _str_at(root, "instance")
+            or _str_at(root, "instanceName")
+            or _str_at(data, "instance")
+            or _str_at(data, "instanceName")
+            or _str_at(data_instance, "instanceName")
+            or _str_at(data_instance, "name")
+        )
+        self.remote_jid_full = (
+            _str_at(body_key, "remoteJid")
+            or _str_at(body_data, "remoteJid")
+            or _str_at(data_key, "remoteJid")
+            or _str_at(data, "remoteJid")
+            or _str_at(root, "remoteJid")
+            or _str_at(root_key, "remoteJid")
+        )
+        self.remote_jid = _bare_jid(self.remote_jid_full)
+        self.remote_jid_alt = _first_truthy((body_key, data_key), "remoteJidAlt")
+        self.key_remote_jid = _first_truthy((body_key, data_key), "remoteJid")
+        self.push_name = _first_str((body_data, data, _node(data, "sender"), root), "pushName")
+        self.from_me = None
+        for key in keys:
+            if key is not None and isinstance(key.get("fromMe"), bool):
+                self.from_me = key["fromMe"]
                 break
-        if ok and isinstance(cur, str) and cur.strip():
-            return cur.strip()
-    return None
-
-
-def _extract_from_me(payload: Dict[str, Any]) -> Optional[bool]:
-    for path in (
-        ("body", "data", "key", "fromMe"),
-        ("data", "key", "fromMe"),
-        ("key", "fromMe"),
-    ):
-        cur: Any = payload
-        ok = True
-        for k in path:
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
+        self.message_id = _first_str(keys, "id")
+        self.message_timestamp = None
+        for node in (body_data, data, root):
+            if node is not None and node.get("messageTimestamp") is not None:
+                self.message_timestamp = node["messageTimestamp"]
                 break
-        if ok and isinstance(cur, bool):
-            return cur
-    return None
+        self.author_jid = _bare_jid(_first_str(keys, "participant"))
+        self.text = None
+        for msg in (body_msg, data_msg):
+            if msg is not None:
+                self.text = (
+                    _str_at(msg, "conversation")
+                    or _str_at(_node(msg, "extendedTextMessage"), "text")
+                    or _str_at(_node(msg, "imageMessage"), "caption")
+                )
+                if self.text:
+                    break
+        if self.text is None:
+            self.text = _str_at(root_msg, "conversation")
+
+        self.message_type = _first_str((body_data, data, root), "messageType")
+        if self.message_type is None:
+            for msg in (body_msg, data_msg, root_msg):
+                if msg is not None:
+                    found = next((key for key in _INFERRED_MESSAGE_TYPES if key in msg), None)
+                    if found:
+                        self.message_type = found
+                        break
+
+        self.is_group = bool(self.remote_jid_full and self.remote_jid_full.endswith("@g.us"))
+        self.chat_key = self.remote_jid_full if self.is_group else str(self.remote_jid or "")
+        if self.remote_jid_full and self.remote_jid_full.endswith("@lid") and isinstance(self.remote_jid_alt, str) and self.remote_jid_alt:
+            self.chat_key = self.remote_jid_alt.split("@", 1)[0]
+
+        # Formato da mensagem (inclui data.update.message das reacoes em messages.update).
+        self.message = body_msg or data_msg or update_msg or root_msg or {}
+        self.kind = _message_kind(self.message)
+        self.reaction_target_id = None
+        self.reaction_text = ""
+        if self.kind == "reaction" or update_msg is not None:
+            reactions = (_node(body_msg, "reactionMessage"), _node(data_msg, "reactionMessage"), _node(update_msg, "reactionMessage"))
+            self.reaction_target_id = _first_truthy(tuple(_node(reaction, "key") for reaction in reactions), "id")
+            self.reaction_text = str(_first_truthy(reactions, "text") or "")
+
+        media_msgs = (body_msg, data_msg, root_msg)
+        self.inline_base64 = _first_str(media_msgs, "base64")
+        self.audio_seconds = None
+        if self.kind == "audio":
+            self.audio_seconds = _first_truthy(tuple(_node(msg, "audioMessage") for msg in media_msgs), "seconds")
+
+        self.body_sender = body.get("sender") if body is not None else None
+        self.sender = self.body_sender or root.get("sender")
+        self.quoted_remote_jid = self.remote_jid_alt or self.key_remote_jid or (root_key.get("remoteJid") if root_key is not None else None)
+        self.quoted_participant = _first_truthy(keys, "participant")
+
+    def normalized(self) -> Dict[str, Any]:
+        """
+        Registro "minimo" para chats.conversa[] (mesmo formato de normalize_message_event).
+        """
+        return {
+            "received_at": _now_utc_iso(),
+            "event": self.event,
+            "instance_name": self.instance_name,
+            "remote_jid": self.remote_jid,
+            "remote_jid_full": self.remote_jid_full,
+            "push_name": self.push_name,
+            "from_me": self.from_me,
+            "message_id": self.message_id,
+            "message_type": self.message_type,
+            "message_timestamp": self.message_timestamp,
+            "is_group": self.is_group,
+            "chat_key": self.chat_key,
+            "author_jid": self.author_jid,
+            "text": self.text,
+            "raw": self.raw,
+        }
+
+
+def parse_webhook_event(payload: Any) -> WebhookEvent:
+    return WebhookEvent(payload)
 
 
 def normalize_message_event(payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -293,30 +242,4 @@ def normalize_message_event(payload: Dict[str, Any]) -> Dict[str, Any]:
     Retorna um registro "minimo" para ser armazenado em chats.conversa[].
     Mantemos um campo `raw` para debug, porque o schema do webhook varia.
     """
-    remote_jid_full = _extract_remote_jid_full(payload)
-    remote_jid = _extract_remote_jid(payload)
-    remote_jid_alt = (
-        _extract_from_path(payload, ("body", "data", "key", "remoteJidAlt"))
-        or _extract_from_path(payload, ("data", "key", "remoteJidAlt"))
-    )
-    is_group = bool(remote_jid_full and str(remote_jid_full).endswith("@g.us"))
-    chat_key = str(remote_jid_full) if is_group and remote_jid_full else str(remote_jid or "")
-    if remote_jid_full and str(remote_jid_full).endswith("@lid") and isinstance(remote_jid_alt, str) and remote_jid_alt:
-        chat_key = remote_jid_alt.split("@", 1)[0]
-    return {
-        "received_at": _now_utc_iso(),
-        "event": _extract_event(payload),
-        "instance_name": _extract_instance_name(payload),
-        "remote_jid": remote_jid,
-        "remote_jid_full": remote_jid_full,
-        "push_name": _extract_push_name(payload),
-        "from_me": _extract_from_me(payload),
-        "message_id": _extract_message_id(payload),
-        "message_type": _extract_message_type(payload),
-        "message_timestamp": _extract_message_timestamp(payload),
-        "is_group": is_group,
-        "chat_key": chat_key,
-        "author_jid": _extract_participant(payload),
-        "text": _extract_text(payload),
-        "raw": payload,
-    }
+    return WebhookEvent(payload).normalized()
@@ -0,0 +1,140 @@
+"""
+image_prep.py — Preparo da imagem antes da chamada de visao.
+
+Fotos do WhatsApp chegam com 1-4 MB e ate 4000px, mas a tarefa e uma descricao
+de uma linha. Antes de enviar ao provedor: aplica a orientacao do EXIF, limita
+o maior lado, recodifica em JPEG/WebP compacto (sem metadados) e marca imagens
+minusculas (figurinhas/emojis) para nem chamar a IA.
+
+Pillow e opcional: sem ele a imagem segue como chegou.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Any, Optional
+
+from .openai_client import _detect_image_upload_mime
+
+try:
+    from PIL import Image, ImageOps
+except Exception:  # pragma: no cover
+    Image = None  # type: ignore
+    ImageOps = None  # type: ignore
+
+
+logger = logging.getLogger("summi_worker.image_prep")
+
+DEFAULT_MAX_EDGE = 1024
+DEFAULT_QUALITY = 80
+MIN_DESCRIBABLE_EDGE = 48
+
+_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    original_size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    reencoded: bool = False
+    skip_reason: Optional[str] = None
+
+
+def _passthrough(image_bytes: bytes, **kwargs: Any) -> PreparedImage:
+    return PreparedImage(
+        data=image_bytes,
+        mime_type=_detect_image_upload_mime(image_bytes),
+        original_size=len(image_bytes),
+        **kwargs,
+    )
+
+
+def prepare_image_for_vision(
+    image_bytes: bytes,
+    *,
+    max_edge: int = DEFAULT_MAX_EDGE,
+    output_format: str = "jpeg",
+    quality: int = DEFAULT_QUALITY,
+    min_edge: int = MIN_DESCRIBABLE_EDGE,
+) -> PreparedImage:
+    """
+    Reduz a imagem para o envio ao provedor de visao.
+
+    Mantem os bytes originais quando Pillow nao esta disponivel, quando a imagem
+    nao pode ser lida ou quando a recodificacao nao reduz nada.
+    """
+    if Image is None or not image_bytes:
+        return _passthrough(image_bytes)
+
+    pil_format, mime_type = _FORMATS.get((output_format or "").strip().lower(), _FORMATS["jpeg"])
+    try:
+        with Image.open(BytesIO(image_bytes)) as opened:
+            width, height = opened.size
+            if max(width, height) < min_edge:
+                return _passthrough(image_bytes, width=width, height=height, skip_reason="image_too_small")
+
+            opened.seek(0)  # GIF/WebP animado: so o primeiro quadro
+            img = ImageOps.exif_transpose(opened)
+            resized = max(img.size) > max_edge
+            if resized:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            if pil_format == "JPEG":
+                if img.mode in ("RGBA", "LA", "P"):
+                    # Figurinhas tem fundo transparente: achata sobre branco.
+                    rgba = img.convert("RGBA")
+                    img = Image.new("RGB", rgba.size, (255, 255, 255))
+                    img.paste(rgba, mask=rgba.getchannel("A"))
+                elif img.mode != "RGB":
+                    img = img.convert("RGB")
+            elif img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() or img.mode == "P" else "RGB")
+
+            out = BytesIO()
+            # Sem exif=/icc_profile=: metadados (GPS, camera) nao vao para o provedor.
+            img.save(out, format=pil_format, quality=int(quality), optimize=True)
+            data = out.getvalue()
+            final_width, final_height = img.size
+    except Exception as exc:
+        logger.info("image_prep.decode_failed bytes=%s error=%s", len(image_bytes), exc)
+        return _passthrough(image_bytes)
+
+    if not resized and len(data) >= len(image_bytes):
+        return _passthrough(image_bytes, width=final_width, height=final_height)
+
+    logger.info(
+        "image_prep.reencoded original_bytes=%s bytes=%s size=%sx%s->%sx%s format=%s",
+        len(image_bytes),
+        len(data),
+        width,
+        height,
+        final_width,
+        final_height,
+        pil_format,
+    )
+    return PreparedImage(
+        data=data,
+        mime_type=mime_type,
+        original_size=len(image_bytes),
+        width=final_width,
+        height=final_height,
+        reencoded=True,
+    )
+
+
+def prepare_image_from_settings(settings: Any, image_bytes: bytes) -> PreparedImage:
+    if not getattr(settings, "enable_image_prep", False):
+        return _passthrough(image_bytes)
+    return prepare_image_for_vision(
+        image_bytes,
+        max_edge=int(getattr(settings, "image_prep_max_edge", DEFAULT_MAX_EDGE)),
+        output_format=str(getattr(settings, "image_prep_format", "jpeg")),
+        quality=int(getattr(settings, "image_prep_quality", DEFAULT_QUALITY)),
+    )
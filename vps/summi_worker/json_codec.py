@@ -0,0 +1,63 @@
+"""
+json_codec.py — JSON do caminho quente (corpo do webhook, PostgREST, prompts).
+
+Usa orjson quando instalado e cai no json da stdlib quando nao. A saida e a
+mesma nos dois: compacta (sem espacos), UTF-8 sem escapes \\uXXXX. Tipos que o
+orjson recusa (chave nao-str fora do basico, Decimal, int > 64 bits) voltam para
+a stdlib com default=str, entao nada quebra por trocar o backend.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None  # type: ignore
+
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """
+    Aceita bytes direto (sem decodificar para str antes). Erro de sintaxe levanta
+    ValueError (orjson.JSONDecodeError e json.JSONDecodeError herdam dele).
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode("utf-8")
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """
+    Serializa para bytes UTF-8 (corpo de request HTTP, valor no Redis).
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """
+    Serializa para str (prompts, logs).
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode("utf-8")
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj)
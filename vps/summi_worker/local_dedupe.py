@@ -0,0 +1,172 @@
+"""
+local_dedupe.py — Dedupe do webhook no processo, na frente do Redis.
+
+Bloom filter por janelas de tempo: a janela de TTL e dividida em geracoes; cada
+id entra na geracao atual e a consulta olha todas. Quando a geracao atual vence,
+a mais antiga e descartada inteira (sem varrer chaves). Um id marcado fica
+visivel por pelo menos `ttl_seconds`.
+
+Memoria fixa, calculada por `capacity` (ids esperados por janela de TTL) e pela
+taxa de falso positivo alvo. Sem falso negativo dentro do TTL; um falso
+positivo descarta uma mensagem nova como duplicada, por isso o alvo padrao e
+baixo (1e-6) e a taxa estimada e reportada em stats().
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger("summi_worker.local_dedupe")
+
+DEFAULT_CAPACITY = 1_000_000
+DEFAULT_FALSE_POSITIVE_RATE = 1e-6
+DEFAULT_GENERATIONS = 4
+MAX_HASHES = 32
+
+
+def bloom_parameters(capacity: int, false_positive_rate: float) -> Tuple[int, int]:
+    """
+    (bits, hashes) otimos para `capacity` itens com a taxa de falso positivo alvo.
+    """
+    n = max(1, int(capacity))
+    p = min(0.5, max(1e-12, float(false_positive_rate)))
+    bits = int(math.ceil(-n * math.log(p) / (math.log(2) ** 2)))
+    bits = max(64, (bits + 7) // 8 * 8)
+    hashes = max(1, min(MAX_HASHES, int(round(bits / n * math.log(2)))))
+    return bits, hashes
+
+
+class _Generation:
+    __slots__ = ("bits", "items", "started_at")
+
+    def __init__(self, size_bits: int, started_at: float) -> None:
+        self.bits = bytearray(size_bits // 8)
+        self.items = 0
+        self.started_at = started_at
+
+
+class TimeBucketedBloom:
+    def __init__(
+        self,
+        ttl_seconds: int,
+        *,
+        capacity: int = DEFAULT_CAPACITY,
+        false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE,
+        generations: int = DEFAULT_GENERATIONS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._generations_count = max(2, int(generations))
+        self._ttl = max(1, int(ttl_seconds))
+        # N geracoes de ttl/(N-1): o id inserido no fim da janela ainda vive ttl inteiro.
+        self._span = self._ttl / (self._generations_count - 1)
+        # Cada geracao recebe ~capacity/(N-1) ids; a consulta soma o erro das N geracoes.
+        per_generation = int(math.ceil(max(1, int(capacity)) / (self._generations_count - 1)))
+        self._target_fp = float(false_positive_rate)
+        self._bits, self._hashes = bloom_parameters(per_generation, self._target_fp / self._generations_count)
+        self._clock = clock
+        self._lock = threading.Lock()
+        now = self._clock()
+        self._generations: List[_Generation] = [_Generation(self._bits, now)]
+        self._hits = 0
+        self._checks = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._generations_count * (self._bits // 8)
+
+    def _positions(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self._bits for i in range(self._hashes)]
+
+    def _rotate(self, now: float) -> None:
+        current = self._generations[-1]
+        if now - current.started_at < self._span:
+            return
+        self._generations.append(_Generation(self._bits, now))
+        dropped = None
+        if len(self._generations) > self._generations_count:
+            dropped = self._generations.pop(0)
+        logger.info(
+            "local_dedupe.rotate dropped_items=%s items=%s estimated_fp_rate=%.2e",
+            dropped.items if dropped else 0,
+            sum(g.items for g in self._generations),
+            self._estimated_fp_rate(),
+        )
+
+    def seen_or_mark(self, key: str) -> bool:
+        """
+        True se o id ja estava marcado (ou falso positivo); False se acabou de marcar.
+        """
+        positions = self._positions(key)
+        with self._lock:
+            self._rotate(self._clock())
+            self._checks += 1
+            for generation in self._generations:
+                bits = generation.bits
+                if all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions):
+                    self._hits += 1
+                    return True
+            current = self._generations[-1]
+            for pos in positions:
+                current.bits[pos >> 3] |= 1 << (pos & 7)
+            current.items += 1
+            return False
+
+    def _estimated_fp_rate(self) -> float:
+        # Por geracao: (1 - e^(-k*n/m))^k; a consulta erra se qualquer geracao errar.
+        miss = 1.0
+        for generation in self._generations:
+            fill = 1.0 - math.exp(-self._hashes * generation.items / self._bits)
+            miss *= 1.0 - fill ** self._hashes
+        return 1.0 - miss
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ttl_seconds": self._ttl,
+                "generations": len(self._generations),
+                "items": sum(g.items for g in self._generations),
+                "memory_bytes": self.memory_bytes,
+                "hashes": self._hashes,
+                "target_fp_rate": self._target_fp,
+                "estimated_fp_rate": self._estimated_fp_rate(),
+                "checks": self._checks,
+                "hits": self._hits,
+            }
+
+
+_FILTERS: Dict[Tuple[int, int, float], TimeBucketedBloom] = {}
+_FILTERS_LOCK = threading.Lock()
+
+
+def get_local_dedupe(settings: Any) -> Optional[TimeBucketedBloom]:
+    """
+    Filtro do processo para o dedupe do webhook (None quando ENABLE_LOCAL_DEDUPE=false).
+    """
+    if not getattr(settings, "enable_local_dedupe", False):
+        return None
+    key = (
+        int(getattr(settings, "webhook_dedupe_ttl_seconds", 24 * 3600)),
+        int(getattr(settings, "local_dedupe_capacity", DEFAULT_CAPACITY)),
+        float(getattr(settings, "local_dedupe_fp_rate", DEFAULT_FALSE_POSITIVE_RATE)),
+    )
+    with _FILTERS_LOCK:
+        bloom = _FILTERS.get(key)
+        if bloom is None:
+            bloom = TimeBucketedBloom(key[0], capacity=key[1], false_positive_rate=key[2])
+            logger.info(
+                "local_dedupe.init ttl_seconds=%s capacity=%s target_fp_rate=%.2e memory_bytes=%s",
+                key[0],
+                key[1],
+                key[2],
+                bloom.memory_bytes,
+            )
+            _FILTERS[key] = bloom
+        return bloom
@@ -4,14 +4,17 @@ import base64
 from dataclasses import dataclass
 from io import BytesIO
 import json
+import logging
 import math
 import re
 import time
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 
 import requests
 from mutagen import File as MutagenFile
 
+logger = logging.getLogger("summi_worker.openai_client")
+
 
 class AIProviderError(RuntimeError):
     pass
@@ -21,6 +24,9 @@ OpenAIError = AIProviderError
 
 
 GEMINI_GENERATE_CONTENT_ENDPOINT = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+GEMINI_STREAM_GENERATE_CONTENT_ENDPOINT = (
+    "https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent"
+)
 GEMINI_TRANSCRIPTION_ENDPOINT = GEMINI_GENERATE_CONTENT_ENDPOINT
 _GEMINI_TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
 
@@ -59,6 +65,7 @@ class OpenAIUsage:
     prompt_tokens: int = 0
     completion_tokens: int = 0
     total_tokens: int = 0
+    cached_tokens: int = 0  # parte de prompt_tokens servida do cache de prefixo do provedor
 
 
 @dataclass(frozen=True)
@@ -71,6 +78,7 @@ class ChatJsonResult:
 class ChatTextResult:
     text: str
     usage: Optional[OpenAIUsage]
+    ttfb_ms: Optional[int] = None  # so em streaming: tempo ate o primeiro trecho de texto
 
 
 @dataclass(frozen=True)
@@ -141,10 +149,13 @@ def _extract_usage(payload: Dict[str, Any]) -> Optional[OpenAIUsage]:
     prompt_tokens = int(_to_float(usage.get("prompt_tokens")) or 0)
     completion_tokens = int(_to_float(usage.get("completion_tokens")) or 0)
     total_tokens = int(_to_float(usage.get("total_tokens")) or (prompt_tokens + completion_tokens))
+    details = usage.get("prompt_tokens_details")
+    cached_tokens = int(_to_float(details.get("cached_tokens")) or 0) if isinstance(details, dict) else 0
     return OpenAIUsage(
         prompt_tokens=prompt_tokens,
         completion_tokens=completion_tokens,
         total_tokens=total_tokens,
+        cached_tokens=cached_tokens,
     )
 
 
@@ -159,6 +170,7 @@ def _extract_gemini_usage(payload: Dict[str, Any]) -> Optional[OpenAIUsage]:
         prompt_tokens=prompt_tokens,
         completion_tokens=completion_tokens,
         total_tokens=total_tokens,
+        cached_tokens=int(_to_float(usage.get("cachedContentTokenCount")) or 0),
     )
 
 
@@ -208,6 +220,101 @@ def _probe_audio_duration_seconds(audio_bytes: bytes) -> Optional[float]:
     return duration if duration > 0 else None
 
 
+def _iter_sse_events(resp: requests.Response) -> Iterator[Dict[str, Any]]:
+    """
+    Le um corpo text/event-stream e devolve o JSON de cada linha `data:` ate `[DONE]`.
+    """
+    for raw_line in resp.iter_lines(decode_unicode=True):
+        line = raw_line.decode("utf-8") if isinstance(raw_line, bytes) else str(raw_line or "")
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        if not data:
+            continue
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        if isinstance(event, dict):
+            yield event
+
+
+def _gemini_chunk_text(payload: Dict[str, Any]) -> str:
+    # Sem strip: os trechos do stream sao concatenados e os espacos entre eles importam.
+    candidates = payload.get("candidates")
+    if not isinstance(candidates, list) or not candidates or not isinstance(candidates[0], dict):
+        return ""
+    content = candidates[0].get("content")
+    parts = content.get("parts") if isinstance(content, dict) else None
+    if not isinstance(parts, list):
+        return ""
+    return "".join(str(part.get("text") or "") for part in parts if isinstance(part, dict))
+
+
+def _collect_text_stream(
+    deltas: Iterator[Tuple[str, Optional[OpenAIUsage]]],
+    *,
+    provider: str,
+    model: str,
+    started_at: float,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> ChatTextResult:
+    parts: list[str] = []
+    usage: Optional[OpenAIUsage] = None
+    ttfb_ms: Optional[int] = None
+    try:
+        for delta, delta_usage in deltas:
+            if delta_usage is not None:
+                usage = delta_usage
+            if not delta:
+                continue
+            if ttfb_ms is None:
+                ttfb_ms = int((time.perf_counter() - started_at) * 1000)
+            parts.append(delta)
+            if on_delta is not None:
+                on_delta(delta)
+    except requests.RequestException as exc:
+        # Conexao caiu no meio do stream (ChunkedEncodingError, timeout de leitura).
+        raise OpenAIError(f"{provider} stream interrupted after {len(parts)} chunks: {exc}") from exc
+    text = "".join(parts).strip()
+    logger.info(
+        "llm.stream provider=%s model=%s ttfb_ms=%s total_ms=%s chars=%s",
+        provider,
+        model,
+        ttfb_ms,
+        int((time.perf_counter() - started_at) * 1000),
+        len(text),
+    )
+    return ChatTextResult(text=text, usage=usage, ttfb_ms=ttfb_ms)
+
+
+def chat_text_maybe_stream(
+    client: Any,
+    model: str,
+    system: str,
+    user: str,
+    temperature: float = 0.4,
+    *,
+    stream: bool = False,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> ChatTextResult:
+    """
+    Usa `chat_text_stream` quando pedido e o cliente suportar; senao a chamada
+    bloqueante de sempre. O texto final e o mesmo nos dois caminhos.
+    """
+    if stream and hasattr(client, "chat_text_stream"):
+        return client.chat_text_stream(
+            model=model,
+            system=system,
+            user=user,
+            temperature=temperature,
+            on_delta=on_delta,
+        )
+    return client.chat_text_response(model=model, system=system, user=user, temperature=temperature)
+
+
 def _extract_gemini_text(payload: Dict[str, Any]) -> str:
     candidates = payload.get("candidates")
     if not isinstance(candidates, list) or not candidates:
@@ -318,14 +425,18 @@ class GeminiClient:
         temperature: float,
         response_mime_type: str,
     ) -> Dict[str, Any]:
-        prompt = "\n\n".join(part for part in (system.strip(), user.strip()) if part)
-        return {
-            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        # System separado do conteudo: o prefixo estatico fica identico entre chamadas
+        # e entra no cache implicito de contexto do Gemini.
+        payload: Dict[str, Any] = {
+            "contents": [{"role": "user", "parts": [{"text": user.strip()}]}],
             "generationConfig": {
                 "temperature": temperature,
                 "responseMimeType": response_mime_type,
             },
         }
+        if system.strip():
+            payload["systemInstruction"] = {"parts": [{"text": system.strip()}]}
+        return payload
 
     def chat_json_response(self, model: str, system: str, user: str, temperature: float = 0.2) -> ChatJsonResult:
         payload = self._text_payload(
@@ -350,6 +461,47 @@ class GeminiClient:
         data = self._post_generate_content(model, payload, timeout=120)
         return ChatTextResult(text=_extract_gemini_text(data), usage=_extract_gemini_usage(data))
 
+    def chat_text_stream(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        temperature: float = 0.4,
+        on_delta: Optional[Callable[[str], None]] = None,
+    ) -> ChatTextResult:
+        payload = self._text_payload(
+            system=system,
+            user=user,
+            temperature=temperature,
+            response_mime_type="text/plain",
+        )
+        url = GEMINI_STREAM_GENERATE_CONTENT_ENDPOINT.format(model=model)
+        started_at = time.perf_counter()
+        try:
+            resp = requests.post(
+                url,
+                params={"key": self._api_key, "alt": "sse"},
+                json=payload,
+                timeout=120,
+                stream=True,
+            )
+        except requests.RequestException as exc:
+            raise OpenAIError(f"gemini stream failed: {exc}") from exc
+        if not resp.ok:
+            # Erros transitorios antes do primeiro byte: cai na chamada com retry.
+            if resp.status_code in _GEMINI_TRANSIENT_STATUS_CODES:
+                resp.close()
+                return self.chat_text_response(model=model, system=system, user=user, temperature=temperature)
+            raise OpenAIError(f"gemini stream failed: {resp.status_code} {resp.text}")
+        with resp:
+            return _collect_text_stream(
+                ((_gemini_chunk_text(event), _extract_gemini_usage(event)) for event in _iter_sse_events(resp)),
+                provider="gemini",
+                model=model,
+                started_at=started_at,
+                on_delta=on_delta,
+            )
+
     def chat_text(self, model: str, system: str, user: str, temperature: float = 0.4) -> str:
         return self.chat_text_response(model=model, system=system, user=user, temperature=temperature).text
 
@@ -441,6 +593,51 @@ class OpenAIClient:
             usage=_extract_usage(data),
         )
 
+    def chat_text_stream(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        temperature: float = 0.4,
+        on_delta: Optional[Callable[[str], None]] = None,
+    ) -> ChatTextResult:
+        url = "https://api.openai.com/v1/chat/completions"
+        payload = {
+            "model": model,
+            "temperature": temperature,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        started_at = time.perf_counter()
+        try:
+            resp = requests.post(url, headers=self._headers(), data=json.dumps(payload), timeout=60, stream=True)
+        except requests.RequestException as exc:
+            raise OpenAIError(f"chat stream failed: {exc}") from exc
+        if not resp.ok:
+            raise OpenAIError(f"chat stream failed: {resp.status_code} {resp.text}")
+        with resp:
+            return _collect_text_stream(
+                (
+                    (
+                        "".join(
+                            str((choice.get("delta") or {}).get("content") or "")
+                            for choice in event.get("choices") or []
+                            if isinstance(choice, dict)
+                        ),
+                        _extract_usage(event),
+                    )
+                    for event in _iter_sse_events(resp)
+                ),
+                provider="openai",
+                model=model,
+                started_at=started_at,
+                on_delta=on_delta,
+            )
+
     def chat_text(self, model: str, system: str, user: str, temperature: float = 0.4) -> str:
         return self.chat_text_response(model=model, system=system, user=user, temperature=temperature).text
 
@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import base64
+import heapq
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from .evolution_client import EvolutionClient, EvolutionError
+from .redis_pool import get_redis
+
+try:
+    import redis
+except Exception:  # pragma: no cover
+    redis = None  # type: ignore
+
+
+logger = logging.getLogger("summi_worker.outbound")
+
+DUE_KEY = "summi:outbound:due"
+INFLIGHT_KEY = "summi:outbound:inflight"
+JOBS_KEY = "summi:outbound:jobs"
+DEPTH_KEY = "summi:outbound:depth"
+SEQ_KEY = "summi:outbound:seq"
+BUCKET_KEY_PREFIX = "summi:outbound:bucket:"
+# zset por destinatario (instance + remote_jid) com os jobs pendentes por ordem de chegada.
+RECIPIENT_KEY_PREFIX = "summi:outbound:recipient:"
+# Dispatcher que caiu com um job reivindicado: o lease vence e o job volta para due.
+DEFAULT_LEASE_SECONDS = 120.0
+# Espera quando a mensagem anterior do mesmo contato esta em envio por outro dispatcher.
+RECIPIENT_BUSY_RETRY_SECONDS = 1.0
+
+# KEYS: bucket; ARGV: now, rate_per_second, burst
+# Retorna "0" quando consumiu um token, senao os segundos ate o proximo token.
+_TAKE_TOKEN_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+# KEYS: due zset, inflight zset; ARGV: now, limit, lease_seconds
+# Devolve para due os leases vencidos e move os vencidos de due para inflight (lease).
+_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, member in ipairs(expired) do
+  redis.call('ZREM', KEYS[2], member)
+  redis.call('ZADD', KEYS[1], now, member)
+end
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[2]))
+local lease_until = now + tonumber(ARGV[3])
+for _, member in ipairs(due) do
+  redis.call('ZREM', KEYS[1], member)
+  redis.call('ZADD', KEYS[2], lease_until, member)
+end
+return due
+"""
+
+
+def is_retryable_send_error(exc: Exception) -> bool:
+    if isinstance(exc, EvolutionError):
+        status = getattr(exc, "status_code", None)
+        return status is None or status == 429 or status >= 500
+    return isinstance(exc, requests.RequestException)
+
+
+class _LocalDelayQueue:
+    """
+    Envios atrasados sem Redis: uma unica thread daemon atende todos os atrasos
+    (heap por horario), em vez de um sleep por mensagem no chamador.
+    """
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, Callable[[], None]]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def call_later(self, delay_seconds: float, fn: Callable[[], None]) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay_seconds), next(self._counter), fn))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="outbound-delay", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                run_at, _, fn = self._heap[0]
+                wait = run_at - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+                heapq.heappop(self._heap)
+            try:
+                fn()
+            except Exception:
+                logger.exception("outbound.local_delayed_send_failed")
+
+
+_LOCAL_DELAY_QUEUE = _LocalDelayQueue()
+
+
+class OutboundSender:
+    """
+    Agenda envios para a Evolution com token bucket por instancia remetente.
+
+    Mesma interface de envio do EvolutionClient (`send_text`, `send_audio_mp3`),
+    com `delay_seconds` opcional; demais metodos sao delegados ao client. Com Redis:
+    - envia na hora se a instancia tem token; senao agenda em `summi:outbound:due`;
+    - 429/5xx/erro de rede reagendam com backoff exponencial + jitter;
+    - `dispatch_due` (queue_worker outbound) drena os envios vencidos; o job fica em
+      `summi:outbound:inflight` com lease ate terminar e volta para due se o lease vencer;
+    - ordem por destinatario: um job so sai quando e o mais antigo pendente do contato.
+    Sem Redis: envio direto; atrasos via uma unica thread de agendamento local.
+    """
+
+    def __init__(
+        self,
+        evolution: EvolutionClient,
+        client: Any = None,
+        *,
+        rate_per_second: float = 1.0,
+        burst: int = 5,
+        max_attempts: int = 5,
+        backoff_base_seconds: float = 2.0,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._evolution = evolution
+        self._client = client
+        self._rate = max(0.01, float(rate_per_second))
+        self._burst = max(1, int(burst))
+        self._max_attempts = max(1, int(max_attempts))
+        self._backoff_base = max(0.1, float(backoff_base_seconds))
+        self._lease = max(1.0, float(lease_seconds))
+        self._clock = clock
+        self._take_token = client.register_script(_TAKE_TOKEN_SCRIPT) if client is not None else None
+        self._claim = client.register_script(_CLAIM_SCRIPT) if client is not None else None
+
+    @classmethod
+    def from_settings(cls, settings: Any, evolution: EvolutionClient) -> "OutboundSender":
+        client = None
+        redis_url = getattr(settings, "redis_url", None)
+        if getattr(settings, "enable_outbound_queue", False) and redis_url and redis is not None:
+            # Cliente compartilhado do processo (o sender e montado a cada request).
+            client = get_redis(redis_url)
+        return cls(
+            evolution,
+            client,
+            rate_per_second=getattr(settings, "outbound_rate_per_second", 1.0),
+            burst=getattr(settings, "outbound_burst", 5),
+            max_attempts=getattr(settings, "outbound_max_attempts", 5),
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._evolution, name)
+
+    @property
+    def queued(self) -> bool:
+        return self._client is not None
+
+    # --- API de envio -------------------------------------------------
+
+    def send_text(self, instance: str, remote_jid: str, text: str, *, delay_seconds: float = 0.0, **kwargs: Any) -> None:
+        self._submit({"kind": "text", "instance": instance, "remote_jid": remote_jid, "text": text, "kwargs": kwargs}, delay_seconds)
+
+    def send_audio_mp3(self, instance: str, remote_jid: str, mp3_bytes: bytes, *, delay_seconds: float = 0.0) -> None:
+        self._submit(
+            {
+                "kind": "audio",
+                "instance": instance,
+                "remote_jid": remote_jid,
+                "audio_b64": base64.b64encode(mp3_bytes).decode("ascii"),
+            },
+            delay_seconds,
+        )
+
+    def queue_depths(self) -> Dict[str, int]:
+        if self._client is None:
+            return {}
+        raw = self._client.hgetall(DEPTH_KEY) or {}
+        return {str(k): int(v) for k, v in raw.items() if int(v) > 0}
+
+    # --- Internals ----------------------------------------------------
+
+    def _deliver(self, job: Dict[str, Any]) -> None:
+        if job["kind"] == "audio":
+            self._evolution.send_audio_mp3(job["instance"], job["remote_jid"], base64.b64decode(job["audio_b64"]))
+            return
+        self._evolution.send_text(job["instance"], job["remote_jid"], job["text"], **(job.get("kwargs") or {}))
+
+    def _submit(self, job: Dict[str, Any], delay_seconds: float) -> None:
+        if self._client is None:
+            if delay_seconds > 0:
+                _LOCAL_DELAY_QUEUE.call_later(delay_seconds, lambda: self._deliver(job))
+                return
+            self._deliver(job)
+            return
+
+        job.setdefault("attempts", 0)
+        if delay_seconds <= 0 and self._client.zcard(self._recipient_key(job)):
+            # Ja ha mensagem pendente para o contato: entra na fila atras dela.
+            delay_seconds = 0.0
+        elif delay_seconds <= 0:
+            wait = self._acquire(job["instance"])
+            if wait <= 0:
+                try:
+                    self._deliver(job)
+                    return
+                except Exception as exc:
+                    if not is_retryable_send_error(exc):
+                        raise
+                    job["attempts"] = 1
+                    delay_seconds = self._backoff(1)
+                    logger.warning(
+                        "outbound.retry_scheduled instance=%s attempt=1 delay_s=%.1f error=%s",
+                        job["instance"],
+                        delay_seconds,
+                        str(exc)[:200],
+                    )
+            else:
+                delay_seconds = wait
+        self._enqueue(job, self._clock() + delay_seconds, new=True)
+
+    def _acquire(self, instance: str) -> float:
+        return float(self._take_token(keys=[f"{BUCKET_KEY_PREFIX}{instance}"], args=[self._clock(), self._rate, self._burst]))
+
+    def _backoff(self, attempt: int) -> float:
+        base = self._backoff_base * (2 ** max(0, attempt - 1))
+        return min(300.0, base) * random.uniform(0.5, 1.5)
+
+    @staticmethod
+    def _recipient_key(job: Dict[str, Any]) -> str:
+        return f"{RECIPIENT_KEY_PREFIX}{job['instance']}:{job['remote_jid']}"
+
+    def _enqueue(self, job: Dict[str, Any], send_at: float, *, new: bool) -> None:
+        job_id = job.setdefault("id", uuid.uuid4().hex)
+        if new:
+            job["seq"] = int(self._client.incr(SEQ_KEY))
+        pipe = self._client.pipeline(transaction=True)
+        pipe.hset(JOBS_KEY, job_id, json.dumps(job, ensure_ascii=False))
+        pipe.zadd(DUE_KEY, {job_id: send_at})
+        if new:
+            pipe.hincrby(DEPTH_KEY, job["instance"], 1)
+            pipe.zadd(self._recipient_key(job), {job_id: job["seq"]})
+        else:
+            pipe.zrem(INFLIGHT_KEY, job_id)
+        pipe.execute()
+
+    def _finish(self, job: Dict[str, Any]) -> None:
+        pipe = self._client.pipeline(transaction=True)
+        pipe.hdel(JOBS_KEY, job["id"])
+        pipe.zrem(INFLIGHT_KEY, job["id"])
+        pipe.zrem(self._recipient_key(job), job["id"])
+        pipe.hincrby(DEPTH_KEY, job["instance"], -1)
+        pipe.execute()
+
+    def _recipient_blocker(self, job: Dict[str, Any]) -> Optional[str]:
+        """
+        Id do job mais antigo ainda pendente para o mesmo contato, se nao for `job`.
+        Cabeca sem job (estado orfao) e descartada.
+        """
+        key = self._recipient_key(job)
+        while True:
+            head = self._client.zrange(key, 0, 0)
+            if not head:
+                return None
+            head_id = str(head[0])
+            if head_id == job["id"]:
+                return None
+            if self._client.hget(JOBS_KEY, head_id):
+                return head_id
+            self._client.zrem(key, head_id)
+
+    def dispatch_due(self, *, limit: int = 50) -> int:
+        """
+        Envia os jobs vencidos respeitando o bucket de cada instancia. Retorna quantos foram processados.
+        """
+        if self._client is None:
+            return 0
+        job_ids = self._claim(keys=[DUE_KEY, INFLIGHT_KEY], args=[self._clock(), max(1, int(limit)), self._lease]) or []
+        jobs: List[Dict[str, Any]] = []
+        for job_id in job_ids:
+            raw = self._client.hget(JOBS_KEY, job_id)
+            if not raw:
+                self._client.zrem(INFLIGHT_KEY, job_id)
+                continue
+            jobs.append(json.loads(raw))
+        # Ordem de chegada: o mais antigo de cada contato sai antes dos seguintes.
+        jobs.sort(key=lambda item: int(item.get("seq") or 0))
+        processed = 0
+        for job in jobs:
+            blocker = self._recipient_blocker(job)
+            if blocker is not None:
+                # Atras do anterior do contato (adiado, em retry ou em envio): logo depois dele.
+                blocker_at = self._client.zscore(DUE_KEY, blocker)
+                send_at = (
+                    max(self._clock(), float(blocker_at)) + 0.001
+                    if blocker_at is not None
+                    else self._clock() + RECIPIENT_BUSY_RETRY_SECONDS
+                )
+                self._enqueue(job, send_at, new=False)
+                continue
+            wait = self._acquire(job["instance"])
+            if wait > 0:
+                self._enqueue(job, self._clock() + wait, new=False)
+                continue
+            processed += 1
+            try:
+                self._deliver(job)
+                self._finish(job)
+            except Exception as exc:
+                job["attempts"] = int(job.get("attempts") or 0) + 1
+                if is_retryable_send_error(exc) and job["attempts"] < self._max_attempts:
+                    delay = self._backoff(job["attempts"])
+                    logger.warning(
+                        "outbound.retry_scheduled instance=%s attempt=%s delay_s=%.1f error=%s",
+                        job["instance"],
+                        job["attempts"],
+                        delay,
+                        str(exc)[:200],
+                    )
+                    self._enqueue(job, self._clock() + delay, new=False)
+                    continue
+                logger.error(
+                    "outbound.dropped instance=%s remote_jid=%s kind=%s attempts=%s error=%s",
+                    job["instance"],
+                    job["remote_jid"],
+                    job["kind"],
+                    job["attempts"],
+                    str(exc)[:300],
+                )
+                self._finish(job)
+        return processed
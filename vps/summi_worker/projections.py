@@ -0,0 +1,53 @@
+"""
+projections.py — Colunas que cada ponto de chamada le do Supabase.
+
+Cada fluxo declara so o que usa (em vez de select=*); o nome aparece nos logs
+de auditoria de tamanho (SUPABASE_RESPONSE_AUDIT) e no fallback para "*" quando
+o schema ainda nao tem alguma coluna.
+"""
+from __future__ import annotations
+
+from .supabase_rest import Projection
+
+# Webhook: mapeamento instancia -> usuario, preferencias de audio/envio e temas do prompt.
+PROFILE_WEBHOOK = Projection(
+    "profile_webhook",
+    (
+        "id",
+        "nome",
+        "name",
+        "numero",
+        "temas_urgentes",
+        "temas_importantes",
+        "transcreve_audio_recebido",
+        "transcreve_audio_enviado",
+        "resume_audio",
+        "segundos_para_resumir",
+        "send_on_reaction",
+        "send_private_only",
+    ),
+)
+
+# analyze_user_chats: so os temas entram no prompt.
+PROFILE_ANALYSIS = Projection("profile_analysis", ("id", "temas_urgentes", "temas_importantes"))
+
+# Summi da Hora / resumo diario / "Summi agora": agenda, destino e opcoes de envio.
+PROFILE_SUMMARY = Projection(
+    "profile_summary",
+    (
+        "id",
+        "nome",
+        "numero",
+        "onboarding_completed",
+        "ultimo_summi_em",
+        "ultimo_summi_diario_em",
+        "summi_frequencia",
+        "apenas_horario_comercial",
+        "Summi em Audio?",
+        "Apaga Mensagens Não Importantes Automaticamente?",
+    ),
+)
+
+# Audio ja transcrito: o match e feito no servidor (JSONB @>), entao a conversa so
+# desce no replay, quando a transcricao existente e reaproveitada.
+CHAT_AUDIO_REPLAY = Projection("chat_audio_replay", ("id", "conversa"))
@@ -0,0 +1,168 @@
+"""
+prompt_budget.py — Orcamento de tokens dos prompts.
+
+Os builders descrevem o prompt como secoes (texto fixo + corpo variavel) com
+prioridade e modo de corte. `fit_prompt` estima os tokens localmente, aplica o
+limite de entrada do modelo (menos a reserva de saida) e, se passar, corta
+primeiro as secoes de menor prioridade. Se nem assim couber, levanta
+`PromptTooLargeError` antes da chamada (em vez de um 400 do provedor depois).
+
+O estimador e heuristico (palavras + pontuacao, palavras longas e texto nao
+ASCII contam mais); erra para cima em portugues, o que e o lado seguro.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+logger = logging.getLogger("summi_worker.prompt_budget")
+
+DEFAULT_OUTPUT_RESERVE_TOKENS = 1024
+DEFAULT_MODEL_INPUT_LIMIT = 128_000
+
+# Prefixo do modelo -> limite de entrada (tokens). Primeiro prefixo que casar vence.
+MODEL_INPUT_LIMITS: Tuple[Tuple[str, int], ...] = (
+    ("gpt-4.1", 1_047_576),
+    ("gpt-4o", 128_000),
+    ("gpt-5", 272_000),
+    ("o3", 200_000),
+    ("o4", 200_000),
+    ("gemini-", 1_048_576),
+)
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+class PromptTooLargeError(ValueError):
+    def __init__(self, message: str, *, tokens: int, limit: int):
+        super().__init__(message)
+        self.tokens = tokens
+        self.limit = limit
+
+
+def estimate_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    total = 0
+    for match in _TOKEN_RE.finditer(text):
+        piece = match.group()
+        if len(piece) == 1 and not piece.isalnum():
+            total += 1 if piece.isascii() else 2
+            continue
+        total += 1 + (len(piece) - 1) // 5
+        if not piece.isascii():
+            total += 1
+    return total
+
+
+def model_input_limit(model: str | None) -> int:
+    name = (model or "").strip().lower()
+    for prefix, limit in MODEL_INPUT_LIMITS:
+        if name.startswith(prefix):
+            return limit
+    return DEFAULT_MODEL_INPUT_LIMIT
+
+
+@dataclass(frozen=True)
+class PromptSection:
+    """
+    `label` e fixo; so `body` e cortado. Prioridade menor = cortada primeiro.
+    trim: none | head (mantem o inicio) | tail (mantem o fim) | middle (mantem as
+    pontas) | drop (remove o corpo inteiro).
+    """
+
+    name: str
+    body: str
+    label: str = ""
+    priority: int = 100
+    trim: str = "none"
+    min_tokens: int = 0
+    marker: str = "[...]"
+
+
+@dataclass(frozen=True)
+class FittedPrompt:
+    text: str
+    tokens: int
+    limit: int
+    trimmed: Tuple[str, ...] = ()
+
+
+def _cut_to_tokens(body: str, target: int, mode: str, marker: str) -> str:
+    if mode == "drop" or target <= 0:
+        return "" if mode == "drop" else marker
+    tokens = estimate_tokens(body)
+    if tokens <= target:
+        return body
+    keep = int(len(body) * max(0, target - estimate_tokens(marker)) / tokens)
+    while True:
+        if mode == "head":
+            candidate = body[:keep] + marker
+        elif mode == "tail":
+            candidate = marker + body[len(body) - keep :] if keep else marker
+        else:
+            half = keep // 2
+            candidate = body[:half] + marker + (body[len(body) - (keep - half) :] if keep - half else "")
+        if keep == 0 or estimate_tokens(candidate) <= target:
+            return candidate
+        keep = int(keep * 0.9)
+
+
+def fit_prompt(
+    sections: Sequence[PromptSection],
+    *,
+    model: str | None,
+    name: str,
+    system: str = "",
+    max_input_tokens: Optional[int] = None,
+    reserve_output_tokens: int = DEFAULT_OUTPUT_RESERVE_TOKENS,
+) -> FittedPrompt:
+    """
+    Junta as secoes (na ordem) cabendo em min(limite do modelo - reserva, max_input_tokens).
+    O `system` conta no orcamento mas nunca e cortado.
+    """
+    limit = model_input_limit(model) - max(0, int(reserve_output_tokens))
+    if max_input_tokens:
+        limit = min(limit, int(max_input_tokens))
+
+    bodies = [section.body or "" for section in sections]
+    body_tokens = [estimate_tokens(body) for body in bodies]
+    total = estimate_tokens(system) + sum(estimate_tokens(s.label) for s in sections) + sum(body_tokens)
+    trimmed = []
+
+    order = sorted(
+        (i for i, s in enumerate(sections) if s.trim != "none"),
+        key=lambda i: sections[i].priority,
+    )
+    for index in order:
+        over = total - limit
+        if over <= 0:
+            break
+        section = sections[index]
+        target = 0 if section.trim == "drop" else max(section.min_tokens, body_tokens[index] - over)
+        if target >= body_tokens[index]:
+            continue
+        bodies[index] = _cut_to_tokens(bodies[index], target, section.trim, section.marker)
+        new_tokens = estimate_tokens(bodies[index])
+        total += new_tokens - body_tokens[index]
+        body_tokens[index] = new_tokens
+        trimmed.append(section.name)
+
+    logger.info(
+        "prompt_budget.fitted name=%s model=%s tokens=%s limit=%s trimmed=%s",
+        name,
+        model,
+        total,
+        limit,
+        ",".join(trimmed) or "-",
+    )
+    if total > limit:
+        raise PromptTooLargeError(
+            f"prompt {name} too large for {model}: {total} > {limit} tokens",
+            tokens=total,
+            limit=limit,
+        )
+    text = "".join(section.label + body for section, body in zip(sections, bodies))
+    return FittedPrompt(text=text, tokens=total, limit=limit, trimmed=tuple(trimmed))
@@ -3,6 +3,8 @@ from __future__ import annotations
 import re
 from typing import Any, Mapping, Optional, Sequence, Tuple
 
+from .prompt_budget import PromptSection, fit_prompt
+
 
 SUMMI_HOUR_FALLBACK_TEXT = (
     "✨ *Summi da Hora*\n\nVocê não tem nenhuma demanda importante por agora, fique tranquilo. ✅"
@@ -77,23 +79,47 @@ def render_summi_hour_audio_fallback(summary_text: str | None) -> Optional[str]:
     return None
 
 
-def build_summi_audio_prompt(summary_text: str) -> Tuple[str, str]:
+# Prefixos estaticos primeiro (cache de prefixo do provedor), dados variaveis no fim.
+_SUMMI_AUDIO_STATIC_PROMPT = (
+    "Preciso que agora você traga de uma forma mais fluida o que havia sido resumido pois o seu resultado vai "
+    "ser transcrito em áudio, portanto imagine que a pessoa que vai escutar esteja no trânsito e precisa das "
+    "informações que foram enviadas por mensagem.\n\n"
+    "Inicie com Summi (lê-se Sâmi) da Hora: (sua mensagem).\n"
+    "Pode ignorar os números dos contatos, leve apenas o nome e a demanda.\n"
+    "Outro detalhe é para não inventar nada. Se a mensagem indicar que não há demanda importante, responda "
+    "exatamente: Summi da Hora: não há nada de importante por agora.\n"
+    "Não pareça uma IA, então sem 'Claro', sem 'Aqui está', sem despedida perguntando se pode ajudar em algo mais.\n"
+    "Retorne apenas o texto final.\n\n"
+)
+
+
+def build_summi_audio_prompt(
+    summary_text: str,
+    *,
+    model: str | None = None,
+    max_input_tokens: int | None = None,
+) -> Tuple[str, str]:
     system = (
         "Você escreve um roteiro curto, falado, para transcrição em áudio. "
         "Use apenas as informações fornecidas. Nunca invente nomes, tarefas, prazos, urgências ou contextos."
     )
-    user = (
-        "Preciso que agora você traga de uma forma mais fluida o que havia sido resumido pois o seu resultado vai "
-        "ser transcrito em áudio, portanto imagine que a pessoa que vai escutar esteja no trânsito e precisa das "
-        "informações que foram enviadas por mensagem.\n\n"
-        f"Mensagem: {summary_text}\n\n"
-        "Inicie com Summi (lê-se Sâmi) da Hora: (sua mensagem).\n"
-        "Pode ignorar os números dos contatos, leve apenas o nome e a demanda.\n"
-        "Outro detalhe é para não inventar nada. Se a mensagem indicar que não há demanda importante, responda "
-        "exatamente: Summi da Hora: não há nada de importante por agora.\n"
-        "Não pareça uma IA, então sem 'Claro', sem 'Aqui está', sem despedida perguntando se pode ajudar em algo mais.\n"
-        "Retorne apenas o texto final."
-    )
+    user = fit_prompt(
+        [
+            PromptSection("instrucoes", "", label=_SUMMI_AUDIO_STATIC_PROMPT),
+            PromptSection(
+                "resumo",
+                summary_text,
+                label="Mensagem: ",
+                # O Summi da Hora ja vem ordenado por prioridade: corta o fim.
+                trim="head",
+                min_tokens=200,
+            ),
+        ],
+        model=model,
+        name="summi_audio",
+        system=system,
+        max_input_tokens=max_input_tokens,
+    ).text
     return system, user
 
 
@@ -207,41 +233,64 @@ def build_transcription_summary_prompt(
     temas_urgentes: str,
     temas_importantes: str,
     audio_seconds: int | None = None,
+    model: str | None = None,
+    max_input_tokens: int | None = None,
 ) -> Tuple[str, str]:
     mode = choose_transcription_summary_mode(transcription, audio_seconds=audio_seconds)
     system = (
         "Você resume transcrições de áudio em português. "
-        "Seja fiel ao conteúdo, objetivo e jamais invente informações.\n"
-        f"Considere que para este usuário, temas URGENTES são: {temas_urgentes}\n"
-        f"Temas IMPORTANTES são: {temas_importantes}"
+        "Seja fiel ao conteúdo, objetivo e jamais invente informações."
     )
 
     if mode == "direct":
-        user = (
+        instructions = (
             "Faça um resumo direto e curto da transcrição abaixo, destacando o assunto principal e qualquer ponto "
             "que se conecte com os temas urgentes ou importantes do usuário.\n"
             "Se houver uma ação claramente pedida, mencione isso de forma natural no próprio resumo.\n"
             "Não use blocos, títulos ou listas nesta modalidade.\n\n"
-            f"Transcrição:\n{transcription}"
         )
-        return system, user
-
-    user = (
-        "Organize a saída em blocos curtos de WhatsApp, usando exatamente estes títulos quando houver conteúdo:\n"
-        "*Assunto principal*\n"
-        "*Assuntos discutidos*\n"
-        "*Atividades a serem realizadas*\n\n"
-        "Regras:\n"
-        "- Em 'Assunto principal', traga o foco central da conversa, priorizando o que se relaciona com os temas "
-        "importantes ou urgentes do usuário.\n"
-        "- Em 'Assuntos discutidos', liste apenas os tópicos realmente tratados na transcrição.\n"
-        "- Inclua 'Atividades a serem realizadas' somente se houver ação clara como responder, enviar algo, "
-        "cobrar, agendar, revisar, mandar relatório ou e-mail.\n"
-        "- Se não houver ação clara, omita completamente o bloco 'Atividades a serem realizadas'.\n"
-        "- Nunca escreva que não há ação identificada.\n"
-        "- Nunca invente nomes, prazos, tarefas ou contextos ausentes.\n\n"
-        f"Transcrição:\n{transcription}"
-    )
+    else:
+        instructions = (
+            "Organize a saída em blocos curtos de WhatsApp, usando exatamente estes títulos quando houver conteúdo:\n"
+            "*Assunto principal*\n"
+            "*Assuntos discutidos*\n"
+            "*Atividades a serem realizadas*\n\n"
+            "Regras:\n"
+            "- Em 'Assunto principal', traga o foco central da conversa, priorizando o que se relaciona com os temas "
+            "importantes ou urgentes do usuário.\n"
+            "- Em 'Assuntos discutidos', liste apenas os tópicos realmente tratados na transcrição.\n"
+            "- Inclua 'Atividades a serem realizadas' somente se houver ação clara como responder, enviar algo, "
+            "cobrar, agendar, revisar, mandar relatório ou e-mail.\n"
+            "- Se não houver ação clara, omita completamente o bloco 'Atividades a serem realizadas'.\n"
+            "- Nunca escreva que não há ação identificada.\n"
+            "- Nunca invente nomes, prazos, tarefas ou contextos ausentes.\n\n"
+        )
+
+    user = fit_prompt(
+        [
+            # Audios muito longos: preserva abertura e fechamento, corta o meio.
+            PromptSection(
+                "temas",
+                "",
+                label=(
+                    f"{instructions}"
+                    f"Considere que para este usuário, temas URGENTES são: {temas_urgentes}\n"
+                    f"Temas IMPORTANTES são: {temas_importantes}\n\n"
+                ),
+            ),
+            PromptSection(
+                "transcricao",
+                transcription,
+                label="Transcrição:\n",
+                trim="middle",
+                min_tokens=500,
+            ),
+        ],
+        model=model,
+        name=f"transcription_summary_{mode}",
+        system=system,
+        max_input_tokens=max_input_tokens,
+    ).text
     return system, user
 
 
@@ -7,11 +7,15 @@ import time
 
 from dotenv import load_dotenv
 
+from .analysis_debounce import AnalysisDebouncer
+from .budget_guard import get_budget_counter
 from .config import load_settings
+from .cost_ledger import start_cost_ledger
 from .evolution_client import EvolutionClient
 from .openai_client import GeminiClient, OpenAIClient
+from .outbound_queue import OutboundSender
 from .redis_queue import RedisQueueClient, run_now_result_key
-from .summi_jobs import run_hourly_job, run_user_summi_now
+from .summi_jobs import analyze_user_chats, run_hourly_job, run_user_summi_now
 from .supabase_rest import SupabaseRest
 
 
@@ -22,6 +26,43 @@ if not logger.handlers:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
 
 
+def _drain_debounced_analysis(settings, supabase, openai, debouncer: AnalysisDebouncer) -> int:
+    due = debouncer.claim_due()
+    for user_id, remote_jids in due.items():
+        started_at = time.perf_counter()
+        try:
+            result = analyze_user_chats(settings, supabase, openai, user_id=user_id, remote_jids=remote_jids)
+        except Exception:
+            logger.exception("queue_worker.debounced_analysis_error user_id=%s chats=%s", user_id, len(remote_jids))
+            # Devolve para pending: a analise sai de novo no proximo ciclo.
+            debouncer.release(user_id=user_id, remote_jids=remote_jids)
+            continue
+        debouncer.ack(user_id=user_id, remote_jids=remote_jids)
+        logger.info(
+            "queue_worker.debounced_analysis_done user_id=%s chats=%s analyzed_count=%s elapsed_ms=%s",
+            user_id,
+            len(remote_jids),
+            result.get("analyzed_count"),
+            int((time.perf_counter() - started_at) * 1000),
+        )
+    return len(due)
+
+
+def _run_outbound_dispatcher(sender: OutboundSender) -> None:
+    if not sender.queued:
+        raise RuntimeError("ENABLE_OUTBOUND_QUEUE=true is required for the outbound worker")
+    logger.info("queue_worker.started kind=outbound")
+    while True:
+        try:
+            if not sender.dispatch_due():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            break
+        except Exception:
+            logger.exception("queue_worker.loop_error kind=outbound")
+            time.sleep(2)
+
+
 def main() -> None:
     queue_kind = (sys.argv[1] if len(sys.argv) > 1 else "analysis").strip().lower()
     settings = load_settings()
@@ -29,20 +70,35 @@ def main() -> None:
         raise RuntimeError("REDIS_URL is required for queue worker")
 
     queue = RedisQueueClient.from_url(settings.redis_url)
-    supabase = SupabaseRest(settings.supabase_url, settings.supabase_service_role_key)
+    start_cost_ledger(settings)
+    get_budget_counter(settings)
+    supabase = SupabaseRest(
+        settings.supabase_url,
+        settings.supabase_service_role_key,
+        audit_response_sizes=settings.supabase_response_audit,
+    )
     openai = (
         GeminiClient(settings.google_api_key or "")
         if settings.llm_provider == "google"
         else OpenAIClient(settings.openai_api_key or "")
     )
     evolution = EvolutionClient(settings.evolution_api_url, settings.evolution_api_key)
+    if settings.enable_outbound_queue or queue_kind == "outbound":
+        evolution = OutboundSender.from_settings(settings, evolution)
+
+    if queue_kind == "outbound":
+        _run_outbound_dispatcher(evolution)
+        return
 
     queue_name = settings.queue_analysis_name if queue_kind == "analysis" else settings.queue_summary_name
-    logger.info("queue_worker.started kind=%s queue=%s", queue_kind, queue_name)
+    debouncer = AnalysisDebouncer.from_settings(settings) if queue_kind == "analysis" else None
+    logger.info("queue_worker.started kind=%s queue=%s debounce=%s", queue_kind, queue_name, debouncer is not None)
 
     while True:
         try:
-            job = queue.dequeue_blocking(queue_name, timeout_seconds=5)
+            if debouncer is not None:
+                _drain_debounced_analysis(settings, supabase, openai, debouncer)
+            job = queue.dequeue_blocking(queue_name, timeout_seconds=1 if debouncer is not None else 5)
             if not job:
                 continue
 
@@ -1,49 +1,60 @@
 from __future__ import annotations
 
 import logging
-from typing import Optional
+from typing import Any, Optional
 
-try:
-    import redis
-except Exception:  # pragma: no cover
-    redis = None  # type: ignore
+from .redis_pool import get_redis, timed
 
 
 logger = logging.getLogger("summi_worker.redis")
 
 
 class RedisDedupe:
-    def __init__(self, redis_url: Optional[str]):
+    def __init__(self, redis_url: Optional[str], *, local: Any = None):
         self._url = (redis_url or "").strip()
         self._client = None
-        if self._url and redis is not None:
-            try:
-                self._client = redis.Redis.from_url(self._url, decode_responses=True)
-            except Exception as exc:
-                logger.warning("redis.init_failed error=%s", exc)
-                self._client = None
+        # Camada local opcional (local_dedupe.TimeBucketedBloom): consultada antes do
+        # Redis e unica defesa quando o Redis esta fora. Nao suporta release().
+        self._local = local
+        if self._url:
+            # Cliente compartilhado do processo: o dedupe e criado a cada webhook.
+            self._client = get_redis(self._url)
 
     @property
     def enabled(self) -> bool:
-        return self._client is not None
+        return self._client is not None or self._local is not None
 
     def seen_or_mark(self, key: str, ttl_seconds: int) -> bool:
         """
         True se chave ja existia (duplicado), False se acabou de marcar.
         """
+        if self._local is not None and self._local.seen_or_mark(key):
+            return True
         if not self._client:
             return False
         try:
-            ok = self._client.set(key, "1", ex=max(1, int(ttl_seconds)), nx=True)
+            with timed("dedupe.set_nx"):
+                ok = self._client.set(key, "1", ex=max(1, int(ttl_seconds)), nx=True)
             return ok is None
         except Exception as exc:
             logger.warning("redis.set_failed key=%s error=%s", key, exc)
             return False
 
+    def exists(self, key: str) -> bool:
+        if not self._client:
+            return False
+        try:
+            with timed("dedupe.exists"):
+                return bool(self._client.exists(key))
+        except Exception as exc:
+            logger.warning("redis.exists_failed key=%s error=%s", key, exc)
+            return False
+
     def release(self, key: str) -> None:
         if not self._client:
             return
         try:
-            self._client.delete(key)
+            with timed("dedupe.delete"):
+                self._client.delete(key)
         except Exception as exc:
             logger.warning("redis.delete_failed key=%s error=%s", key, exc)
@@ -0,0 +1,139 @@
+"""
+redis_pool.py — Acesso compartilhado ao Redis do processo.
+
+- um cliente (e um pool de conexoes) por URL, reaproveitado entre requests; antes
+  cada request abria o seu via Redis.from_url e pagava conexao nova
+- histogramas de latencia por operacao (buckets fixos em ms), expostos em
+  /internal/redis-stats
+- scripts Lua para operacoes compostas em uma ida ao Redis (dedupe + enqueue)
+"""
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import redis
+except Exception:  # pragma: no cover
+    redis = None  # type: ignore
+
+
+logger = logging.getLogger("summi_worker.redis_pool")
+
+POOL_MAX_CONNECTIONS = 50
+POOL_TIMEOUT_SECONDS = 5
+HEALTH_CHECK_INTERVAL_SECONDS = 30
+LATENCY_BUCKETS_MS = (0.5, 1.0, 2.0, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0)
+
+# KEYS[1] = chave de dedupe, KEYS[2] = fila; ARGV[1] = TTL (s), ARGV[2] = payload.
+# 1 = marcou e enfileirou; 0 = ja existia (nada enfileirado).
+DEDUPE_AND_ENQUEUE_SCRIPT = """
+if redis.call('SET', KEYS[1], '1', 'NX', 'EX', tonumber(ARGV[1])) then
+  redis.call('RPUSH', KEYS[2], ARGV[2])
+  return 1
+end
+return 0
+"""
+
+
+class LatencyHistogram:
+    def __init__(self, buckets_ms: tuple = LATENCY_BUCKETS_MS) -> None:
+        self._bounds = tuple(sorted(buckets_ms))
+        self._lock = threading.Lock()
+        self._ops: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+
+    def observe(self, op: str, elapsed_ms: float) -> None:
+        index = bisect.bisect_left(self._bounds, elapsed_ms)
+        with self._lock:
+            counts = self._ops.get(op)
+            if counts is None:
+                counts = [0] * (len(self._bounds) + 1)
+                self._ops[op] = counts
+                self._sums[op] = 0.0
+            counts[index] += 1
+            self._sums[op] += elapsed_ms
+
+    def _quantile(self, counts: List[int], q: float) -> Optional[float]:
+        # Limite superior do bucket que contem o quantil (None = acima do ultimo bucket).
+        total = sum(counts)
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count:
+                return self._bounds[index] if index < len(self._bounds) else None
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ops = {op: list(counts) for op, counts in self._ops.items()}
+            sums = dict(self._sums)
+        result: Dict[str, Any] = {}
+        for op, counts in sorted(ops.items()):
+            total = sum(counts)
+            labels = [f"le_{bound:g}ms" for bound in self._bounds] + ["gt_max"]
+            result[op] = {
+                "count": total,
+                "avg_ms": round(sums[op] / total, 3) if total else 0.0,
+                "p50_ms": self._quantile(counts, 0.50),
+                "p99_ms": self._quantile(counts, 0.99),
+                "buckets": {label: count for label, count in zip(labels, counts) if count},
+            }
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._ops.clear()
+            self._sums.clear()
+
+
+LATENCY = LatencyHistogram()
+
+
+@contextmanager
+def timed(op: str) -> Iterator[None]:
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        LATENCY.observe(op, (time.perf_counter() - started_at) * 1000)
+
+
+def latency_snapshot() -> Dict[str, Any]:
+    return LATENCY.snapshot()
+
+
+_CLIENTS: Dict[str, Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_redis(redis_url: Optional[str]) -> Any:
+    """
+    Cliente compartilhado do processo para a URL (None sem URL, sem redis-py ou se falhar).
+    """
+    url = (redis_url or "").strip()
+    if not url or redis is None:
+        return None
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(url)
+        if client is None:
+            try:
+                # Pool bloqueante: com todas as conexoes em uso, espera em vez de falhar.
+                pool = redis.BlockingConnectionPool.from_url(
+                    url,
+                    decode_responses=True,
+                    max_connections=POOL_MAX_CONNECTIONS,
+                    timeout=POOL_TIMEOUT_SECONDS,
+                    health_check_interval=HEALTH_CHECK_INTERVAL_SECONDS,
+                )
+                client = redis.Redis(connection_pool=pool)
+            except Exception as exc:
+                logger.warning("redis_pool.init_failed error=%s", exc)
+                return None
+            _CLIENTS[url] = client
+        return client
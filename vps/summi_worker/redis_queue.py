@@ -1,13 +1,21 @@
 from __future__ import annotations
 
-import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Dict, Optional
 
 from redis import Redis
 
+from . import json_codec
+from .redis_pool import DEDUPE_AND_ENQUEUE_SCRIPT, get_redis, timed
+
 
 RUN_NOW_RESULT_KEY_PREFIX = "summi:run_now:result:"
+# Um job analyze_user pendente por chat (o job analisa tudo que estiver pendente). A
+# chave sai quando o job e retirado da fila; o TTL so cobre worker que caiu antes.
+ANALYSIS_ENQUEUE_DEDUPE_KEY_PREFIX = "summi:analysis:queued:"
+ANALYSIS_ENQUEUE_DEDUPE_TTL_SECONDS = 30
+# Campo do job com a chave de dedupe de enqueue_once, liberada no dequeue.
+DEDUPE_KEY_FIELD = "dedupe_key"
 
 
 def run_now_result_key(job_id: str) -> str:
@@ -17,29 +25,77 @@ def run_now_result_key(job_id: str) -> str:
 @dataclass
 class RedisQueueClient:
     redis: Redis
+    _dedupe_and_enqueue: Any = field(default=None, init=False, repr=False)
 
     @classmethod
     def from_url(cls, url: str) -> "RedisQueueClient":
-        return cls(redis=Redis.from_url(url, decode_responses=True))
+        # Pool compartilhado do processo; Redis.from_url so se o pool nao subir.
+        return cls(redis=get_redis(url) or Redis.from_url(url, decode_responses=True))
 
     def enqueue(self, queue_name: str, payload: Dict[str, Any]) -> None:
-        self.redis.rpush(queue_name, json.dumps(payload, ensure_ascii=False))
+        with timed("queue.enqueue"):
+            self.redis.rpush(queue_name, json_codec.dumps(payload))
+
+    def enqueue_once(self, dedupe_key: str, ttl_seconds: int, queue_name: str, payload: Dict[str, Any]) -> bool:
+        """
+        Marca `dedupe_key` (SET NX EX) e enfileira no mesmo script Lua.
+        True se enfileirou; False se ja havia um job pendente com a mesma chave.
+        A chave vai no job e e apagada no dequeue: mensagens que chegam depois que
+        o job saiu da fila enfileiram outro (borda final, nada fica sem analise).
+        """
+        if self._dedupe_and_enqueue is None:
+            self._dedupe_and_enqueue = self.redis.register_script(DEDUPE_AND_ENQUEUE_SCRIPT)
+        with timed("queue.dedupe_and_enqueue"):
+            queued = self._dedupe_and_enqueue(
+                keys=[dedupe_key, queue_name],
+                args=[max(1, int(ttl_seconds)), json_codec.dumps({**payload, DEDUPE_KEY_FIELD: dedupe_key})],
+            )
+        return bool(int(queued or 0))
+
+    def set_json_and_enqueue(
+        self,
+        key: str,
+        value: Dict[str, Any],
+        ttl_seconds: int,
+        queue_name: str,
+        payload: Dict[str, Any],
+    ) -> None:
+        """
+        SET do resultado + RPUSH do job em um MULTI: uma ida ao Redis e o job so
+        existe se o resultado "processing" tambem foi gravado.
+        """
+        with timed("queue.set_json_and_enqueue"):
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.set(key, json_codec.dumps(value), ex=max(1, int(ttl_seconds)))
+            pipe.rpush(queue_name, json_codec.dumps(payload))
+            pipe.execute()
 
     def dequeue_blocking(self, queue_name: str, timeout_seconds: int = 5) -> Optional[Dict[str, Any]]:
         item = self.redis.blpop(queue_name, timeout=timeout_seconds)
         if not item:
             return None
         _, raw = item
-        return json.loads(raw)
+        job = json_codec.loads(raw)
+        dedupe_key = job.get(DEDUPE_KEY_FIELD) if isinstance(job, dict) else None
+        if dedupe_key:
+            # Libera antes de processar: o que chegar daqui em diante gera novo job.
+            try:
+                with timed("queue.release_dedupe"):
+                    self.redis.delete(dedupe_key)
+            except Exception:
+                pass
+        return job
 
     def set_json(self, key: str, payload: Dict[str, Any], ttl_seconds: int) -> None:
-        self.redis.set(key, json.dumps(payload, ensure_ascii=False), ex=max(1, int(ttl_seconds)))
+        with timed("queue.set_json"):
+            self.redis.set(key, json_codec.dumps(payload), ex=max(1, int(ttl_seconds)))
 
     def get_json(self, key: str) -> Optional[Dict[str, Any]]:
-        raw = self.redis.get(key)
+        with timed("queue.get_json"):
+            raw = self.redis.get(key)
         if not raw:
             return None
         try:
-            return json.loads(raw)
+            return json_codec.loads(raw)
         except Exception:
             return None
@@ -1,17 +1,29 @@
 from __future__ import annotations
 
+import datetime as dt
+import threading
 import time
+from typing import Optional, Set
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from dotenv import load_dotenv
 
+from .budget_guard import get_budget_counter
 from .config import load_settings
+from .conversation_compaction import run_conversation_compaction_job
+from .cost_ledger import start_cost_ledger
 from .evolution_client import EvolutionClient
 from .openai_client import GeminiClient, OpenAIClient
+from .outbound_queue import OutboundSender
 from .redis_queue import RedisQueueClient
 from .blog_writer import run_daily_blog_post
-from .summi_jobs import run_daily_summary_job, run_hourly_job
+from .summi_jobs import (
+    daily_summary_shard_offsets,
+    pending_daily_summary_shards,
+    run_daily_summary_job,
+    run_hourly_job,
+)
 from .supabase_rest import SupabaseRest
 
 
@@ -23,13 +35,21 @@ def main() -> None:
         print("ENABLE_HOURLY_JOB=false; exiting")
         return
 
-    supabase = SupabaseRest(settings.supabase_url, settings.supabase_service_role_key)
+    supabase = SupabaseRest(
+        settings.supabase_url,
+        settings.supabase_service_role_key,
+        audit_response_sizes=settings.supabase_response_audit,
+    )
+    start_cost_ledger(settings)
+    get_budget_counter(settings)
     openai = (
         GeminiClient(settings.google_api_key or "")
         if settings.llm_provider == "google"
         else OpenAIClient(settings.openai_api_key or "")
     )
     evolution = EvolutionClient(settings.evolution_api_url, settings.evolution_api_key)
+    if settings.enable_outbound_queue:
+        evolution = OutboundSender.from_settings(settings, evolution)
     queue = RedisQueueClient.from_url(settings.redis_url) if (settings.enable_summary_queue and settings.redis_url) else None
 
     scheduler = BackgroundScheduler()
@@ -52,6 +72,25 @@ def main() -> None:
         misfire_grace_time=300,
     )
 
+    if settings.enable_conversation_compaction:
+        def _run_conversation_compaction() -> None:
+            result = run_conversation_compaction_job(settings, supabase)
+            print(f"Conversation compaction done: {result}")
+
+        scheduler.add_job(
+            _run_conversation_compaction,
+            "interval",
+            hours=6,
+            id="conversation_compaction_job",
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=900,
+        )
+        print(
+            "Conversation compaction scheduled every 6h "
+            f"(keep={settings.conversa_keep_events} max_bytes={settings.conversa_max_bytes})"
+        )
+
     if settings.blog_auto_post_enabled:
         def _run_blog_post() -> None:
             run_daily_blog_post(
@@ -80,33 +119,81 @@ def main() -> None:
         )
 
     # Job diário: resumo de conversas pendentes + Inbox Zero no horário configurado.
+    # Fatiado por hash do usuario: cada shard dispara num offset da janela de conclusao,
+    # evitando uma rajada unica de envios contra a Evolution.
     if settings.enable_daily_job:
-        def _run_daily_summary() -> None:
+        shard_offsets = daily_summary_shard_offsets(settings)
+        shard_count = len(shard_offsets)
+        running_shards: Set[int] = set()
+        running_lock = threading.Lock()
+
+        def _run_daily_summary(shard_index: int, day: Optional[str] = None) -> None:
+            with running_lock:
+                if shard_index in running_shards:
+                    print(f"Daily summary shard {shard_index + 1}/{shard_count} already running; skipping")
+                    return
+                running_shards.add(shard_index)
             print(
-                "Running daily summary job at "
-                f"{settings.daily_summary_hour_utc:02d}:00 ({settings.daily_summary_timezone})"
+                "Running daily summary job shard "
+                f"{shard_index + 1}/{shard_count} ({settings.daily_summary_timezone})"
             )
             try:
-                result = run_daily_summary_job(settings, supabase, openai, evolution)
+                result = run_daily_summary_job(
+                    settings,
+                    supabase,
+                    openai,
+                    evolution,
+                    shard_index=shard_index,
+                    shard_count=shard_count,
+                    day=day,
+                )
                 print(f"Daily summary done: {result}")
             except Exception as exc:
                 print(f"Daily summary job failed: {exc}")
+            finally:
+                with running_lock:
+                    running_shards.discard(shard_index)
+
+        for shard_index, offset_minutes in enumerate(shard_offsets):
+            scheduler.add_job(
+                _run_daily_summary,
+                CronTrigger(
+                    hour=offset_minutes // 60,
+                    minute=offset_minutes % 60,
+                    timezone=settings.daily_summary_timezone,
+                ),
+                args=[shard_index],
+                id="daily_summary_job" if shard_count == 1 else f"daily_summary_job_{shard_index}",
+                max_instances=1,
+                coalesce=True,
+                misfire_grace_time=600,
+            )
+
+        # Retomada: no boot e a cada 15min, shards de hoje sem checkpoint de conclusao
+        # rodam de novo (checkpoint por usuario evita reenvio para quem ja recebeu).
+        def _resume_daily_summary() -> None:
+            try:
+                pending = pending_daily_summary_shards(settings)
+            except Exception as exc:
+                print(f"Daily summary resume check failed: {exc}")
+                return
+            for shard_index, day in pending:
+                print(f"Resuming daily summary shard {shard_index + 1}/{shard_count} for {day}")
+                _run_daily_summary(shard_index, day)
 
         scheduler.add_job(
-            _run_daily_summary,
-            CronTrigger(
-                hour=settings.daily_summary_hour_utc,
-                minute=0,
-                timezone=settings.daily_summary_timezone,
-            ),
-            id="daily_summary_job",
+            _resume_daily_summary,
+            "interval",
+            minutes=15,
+            id="daily_summary_resume",
+            next_run_time=dt.datetime.now(dt.timezone.utc),
             max_instances=1,
             coalesce=True,
-            misfire_grace_time=600,
         )
         print(
             "Daily summary job scheduled for "
-            f"{settings.daily_summary_hour_utc:02d}:00 ({settings.daily_summary_timezone})"
+            f"{settings.daily_summary_hour_utc:02d}:00 ({settings.daily_summary_timezone}) "
+            f"shards={shard_count} window={settings.daily_summary_window_minutes}min"
         )
 
     scheduler.start()
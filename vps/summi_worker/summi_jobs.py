@@ -2,21 +2,30 @@ from __future__ import annotations
 
 import datetime as dt
 import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Tuple
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from .analysis import AnalyzedChat, analyze_single_chat, build_audio_script_with_usage, build_summary_text
+from .budget_gate import BudgetExceededError, BudgetRun, estimate_chat_cost, estimate_tts_cost, reserve_budget
 from .budget_guard import get_user_budget_state
 from .config import Settings, get_analysis_model, get_summary_model
+from .conversation_compaction import conversa_with_summary
 from .cost_tracking import log_chat_cost, log_tts_cost
 from .evolution_client import EvolutionClient
 from .openai_client import OpenAIClient
+from .outbound_queue import OutboundSender
+from .projections import PROFILE_ANALYSIS, PROFILE_SUMMARY
 from .redis_dedupe import RedisDedupe
 from .supabase_rest import (
+    SupabaseError,
     SupabaseRest,
     to_postgrest_filter_eq,
     to_postgrest_filter_gt,
     to_postgrest_filter_gte,
+    to_postgrest_filter_in,
     to_postgrest_filter_lt,
     to_postgrest_filter_neq,
 )
@@ -24,6 +33,18 @@ from .supabase_rest import (
 
 logger = logging.getLogger("summi_worker.summi_jobs")
 HOURLY_SUMMARY_SEND_LOCK_TTL_SECONDS = 5 * 60
+DAILY_SUMMARY_USER_LOCK_TTL_SECONDS = 10 * 60
+DAILY_SUMMARY_CHECKPOINT_TTL_SECONDS = 36 * 60 * 60
+# Shard sem checkpoint de conclusao e retomado ate N segundos apos o disparo.
+DAILY_SUMMARY_RESUME_MAX_DELAY_SECONDS = 6 * 60 * 60
+DUE_PROFILES_BATCH_LIMIT = 1000
+CHATS_NEEDING_ANALYSIS_LIMIT = 250
+# Escritas em lote: um batch_patch a cada N linhas (e no fim do job), nao um PATCH por linha.
+PATCH_BATCH_SIZE = 25
+PROFILES_IN_FILTER_CHUNK = 200
+_CHAT_ANALYSIS_COLUMNS = (
+    "id,id_usuario,remote_jid,nome,criado_em,modificado_em,ultimo_evento_em,contexto,analisado_em,conversa,prioridade"
+)
 
 
 def _now_utc_iso() -> str:
@@ -92,6 +113,91 @@ def _unique_active_user_ids(subscribers: List[Dict[str, Any]]) -> List[str]:
     return user_ids
 
 
+class _PatchBuffer:
+    """
+    Acumula PATCHes por id e grava em lote (SupabaseRest.patch_many). Linhas do
+    mesmo id sao mescladas; grava a cada `batch_size` ids e no `flush` final.
+    Com `quiet`, falha de escrita so gera log (como os PATCHes de perfil faziam).
+    """
+
+    def __init__(
+        self,
+        supabase: SupabaseRest,
+        table: str,
+        *,
+        batch_size: int = PATCH_BATCH_SIZE,
+        quiet: bool = False,
+    ) -> None:
+        self._supabase = supabase
+        self._table = table
+        self._batch_size = max(1, batch_size)
+        self._quiet = quiet
+        self._rows: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, row_id: str, data: Dict[str, Any]) -> None:
+        self._rows.setdefault(str(row_id), {"id": str(row_id)}).update(data)
+        if len(self._rows) >= self._batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        rows, self._rows = list(self._rows.values()), {}
+        if not rows:
+            return
+        try:
+            if hasattr(self._supabase, "patch_many"):
+                self._supabase.patch_many(self._table, rows, key="id")
+                return
+            for row in rows:
+                data = {col: value for col, value in row.items() if col != "id"}
+                self._supabase.patch(self._table, data, filters=[to_postgrest_filter_eq("id", row["id"])])
+        except Exception as exc:
+            if not self._quiet:
+                raise
+            logger.warning(
+                "patch_buffer.flush_failed table=%s rows=%s error=%s",
+                self._table,
+                len(rows),
+                _summarize_exception(exc, max_chars=200),
+            )
+
+
+def _mark_profile_sent(supabase: SupabaseRest, user_id: str, data: Dict[str, Any]) -> None:
+    # Marcadores de envio (ultimo_summi_em, onboarding_completed) vao na hora, logo
+    # apos o envio: ficar num buffer abre janela para reenviar se o processo cair.
+    try:
+        supabase.patch("profiles", data=data, filters=[to_postgrest_filter_eq("id", user_id)])
+    except Exception as exc:
+        logger.warning(
+            "hourly_summary.mark_sent_failed user_id=%s columns=%s error=%s",
+            user_id,
+            ",".join(sorted(data)),
+            _summarize_exception(exc, max_chars=200),
+        )
+
+
+def _select_all(supabase: SupabaseRest, table: str, **kwargs: Any) -> List[Dict[str, Any]]:
+    # Paginado por Range quando disponivel; senao o select com limit de sempre.
+    if hasattr(supabase, "select_all"):
+        return supabase.select_all(table, **kwargs)
+    return supabase.select(table, limit=1000, **kwargs)
+
+
+def _load_profiles_by_ids(supabase: SupabaseRest, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    profiles: Dict[str, Dict[str, Any]] = {}
+    for start in range(0, len(user_ids), PROFILES_IN_FILTER_CHUNK):
+        chunk = user_ids[start : start + PROFILES_IN_FILTER_CHUNK]
+        rows = supabase.select(
+            "profiles",
+            select=PROFILE_SUMMARY,
+            filters=[to_postgrest_filter_in("id", chunk)],
+            limit=len(chunk),
+        )
+        for row in rows or []:
+            if isinstance(row, dict) and row.get("id"):
+                profiles[str(row["id"])] = row
+    return profiles
+
+
 def _extract_phone_digits(value: Any) -> str:
     return "".join(c for c in str(value or "") if c.isdigit())
 
@@ -188,6 +294,53 @@ def _summary_is_due(profile: Dict[str, Any], *, now_utc: dt.datetime) -> bool:
     return elapsed_hours >= _summary_frequency_hours(profile)
 
 
+def _load_due_profiles(supabase: SupabaseRest, *, now_utc: dt.datetime) -> Optional[List[Dict[str, Any]]]:
+    """
+    Perfis de assinantes ativos com Summi da Hora vencido (indice profiles.proximo_summi_em),
+    todas as paginas via cursor keyset (proximo_summi_em, id).
+    Retorna None quando a RPC nao existe ainda; o job cai na varredura completa.
+    """
+    profiles: List[Dict[str, Any]] = []
+    cursor: Optional[Tuple[Any, str]] = None
+    while True:
+        payload: Dict[str, Any] = {"p_now": now_utc.isoformat(), "p_limit": DUE_PROFILES_BATCH_LIMIT}
+        if cursor is not None:
+            payload["p_after_due"], payload["p_after_id"] = cursor
+        try:
+            rows = supabase.rpc("summi_due_profiles", payload)
+        except SupabaseError as exc:
+            logger.warning("hourly_summary.due_index_unavailable error=%s", _summarize_exception(exc, max_chars=200))
+            return None
+        if not isinstance(rows, list):
+            return None if cursor is None else profiles
+        page = [row for row in rows if isinstance(row, dict) and row.get("id")]
+        profiles.extend(page)
+        if len(rows) < DUE_PROFILES_BATCH_LIMIT or not page:
+            return profiles
+        next_cursor = (page[-1].get("proximo_summi_em"), str(page[-1]["id"]))
+        if next_cursor == cursor:
+            return profiles
+        cursor = next_cursor
+
+
+def _summary_not_before(profile: Dict[str, Any], *, now_utc: dt.datetime) -> dt.datetime:
+    # Proximo horario em que o usuario volta a ser elegivel (ultimo envio + frequencia).
+    interval = dt.timedelta(hours=_summary_frequency_hours(profile))
+    ultimo_dt = _parse_iso_datetime(profile.get("ultimo_summi_em"))
+    if ultimo_dt is not None and ultimo_dt + interval > now_utc:
+        return ultimo_dt + interval
+    return now_utc + interval
+
+
+def _next_business_window_start(settings: Settings, now_utc: dt.datetime) -> dt.datetime:
+    tz = _resolve_business_timezone(settings)
+    now_local = now_utc.astimezone(tz)
+    start_local = now_local.replace(hour=settings.business_hours_start, minute=0, second=0, microsecond=0)
+    if start_local <= now_local:
+        start_local += dt.timedelta(days=1)
+    return start_local.astimezone(dt.timezone.utc)
+
+
 def _parse_iso_datetime(value: Any) -> dt.datetime | None:
     raw = str(value or "").strip()
     if not raw:
@@ -201,32 +354,43 @@ def _parse_iso_datetime(value: Any) -> dt.datetime | None:
     return parsed
 
 
-def _chat_has_new_event_since_analysis(chat: Dict[str, Any]) -> bool:
-    analyzed_dt = _parse_iso_datetime(chat.get("analisado_em"))
-    if analyzed_dt is None:
-        return True
-
-    event_dt = _parse_iso_datetime(chat.get("ultimo_evento_em")) or _parse_iso_datetime(chat.get("modificado_em"))
-    if event_dt is None:
-        return False
-    return event_dt > analyzed_dt
+def _load_chats_needing_analysis(
+    supabase: SupabaseRest,
+    *,
+    user_id: str,
+    ignore_remote_jid: str | None,
+    remote_jids: Optional[List[str]] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Chats com evento novo desde a ultima analise, numa unica RPC indexada
+    (chats_needing_analysis compara ultimo_evento_em > analisado_em no banco).
+    Retorna None quando a RPC nao existe ainda; o job cai nas duas consultas antigas.
+    """
+    try:
+        rows = supabase.rpc(
+            "chats_needing_analysis",
+            {
+                "p_user_id": user_id,
+                "p_ignore_remote_jid": ignore_remote_jid or None,
+                "p_remote_jids": [str(jid) for jid in remote_jids] if remote_jids is not None else None,
+                "p_include_conversa": True,
+                "p_limit": CHATS_NEEDING_ANALYSIS_LIMIT,
+            },
+        )
+    except SupabaseError as exc:
+        logger.warning("analyze.candidates_rpc_unavailable error=%s", _summarize_exception(exc, max_chars=200))
+        return None
+    if not isinstance(rows, list):
+        return None
+    return [row for row in rows if isinstance(row, dict) and row.get("id")]
 
 
-def analyze_user_chats(
-    settings: Settings,
+def _scan_chats_needing_analysis(
     supabase: SupabaseRest,
-    openai: OpenAIClient,
     *,
     user_id: str,
-    blacklist: str | None = None,
-) -> Dict[str, Any]:
-    # Carrega perfil
-    profiles = supabase.select("profiles", select="*", filters=[to_postgrest_filter_eq("id", user_id)], limit=1)
-    if not profiles:
-        return {"success": False, "error": "profile_not_found"}
-    profile = profiles[0]
-
-    # Carrega chats que precisam ser analisados: analisado_em is null OR ultimo_evento_em > analisado_em
+    ignore_remote_jid: str,
+) -> List[Dict[str, Any]]:
     # PostgREST nao suporta comparacao coluna-coluna direto; fazemos 2 consultas e unimos.
     chats_to_analyze: List[Dict[str, Any]] = []
 
@@ -234,10 +398,10 @@ def analyze_user_chats(
     chats_to_analyze.extend(
         supabase.select(
             "chats",
-            select="id,id_usuario,remote_jid,nome,criado_em,modificado_em,ultimo_evento_em,contexto,analisado_em,conversa,prioridade",
+            select=_CHAT_ANALYSIS_COLUMNS,
             filters=[
                 to_postgrest_filter_eq("id_usuario", user_id),
-                to_postgrest_filter_neq("remote_jid", settings.ignore_remote_jid),
+                to_postgrest_filter_neq("remote_jid", ignore_remote_jid),
                 ("analisado_em", "is.null"),
             ],
             order="modificado_em.desc",
@@ -250,10 +414,10 @@ def analyze_user_chats(
     since = (dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=30)).isoformat()
     recently = supabase.select(
         "chats",
-        select="id,id_usuario,remote_jid,nome,criado_em,modificado_em,ultimo_evento_em,contexto,analisado_em,conversa,prioridade",
+        select=_CHAT_ANALYSIS_COLUMNS,
         filters=[
             to_postgrest_filter_eq("id_usuario", user_id),
-            to_postgrest_filter_neq("remote_jid", settings.ignore_remote_jid),
+            to_postgrest_filter_neq("remote_jid", ignore_remote_jid),
             ("analisado_em", "not.is.null"),
             ("ultimo_evento_em", "not.is.null"),
             to_postgrest_filter_gte("ultimo_evento_em", since),
@@ -274,25 +438,90 @@ def analyze_user_chats(
             continue
         seen.add(cid)
         unique_chats.append(c)
+    return unique_chats
+
+
+def _chat_has_new_event_since_analysis(chat: Dict[str, Any]) -> bool:
+    analyzed_dt = _parse_iso_datetime(chat.get("analisado_em"))
+    if analyzed_dt is None:
+        return True
+
+    event_dt = _parse_iso_datetime(chat.get("ultimo_evento_em")) or _parse_iso_datetime(chat.get("modificado_em"))
+    if event_dt is None:
+        return False
+    return event_dt > analyzed_dt
+
+
+def analyze_user_chats(
+    settings: Settings,
+    supabase: SupabaseRest,
+    openai: OpenAIClient,
+    *,
+    user_id: str,
+    blacklist: str | None = None,
+    remote_jids: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    # Carrega perfil
+    profiles = supabase.select("profiles", select=PROFILE_ANALYSIS, filters=[to_postgrest_filter_eq("id", user_id)], limit=1)
+    if not profiles:
+        return {"success": False, "error": "profile_not_found"}
+    profile = profiles[0]
+
+    # Carrega chats que precisam ser analisados: analisado_em is null OR ultimo_evento_em > analisado_em
+    unique_chats = _load_chats_needing_analysis(
+        supabase,
+        user_id=user_id,
+        ignore_remote_jid=settings.ignore_remote_jid,
+        remote_jids=remote_jids,
+    )
+    if unique_chats is None:
+        unique_chats = _scan_chats_needing_analysis(
+            supabase,
+            user_id=user_id,
+            ignore_remote_jid=settings.ignore_remote_jid,
+        )
+
+    # Analise disparada pelo debounce: apenas os chats cuja rajada ja silenciou.
+    if remote_jids is not None:
+        wanted = {str(jid) for jid in remote_jids}
+        unique_chats = [c for c in unique_chats if str(c.get("remote_jid") or "") in wanted]
 
     temas_urgentes = profile.get("temas_urgentes")
     temas_importantes = profile.get("temas_importantes")
 
     analyzed: List[AnalyzedChat] = []
-    for chat in unique_chats:
-        analyzed_chat, usage = analyze_single_chat(
-            openai,
-            get_analysis_model(settings),
-            chat_id=chat["id"],
-            conversa=chat.get("conversa", []),
-            nome=chat.get("nome") or chat.get("Nome") or "",
-            remote_jid=chat.get("remote_jid") or "",
-            criado_em=chat.get("criado_em"),
-            modificado_em=chat.get("ultimo_evento_em") or chat.get("modificado_em"),
-            temas_urgentes=temas_urgentes,
-            temas_importantes=temas_importantes,
-            blacklist=blacklist,
-        )
+    budget_blocked = False
+    budget = BudgetRun(settings, supabase, user_id=user_id)
+    for index, chat in enumerate(unique_chats):
+        try:
+            reservation = budget.reserve(
+                operation="analyze",
+                estimated_usd=lambda: estimate_chat_cost(str(chat.get("conversa") or ""), model=get_analysis_model(settings)),
+            )
+        except BudgetExceededError as exc:
+            # Hard cap atingido: os chats restantes ficam para depois (nao gasta antes de checar).
+            logger.info(
+                "analysis.budget_blocked user_id=%s remaining_chats=%s reason=%s",
+                user_id,
+                len(unique_chats) - index,
+                exc,
+            )
+            budget_blocked = True
+            break
+        with reservation:
+            analyzed_chat, usage = analyze_single_chat(
+                openai,
+                get_analysis_model(settings),
+                chat_id=chat["id"],
+                conversa=conversa_with_summary(chat.get("conversa", []), chat.get("conversa_resumo")),
+                nome=chat.get("nome") or chat.get("Nome") or "",
+                remote_jid=chat.get("remote_jid") or "",
+                criado_em=chat.get("criado_em"),
+                modificado_em=chat.get("ultimo_evento_em") or chat.get("modificado_em"),
+                temas_urgentes=temas_urgentes,
+                temas_importantes=temas_importantes,
+                blacklist=blacklist,
+            )
         if usage is not None:
             log_chat_cost(
                 supabase,
@@ -301,8 +530,11 @@ def analyze_user_chats(
                 model=get_analysis_model(settings),
                 input_tokens=usage.prompt_tokens,
                 output_tokens=usage.completion_tokens,
+                cached_tokens=getattr(usage, "cached_tokens", 0),
             )
 
+        # Grava na hora: analisado_em e o que impede outra rodada (debounce x job
+        # horario) de analisar e pagar pelo mesmo chat de novo.
         supabase.patch(
             "chats",
             data={
@@ -328,10 +560,10 @@ def analyze_user_chats(
         except Exception:
             pass  # Não aborta o fluxo por falha em métricas
 
-    return {"success": True, "analyzed_count": len(analyzed)}
-
-
-import time
+    result: Dict[str, Any] = {"success": True, "analyzed_count": len(analyzed)}
+    if budget_blocked:
+        result["budget_blocked"] = True
+    return result
 
 
 def _daily_summary_sent_today(profile: Dict[str, Any], *, now_utc: dt.datetime) -> bool:
@@ -348,11 +580,199 @@ def _daily_summary_sent_today(profile: Dict[str, Any], *, now_utc: dt.datetime)
         return False
 
 
+def _daily_summary_shard(user_id: str, shard_count: int) -> int:
+    # Hash estavel entre processos (hash() do Python e randomizado por processo).
+    return zlib.crc32(user_id.encode("utf-8")) % max(1, shard_count)
+
+
+def _daily_summary_done_key(day: str, user_id: str) -> str:
+    return f"summi:daily:done:{day}:{user_id}"
+
+
+def _daily_summary_lock_key(day: str, user_id: str) -> str:
+    return f"summi:daily:lock:{day}:{user_id}"
+
+
+def _daily_summary_shard_done_key(day: str, shard_index: int, shard_count: int) -> str:
+    return f"summi:daily:shard_done:{day}:{shard_index}/{shard_count}"
+
+
+def daily_summary_shard_offsets(settings: Settings) -> List[int]:
+    """
+    Minuto do dia (no fuso DAILY_SUMMARY_TIMEZONE) em que cada shard dispara,
+    espalhados pela janela de conclusao.
+    """
+    shard_count = max(1, int(getattr(settings, "daily_summary_shards", 1) or 1))
+    step_minutes = int(getattr(settings, "daily_summary_window_minutes", 0) or 0) // shard_count if shard_count > 1 else 0
+    start = int(settings.daily_summary_hour_utc) * 60
+    return [(start + shard_index * step_minutes) % (24 * 60) for shard_index in range(shard_count)]
+
+
+def _latest_daily_fire(now_utc: dt.datetime, tz: dt.tzinfo, offset_minutes: int) -> dt.datetime:
+    local_now = now_utc.astimezone(tz)
+    fire = local_now.replace(hour=offset_minutes // 60, minute=offset_minutes % 60, second=0, microsecond=0)
+    if fire > local_now:
+        fire -= dt.timedelta(days=1)
+    return fire.astimezone(dt.timezone.utc)
+
+
+def pending_daily_summary_shards(
+    settings: Settings,
+    *,
+    now_utc: Optional[dt.datetime] = None,
+) -> List[Tuple[int, str]]:
+    """
+    (shard_index, dia) dos shards cujo ultimo disparo ja passou (ha no maximo
+    DAILY_SUMMARY_RESUME_MAX_DELAY_SECONDS) e nao tem checkpoint de conclusao:
+    processo caiu no meio da fatia ou estava fora no horario do cron.
+    Sem Redis nao ha checkpoint para ler e nada e retomado.
+    """
+    checkpoint = RedisDedupe(getattr(settings, "redis_url", None))
+    if not checkpoint.enabled:
+        return []
+    now_utc = now_utc or dt.datetime.now(dt.timezone.utc)
+    timezone_name = str(getattr(settings, "daily_summary_timezone", "") or "UTC")
+    try:
+        tz: dt.tzinfo = ZoneInfo(timezone_name)
+    except ZoneInfoNotFoundError:
+        tz = dt.timezone.utc
+    offsets = daily_summary_shard_offsets(settings)
+    pending: List[Tuple[int, str]] = []
+    for shard_index, offset_minutes in enumerate(offsets):
+        fire_utc = _latest_daily_fire(now_utc, tz, offset_minutes)
+        if (now_utc - fire_utc).total_seconds() > DAILY_SUMMARY_RESUME_MAX_DELAY_SECONDS:
+            continue
+        day = fire_utc.date().isoformat()
+        if not checkpoint.exists(_daily_summary_shard_done_key(day, shard_index, len(offsets))):
+            pending.append((shard_index, day))
+    return pending
+
+
+def _send_daily_summary_for_user(
+    settings: Settings,
+    supabase: SupabaseRest,
+    openai: OpenAIClient,
+    evolution: EvolutionClient,
+    *,
+    user_id: str,
+    now_utc: dt.datetime,
+) -> str:
+    profiles = supabase.select("profiles", select=PROFILE_SUMMARY, filters=[to_postgrest_filter_eq("id", user_id)], limit=1)
+    if not profiles:
+        return "no_profile"
+    profile = profiles[0]
+
+    # Evita envio duplo no mesmo dia
+    if _daily_summary_sent_today(profile, now_utc=now_utc):
+        return "already_sent"
+
+    numero_usuario = "".join(c for c in str(profile.get("numero") or "") if c.isdigit())
+    if not numero_usuario:
+        return "no_phone"
+
+    # Buscar conversas pendentes com prioridade >= 2 (não respondidas)
+    chats = supabase.select(
+        "chats",
+        select="id,nome,remote_jid,prioridade,contexto,criado_em,analisado_em",
+        filters=[
+            to_postgrest_filter_eq("id_usuario", user_id),
+            to_postgrest_filter_neq("remote_jid", settings.ignore_remote_jid),
+            ("contexto", "not.is.null"),
+            ("prioridade", "gte.2"),
+        ],
+        order="prioridade.desc,analisado_em.desc",
+        limit=50,
+    )
+
+    if not chats:
+        return "no_priority_chats"
+
+    items = _build_summary_items(chats)
+
+    # Identificar status de trial para rodapé
+    is_trial = True
+    try:
+        state = get_user_budget_state(settings, supabase, user_id=user_id)
+        is_trial = state.plan_kind == "trial"
+    except Exception:
+        pass
+
+    summary_text = build_summary_text(openai, get_summary_model(settings), items=items, is_trial=is_trial)
+    evolution.send_text(settings.summi_sender_instance, numero_usuario, summary_text)
+
+    # Marcar timestamp do envio
+    try:
+        supabase.patch(
+            "profiles",
+            data={"ultimo_summi_diario_em": _now_utc_iso()},
+            filters=[to_postgrest_filter_eq("id", user_id)],
+        )
+    except Exception:
+        pass
+
+    # Inbox Zero diário: apagar todas as conversas após o resumo
+    # O usuário já foi informado. Isso limpa para o próximo dia.
+    try:
+        supabase.delete(
+            "chats",
+            filters=[to_postgrest_filter_eq("id_usuario", user_id)],
+        )
+    except Exception as exc:
+        logger.warning("daily_summary.delete_chats_failed user_id=%s error=%s", user_id, exc)
+
+    # Enviar áudio se habilitado
+    if _should_send_summi_audio(settings, profile):
+        try:
+            audio_script, script_usage = build_audio_script_with_usage(
+                openai,
+                get_summary_model(settings),
+                summary_text=summary_text,
+                stream=bool(getattr(settings, "enable_llm_streaming", False)),
+            )
+            if script_usage is not None:
+                log_chat_cost(
+                    supabase,
+                    user_id,
+                    operation="summary",
+                    model=get_summary_model(settings),
+                    input_tokens=script_usage.prompt_tokens,
+                    output_tokens=script_usage.completion_tokens,
+                    cached_tokens=getattr(script_usage, "cached_tokens", 0),
+                )
+            with reserve_budget(
+                settings,
+                supabase,
+                user_id=user_id,
+                operation="tts",
+                estimated_usd=lambda: estimate_tts_cost(audio_script),
+            ):
+                tts_result = openai.tts_mp3_response(
+                    settings.openai_tts_model,
+                    settings.openai_tts_voice,
+                    audio_script,
+                )
+            log_tts_cost(
+                supabase,
+                user_id,
+                model=settings.openai_tts_model,
+                char_count=tts_result.char_count,
+            )
+            evolution.send_audio_mp3(settings.summi_sender_instance, numero_usuario, tts_result.audio_bytes)
+        except Exception as exc:
+            logger.warning("daily_summary.audio_failed user_id=%s error=%s", user_id, exc)
+
+    return "sent"
+
+
 def run_daily_summary_job(
     settings: Settings,
     supabase: SupabaseRest,
     openai: OpenAIClient,
     evolution: EvolutionClient,
+    *,
+    shard_index: Optional[int] = None,
+    shard_count: int = 1,
+    day: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Job diário (19:00 UTC): envia resumo das conversas pendentes (prioridade >= 2)
@@ -360,137 +780,95 @@ def run_daily_summary_job(
 
     Independente do job horário — roda mesmo se summi_frequencia=24h.
     Conversas existentes no banco = não respondidas (Inbox Zero garante delete ao responder).
+
+    Com `shard_count > 1` processa apenas os usuarios cujo hash cai em `shard_index`;
+    o scheduler espalha as fatias pela janela de conclusao. Cada usuario concluido
+    vira um checkpoint no Redis, entao uma execucao que caiu retoma de onde parou;
+    a fatia so ganha o checkpoint de conclusao (lido por pending_daily_summary_shards)
+    quando nenhum usuario falhou nem ficou travado por outra execucao, para a
+    retomada tentar de novo quem ficou sem checkpoint proprio.
+    `day` fixa o dia dos checkpoints numa retomada (padrao: hoje em UTC).
     """
     now_utc = dt.datetime.now(dt.timezone.utc)
+    day = day or now_utc.date().isoformat()
 
-    subs = supabase.select(
+    subs = _select_all(
+        supabase,
         "subscribers",
         select="user_id,subscription_end,subscription_status,subscribed",
         filters=[
             ("subscribed", "eq.true"),
             to_postgrest_filter_gte("subscription_end", _now_utc_iso()),
         ],
-        limit=1000,
+        order="id.asc",
     )
 
-    sent = 0
-    skipped_already_sent = 0
-    skipped_no_priority_chats = 0
-    errors = 0
     user_ids = _unique_active_user_ids(subs)
-
-    for user_id in user_ids:
-        profiles = supabase.select("profiles", select="*", filters=[to_postgrest_filter_eq("id", user_id)], limit=1)
-        if not profiles:
-            continue
-        profile = profiles[0]
-
-        # Evita envio duplo no mesmo dia
-        if _daily_summary_sent_today(profile, now_utc=now_utc):
-            skipped_already_sent += 1
-            continue
-
-        numero_usuario = "".join(c for c in str(profile.get("numero") or "") if c.isdigit())
-        if not numero_usuario:
-            continue
-
+    if shard_index is not None and shard_count > 1:
+        user_ids = [uid for uid in user_ids if _daily_summary_shard(uid, shard_count) == shard_index]
+
+    checkpoint = RedisDedupe(getattr(settings, "redis_url", None))
+    outcomes: Dict[str, int] = {}
+    outcomes_lock = threading.Lock()
+
+    def _record(outcome: str) -> None:
+        with outcomes_lock:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def _process(user_id: str) -> None:
+        done_key = _daily_summary_done_key(day, user_id)
+        if checkpoint.exists(done_key):
+            _record("checkpointed")
+            return
+        lock_key = _daily_summary_lock_key(day, user_id)
+        if checkpoint.seen_or_mark(lock_key, DAILY_SUMMARY_USER_LOCK_TTL_SECONDS):
+            _record("locked")
+            return
         try:
-            # Buscar conversas pendentes com prioridade >= 2 (não respondidas)
-            chats = supabase.select(
-                "chats",
-                select="id,nome,remote_jid,prioridade,contexto,criado_em,analisado_em",
-                filters=[
-                    to_postgrest_filter_eq("id_usuario", user_id),
-                    to_postgrest_filter_neq("remote_jid", settings.ignore_remote_jid),
-                    ("contexto", "not.is.null"),
-                    ("prioridade", "gte.2"),
-                ],
-                order="prioridade.desc,analisado_em.desc",
-                limit=50,
+            outcome = _send_daily_summary_for_user(
+                settings,
+                supabase,
+                openai,
+                evolution,
+                user_id=user_id,
+                now_utc=now_utc,
             )
+            checkpoint.seen_or_mark(done_key, DAILY_SUMMARY_CHECKPOINT_TTL_SECONDS)
+            _record(outcome)
+        except Exception as exc:
+            _record("error")
+            logger.exception("daily_summary.user_failed user_id=%s error=%s", user_id, _summarize_exception(exc))
+        finally:
+            checkpoint.release(lock_key)
 
-            if not chats:
-                skipped_no_priority_chats += 1
-                continue
-
-            items = _build_summary_items(chats)
-            
-            # Identificar status de trial para rodapé
-            is_trial = True
-            try:
-                state = get_user_budget_state(settings, supabase, user_id=user_id)
-                is_trial = state.plan_kind == "trial"
-            except Exception:
-                pass
-
-            summary_text = build_summary_text(openai, get_summary_model(settings), items=items, is_trial=is_trial)
-            evolution.send_text(settings.summi_sender_instance, numero_usuario, summary_text)
-            sent += 1
-
-            # Marcar timestamp do envio
-            try:
-                supabase.patch(
-                    "profiles",
-                    data={"ultimo_summi_diario_em": _now_utc_iso()},
-                    filters=[to_postgrest_filter_eq("id", user_id)],
-                )
-            except Exception:
-                pass
-
-            # Inbox Zero diário: apagar todas as conversas após o resumo
-            # O usuário já foi informado. Isso limpa para o próximo dia.
-            try:
-                supabase.delete(
-                    "chats",
-                    filters=[to_postgrest_filter_eq("id_usuario", user_id)],
-                )
-            except Exception as exc:
-                print(f"daily_summary: delete_chats_failed user={user_id} error={exc}")
-
-            # Enviar áudio se habilitado
-            if _should_send_summi_audio(settings, profile):
-                try:
-                    audio_script, script_usage = build_audio_script_with_usage(
-                        openai,
-                        get_summary_model(settings),
-                        summary_text=summary_text,
-                    )
-                    if script_usage is not None:
-                        log_chat_cost(
-                            supabase,
-                            user_id,
-                            operation="summary",
-                            model=get_summary_model(settings),
-                            input_tokens=script_usage.prompt_tokens,
-                            output_tokens=script_usage.completion_tokens,
-                        )
-                    tts_result = openai.tts_mp3_response(
-                        settings.openai_tts_model,
-                        settings.openai_tts_voice,
-                        audio_script,
-                    )
-                    log_tts_cost(
-                        supabase,
-                        user_id,
-                        model=settings.openai_tts_model,
-                        char_count=tts_result.char_count,
-                    )
-                    evolution.send_audio_mp3(settings.summi_sender_instance, numero_usuario, tts_result.audio_bytes)
-                except Exception as exc:
-                    print(f"daily_summary: audio_failed user={user_id} error={exc}")
+    concurrency = max(1, int(getattr(settings, "daily_summary_concurrency", 1) or 1))
+    if concurrency > 1 and len(user_ids) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="daily-summary") as pool:
+            list(pool.map(_process, user_ids))
+    else:
+        for user_id in user_ids:
+            _process(user_id)
 
-        except Exception as exc:
-            errors += 1
-            print(f"daily_summary: user_failed user={user_id} error={exc}")
+    if shard_index is not None and not outcomes.get("error", 0) and not outcomes.get("locked", 0):
+        checkpoint.seen_or_mark(
+            _daily_summary_shard_done_key(day, shard_index, max(1, shard_count)),
+            DAILY_SUMMARY_CHECKPOINT_TTL_SECONDS,
+        )
 
-    return {
+    result = {
         "success": True,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
         "unique_subscribers": len(user_ids),
-        "sent": sent,
-        "skipped_already_sent_today": skipped_already_sent,
-        "skipped_no_priority_chats": skipped_no_priority_chats,
-        "errors": errors,
+        "sent": outcomes.get("sent", 0),
+        "skipped_already_sent_today": outcomes.get("already_sent", 0),
+        "skipped_no_priority_chats": outcomes.get("no_priority_chats", 0),
+        "skipped_checkpointed": outcomes.get("checkpointed", 0),
+        "skipped_locked": outcomes.get("locked", 0),
+        "errors": outcomes.get("error", 0),
     }
+    logger.info("daily_summary.done %s", result)
+    return result
 
 
 def send_onboarding_messages(evolution: EvolutionClient, instance: str, numero: str, nome: str):
@@ -518,12 +896,12 @@ def send_onboarding_messages(evolution: EvolutionClient, instance: str, numero:
         "Bem-vindo(a) à Summi! 🚀"
     )
 
+    # Atrasos agendados no OutboundSender (fila Redis ou thread local), sem segurar o job com sleep.
+    sender = evolution if isinstance(evolution, OutboundSender) else OutboundSender(evolution)
     try:
-        evolution.send_text(instance, numero, msg1)
-        time.sleep(2)
-        evolution.send_text(instance, numero, msg2)
-        time.sleep(4)
-        evolution.send_text(instance, numero, msg3)
+        sender.send_text(instance, numero, msg1)
+        sender.send_text(instance, numero, msg2, delay_seconds=2)
+        sender.send_text(instance, numero, msg3, delay_seconds=6)
     except Exception as e:
         print(f"Error sending onboarding to {numero}: {e}")
 
@@ -578,7 +956,7 @@ def run_user_summi_now(
     }
 
     try:
-        profiles = supabase.select("profiles", select="*", filters=[to_postgrest_filter_eq("id", user_id)], limit=1)
+        profiles = supabase.select("profiles", select=PROFILE_SUMMARY, filters=[to_postgrest_filter_eq("id", user_id)], limit=1)
         if not profiles:
             return {
                 **base_response,
@@ -667,6 +1045,7 @@ def run_user_summi_now(
                     openai,
                     get_summary_model(settings),
                     summary_text=summary_text,
+                    stream=bool(getattr(settings, "enable_llm_streaming", False)),
                 )
                 if script_usage is not None:
                     log_chat_cost(
@@ -676,12 +1055,20 @@ def run_user_summi_now(
                         model=get_summary_model(settings),
                         input_tokens=script_usage.prompt_tokens,
                         output_tokens=script_usage.completion_tokens,
+                        cached_tokens=getattr(script_usage, "cached_tokens", 0),
+                    )
+                with reserve_budget(
+                    settings,
+                    supabase,
+                    user_id=user_id,
+                    operation="tts",
+                    estimated_usd=lambda: estimate_tts_cost(audio_script),
+                ):
+                    tts_result = openai.tts_mp3_response(
+                        settings.openai_tts_model,
+                        settings.openai_tts_voice,
+                        audio_script,
                     )
-                tts_result = openai.tts_mp3_response(
-                    settings.openai_tts_model,
-                    settings.openai_tts_voice,
-                    audio_script,
-                )
                 log_tts_cost(
                     supabase,
                     user_id,
@@ -728,16 +1115,24 @@ def run_hourly_job(
     now_utc = dt.datetime.now(dt.timezone.utc)
     summary_send_dedupe = RedisDedupe(getattr(settings, "redis_url", None))
 
-    # Assinantes ativos
-    subs = supabase.select(
-        "subscribers",
-        select="user_id,subscription_end,subscription_status,subscribed",
-        filters=[
-            ("subscribed", "eq.true"),
-            to_postgrest_filter_gte("subscription_end", _now_utc_iso()),
-        ],
-        limit=1000,
-    )
+    # Indice de vencimento: so toca quem esta devido agora (custo proporcional aos envios).
+    due_profiles = _load_due_profiles(supabase, now_utc=now_utc)
+    profiles_by_user: Optional[Dict[str, Dict[str, Any]]] = None
+    if due_profiles is not None:
+        profiles_by_user = {str(p["id"]): p for p in due_profiles}
+        subs = [{"user_id": user_id} for user_id in profiles_by_user]
+    else:
+        # Assinantes ativos (todas as paginas) e perfis em lote via in.(...)
+        subs = _select_all(
+            supabase,
+            "subscribers",
+            select="user_id,subscription_end,subscription_status,subscribed",
+            filters=[
+                ("subscribed", "eq.true"),
+                to_postgrest_filter_gte("subscription_end", _now_utc_iso()),
+            ],
+            order="id.asc",
+        )
 
     sent = 0
     skipped_hours = 0
@@ -751,41 +1146,52 @@ def run_hourly_job(
     skipped_locked_users = 0
     user_ids = _unique_active_user_ids(subs)
     deduplicated_rows = len(subs) - len(user_ids)
+    fallback_profiles: Dict[str, Dict[str, Any]] = {}
+    if profiles_by_user is None:
+        fallback_profiles = _load_profiles_by_ids(supabase, user_ids)
+    # Em lote so o que e idempotente (adiamentos de proximo_summi_em); perder o
+    # buffer so faz o usuario ser reavaliado na proxima rodada.
+    profile_updates = _PatchBuffer(supabase, "profiles", quiet=True)
+
+    def defer_due(user_id: str, profile: Dict[str, Any]) -> None:
+        # Pulado sem envio: o trigger so recalcula proximo_summi_em a partir de
+        # ultimo_summi_em, entao avancamos no indice aqui para o usuario nao voltar
+        # em toda rodada (nem ocupar a pagina de quem esta devido de verdade).
+        if profiles_by_user is not None:
+            profile_updates.add(user_id, {"proximo_summi_em": _summary_not_before(profile, now_utc=now_utc).isoformat()})
+
     for user_id in user_ids:
 
-        profiles = supabase.select("profiles", select="*", filters=[to_postgrest_filter_eq("id", user_id)], limit=1)
-        if not profiles:
+        profile = (profiles_by_user or fallback_profiles).get(user_id)
+        if profile is None:
             continue
-        profile = profiles[0]
 
         if not _within_business_hours(settings, profile, now_utc):
             skipped_hours += 1
+            if profiles_by_user is not None:
+                # Fora do horario comercial: adia no indice ate a proxima janela.
+                profile_updates.add(user_id, {"proximo_summi_em": _next_business_window_start(settings, now_utc).isoformat()})
             continue
 
         # Numero do usuario e usado tanto no onboarding quanto no envio regular.
         numero_usuario = _extract_phone_digits(profile.get("numero"))
         if not numero_usuario:
+            defer_due(user_id, profile)
             continue
 
         # Verificar se precisa de onboarding (primeiro envio)
         ultimo_summi = profile.get("ultimo_summi_em")
         onboarding_done = profile.get("onboarding_completed")
-        
+
         if not ultimo_summi and not onboarding_done:
             print(f"Sending onboarding to new user: {user_id}")
             send_onboarding_messages(evolution, settings.summi_sender_instance, numero_usuario, profile.get("nome", ""))
             # Marcar como enviado para evitar repetição (usando onboarding_completed já existente)
-            try:
-                supabase.patch(
-                    "profiles",
-                    data={"onboarding_completed": True},
-                    filters=[to_postgrest_filter_eq("id", user_id)],
-                )
-            except Exception:
-                pass
+            _mark_profile_sent(supabase, user_id, {"onboarding_completed": True})
 
         if not _summary_is_due(profile, now_utc=now_utc):
             skipped_hours += 1
+            defer_due(user_id, profile)
             continue
 
         lock_key = _hourly_summary_send_lock_key(user_id)
@@ -818,6 +1224,7 @@ def run_hourly_job(
             items = _build_summary_items(chats)
             if not items:
                 skipped_no_priority_items += 1
+                defer_due(user_id, profile)
                 continue
 
             # Identificar status de trial para rodapé
@@ -834,14 +1241,7 @@ def run_hourly_job(
             keep_lock = True
 
             # Atualizar timestamp do último envio
-            try:
-                supabase.patch(
-                    "profiles",
-                    data={"ultimo_summi_em": _now_utc_iso()},
-                    filters=[to_postgrest_filter_eq("id", user_id)],
-                )
-            except Exception:
-                pass  # Não aborta o fluxo por falha em timestamp
+            _mark_profile_sent(supabase, user_id, {"ultimo_summi_em": _now_utc_iso()})
 
             if _should_send_summi_audio(settings, profile):
                 try:
@@ -849,6 +1249,7 @@ def run_hourly_job(
                         openai,
                         get_summary_model(settings),
                         summary_text=summary_text,
+                        stream=bool(getattr(settings, "enable_llm_streaming", False)),
                     )
                     if script_usage is not None:
                         log_chat_cost(
@@ -858,12 +1259,20 @@ def run_hourly_job(
                             model=get_summary_model(settings),
                             input_tokens=script_usage.prompt_tokens,
                             output_tokens=script_usage.completion_tokens,
+                            cached_tokens=getattr(script_usage, "cached_tokens", 0),
+                        )
+                    with reserve_budget(
+                        settings,
+                        supabase,
+                        user_id=user_id,
+                        operation="tts",
+                        estimated_usd=lambda: estimate_tts_cost(audio_script),
+                    ):
+                        tts_result = openai.tts_mp3_response(
+                            settings.openai_tts_model,
+                            settings.openai_tts_voice,
+                            audio_script,
                         )
-                    tts_result = openai.tts_mp3_response(
-                        settings.openai_tts_model,
-                        settings.openai_tts_voice,
-                        audio_script,
-                    )
                     log_tts_cost(
                         supabase,
                         user_id,
@@ -886,9 +1295,12 @@ def run_hourly_job(
         finally:
             if not keep_lock:
                 summary_send_dedupe.release(lock_key)
+    # Fora de finally: uma excecao do loop nao e mascarada por falha no flush.
+    profile_updates.flush()
 
     return {
         "success": True,
+        "due_index": profiles_by_user is not None,
         "subscribers": len(subs),
         "unique_subscribers": len(user_ids),
         "deduplicated_subscriber_rows": deduplicated_rows,
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+    from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+except Exception:  # pragma: no cover
+    InvalidSignature = None  # type: ignore
+    hashes = None  # type: ignore
+    ec = None  # type: ignore
+    padding = None  # type: ignore
+    rsa = None  # type: ignore
+    encode_dss_signature = None  # type: ignore
+
+
+logger = logging.getLogger("summi_worker.supabase_auth")
+
+JWT_LEEWAY_SECONDS = 30
+JWKS_REFRESH_MIN_INTERVAL_SECONDS = 30
+TOKEN_CACHE_MAX_ENTRIES = 5000
+
+
+class SupabaseTokenError(RuntimeError):
+    pass
+
+
+def _b64url_decode(value: str) -> bytes:
+    padded = value + "=" * (-len(value) % 4)
+    return base64.urlsafe_b64decode(padded.encode("ascii"))
+
+
+def _b64url_int(value: str) -> int:
+    return int.from_bytes(_b64url_decode(value), "big")
+
+
+def _split_token(token: str) -> Tuple[Dict[str, Any], Dict[str, Any], bytes, bytes]:
+    parts = token.split(".")
+    if len(parts) != 3:
+        raise SupabaseTokenError("malformed token")
+    try:
+        header = json.loads(_b64url_decode(parts[0]))
+        claims = json.loads(_b64url_decode(parts[1]))
+        signature = _b64url_decode(parts[2])
+    except Exception as exc:
+        raise SupabaseTokenError(f"malformed token: {exc}") from exc
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise SupabaseTokenError("malformed token")
+    signing_input = f"{parts[0]}.{parts[1]}".encode("ascii")
+    return header, claims, signing_input, signature
+
+
+def _public_key_from_jwk(jwk: Dict[str, Any]) -> Any:
+    if ec is None or rsa is None:
+        return None
+    kty = jwk.get("kty")
+    try:
+        if kty == "EC" and jwk.get("crv") == "P-256":
+            numbers = ec.EllipticCurvePublicNumbers(_b64url_int(jwk["x"]), _b64url_int(jwk["y"]), ec.SECP256R1())
+            return numbers.public_key()
+        if kty == "RSA":
+            return rsa.RSAPublicNumbers(_b64url_int(jwk["e"]), _b64url_int(jwk["n"])).public_key()
+    except Exception as exc:
+        logger.warning("supabase_auth.jwk_invalid kid=%s error=%s", jwk.get("kid"), exc)
+    return None
+
+
+def _verify_asymmetric(alg: str, public_key: Any, signing_input: bytes, signature: bytes) -> bool:
+    try:
+        if alg == "ES256" and isinstance(public_key, ec.EllipticCurvePublicKey):
+            if len(signature) != 64:
+                return False
+            r = int.from_bytes(signature[:32], "big")
+            s = int.from_bytes(signature[32:], "big")
+            public_key.verify(encode_dss_signature(r, s), signing_input, ec.ECDSA(hashes.SHA256()))
+            return True
+        if alg == "RS256" and isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(signature, signing_input, padding.PKCS1v15(), hashes.SHA256())
+            return True
+    except InvalidSignature:
+        return False
+    return False
+
+
+class SupabaseJwtVerifier:
+    """
+    Valida JWTs do Supabase Auth localmente, sem round-trip para /auth/v1/user.
+
+    - HS256: usa o JWT secret do projeto (SUPABASE_JWT_SECRET).
+    - ES256/RS256: usa as chaves publicas do JWKS do projeto, com cache e
+      refetch quando aparece um `kid` desconhecido (rotacao de chaves).
+
+    `verify` retorna None quando nao ha como validar localmente (sem secret,
+    sem `cryptography`, JWKS indisponivel); o chamador decide o fallback.
+    """
+
+    def __init__(
+        self,
+        supabase_url: str,
+        *,
+        jwt_secret: Optional[str] = None,
+        jwks_ttl_seconds: int = 600,
+        http_get: Callable[..., Any] = requests.get,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._url = supabase_url.rstrip("/")
+        self._issuer = f"{self._url}/auth/v1"
+        self._secret = (jwt_secret or "").encode("utf-8")
+        self._jwks_ttl = max(30, int(jwks_ttl_seconds))
+        self._http_get = http_get
+        self._clock = clock
+        self._keys: Dict[str, Any] = {}
+        self._keys_fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def jwks_url(self) -> str:
+        return f"{self._issuer}/.well-known/jwks.json"
+
+    def _fetch_jwks(self) -> None:
+        now = self._clock()
+        if self._keys_fetched_at and now - self._keys_fetched_at < JWKS_REFRESH_MIN_INTERVAL_SECONDS:
+            return
+        self._keys_fetched_at = now
+        try:
+            resp = self._http_get(self.jwks_url, timeout=5)
+            if not resp.ok:
+                logger.warning("supabase_auth.jwks_fetch_failed status=%s", resp.status_code)
+                return
+            body = resp.json()
+        except Exception as exc:
+            logger.warning("supabase_auth.jwks_fetch_failed error=%s", exc)
+            return
+
+        raw_keys = body.get("keys") if isinstance(body, dict) else None
+        keys: Dict[str, Any] = {}
+        for jwk in raw_keys or []:
+            if not isinstance(jwk, dict) or not jwk.get("kid"):
+                continue
+            public_key = _public_key_from_jwk(jwk)
+            if public_key is not None:
+                keys[str(jwk["kid"])] = public_key
+        self._keys = keys
+        logger.info("supabase_auth.jwks_loaded keys=%s", len(keys))
+
+    def _public_key(self, kid: str) -> Any:
+        with self._lock:
+            expired = self._clock() - self._keys_fetched_at >= self._jwks_ttl
+            if expired or kid not in self._keys:
+                self._fetch_jwks()
+            return self._keys.get(kid)
+
+    def _check_claims(self, claims: Dict[str, Any]) -> Dict[str, Any]:
+        now = self._clock()
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)) or exp + JWT_LEEWAY_SECONDS < now:
+            raise SupabaseTokenError("token expired")
+        nbf = claims.get("nbf")
+        if isinstance(nbf, (int, float)) and nbf - JWT_LEEWAY_SECONDS > now:
+            raise SupabaseTokenError("token not yet valid")
+        iss = claims.get("iss")
+        if iss and str(iss).rstrip("/") != self._issuer:
+            raise SupabaseTokenError("unexpected issuer")
+        if claims.get("role") != "authenticated" or not claims.get("sub"):
+            raise SupabaseTokenError("not a user token")
+        return claims
+
+    def verify(self, token: str) -> Optional[Dict[str, Any]]:
+        header, claims, signing_input, signature = _split_token(token)
+        alg = str(header.get("alg") or "")
+
+        if alg == "HS256":
+            if not self._secret:
+                return None
+            expected = hmac.new(self._secret, signing_input, hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, signature):
+                raise SupabaseTokenError("invalid signature")
+            return self._check_claims(claims)
+
+        if alg in ("ES256", "RS256"):
+            if ec is None:
+                return None
+            kid = str(header.get("kid") or "")
+            public_key = self._public_key(kid) if kid else None
+            if public_key is None:
+                return None
+            if not _verify_asymmetric(alg, public_key, signing_input, signature):
+                raise SupabaseTokenError("invalid signature")
+            return self._check_claims(claims)
+
+        raise SupabaseTokenError(f"unsupported alg: {alg or 'none'}")
+
+
+class TokenUserCache:
+    """
+    Cache curto token -> user_id. A chave e o SHA-256 do token (nunca guardamos
+    o bearer em claro) e a validade nunca ultrapassa o `exp` do proprio JWT.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int,
+        *,
+        max_entries: int = TOKEN_CACHE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._ttl = max(0, int(ttl_seconds))
+        self._max_entries = max(1, int(max_entries))
+        self._clock = clock
+        self._items: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[str]:
+        if not self._ttl:
+            return None
+        key = self._key(token)
+        with self._lock:
+            item = self._items.get(key)
+            if not item:
+                return None
+            expires_at, user_id = item
+            if expires_at <= self._clock():
+                self._items.pop(key, None)
+                return None
+            return user_id
+
+    def put(self, token: str, user_id: str, *, token_exp: Optional[float] = None) -> None:
+        if not self._ttl:
+            return
+        now = self._clock()
+        expires_at = now + self._ttl
+        if isinstance(token_exp, (int, float)):
+            expires_at = min(expires_at, float(token_exp))
+        if expires_at <= now:
+            return
+        with self._lock:
+            if len(self._items) >= self._max_entries:
+                expired = [k for k, (exp, _) in self._items.items() if exp <= now]
+                for k in expired:
+                    self._items.pop(k, None)
+                if len(self._items) >= self._max_entries:
+                    self._items.pop(next(iter(self._items)))
+            self._items[self._key(token)] = (expires_at, user_id)
+
+
+_VERIFIERS: Dict[Tuple[str, str, int], SupabaseJwtVerifier] = {}
+_TOKEN_CACHES: Dict[int, TokenUserCache] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_jwt_verifier(settings: Any) -> SupabaseJwtVerifier:
+    # Settings sao recarregados a cada request; o verificador (e o cache de JWKS) e por processo.
+    key = (
+        str(settings.supabase_url),
+        str(getattr(settings, "supabase_jwt_secret", None) or ""),
+        int(getattr(settings, "supabase_jwks_cache_ttl_seconds", 600)),
+    )
+    with _REGISTRY_LOCK:
+        verifier = _VERIFIERS.get(key)
+        if verifier is None:
+            verifier = SupabaseJwtVerifier(key[0], jwt_secret=key[1] or None, jwks_ttl_seconds=key[2])
+            _VERIFIERS[key] = verifier
+        return verifier
+
+
+def get_token_cache(settings: Any) -> TokenUserCache:
+    ttl = int(getattr(settings, "auth_token_cache_ttl_seconds", 60))
+    with _REGISTRY_LOCK:
+        cache = _TOKEN_CACHES.get(ttl)
+        if cache is None:
+            cache = TokenUserCache(ttl)
+            _TOKEN_CACHES[ttl] = cache
+        return cache
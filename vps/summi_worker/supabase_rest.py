@@ -2,16 +2,40 @@ from __future__ import annotations
 
 import datetime as dt
 import json
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+import os
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 from urllib.parse import urlencode
 
 import requests
 
+from .json_codec import dumps_bytes, loads
+
+logger = logging.getLogger("summi_worker.supabase_rest")
+
 
 class SupabaseError(RuntimeError):
     pass
 
 
+@dataclass(frozen=True)
+class Projection:
+    """
+    Lista nomeada de colunas para um select. O nome identifica o ponto de chamada
+    nos logs (auditoria de tamanho e fallback quando uma coluna nao existe).
+    """
+
+    name: str
+    columns: Tuple[str, ...]
+
+    @property
+    def select(self) -> str:
+        # Colunas legadas com espaco/acento/"?" precisam de aspas no PostgREST.
+        return ",".join(col if col.replace("_", "").isalnum() and col.isascii() else f'"{col}"' for col in self.columns)
+
+
 def _iso_now() -> str:
     return dt.datetime.now(dt.timezone.utc).isoformat()
 
@@ -21,9 +45,12 @@ class SupabaseRest:
     Minimal Supabase PostgREST wrapper using service role to bypass RLS.
     """
 
-    def __init__(self, supabase_url: str, service_role_key: str):
+    def __init__(self, supabase_url: str, service_role_key: str, *, audit_response_sizes: bool = False):
         self._url = supabase_url.rstrip("/")
         self._key = service_role_key
+        # Modo dev: loga bytes/linhas de cada select por ponto de chamada.
+        self._audit_response_sizes = audit_response_sizes
+        self._audit_totals: Dict[str, List[int]] = {}
 
     def _headers(self) -> Dict[str, str]:
         return {
@@ -35,12 +62,59 @@ class SupabaseRest:
     def select(
         self,
         table: str,
-        select: str = "*",
+        select: Union[str, Projection] = "*",
         filters: Optional[List[Tuple[str, str]]] = None,
         order: Optional[str] = None,
         limit: Optional[int] = None,
     ) -> List[Dict[str, Any]]:
-        params: Dict[str, str] = {"select": select}
+        return self._select(table, select, filters, order, limit)
+
+    def select_all(
+        self,
+        table: str,
+        select: Union[str, Projection] = "*",
+        filters: Optional[List[Tuple[str, str]]] = None,
+        order: Optional[str] = None,
+        page_size: int = 1000,
+        max_rows: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Le todas as linhas em paginas (header Range), sem o corte silencioso do
+        max-rows do PostgREST. Passe `order` com chave unica para paginas estaveis.
+        So para numa pagina vazia (ou 416): com max-rows abaixo de `page_size` o
+        servidor devolve paginas menores que o pedido, e isso nao e o fim.
+        """
+        page_size = max(1, int(page_size))
+        rows: List[Dict[str, Any]] = []
+        while max_rows is None or len(rows) < max_rows:
+            start = len(rows)
+            end = start + page_size - 1
+            if max_rows is not None:
+                end = min(end, max_rows - 1)
+            page = self._select(
+                table,
+                select,
+                filters,
+                order,
+                None,
+                extra_headers={"Range-Unit": "items", "Range": f"{start}-{end}"},
+            )
+            if not page:
+                break
+            rows.extend(page)
+        return rows
+
+    def _select(
+        self,
+        table: str,
+        select: Union[str, Projection],
+        filters: Optional[List[Tuple[str, str]]],
+        order: Optional[str],
+        limit: Optional[int],
+        *,
+        extra_headers: Optional[Dict[str, str]] = None,
+    ) -> List[Dict[str, Any]]:
+        params: Dict[str, str] = {"select": select.select if isinstance(select, Projection) else select}
         if order:
             params["order"] = order
         if limit is not None:
@@ -50,11 +124,44 @@ class SupabaseRest:
             for k, v in filters:
                 params[k] = v
 
+        headers = {**self._headers(), **(extra_headers or {})}
         url = f"{self._url}/rest/v1/{table}?{urlencode(params, doseq=True)}"
-        resp = requests.get(url, headers=self._headers(), timeout=30)
+        resp = requests.get(url, headers=headers, timeout=30)
+        if not resp.ok and isinstance(select, Projection) and _is_undefined_column(resp):
+            # Schema atras da projecao (coluna ainda nao criada): nao derruba o fluxo.
+            logger.warning("supabase.projection_fallback table=%s projection=%s error=%s", table, select.name, resp.text[:200])
+            params["select"] = "*"
+            url = f"{self._url}/rest/v1/{table}?{urlencode(params, doseq=True)}"
+            resp = requests.get(url, headers=headers, timeout=30)
         if not resp.ok:
+            # 416 = Range alem do fim (pagina vazia exata).
+            if extra_headers and resp.status_code == 416:
+                return []
             raise SupabaseError(f"select failed: {resp.status_code} {resp.text}")
-        return resp.json()
+        rows = loads(resp.content)
+        if self._audit_response_sizes:
+            self._audit_select(table, select, resp, rows)
+        return rows
+
+    def _audit_select(self, table: str, select: Union[str, Projection], resp: Any, rows: Any) -> None:
+        if isinstance(select, Projection):
+            site = select.name
+        else:
+            caller = sys._getframe(3)
+            site = f"{os.path.basename(caller.f_code.co_filename)}:{caller.f_lineno}"
+        size = len(getattr(resp, "content", b"") or b"")
+        totals = self._audit_totals.setdefault(site, [0, 0])
+        totals[0] += 1
+        totals[1] += size
+        logger.info(
+            "supabase.response_size table=%s site=%s bytes=%s rows=%s calls_total=%s bytes_total=%s",
+            table,
+            site,
+            size,
+            len(rows) if isinstance(rows, list) else 1,
+            totals[0],
+            totals[1],
+        )
 
     def patch(
         self,
@@ -70,7 +177,7 @@ class SupabaseRest:
         resp = requests.patch(
             url,
             headers={**self._headers(), "Prefer": "return=minimal"},
-            data=json.dumps(data),
+            data=dumps_bytes(data),
             timeout=30,
         )
         if not resp.ok:
@@ -83,12 +190,12 @@ class SupabaseRest:
         resp = requests.post(
             url,
             headers={**self._headers(), "Prefer": "return=representation"},
-            data=json.dumps(rows),
+            data=dumps_bytes(rows),
             timeout=30,
         )
         if not resp.ok:
             raise SupabaseError(f"insert failed: {resp.status_code} {resp.text}")
-        return resp.json()
+        return loads(resp.content)
 
     def delete(
         self,
@@ -114,34 +221,106 @@ class SupabaseRest:
         table: str,
         rows: List[Dict[str, Any]],
         on_conflict: str,
+        *,
+        chunk_size: int = 500,
     ) -> None:
         url = f"{self._url}/rest/v1/{table}?{urlencode({'on_conflict': on_conflict})}"
-        resp = requests.post(
-            url,
-            headers={**self._headers(), "Prefer": "resolution=merge-duplicates,return=minimal"},
-            data=json.dumps(rows),
-            timeout=30,
-        )
-        if not resp.ok:
-            raise SupabaseError(f"upsert failed: {resp.status_code} {resp.text}")
+        for chunk in _chunks(rows, chunk_size):
+            resp = requests.post(
+                url,
+                headers={**self._headers(), "Prefer": "resolution=merge-duplicates,return=minimal"},
+                data=dumps_bytes(chunk),
+                timeout=30,
+            )
+            if not resp.ok:
+                raise SupabaseError(f"upsert failed: {resp.status_code} {resp.text}")
+
+    def patch_many(
+        self,
+        table: str,
+        rows: List[Dict[str, Any]],
+        *,
+        key: str = "id",
+        chunk_size: int = 500,
+    ) -> int:
+        """
+        PATCH de varias linhas (cada uma com seus valores) via RPC batch_patch:
+        uma chamada por grupo de linhas com as mesmas colunas. So sem a RPC
+        (is_missing_function) cai no PATCH linha a linha; outros erros propagam.
+        """
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for row in rows:
+            if row.get(key) is None:
+                continue
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        updated = 0
+        for group in groups.values():
+            for chunk in _chunks(group, chunk_size):
+                try:
+                    result = self.rpc("batch_patch", {"p_table": table, "p_key": key, "p_rows": chunk})
+                except SupabaseError as exc:
+                    if not is_missing_function(exc):
+                        raise
+                    logger.warning("supabase.batch_patch_unavailable table=%s rows=%s error=%s", table, len(chunk), str(exc)[:200])
+                    for row in chunk:
+                        data = {col: value for col, value in row.items() if col != key}
+                        self.patch(table, data, filters=[to_postgrest_filter_eq(key, str(row[key]))])
+                    updated += len(chunk)
+                    continue
+                updated += int(result) if isinstance(result, int) else len(chunk)
+        return updated
 
     def rpc(self, fn: str, payload: Dict[str, Any]) -> Any:
         url = f"{self._url}/rest/v1/rpc/{fn}"
-        resp = requests.post(url, headers=self._headers(), data=json.dumps(payload), timeout=30)
+        resp = requests.post(url, headers=self._headers(), data=dumps_bytes(payload), timeout=30)
         if not resp.ok:
             raise SupabaseError(f"rpc failed: {resp.status_code} {resp.text}")
-        if not resp.text.strip():
+        if not resp.content.strip():
             return None
         try:
-            return resp.json()
+            return loads(resp.content)
         except ValueError:
             return resp.text
 
 
+def _chunks(rows: List[Dict[str, Any]], size: int) -> Iterable[List[Dict[str, Any]]]:
+    size = max(1, int(size))
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
+
+
+def is_missing_function(exc: BaseException) -> bool:
+    """
+    RPC inexistente (migration ainda nao aplicada): PGRST202 ou 404 no /rpc. So
+    nesse caso e seguro cair para o caminho antigo; 5xx/timeout podem ter
+    chegado a commitar no banco.
+    """
+    text = str(exc)
+    return "PGRST202" in text or text.startswith("rpc failed: 404")
+
+
+def _is_undefined_column(resp: Any) -> bool:
+    # 42703 = undefined_column (Postgres); PGRST204 = coluna fora do cache de schema do PostgREST.
+    text = str(getattr(resp, "text", "") or "")
+    return getattr(resp, "status_code", 0) == 400 and ("42703" in text or "does not exist" in text or "PGRST204" in text)
+
+
 def to_postgrest_filter_eq(column: str, value: str) -> Tuple[str, str]:
     return (column, f"eq.{value}")
 
 
+def to_postgrest_filter_in(column: str, values: Iterable[Any]) -> Tuple[str, str]:
+    # in.(a,b,"c,d"): valores com virgula, parenteses, aspas ou espaco vao entre aspas.
+    items = []
+    for value in values:
+        text = str(value)
+        if any(ch in text for ch in ',()" \\'):
+            text = '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        items.append(text)
+    return (column, f"in.({','.join(items)})")
+
+
 def to_postgrest_filter_neq(column: str, value: str) -> Tuple[str, str]:
     return (column, f"neq.{value}")
 
@@ -161,3 +340,8 @@ def to_postgrest_filter_lt(column: str, value: str) -> Tuple[str, str]:
 def to_postgrest_filter_is(column: str, value: str) -> Tuple[str, str]:
     # example: is.null
     return (column, f"is.{value}")
+
+
+def to_postgrest_filter_contains(column: str, value: Any) -> Tuple[str, str]:
+    # JSONB @> no servidor, ex.: conversa contem [{"message_id": "X"}]
+    return (column, f"cs.{json.dumps(value, ensure_ascii=False, separators=(',', ':'))}")
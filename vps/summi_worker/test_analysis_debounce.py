@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker import analysis_debounce
+from summi_worker.analysis_debounce import CLAIMED_KEY, PENDING_KEY, AnalysisDebouncer
+
+
+class _PipelineFake:
+    def __init__(self, redis_fake: "_RedisFake") -> None:
+        self._redis = redis_fake
+
+    def __getattr__(self, name):
+        return getattr(self._redis, name)
+
+    def execute(self) -> None:
+        return None
+
+
+class _RedisFake:
+    """Simula os scripts Lua do debounce sobre dicts em memoria."""
+
+    def __init__(self) -> None:
+        self.values: dict[str, str] = {}
+        self.zsets: dict[str, dict[str, float]] = {PENDING_KEY: {}, CLAIMED_KEY: {}}
+
+    def register_script(self, script: str):
+        if script == analysis_debounce._CLAIM_SCRIPT:
+            return self._claim
+        return self._schedule
+
+    def _schedule(self, keys, args):
+        member, now, settle = args[0], float(args[1]), float(args[2])
+        self.zsets[keys[0]][member] = now + settle
+        return str(now + settle)
+
+    def _claim(self, keys, args):
+        now, limit, lease = float(args[0]), int(args[1]), float(args[2])
+        pending, claimed = self.zsets[keys[0]], self.zsets[keys[1]]
+        for member, expires in list(claimed.items()):
+            if expires <= now:
+                claimed.pop(member)
+                pending.setdefault(member, now)
+        due = sorted((score, member) for member, score in pending.items() if score <= now)[:limit]
+        for _, member in due:
+            pending.pop(member)
+            claimed[member] = now + lease
+        return [member for _, member in due]
+
+    def pipeline(self, transaction: bool = True) -> _PipelineFake:
+        return _PipelineFake(self)
+
+    def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+    def set(self, key: str, value, ex=None) -> None:
+        self.values[key] = str(value)
+
+    def zrem(self, key: str, *members: str) -> None:
+        for member in members:
+            self.zsets[key].pop(member, None)
+
+    def zadd(self, key: str, mapping: dict, nx: bool = False) -> None:
+        for member, score in mapping.items():
+            if nx and member in self.zsets[key]:
+                continue
+            self.zsets[key][member] = score
+
+
+class AnalysisDebouncerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = {"now": 1000.0}
+        self.redis = _RedisFake()
+        self.debouncer = AnalysisDebouncer(
+            self.redis,
+            settle_seconds=45,
+            max_wait_seconds=300,
+            min_interval_seconds=0,
+            lease_seconds=120,
+            clock=lambda: self.clock["now"],
+        )
+
+    def test_failed_analysis_is_released_back_to_pending(self) -> None:
+        self.debouncer.schedule(user_id="u1", remote_jid="5511")
+        self.clock["now"] += 50
+
+        self.assertEqual(self.debouncer.claim_due(), {"u1": ["5511"]})
+        self.assertEqual(self.redis.zsets[PENDING_KEY], {})
+
+        self.debouncer.release(user_id="u1", remote_jids=["5511"], retry_seconds=30)
+        self.assertEqual(self.redis.zsets[CLAIMED_KEY], {})
+        self.assertEqual(self.debouncer.claim_due(), {})
+
+        self.clock["now"] += 30
+        self.assertEqual(self.debouncer.claim_due(), {"u1": ["5511"]})
+        self.debouncer.ack(user_id="u1", remote_jids=["5511"])
+        self.assertEqual(self.redis.zsets[CLAIMED_KEY], {})
+        self.assertEqual(self.redis.zsets[PENDING_KEY], {})
+
+    def test_claim_of_crashed_worker_returns_after_lease(self) -> None:
+        self.debouncer.schedule(user_id="u1", remote_jid="5511")
+        self.clock["now"] += 50
+        self.assertEqual(self.debouncer.claim_due(), {"u1": ["5511"]})
+
+        self.clock["now"] += 60
+        self.assertEqual(self.debouncer.claim_due(), {})
+        self.clock["now"] += 61
+        self.assertEqual(self.debouncer.claim_due(), {"u1": ["5511"]})
+
+    def test_drain_acks_successes_and_releases_failures(self) -> None:
+        from summi_worker import queue_worker
+
+        for user_id in ("ok", "boom"):
+            self.debouncer.schedule(user_id=user_id, remote_jid="5511")
+        self.clock["now"] += 50
+
+        def _analyze(settings, supabase, openai, *, user_id, remote_jids):
+            if user_id == "boom":
+                raise RuntimeError("llm timeout")
+            return {"success": True, "analyzed_count": len(remote_jids)}
+
+        with patch.object(queue_worker, "analyze_user_chats", _analyze):
+            drained = queue_worker._drain_debounced_analysis(SimpleNamespace(), object(), object(), self.debouncer)
+
+        self.assertEqual(drained, 2)
+        self.assertEqual(self.redis.zsets[CLAIMED_KEY], {})
+        self.assertEqual(list(self.redis.zsets[PENDING_KEY]), ["boom|5511"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import json
 import sys
 import unittest
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import patch
 
 
@@ -10,8 +14,12 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from summi_worker.app import _dispatch_analysis, _should_skip_transcription
+from starlette.requests import Request
+
+from summi_worker import app as app_module
+from summi_worker.app import _dispatch_analysis, _should_skip_transcription, _upsert_chat_message
 from summi_worker.config import Settings
+from summi_worker.supabase_rest import SupabaseError
 
 
 class _FakeBackgroundTasks:
@@ -30,6 +38,28 @@ class _FakeQueue:
         self.calls.append((queue_name, payload))
 
 
+class _FakeDedupingQueue(_FakeQueue):
+    def __init__(self) -> None:
+        super().__init__()
+        self.marked: set[str] = set()
+
+    def enqueue_once(self, dedupe_key: str, ttl_seconds: int, queue_name: str, payload: dict[str, object]) -> bool:
+        if dedupe_key in self.marked:
+            return False
+        self.marked.add(dedupe_key)
+        self.calls.append((queue_name, payload))
+        return True
+
+
+class _FakeDebouncer:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, str]] = []
+
+    def schedule(self, *, user_id: str, remote_jid: str) -> float:
+        self.calls.append((user_id, remote_jid))
+        return 0.0
+
+
 def _settings(*, enable_analysis_queue: bool = False) -> Settings:
     return Settings(
         supabase_url="https://supabase.example.com",
@@ -170,6 +200,55 @@ class DispatchAnalysisTest(unittest.TestCase):
         self.assertEqual(background_tasks.calls, [])
         analyze_user_chats.assert_not_called()
 
+    def test_dispatch_analysis_enqueues_one_job_per_chat_burst(self) -> None:
+        fake_queue = _FakeDedupingQueue()
+
+        with patch("summi_worker.app._redis_queue", return_value=fake_queue), patch(
+            "summi_worker.app.analyze_user_chats"
+        ) as analyze_user_chats:
+            for message_id in ("A1", "A2"):
+                _, analysis_enqueued, _, analyze_error = _dispatch_analysis(
+                    settings=_settings(enable_analysis_queue=True),
+                    user_id="user-1",
+                    instance_name="lucasborges_5286",
+                    remote_jid="551199999999",
+                    message_id=message_id,
+                    supabase=object(),
+                    openai=object(),
+                    background_tasks=None,
+                )
+                self.assertTrue(analysis_enqueued)
+                self.assertIsNone(analyze_error)
+
+        self.assertEqual([payload["message_id"] for _, payload in fake_queue.calls], ["A1"])
+        analyze_user_chats.assert_not_called()
+
+    def test_dispatch_analysis_coalesces_bursts_through_debouncer(self) -> None:
+        fake_queue = _FakeQueue()
+        debouncer = _FakeDebouncer()
+
+        with patch("summi_worker.app._redis_queue", return_value=fake_queue), patch(
+            "summi_worker.app._analysis_debouncer", return_value=debouncer
+        ), patch("summi_worker.app.analyze_user_chats") as analyze_user_chats:
+            for message_id in ("A1", "A2", "A3"):
+                _, analysis_enqueued, analysis_deferred, analyze_error = _dispatch_analysis(
+                    settings=_settings(enable_analysis_queue=True),
+                    user_id="user-1",
+                    instance_name="lucasborges_5286",
+                    remote_jid="551199999999",
+                    message_id=message_id,
+                    supabase=object(),
+                    openai=object(),
+                    background_tasks=None,
+                )
+                self.assertTrue(analysis_enqueued)
+                self.assertFalse(analysis_deferred)
+                self.assertIsNone(analyze_error)
+
+        self.assertEqual(debouncer.calls, [("user-1", "551199999999")] * 3)
+        self.assertEqual(fake_queue.calls, [])
+        analyze_user_chats.assert_not_called()
+
 
 class ShouldSkipTranscriptionTest(unittest.TestCase):
     """Testa a lógica de pular re-transcrição de áudios já processados."""
@@ -235,5 +314,163 @@ class ShouldSkipTranscriptionTest(unittest.TestCase):
         self.assertFalse(_should_skip_transcription(conversa, "DEF456"))
 
 
+class _ChatStoreFake:
+    def __init__(self, rpc_result=None, rpc_error: Exception | None = None) -> None:
+        self.rpc_result = rpc_result
+        self.rpc_error = rpc_error
+        self.calls = []
+
+    def rpc(self, fn, payload):
+        self.calls.append(("rpc", fn, payload))
+        if self.rpc_error is not None:
+            raise self.rpc_error
+        return self.rpc_result
+
+    def select(self, table, **kwargs):
+        self.calls.append(("select", table))
+        return []
+
+    def insert(self, table, rows):
+        self.calls.append(("insert", table, rows))
+        return [{"id": "chat-fallback"}]
+
+
+class UpsertChatMessageTest(unittest.TestCase):
+    def _upsert(self, supabase) -> str:
+        return _upsert_chat_message(
+            supabase,
+            user_id="user-1",
+            remote_jid="120363000000000000",
+            display_name="Grupo",
+            is_group=True,
+            author_name="Ana",
+            normalized_event={"message_id": "M1"},
+            message_text_for_chat="oi",
+        )
+
+    def test_append_rpc_is_a_single_round_trip(self) -> None:
+        supabase = _ChatStoreFake(rpc_result="chat-1")
+
+        self.assertEqual(self._upsert(supabase), "chat-1")
+        self.assertEqual(len(supabase.calls), 1)
+        _, fn, payload = supabase.calls[0]
+        self.assertEqual(fn, "append_chat_event")
+        self.assertEqual(payload["p_event"], {"message_id": "M1", "text": "oi"})
+        self.assertEqual(payload["p_grupo"], "120363000000000000@g.us")
+        self.assertEqual(payload["p_legacy_line"], "- Ana: oi")
+
+    def test_missing_rpc_falls_back_to_select_and_insert(self) -> None:
+        supabase = _ChatStoreFake(rpc_error=SupabaseError("rpc failed: 404"))
+
+        self.assertEqual(self._upsert(supabase), "chat-fallback")
+        self.assertEqual([call[0] for call in supabase.calls], ["rpc", "select", "insert"])
+
+    def test_rpc_server_error_is_raised_without_fallback(self) -> None:
+        supabase = _ChatStoreFake(rpc_error=SupabaseError("rpc failed: 503 upstream timeout"))
+
+        with self.assertRaises(SupabaseError):
+            self._upsert(supabase)
+        self.assertEqual([call[0] for call in supabase.calls], ["rpc"])
+
+
+def _webhook_request(payload: dict[str, object]) -> Request:
+    messages = [{"type": "http.request", "body": json.dumps(payload).encode("utf-8"), "more_body": False}]
+
+    async def receive() -> dict[str, object]:
+        return messages.pop(0)
+
+    scope = {"type": "http", "method": "POST", "path": "/webhooks/evolution", "headers": [], "query_string": b""}
+    return Request(scope, receive)
+
+
+class _WebhookSupabaseFake:
+    def __init__(self, chats: list[dict[str, object]]) -> None:
+        self.chats = chats
+        self.selects: list[tuple[str, object]] = []
+
+    def select(self, table, **kwargs):
+        self.selects.append((table, kwargs.get("select")))
+        if table == "profiles":
+            return [{"id": "user-1", "numero": "5511999999999", "resume_audio": False, "send_on_reaction": False}]
+        if table == "chats":
+            return self.chats
+        return []
+
+    def rpc(self, fn, payload):
+        return None
+
+
+class _WebhookEvolutionFake:
+    def find_message_status(self, instance_name, message_id, remote_jid):
+        return None
+
+    def get_media_base64(self, instance_name, message_id):
+        raise AssertionError("media inline nao deveria ser buscada")
+
+
+class AudioReplayWebhookTest(unittest.TestCase):
+    def _audio_payload(self) -> dict[str, object]:
+        return {
+            "event": "messages.upsert",
+            "instance": "lucasborges_5286",
+            "data": {
+                "key": {"remoteJid": "556299999999@s.whatsapp.net", "fromMe": False, "id": "AUD1"},
+                "pushName": "Contato",
+                "message": {"audioMessage": {"seconds": 12}, "base64": base64.b64encode(b"OggS" + b"0" * 64).decode("ascii")},
+                "messageType": "audioMessage",
+            },
+        }
+
+    def test_replayed_audio_reuses_existing_transcription(self) -> None:
+        supabase = _WebhookSupabaseFake(
+            [
+                {
+                    "id": "chat-1",
+                    "conversa": [
+                        {"message_id": "OTHER", "text": "x"},
+                        {
+                            "message_id": "AUD1",
+                            "text": "pode confirmar o pedido",
+                            "audio_transcribed": True,
+                            "audio_transcription_model": "gpt-4o-mini-transcribe",
+                        },
+                    ],
+                }
+            ]
+        )
+        stored: list[dict[str, object]] = []
+        sent: list[str] = []
+
+        def fake_upsert(_supabase, **kwargs):
+            stored.append(kwargs)
+            return "chat-1"
+
+        def fake_send(**kwargs):
+            sent.append(kwargs["text"])
+            return {"sent": True}
+
+        with patch.object(app_module, "_settings", return_value=_settings()), patch.object(
+            app_module, "_supabase", return_value=supabase
+        ), patch.object(app_module, "_openai", return_value=object()), patch.object(
+            app_module, "_evolution", return_value=_WebhookEvolutionFake()
+        ), patch.object(
+            app_module, "_redis_dedupe", return_value=SimpleNamespace(enabled=False)
+        ), patch.object(
+            app_module, "get_user_budget_state", side_effect=RuntimeError("sem budget")
+        ), patch.object(
+            app_module, "_transcribe_audio_with_fallback", side_effect=AssertionError("nao deveria transcrever")
+        ), patch.object(app_module, "_upsert_chat_message", side_effect=fake_upsert), patch.object(
+            app_module, "_send_aux_message", side_effect=fake_send
+        ):
+            result = asyncio.run(app_module._handle_evolution_webhook(_webhook_request(self._audio_payload())))
+
+        self.assertTrue(result["audio_transcription_skipped"])
+        self.assertEqual(result["audio_transcription_skip_reason"], "already_transcribed")
+        self.assertEqual(result["audio_transcription_model"], "gpt-4o-mini-transcribe")
+        self.assertEqual(sent, ["pode confirmar o pedido"])
+        self.assertEqual(stored[0]["message_text_for_chat"], "pode confirmar o pedido")
+        self.assertIn(("chats", app_module.CHAT_AUDIO_REPLAY), supabase.selects)
+
+
 if __name__ == "__main__":
     unittest.main()
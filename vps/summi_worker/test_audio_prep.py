@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import sys
+import types
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+if "mutagen" not in sys.modules:
+    mutagen_stub = types.ModuleType("mutagen")
+    mutagen_stub.File = lambda *args, **kwargs: None
+    sys.modules["mutagen"] = mutagen_stub
+
+from summi_worker.audio_prep import build_ffmpeg_args, normalize_audio, prepare_audio_from_settings
+
+
+ORIGINAL = b"ID3" + b"\x00" * 4000
+NORMALIZED = b"OggS" + b"\x01" * 900
+
+
+def _fake_ffmpeg(output: bytes):
+    calls = []
+
+    def _run(args):
+        calls.append(args)
+        with open(args[-1], "wb") as fh:
+            fh.write(output)
+
+    return calls, _run
+
+
+def _fake_probe(audio_bytes: bytes):
+    return 42.0 if audio_bytes.startswith(b"ID3") else 35.5
+
+
+class AudioPrepTest(unittest.TestCase):
+    def test_normalized_audio_reports_duration_before_and_after(self) -> None:
+        calls, run = _fake_ffmpeg(NORMALIZED)
+        with patch.dict(
+            normalize_audio.__globals__,
+            {"_ffmpeg_binary": lambda: "/usr/bin/ffmpeg", "_run_ffmpeg": run, "_probe_audio_duration_seconds": _fake_probe},
+        ):
+            prepared = normalize_audio(ORIGINAL)
+
+        self.assertTrue(prepared.normalized)
+        self.assertEqual(prepared.data, NORMALIZED)
+        self.assertEqual(prepared.filename, "audio.ogg")
+        self.assertEqual(
+            prepared.metadata(),
+            {
+                "audio_prep_original_bytes": len(ORIGINAL),
+                "audio_prep_bytes": len(NORMALIZED),
+                "audio_prep_original_seconds": 42.0,
+                "audio_prep_seconds": 35.5,
+            },
+        )
+        self.assertTrue(calls[0][calls[0].index("-i") + 1].endswith("in-audio.mp3"))
+
+    def test_larger_output_without_trim_keeps_original(self) -> None:
+        _, run = _fake_ffmpeg(b"OggS" + b"\x01" * 8000)
+        with patch.dict(
+            normalize_audio.__globals__,
+            {"_ffmpeg_binary": lambda: "/usr/bin/ffmpeg", "_run_ffmpeg": run, "_probe_audio_duration_seconds": lambda _b: 42.0},
+        ):
+            prepared = normalize_audio(ORIGINAL)
+
+        self.assertFalse(prepared.normalized)
+        self.assertEqual(prepared.data, ORIGINAL)
+        self.assertEqual(prepared.metadata(), {})
+
+    def test_missing_ffmpeg_or_disabled_setting_is_passthrough(self) -> None:
+        with patch.dict(normalize_audio.__globals__, {"_ffmpeg_binary": lambda: None}):
+            no_ffmpeg = normalize_audio(ORIGINAL)
+        disabled = prepare_audio_from_settings(SimpleNamespace(enable_audio_prep=False), ORIGINAL)
+
+        for prepared in (no_ffmpeg, disabled):
+            self.assertFalse(prepared.normalized)
+            self.assertEqual(prepared.data, ORIGINAL)
+
+    def test_ffmpeg_args_downmix_resample_and_trim_both_ends(self) -> None:
+        args = build_ffmpeg_args("ffmpeg", "in.m4a", "out.mp3", codec="mp3")
+
+        self.assertEqual(args[args.index("-ac") + 1], "1")
+        self.assertEqual(args[args.index("-ar") + 1], "16000")
+        self.assertEqual(args[args.index("-b:a") + 1], "32k")
+        self.assertEqual(args[args.index("-af") + 1].count("silenceremove"), 2)
+        self.assertEqual(args[-1], "out.mp3")
+
+
+if __name__ == "__main__":
+    unittest.main()
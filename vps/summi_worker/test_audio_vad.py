@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import math
+import sys
+import types
+import unittest
+import wave
+from array import array
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+if "mutagen" not in sys.modules:
+    mutagen_stub = types.ModuleType("mutagen")
+    mutagen_stub.File = lambda *args, **kwargs: None
+    sys.modules["mutagen"] = mutagen_stub
+
+from summi_worker.audio_prep import prepare_audio_from_settings
+from summi_worker.audio_vad import detect_speech_segments, map_to_source, trim_silences
+
+
+RATE = 8000
+
+
+def _tone(seconds: float) -> array:
+    return array("h", (int(8000 * math.sin(2 * math.pi * 220 * i / RATE)) for i in range(int(seconds * RATE))))
+
+
+def _silence(seconds: float, noise: int = 40) -> array:
+    return array("h", ((noise if i % 2 else -noise) for i in range(int(seconds * RATE))))
+
+
+def _voice_note() -> array:
+    # 1s silencio, 1s fala, pausa curta 0.3s, 1s fala, pausa longa 4s, 1s fala, 2s silencio
+    return _silence(1) + _tone(1) + _silence(0.3) + _tone(1) + _silence(4) + _tone(1) + _silence(2)
+
+
+def _wav_bytes(samples: array) -> bytes:
+    out = BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes(samples.tobytes())
+    return out.getvalue()
+
+
+class AudioVadTest(unittest.TestCase):
+    def test_long_pauses_are_cut_and_short_pauses_kept(self) -> None:
+        segments = detect_speech_segments(_voice_note(), RATE, min_silence_seconds=0.8, pad_seconds=0.2)
+
+        self.assertEqual(len(segments), 2)
+        self.assertAlmostEqual(segments[0][0], 0.8, delta=0.05)
+        self.assertAlmostEqual(segments[0][1], 3.5, delta=0.05)
+        self.assertAlmostEqual(segments[1][0], 7.1, delta=0.05)
+
+    def test_timestamp_map_points_back_to_original_audio(self) -> None:
+        result = trim_silences(_voice_note(), RATE, min_silence_seconds=0.8, pad_seconds=0.2)
+
+        self.assertAlmostEqual(result.original_seconds, 10.3, delta=0.01)
+        self.assertAlmostEqual(result.seconds, 4.1, delta=0.1)
+        self.assertGreater(result.seconds_saved, 6.0)
+        second = result.segments[1]
+        self.assertAlmostEqual(map_to_source(result.segments, second.output_start + 0.5), second.source_start + 0.5, places=6)
+        self.assertAlmostEqual(map_to_source(result.segments, 0.1), result.segments[0].source_start + 0.1, places=6)
+
+    def test_audio_without_speech_is_left_alone(self) -> None:
+        self.assertIsNone(trim_silences(_silence(3), RATE))
+
+    def test_wav_voice_note_reports_saved_seconds_without_ffmpeg(self) -> None:
+        raw = _wav_bytes(_voice_note())
+        settings = SimpleNamespace(enable_audio_vad=True, enable_audio_prep=False)
+
+        with patch.dict(prepare_audio_from_settings.__globals__, {"_ffmpeg_binary": lambda: None}):
+            prepared = prepare_audio_from_settings(settings, raw, filename="audio.wav")
+
+        meta = prepared.metadata()
+        self.assertEqual(prepared.filename, "audio.wav")
+        self.assertLess(len(prepared.data), len(raw) // 2)
+        self.assertGreater(meta["audio_vad_seconds_saved"], 6.0)
+        self.assertEqual(len(meta["audio_vad_segments"]), 2)
+        self.assertEqual(meta["audio_vad_segments"][0][0], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import datetime as dt
+import sys
+import types
+import unittest
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+if "mutagen" not in sys.modules:
+    mutagen_stub = types.ModuleType("mutagen")
+    mutagen_stub.File = lambda *args, **kwargs: None
+    sys.modules["mutagen"] = mutagen_stub
+
+from summi_worker.budget_gate import (
+    BudgetExceededError,
+    BudgetRun,
+    estimate_transcription_cost,
+    reserve_budget,
+)
+
+
+NOW = dt.datetime(2099, 3, 5, tzinfo=dt.timezone.utc)
+
+
+class _SupabaseFake:
+    def __init__(self, spent_usd: float) -> None:
+        self.spent_usd = spent_usd
+        self.selects: list[str] = []
+
+    def select(self, table, select="*", filters=None, order=None, limit=None):
+        self.selects.append(table)
+        if table == "subscribers":
+            return [{"subscription_status": "active", "trial_ends_at": None, "subscribed": True}]
+        if table == "user_costs":
+            return [{"cost_openai_usd": self.spent_usd, "date": "2099-03-01"}]
+        raise AssertionError(f"Unexpected table {table}")
+
+
+def _settings(**overrides: object) -> SimpleNamespace:
+    values = {
+        "enforce_budget_hard_cap": True,
+        "usd_brl_exchange_rate": 5.0,
+        "paid_ai_soft_cap_brl": 4.0,
+        "paid_ai_hard_cap_brl": 5.0,
+        "trial_ai_soft_cap_brl": 1.0,
+        "trial_ai_hard_cap_brl": 1.5,
+    }
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+class BudgetGateTest(unittest.TestCase):
+    def test_reservations_count_against_hard_cap_until_settled(self) -> None:
+        settings = _settings()
+        supabase = _SupabaseFake(spent_usd=0.90)  # hard cap = 5 BRL / 5.0 = 1.00 USD
+
+        first = reserve_budget(settings, supabase, user_id="gate-1", operation="analyze", estimated_usd=Decimal("0.06"), now_utc=NOW)
+        with self.assertRaises(BudgetExceededError) as ctx:
+            reserve_budget(settings, supabase, user_id="gate-1", operation="analyze", estimated_usd=Decimal("0.06"), now_utc=NOW)
+        self.assertIn("budget_hard_cap_reached:paid", str(ctx.exception))
+
+        first.settle()
+        with reserve_budget(settings, supabase, user_id="gate-1", operation="analyze", estimated_usd=Decimal("0.06"), now_utc=NOW):
+            pass
+
+    def test_budget_run_reads_state_once_and_reserves_in_memory(self) -> None:
+        settings = _settings()
+        supabase = _SupabaseFake(spent_usd=0.80)  # hard cap = 1.00 USD
+        run = BudgetRun(settings, supabase, user_id="gate-3", now_utc=NOW)
+
+        for _ in range(3):
+            with run.reserve(operation="analyze", estimated_usd=Decimal("0.06")):
+                pass
+        with self.assertRaises(BudgetExceededError):
+            run.reserve(operation="analyze", estimated_usd=Decimal("0.06"))
+
+        self.assertEqual(supabase.selects, ["subscribers", "user_costs"])
+
+    def test_disabled_gate_never_estimates_or_blocks(self) -> None:
+        def _estimate() -> Decimal:
+            raise AssertionError("estimate should not run when the gate is off")
+
+        reservation = reserve_budget(
+            _settings(enforce_budget_hard_cap=False),
+            _SupabaseFake(spent_usd=100.0),
+            user_id="gate-2",
+            operation="tts",
+            estimated_usd=_estimate,
+            now_utc=NOW,
+        )
+
+        self.assertEqual(reservation.amount, Decimal("0"))
+
+    def test_transcription_estimate_falls_back_to_payload_size(self) -> None:
+        cost = estimate_transcription_cost(b"\x00" * 120_000, model="whisper-1")
+
+        self.assertEqual(cost, Decimal("0.00600000"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,29 +4,67 @@ import datetime as dt
 import sys
 import unittest
 from pathlib import Path
+from decimal import Decimal
 from types import SimpleNamespace
+from unittest.mock import patch
 
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from summi_worker.budget_guard import get_user_budget_state, should_skip_audio_summary
+from summi_worker import budget_guard
+from summi_worker.budget_guard import BudgetCounter, get_user_budget_state, record_spend, should_skip_audio_summary
 
 
 class _SupabaseFake:
-    def __init__(self, *, subscriber: dict | None, user_cost_rows: list[dict]) -> None:
+    def __init__(self, *, subscriber: dict | None, user_cost_rows: list[dict], on_user_costs=None) -> None:
         self.subscriber = subscriber
         self.user_cost_rows = user_cost_rows
+        self.on_user_costs = on_user_costs
+        self.selects: list[str] = []
 
     def select(self, table, select="*", filters=None, order=None, limit=None):
+        self.selects.append(table)
         if table == "subscribers":
             return [self.subscriber] if self.subscriber else []
         if table == "user_costs":
+            if self.on_user_costs is not None:
+                self.on_user_costs()
             return self.user_cost_rows
         raise AssertionError(f"Unexpected table {table}")
 
 
+class _RedisFake:
+    def __init__(self) -> None:
+        self.values: dict[str, str] = {}
+
+    def register_script(self, script):
+        def add(keys, args):
+            for key in keys:
+                if key in self.values:
+                    self.values[key] = str(float(self.values[key]) + float(args[0]))
+                    return self.values[key]
+            return None
+
+        def finish_seed(keys, args):
+            if keys[0] in self.values:
+                return self.values[keys[0]]
+            self.values[keys[0]] = str(float(args[0]) + float(self.values.pop(keys[1], "0")))
+            return self.values[keys[0]]
+
+        return finish_seed if script == budget_guard._FINISH_SEED_SCRIPT else add
+
+    def mget(self, *keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+
 class BudgetGuardTest(unittest.TestCase):
     def setUp(self) -> None:
         self.settings = SimpleNamespace(
@@ -88,6 +126,60 @@ class BudgetGuardTest(unittest.TestCase):
         self.assertFalse(state.soft_cap_reached)
         self.assertFalse(state.hard_cap_reached)
 
+    def test_counter_seeds_once_then_reads_from_redis(self) -> None:
+        supabase = _SupabaseFake(
+            subscriber={"subscription_status": "active", "trial_ends_at": None, "subscribed": True},
+            user_cost_rows=[{"cost_openai_usd": 0.50, "date": "2099-03-01"}],
+        )
+        redis_client = _RedisFake()
+        counter = BudgetCounter(redis_client)
+        now_utc = dt.datetime(2099, 3, 5, tzinfo=dt.timezone.utc)
+
+        with patch.dict(
+            get_user_budget_state.__globals__,
+            {"get_budget_counter": lambda settings: counter, "_ACTIVE_COUNTER": counter},
+        ):
+            record_spend("user-3", Decimal("0.10"), date_str="2099-03-05")
+            first = get_user_budget_state(self.settings, supabase, user_id="user-3", now_utc=now_utc)
+            record_spend("user-3", Decimal("0.25"), date_str="2099-03-05")
+            second = get_user_budget_state(self.settings, supabase, user_id="user-3", now_utc=now_utc)
+
+        self.assertEqual(first.current_cost_usd, Decimal("0.5"))
+        self.assertEqual(supabase.selects, ["subscribers", "user_costs"])
+        self.assertEqual(second.plan_kind, "paid")
+        self.assertEqual(second.current_cost_usd, Decimal("0.75"))
+        self.assertEqual(float(second.current_cost_brl), 4.35)
+        self.assertTrue(second.soft_cap_reached)
+
+    def test_spend_recorded_while_seeding_is_not_lost(self) -> None:
+        redis_client = _RedisFake()
+        counter = BudgetCounter(redis_client)
+        now_utc = dt.datetime(2099, 3, 5, tzinfo=dt.timezone.utc)
+        supabase = _SupabaseFake(
+            subscriber={"subscription_status": "active", "trial_ends_at": None, "subscribed": True},
+            user_cost_rows=[{"cost_openai_usd": 0.50, "date": "2099-03-01"}],
+            # Outro worker registra gasto enquanto este le o user_costs.
+            on_user_costs=lambda: record_spend("user-4", Decimal("0.20"), date_str="2099-03-05"),
+        )
+
+        with patch.dict(
+            get_user_budget_state.__globals__,
+            {"get_budget_counter": lambda settings: counter, "_ACTIVE_COUNTER": counter},
+        ):
+            first = get_user_budget_state(self.settings, supabase, user_id="user-4", now_utc=now_utc)
+            second = get_user_budget_state(self.settings, supabase, user_id="user-4", now_utc=now_utc)
+
+        self.assertEqual(first.current_cost_usd, Decimal("0.7"))
+        self.assertEqual(second.current_cost_usd, Decimal("0.7"))
+        self.assertEqual(supabase.selects.count("user_costs"), 1)
+
+    def test_month_key_uses_utc_on_both_sides(self) -> None:
+        # 23:30 em Sao Paulo no dia 31 ja e dia 1 em UTC: gasto e leitura caem no mesmo mes.
+        local_now = dt.datetime(2099, 3, 31, 23, 30, tzinfo=dt.timezone(dt.timedelta(hours=-3)))
+
+        self.assertEqual(budget_guard.utc_date_str(local_now), "2099-04-01")
+        self.assertEqual(budget_guard._month_start_date(local_now), "2099-04-01")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker.conversation_compaction import (
+    compact_conversations,
+    conversa_with_summary,
+    run_conversation_compaction_job,
+)
+from summi_worker.supabase_rest import SupabaseError
+
+
+class _SupabaseFake:
+    def __init__(self, batches) -> None:
+        self.batches = list(batches)
+        self.calls = []
+
+    def rpc(self, fn, payload):
+        self.calls.append((fn, payload))
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return [batch]
+
+
+class ConversationCompactionTest(unittest.TestCase):
+    def test_batches_until_partial_batch_and_sums_bytes(self) -> None:
+        supabase = _SupabaseFake(
+            [
+                {"chats_compacted": 2, "events_folded": 30, "bytes_before": 9000, "bytes_after": 3000},
+                {"chats_compacted": 1, "events_folded": 5, "bytes_before": 1000, "bytes_after": 800},
+            ]
+        )
+
+        report = compact_conversations(supabase, keep_events=20, batch_limit=2)
+
+        self.assertEqual(len(supabase.calls), 2)
+        self.assertEqual(supabase.calls[0][0], "compact_chat_conversations")
+        self.assertEqual(supabase.calls[0][1]["p_keep_events"], 20)
+        self.assertEqual(report.chats_compacted, 3)
+        self.assertEqual(report.events_folded, 35)
+        self.assertEqual(report.bytes_reclaimed, 6200)
+
+    def test_job_reports_reclaimed_bytes_and_survives_missing_rpc(self) -> None:
+        settings = SimpleNamespace(conversa_keep_events=50, conversa_max_bytes=65536, conversa_summary_max_chars=8000)
+        ok = run_conversation_compaction_job(
+            settings,
+            _SupabaseFake([{"chats_compacted": 1, "events_folded": 2, "bytes_before": 500, "bytes_after": 100}]),
+        )
+        failed = run_conversation_compaction_job(settings, _SupabaseFake([SupabaseError("rpc failed: 404")]))
+
+        self.assertEqual(ok["bytes_reclaimed"], 400)
+        self.assertFalse(failed["success"])
+
+    def test_summary_goes_before_kept_events(self) -> None:
+        conversa = [{"text": "ultima"}]
+
+        self.assertEqual(conversa_with_summary(conversa, None), conversa)
+        self.assertEqual(
+            conversa_with_summary(conversa, "- Ana: oi\n"),
+            [{"resumo_anterior": "- Ana: oi"}, {"text": "ultima"}],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
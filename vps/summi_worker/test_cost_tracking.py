@@ -2,13 +2,100 @@ from decimal import Decimal
 import sys
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from summi_worker.cost_tracking import calculate_chat_cost, calculate_transcription_cost
+from summi_worker import cost_ledger
+from summi_worker.cost_ledger import CostLedger, install_cost_ledger
+from summi_worker.cost_tracking import (
+    calculate_chat_cost,
+    calculate_transcription_cost,
+    log_chat_cost,
+    log_transcription_cost,
+)
+from summi_worker.supabase_rest import SupabaseError
+
+
+class _FakeSupabase:
+    def __init__(self, *, bulk_rpc_available: bool = True, bulk_rpc_error: str | None = None) -> None:
+        self.bulk_rpc_available = bulk_rpc_available
+        self.bulk_rpc_error = bulk_rpc_error
+        self.inserts: list[tuple[str, list]] = []
+        self.rpcs: list[tuple[str, dict]] = []
+        self.fail_insert_calls: set[int] = set()
+        self.insert_calls = 0
+
+    def insert(self, table: str, rows: list) -> list:
+        self.insert_calls += 1
+        if self.insert_calls in self.fail_insert_calls:
+            raise SupabaseError("insert failed: 503 service unavailable")
+        self.inserts.append((table, rows))
+        return rows
+
+    def rpc(self, fn: str, payload: dict) -> None:
+        if fn == "increment_user_costs_bulk" and not self.bulk_rpc_available:
+            raise SupabaseError("rpc failed: 404 function not found")
+        if fn == "increment_user_costs_bulk" and self.bulk_rpc_error:
+            raise SupabaseError(self.bulk_rpc_error)
+        self.rpcs.append((fn, payload))
+        return None
+
+
+class _FakeLedgerRedis:
+    """Subconjunto de comandos usados pelo write-ahead do CostLedger."""
+
+    def __init__(self) -> None:
+        self.lists: dict[str, list] = {}
+        self.values: dict[str, str] = {}
+        self.sets: dict[str, set] = {}
+
+    def register_script(self, _script: str):
+        def _claim(keys, args):
+            wal, batch, inflight, lease = keys
+            if wal not in self.lists:
+                return 0
+            self.lists[batch] = self.lists.pop(wal)
+            self.sets.setdefault(inflight, set()).add(args[0])
+            self.values[lease] = "1"
+            return 1
+
+        return _claim
+
+    def rpush(self, key: str, value: str) -> None:
+        self.lists.setdefault(key, []).append(value)
+
+    def lrange(self, key: str, _start: int, _end: int) -> list:
+        return list(self.lists.get(key, []))
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+    def set(self, key: str, value: str, nx: bool = False, ex: int | None = None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def smembers(self, key: str) -> set:
+        return set(self.sets.get(key, set()))
+
+    def pipeline(self, transaction: bool = True) -> "_FakeLedgerRedis":
+        return self
+
+    def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.lists.pop(key, None)
+            self.values.pop(key, None)
+
+    def srem(self, key: str, member: str) -> None:
+        self.sets.get(key, set()).discard(member)
+
+    def execute(self) -> None:
+        return None
 
 
 class CostTrackingTest(unittest.TestCase):
@@ -24,6 +111,147 @@ class CostTrackingTest(unittest.TestCase):
             Decimal("0.00050000"),
         )
 
+    def test_cached_prompt_tokens_are_billed_at_discounted_rate(self) -> None:
+        full = calculate_chat_cost(4000, 100, model="gemini-2.5-flash-lite")
+        cached = calculate_chat_cost(4000, 100, model="gemini-2.5-flash-lite", cached_tokens=3000)
+
+        # 3000 tokens a 0.025/1M em vez de 0.10/1M
+        self.assertEqual(full - cached, Decimal("0.00022500"))
+        self.assertEqual(
+            calculate_chat_cost(1000, 0, model="gpt-4o-mini", cached_tokens=5000),
+            calculate_chat_cost(1000, 0, model="gpt-4o-mini", cached_tokens=1000),
+        )
+
+
+class CostLedgerTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        install_cost_ledger(None)
+
+    def test_installed_ledger_batches_cost_logs_and_daily_increments(self) -> None:
+        supabase = _FakeSupabase()
+        ledger = CostLedger(supabase)
+        install_cost_ledger(ledger)
+
+        for _ in range(3):
+            log_chat_cost(supabase, "user-1", operation="analyze", model="gpt-4o-mini", input_tokens=1000, output_tokens=100)
+        log_transcription_cost(supabase, "user-1", model="whisper-1", duration_seconds=30)
+
+        self.assertEqual(supabase.inserts, [])
+        self.assertEqual(supabase.rpcs, [])
+
+        self.assertEqual(ledger.flush(), 4)
+
+        self.assertEqual(len(supabase.inserts), 1)
+        table, rows = supabase.inserts[0]
+        self.assertEqual(table, "cost_logs")
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({frozenset(row) for row in rows}, {frozenset(rows[0])})
+        self.assertTrue(all(row["created_at"] for row in rows))
+
+        self.assertEqual(len(supabase.rpcs), 1)
+        fn, payload = supabase.rpcs[0]
+        self.assertEqual(fn, "increment_user_costs_bulk")
+        by_col = {row["operation_col"]: row for row in payload["p_rows"]}
+        self.assertEqual(by_col["analysis_cost_usd"]["calls"], 3)
+        self.assertEqual(by_col["analysis_cost_usd"]["tokens"], 3300)
+        self.assertAlmostEqual(by_col["transcription_cost_usd"]["audio_minutes"], 0.5)
+        self.assertEqual(ledger.flush(), 0)
+
+    def test_tokens_cached_column_is_only_sent_when_some_row_has_it(self) -> None:
+        supabase = _FakeSupabase()
+        ledger = CostLedger(supabase)
+        install_cost_ledger(ledger)
+
+        log_chat_cost(supabase, "user-1", operation="analyze", model="gpt-4o-mini", input_tokens=1000, output_tokens=100)
+        ledger.flush()
+        log_chat_cost(supabase, "user-1", operation="analyze", model="gpt-4o-mini", input_tokens=1000, output_tokens=100)
+        log_chat_cost(
+            supabase, "user-1", operation="analyze", model="gpt-4o-mini", input_tokens=2000, output_tokens=100, cached_tokens=1024
+        )
+        ledger.flush()
+
+        first_rows, second_rows = supabase.inserts[0][1], supabase.inserts[1][1]
+        self.assertNotIn("tokens_cached", first_rows[0])
+        self.assertEqual([row["tokens_cached"] for row in second_rows], [None, 1024])
+        self.assertEqual({frozenset(row) for row in second_rows}, {frozenset(second_rows[0])})
+
+    def test_flush_falls_back_to_single_rpc_per_aggregate(self) -> None:
+        supabase = _FakeSupabase(bulk_rpc_available=False)
+        ledger = CostLedger(supabase)
+        install_cost_ledger(ledger)
+
+        log_chat_cost(supabase, "user-1", operation="summary", model="gpt-4o-mini", input_tokens=500, output_tokens=50)
+        log_chat_cost(supabase, "user-1", operation="summary", model="gpt-4o-mini", input_tokens=500, output_tokens=50)
+        ledger.flush()
+
+        self.assertEqual([fn for fn, _ in supabase.rpcs], ["increment_user_cost"])
+        self.assertEqual(supabase.rpcs[0][1]["p_calls"], 2)
+        self.assertEqual(supabase.rpcs[0][1]["p_operation_col"], "summary_cost_usd")
+
+    def test_bulk_rpc_server_error_keeps_entries_without_fallback(self) -> None:
+        supabase = _FakeSupabase(bulk_rpc_error="rpc failed: 504 gateway timeout")
+        ledger = CostLedger(supabase)
+        install_cost_ledger(ledger)
+
+        log_chat_cost(supabase, "user-1", operation="analyze", model="gpt-4o-mini", input_tokens=1000, output_tokens=100)
+
+        self.assertEqual(ledger.flush(), 0)
+        # Sem fallback unitario: a RPC em lote pode ter commitado antes do 504.
+        self.assertEqual(supabase.rpcs, [])
+        self.assertEqual(len(supabase.inserts), 1)
+
+        supabase.bulk_rpc_error = None
+        self.assertEqual(ledger.flush(), 1)
+        self.assertEqual([fn for fn, _ in supabase.rpcs], ["increment_user_costs_bulk"])
+        # cost_logs nao e reinserido na nova tentativa.
+        self.assertEqual(len(supabase.inserts), 1)
+
+    def test_failed_cost_logs_chunk_does_not_duplicate_previous_chunks(self) -> None:
+        supabase = _FakeSupabase()
+        supabase.fail_insert_calls = {2}
+        ledger = CostLedger(supabase)
+        install_cost_ledger(ledger)
+
+        with patch.object(cost_ledger, "COST_LOGS_CHUNK_SIZE", 2):
+            for tokens in range(1, 6):
+                log_chat_cost(supabase, "user-1", operation="analyze", model="gpt-4o-mini", input_tokens=tokens, output_tokens=0)
+            self.assertEqual(ledger.flush(), 0)
+            self.assertEqual(ledger.flush(), 5)
+
+        inserted = [row["tokens_input"] for _table, rows in supabase.inserts for row in rows]
+        self.assertEqual(inserted, [1, 2, 3, 4, 5])
+        self.assertEqual(len(supabase.rpcs), 1)
+        self.assertEqual(supabase.rpcs[0][1]["p_rows"][0]["calls"], 5)
+
+    def test_redis_batch_resumes_cost_logs_after_failed_chunk(self) -> None:
+        supabase = _FakeSupabase()
+        supabase.fail_insert_calls = {2}
+        client = _FakeLedgerRedis()
+        ledger = CostLedger(supabase, client)
+        install_cost_ledger(ledger)
+
+        with patch.object(cost_ledger, "COST_LOGS_CHUNK_SIZE", 2):
+            for tokens in range(1, 6):
+                log_chat_cost(supabase, "user-1", operation="analyze", model="gpt-4o-mini", input_tokens=tokens, output_tokens=0)
+            self.assertEqual(ledger.flush(), 0)
+            # Lote orfao retomado quando o lease expira.
+            client.values = {key: value for key, value in client.values.items() if not key.startswith(cost_ledger.LEASE_KEY_PREFIX)}
+            self.assertEqual(ledger.flush(), 5)
+
+        inserted = [row["tokens_input"] for _table, rows in supabase.inserts for row in rows]
+        self.assertEqual(inserted, [1, 2, 3, 4, 5])
+        self.assertEqual(len(supabase.rpcs), 1)
+        self.assertEqual(client.sets[cost_ledger.INFLIGHT_KEY], set())
+
+    def test_without_ledger_writes_synchronously(self) -> None:
+        supabase = _FakeSupabase()
+
+        log_chat_cost(supabase, "user-1", operation="analyze", model="gpt-4o-mini", input_tokens=1000, output_tokens=100)
+
+        self.assertEqual(len(supabase.inserts), 1)
+        self.assertNotIn("tokens_cached", supabase.inserts[0][1][0])
+        self.assertEqual([fn for fn, _ in supabase.rpcs], ["increment_user_cost"])
+
 
 if __name__ == "__main__":
     unittest.main()
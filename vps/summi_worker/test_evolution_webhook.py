@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker.evolution_webhook import WebhookEvent, normalize_message_event, parse_webhook_event
+from summi_worker.webhook_samples import sample_payloads
+
+
+SAMPLES = dict(sample_payloads())
+
+
+class ParseWebhookEventTest(unittest.TestCase):
+    def test_direct_v2_text_message(self) -> None:
+        event = parse_webhook_event(SAMPLES["text_v2"])
+
+        self.assertEqual(event.event, "messages.upsert")
+        self.assertEqual(event.instance_name, "lucasborges_5286")
+        self.assertEqual(event.remote_jid, "556299999999")
+        self.assertEqual(event.key_remote_jid, "556299999999@s.whatsapp.net")
+        self.assertEqual(event.message_id, "3EB0C7A1")
+        self.assertIs(event.from_me, False)
+        self.assertEqual(event.kind, "text")
+        self.assertEqual(event.text, "Bom dia, o pedido ja saiu?")
+        self.assertEqual(event.sender, "551188888888@s.whatsapp.net")
+        self.assertIsNone(event.body_sender)
+
+    def test_n8n_body_envelope_with_group_audio(self) -> None:
+        event = parse_webhook_event(SAMPLES["audio_n8n_body"])
+
+        self.assertEqual(event.kind, "audio")
+        self.assertTrue(event.is_group)
+        self.assertEqual(event.chat_key, "120363000000@g.us")
+        self.assertEqual(event.author_jid, "5562777")
+        self.assertEqual(event.audio_seconds, 42)
+        self.assertTrue(event.inline_base64.startswith("T2dnUw=="))
+        self.assertEqual(event.body_sender, "551188888888@s.whatsapp.net")
+        self.assertEqual(event.quoted_participant, "5562777@s.whatsapp.net")
+
+    def test_reaction_update_uses_lid_alt_jid(self) -> None:
+        event = parse_webhook_event(SAMPLES["reaction_update"])
+
+        self.assertEqual(event.kind, "reaction")
+        self.assertEqual(event.reaction_text, "⚡")
+        self.assertEqual(event.reaction_target_id, "ABCD")
+        self.assertEqual(event.chat_key, "556299999999")
+        self.assertEqual(event.quoted_remote_jid, "556299999999@s.whatsapp.net")
+        self.assertIsNone(event.message_type)
+
+    def test_list_wrapped_data_and_empty_payload(self) -> None:
+        event = parse_webhook_event({"data": [{"key": {"remoteJid": "5511@s.whatsapp.net", "id": "X", "fromMe": True}}]})
+        self.assertEqual(event.message_id, "X")
+        self.assertIs(event.from_me, True)
+
+        empty = parse_webhook_event({})
+        self.assertEqual(empty.kind, "unknown")
+        self.assertEqual(empty.chat_key, "")
+        self.assertEqual(empty.message, {})
+
+    def test_event_uses_slots(self) -> None:
+        event = parse_webhook_event({})
+        self.assertFalse(hasattr(event, "__dict__"))
+        with self.assertRaises(AttributeError):
+            event.unexpected = 1  # type: ignore[attr-defined]
+
+    def test_normalize_message_event_keeps_stored_shape(self) -> None:
+        normalized = normalize_message_event(SAMPLES["text_v2"])
+
+        self.assertEqual(
+            set(normalized),
+            {
+                "received_at",
+                "event",
+                "instance_name",
+                "remote_jid",
+                "remote_jid_full",
+                "push_name",
+                "from_me",
+                "message_id",
+                "message_type",
+                "message_timestamp",
+                "is_group",
+                "chat_key",
+                "author_jid",
+                "text",
+                "raw",
+            },
+        )
+        self.assertIs(normalized["raw"], SAMPLES["text_v2"])
+        self.assertIsInstance(parse_webhook_event(SAMPLES["text_v2"]), WebhookEvent)
+
+
+if __name__ == "__main__":
+    unittest.main()
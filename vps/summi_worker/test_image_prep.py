@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import os
+import sys
+import types
+import unittest
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+if "mutagen" not in sys.modules:
+    mutagen_stub = types.ModuleType("mutagen")
+    mutagen_stub.File = lambda *args, **kwargs: None
+    sys.modules["mutagen"] = mutagen_stub
+
+from summi_worker.image_prep import Image, prepare_image_for_vision, prepare_image_from_settings
+
+
+def _photo_bytes(width: int, height: int, *, fmt: str = "JPEG", mode: str = "RGB", **save_kwargs: object) -> bytes:
+    # Ruido aleatorio comprime mal, como uma foto real.
+    img = Image.frombytes(mode, (width, height), os.urandom(width * height * len(mode)))
+    out = BytesIO()
+    img.save(out, format=fmt, **save_kwargs)
+    return out.getvalue()
+
+
+class ImagePrepPassthroughTest(unittest.TestCase):
+    def test_disabled_or_without_pillow_keeps_original_bytes(self) -> None:
+        raw = b"\xff\xd8\xff" + b"\x00" * 64
+
+        disabled = prepare_image_from_settings(SimpleNamespace(enable_image_prep=False), raw)
+        with patch.dict(prepare_image_for_vision.__globals__, {"Image": None}):
+            no_pillow = prepare_image_for_vision(raw)
+
+        for prepared in (disabled, no_pillow):
+            self.assertEqual(prepared.data, raw)
+            self.assertEqual(prepared.mime_type, "image/jpeg")
+            self.assertFalse(prepared.reencoded)
+
+
+@unittest.skipIf(Image is None, "Pillow not installed")
+class ImagePrepTest(unittest.TestCase):
+    def test_large_photo_is_downscaled_and_stripped(self) -> None:
+        exif = Image.Exif()
+        exif[0x010F] = "CameraMaker"
+        raw = _photo_bytes(3000, 2000, quality=95, exif=exif.tobytes())
+
+        prepared = prepare_image_for_vision(raw, max_edge=1024)
+
+        self.assertTrue(prepared.reencoded)
+        self.assertEqual((prepared.width, prepared.height), (1024, 683))
+        self.assertLess(len(prepared.data), len(raw) // 4)
+        with Image.open(BytesIO(prepared.data)) as out:
+            self.assertEqual(out.format, "JPEG")
+            self.assertEqual(dict(out.getexif()), {})
+
+    def test_transparent_sticker_becomes_webp_under_the_edge_cap(self) -> None:
+        raw = _photo_bytes(2048, 2048, fmt="PNG", mode="RGBA")
+
+        prepared = prepare_image_for_vision(raw, max_edge=512, output_format="webp")
+
+        self.assertEqual(prepared.mime_type, "image/webp")
+        self.assertEqual((prepared.width, prepared.height), (512, 512))
+        self.assertLess(len(prepared.data), len(raw) // 10)
+
+    def test_tiny_sticker_is_marked_for_skip(self) -> None:
+        raw = _photo_bytes(32, 32, fmt="PNG", mode="RGBA")
+
+        prepared = prepare_image_for_vision(raw)
+
+        self.assertEqual(prepared.skip_reason, "image_too_small")
+        self.assertEqual(prepared.data, raw)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import json
+import sys
+import unittest
+from decimal import Decimal
+from pathlib import Path
+from unittest.mock import patch
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker import json_codec
+
+
+SAMPLE = {"text": "orçamento até sexta ⚡", "n": 3, "ok": True, "items": [1, None, 2.5]}
+
+
+class JsonCodecTest(unittest.TestCase):
+    def test_round_trip_from_bytes_and_str(self) -> None:
+        encoded = json_codec.dumps_bytes(SAMPLE)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(json_codec.loads(encoded), SAMPLE)
+        self.assertEqual(json_codec.loads(encoded.decode("utf-8")), SAMPLE)
+        self.assertEqual(json_codec.loads(memoryview(encoded)), SAMPLE)
+
+    def test_output_is_compact_utf8_and_same_as_stdlib_fallback(self) -> None:
+        expected = json.dumps(SAMPLE, ensure_ascii=False, separators=(",", ":"))
+        self.assertEqual(json_codec.dumps(SAMPLE), expected)
+        with patch.object(json_codec, "orjson", None):
+            self.assertEqual(json_codec.dumps(SAMPLE), expected)
+            self.assertEqual(json_codec.dumps_bytes(SAMPLE), expected.encode("utf-8"))
+            self.assertEqual(json_codec.loads(expected.encode("utf-8")), SAMPLE)
+
+    def test_unsupported_types_fall_back_to_str(self) -> None:
+        self.assertEqual(json_codec.dumps({"v": Decimal("1.50")}), '{"v":"1.50"}')
+        self.assertEqual(json_codec.loads(json_codec.dumps_bytes({1: "a"})), {"1": "a"})
+
+    def test_invalid_json_raises_value_error(self) -> None:
+        with self.assertRaises(ValueError):
+            json_codec.loads(b"{not json")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker.local_dedupe import TimeBucketedBloom, bloom_parameters
+from summi_worker.redis_dedupe import RedisDedupe
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _FailingRedis:
+    def set(self, *args, **kwargs):
+        raise ConnectionError("redis down")
+
+
+class TimeBucketedBloomTest(unittest.TestCase):
+    def test_marks_then_reports_duplicate(self) -> None:
+        bloom = TimeBucketedBloom(3600, capacity=1000)
+
+        self.assertFalse(bloom.seen_or_mark("summi:webhook:inst:ABC"))
+        self.assertTrue(bloom.seen_or_mark("summi:webhook:inst:ABC"))
+        self.assertFalse(bloom.seen_or_mark("summi:webhook:inst:DEF"))
+        self.assertEqual(bloom.stats()["hits"], 1)
+
+    def test_ids_live_at_least_ttl_and_expire_after_rotation(self) -> None:
+        clock = _Clock()
+        bloom = TimeBucketedBloom(300, capacity=1000, generations=4, clock=clock)
+        bloom.seen_or_mark("old")
+
+        clock.now = 299.0
+        self.assertTrue(bloom.seen_or_mark("old"))
+
+        # 4 geracoes de 100s: depois de 400s a geracao de "old" sai.
+        for step in range(1, 6):
+            clock.now = 299.0 + step * 100
+            bloom.seen_or_mark(f"filler-{step}")
+        self.assertFalse(bloom.seen_or_mark("old"))
+
+    def test_false_positive_rate_stays_near_target_at_capacity(self) -> None:
+        bloom = TimeBucketedBloom(3600, capacity=20_000, false_positive_rate=1e-3, generations=2)
+        for index in range(20_000):
+            bloom.seen_or_mark(f"in-{index}")
+
+        # Sondas tambem marcam: poucas, para nao passar muito da capacidade.
+        false_positives = sum(bloom.seen_or_mark(f"out-{index}") for index in range(2_000))
+        stats = bloom.stats()
+
+        self.assertLessEqual(false_positives, 6)
+        self.assertLess(stats["estimated_fp_rate"], 2e-3)
+        self.assertEqual(stats["memory_bytes"], 2 * bloom_parameters(20_000, 5e-4)[0] // 8)
+
+
+class RedisDedupeLocalTierTest(unittest.TestCase):
+    def test_local_tier_catches_duplicates_while_redis_is_down(self) -> None:
+        dedupe = RedisDedupe(None, local=TimeBucketedBloom(3600, capacity=1000))
+        dedupe._client = _FailingRedis()
+
+        with self.assertLogs("summi_worker.redis", level="WARNING"):
+            self.assertFalse(dedupe.seen_or_mark("summi:webhook:inst:ABC", 3600))
+        self.assertTrue(dedupe.seen_or_mark("summi:webhook:inst:ABC", 3600))
+
+    def test_local_tier_enables_dedupe_without_redis_url(self) -> None:
+        self.assertFalse(RedisDedupe(None).enabled)
+        self.assertTrue(RedisDedupe(None, local=TimeBucketedBloom(60, capacity=10)).enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
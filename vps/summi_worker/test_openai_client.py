@@ -28,6 +28,27 @@ except ImportError:
 REQUESTS_POST_TARGET = f"{OpenAIClient.__module__}.requests.post"
 
 
+class _FakeStreamResponse:
+    def __init__(self, lines: list[str], status_code: int = 200) -> None:
+        self._lines = lines
+        self.status_code = status_code
+        self.text = ""
+        self.ok = 200 <= status_code < 300
+        self.closed = False
+
+    def iter_lines(self, decode_unicode: bool = False):
+        yield from self._lines
+
+    def close(self) -> None:
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
 class _FakeResponse:
     def __init__(self, payload: dict[str, object], status_code: int = 200) -> None:
         self._payload = payload
@@ -171,7 +192,12 @@ class OpenAIClientTranscriptionTest(unittest.TestCase):
             return_value=_FakeResponse(
                 {
                     "choices": [{"message": {"content": "Resumo pronto"}}],
-                    "usage": {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150},
+                    "usage": {
+                        "prompt_tokens": 120,
+                        "completion_tokens": 30,
+                        "total_tokens": 150,
+                        "prompt_tokens_details": {"cached_tokens": 96},
+                    },
                 }
             ),
         ):
@@ -187,6 +213,49 @@ class OpenAIClientTranscriptionTest(unittest.TestCase):
         self.assertEqual(result.usage.prompt_tokens, 120)
         self.assertEqual(result.usage.completion_tokens, 30)
         self.assertEqual(result.usage.total_tokens, 150)
+        self.assertEqual(result.usage.cached_tokens, 96)
+
+    def test_chat_text_stream_joins_deltas_and_reads_final_usage(self) -> None:
+        client = OpenAIClient("key")
+        deltas: list[str] = []
+        lines = [
+            'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            "",
+            'data: {"choices": [{"delta": {"content": "Resumo"}}]}',
+            'data: {"choices": [{"delta": {"content": " pronto"}}]}',
+            'data: {"choices": [], "usage": {"prompt_tokens": 80, "completion_tokens": 4, "total_tokens": 84}}',
+            "data: [DONE]",
+        ]
+
+        with patch(REQUESTS_POST_TARGET, return_value=_FakeStreamResponse(lines)) as post:
+            result = client.chat_text_stream("gpt-4o-mini", "system", "user", on_delta=deltas.append)
+
+        self.assertEqual(result.text, "Resumo pronto")
+        self.assertEqual(deltas, ["Resumo", " pronto"])
+        self.assertEqual(result.usage.total_tokens, 84)
+        self.assertIsNotNone(result.ttfb_ms)
+        self.assertTrue(post.call_args.kwargs["stream"])
+        self.assertIn('"include_usage": true', post.call_args.kwargs["data"])
+
+    def test_chat_text_stream_wraps_connection_errors(self) -> None:
+        import requests
+
+        client = OpenAIClient("key")
+
+        class _BrokenStream(_FakeStreamResponse):
+            def iter_lines(self, decode_unicode: bool = False):
+                yield 'data: {"choices": [{"delta": {"content": "Resumo"}}]}'
+                raise requests.exceptions.ChunkedEncodingError("connection reset")
+
+        with patch(REQUESTS_POST_TARGET, side_effect=requests.ConnectionError("refused")):
+            with self.assertRaisesRegex(RuntimeError, "chat stream failed: refused"):
+                client.chat_text_stream("gpt-4o-mini", "system", "user")
+
+        broken = _BrokenStream([])
+        with patch(REQUESTS_POST_TARGET, return_value=broken):
+            with self.assertRaisesRegex(RuntimeError, "openai stream interrupted after 1 chunks"):
+                client.chat_text_stream("gpt-4o-mini", "system", "user")
+        self.assertTrue(broken.closed)
 
     def test_tts_mp3_response_tracks_char_count(self) -> None:
         client = OpenAIClient("key")
@@ -220,6 +289,7 @@ class GeminiTranscriptionClientTest(unittest.TestCase):
                         "promptTokenCount": 100,
                         "candidatesTokenCount": 20,
                         "totalTokenCount": 120,
+                        "cachedContentTokenCount": 64,
                     },
                 }
             ),
@@ -228,7 +298,10 @@ class GeminiTranscriptionClientTest(unittest.TestCase):
 
         self.assertEqual(result.data["Prioridade"], "2")
         self.assertEqual(result.usage.total_tokens if result.usage else None, 120)
+        self.assertEqual(result.usage.cached_tokens if result.usage else None, 64)
         payload = post.call_args.kwargs["json"]
+        self.assertEqual(payload["systemInstruction"], {"parts": [{"text": "system"}]})
+        self.assertEqual(payload["contents"][0]["parts"], [{"text": "user"}])
         self.assertEqual(payload["generationConfig"]["responseMimeType"], "application/json")
         self.assertEqual(post.call_args.kwargs["params"], {"key": "google-key"})
 
@@ -278,6 +351,37 @@ class GeminiTranscriptionClientTest(unittest.TestCase):
         self.assertEqual(result.text, "Resumo pronto")
         self.assertEqual(post.call_count, 2)
 
+    def test_chat_text_stream_keeps_spaces_between_chunks(self) -> None:
+        client = GeminiClient("google-key")
+        lines = [
+            'data: {"candidates": [{"content": {"parts": [{"text": "Resumo "}]}}]}',
+            'data: {"candidates": [{"content": {"parts": [{"text": "pronto"}]}}], '
+            '"usageMetadata": {"promptTokenCount": 50, "candidatesTokenCount": 3}}',
+        ]
+
+        with patch(REQUESTS_POST_TARGET, return_value=_FakeStreamResponse(lines)) as post:
+            result = client.chat_text_stream("gemini-2.5-flash-lite", "system", "user")
+
+        self.assertEqual(result.text, "Resumo pronto")
+        self.assertEqual(result.usage.total_tokens, 53)
+        self.assertIn(":streamGenerateContent", post.call_args.args[0])
+        self.assertEqual(post.call_args.kwargs["params"]["alt"], "sse")
+
+    def test_chat_text_stream_falls_back_on_transient_gemini_error(self) -> None:
+        client = GeminiClient("google-key", max_retries=0)
+
+        with patch(
+            REQUESTS_POST_TARGET,
+            side_effect=[
+                _FakeStreamResponse([], status_code=503),
+                _FakeResponse({"candidates": [{"content": {"parts": [{"text": "Resumo pronto"}]}}]}),
+            ],
+        ):
+            result = client.chat_text_stream("gemini-2.5-flash-lite", "system", "user")
+
+        self.assertEqual(result.text, "Resumo pronto")
+        self.assertIsNone(result.ttfb_ms)
+
     def test_transcribe_audio_posts_inline_audio_and_extracts_text(self) -> None:
         client = GeminiTranscriptionClient("google-key")
 
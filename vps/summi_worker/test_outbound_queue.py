@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker import outbound_queue
+from summi_worker.evolution_client import EvolutionError
+from summi_worker.outbound_queue import OutboundSender, is_retryable_send_error
+
+
+class _FakeEvolution:
+    def __init__(self, failures: list[Exception] | None = None) -> None:
+        self.sent: list[tuple[str, str, str]] = []
+        self.failures = list(failures or [])
+        self.event = threading.Event()
+
+    def send_text(self, instance: str, remote_jid: str, text: str, **kwargs: object) -> None:
+        if self.failures:
+            raise self.failures.pop(0)
+        self.sent.append((instance, remote_jid, text))
+        self.event.set()
+
+    def get_media_base64(self, instance: str, message_id: str) -> str:
+        return "media"
+
+
+class _FakePipeline:
+    def __init__(self, client: "_FakeRedis") -> None:
+        self._client = client
+
+    def hset(self, key: str, field: str, value: str) -> None:
+        self._client.hashes.setdefault(key, {})[field] = value
+
+    def hdel(self, key: str, field: str) -> None:
+        self._client.hashes.setdefault(key, {}).pop(field, None)
+
+    def hincrby(self, key: str, field: str, amount: int) -> None:
+        bucket = self._client.hashes.setdefault(key, {})
+        bucket[field] = str(int(bucket.get(field, 0)) + amount)
+
+    def zadd(self, key: str, mapping: dict) -> None:
+        self._client.zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key: str, member: str) -> None:
+        self._client.zrem(key, member)
+
+    def execute(self) -> None:
+        return None
+
+
+class _FakeRedis:
+    """Simula os scripts Lua: bucket com espera configuravel e claim por score com lease."""
+
+    def __init__(self) -> None:
+        self.hashes: dict[str, dict[str, str]] = {}
+        self.zsets: dict[str, dict[str, float]] = {outbound_queue.DUE_KEY: {}}
+        self.zset = self.zsets[outbound_queue.DUE_KEY]
+        self.token_waits: list[float] = []
+        self.counter = 0
+
+    def register_script(self, script: str):
+        if script == outbound_queue._TAKE_TOKEN_SCRIPT:
+            return lambda keys, args: str(self.token_waits.pop(0) if self.token_waits else 0)
+
+        def claim(keys, args):
+            now, limit, lease = float(args[0]), int(args[1]), float(args[2])
+            due, inflight = self.zsets.setdefault(keys[0], {}), self.zsets.setdefault(keys[1], {})
+            for member, expires in list(inflight.items()):
+                if expires <= now:
+                    inflight.pop(member)
+                    due[member] = now
+            claimed = sorted((score, member) for member, score in due.items() if score <= now)[:limit]
+            for _, member in claimed:
+                due.pop(member)
+                inflight[member] = now + lease
+            return [member for _, member in claimed]
+
+        return claim
+
+    def incr(self, key: str) -> int:
+        self.counter += 1
+        return self.counter
+
+    def zcard(self, key: str) -> int:
+        return len(self.zsets.get(key, {}))
+
+    def zrange(self, key: str, start: int, end: int) -> list[str]:
+        members = [member for _, member in sorted((score, member) for member, score in self.zsets.get(key, {}).items())]
+        return members[start : end + 1]
+
+    def zscore(self, key: str, member: str):
+        return self.zsets.get(key, {}).get(member)
+
+    def zrem(self, key: str, member: str) -> None:
+        self.zsets.get(key, {}).pop(member, None)
+
+    def pipeline(self, transaction: bool = True) -> _FakePipeline:
+        return _FakePipeline(self)
+
+    def hget(self, key: str, field: str):
+        return self.hashes.get(key, {}).get(field)
+
+    def hgetall(self, key: str) -> dict:
+        return dict(self.hashes.get(key, {}))
+
+
+class OutboundSenderTest(unittest.TestCase):
+    def test_retryable_errors(self) -> None:
+        self.assertTrue(is_retryable_send_error(EvolutionError("rate limited", status_code=429)))
+        self.assertTrue(is_retryable_send_error(EvolutionError("bad gateway", status_code=502)))
+        self.assertTrue(is_retryable_send_error(EvolutionError("network")))
+        self.assertFalse(is_retryable_send_error(EvolutionError("bad request", status_code=400)))
+        self.assertFalse(is_retryable_send_error(ValueError("boom")))
+
+    def test_without_redis_sends_directly_and_delays_on_local_thread(self) -> None:
+        evolution = _FakeEvolution()
+        sender = OutboundSender(evolution)
+
+        sender.send_text("inst", "5511@s.whatsapp.net", "now")
+        self.assertEqual(evolution.sent, [("inst", "5511@s.whatsapp.net", "now")])
+
+        evolution.event.clear()
+        sender.send_text("inst", "5511@s.whatsapp.net", "later", delay_seconds=0.05)
+        self.assertTrue(evolution.event.wait(timeout=2))
+        self.assertEqual(evolution.sent[-1][2], "later")
+        self.assertEqual(sender.get_media_base64("inst", "msg"), "media")
+
+    def test_rate_limited_send_is_queued_then_dispatched_with_retry(self) -> None:
+        clock = {"now": 1000.0}
+        redis_client = _FakeRedis()
+        evolution = _FakeEvolution(failures=[EvolutionError("too many", status_code=429)])
+        sender = OutboundSender(evolution, redis_client, max_attempts=3, clock=lambda: clock["now"])
+
+        redis_client.token_waits = [1.5]
+        sender.send_text("inst", "5511@s.whatsapp.net", "hello")
+
+        self.assertEqual(evolution.sent, [])
+        self.assertEqual(sender.queue_depths(), {"inst": 1})
+        self.assertEqual(sender.dispatch_due(), 0)
+
+        clock["now"] += 2
+        self.assertEqual(sender.dispatch_due(), 1)
+        self.assertEqual(evolution.sent, [])
+        self.assertEqual(len(redis_client.zset), 1)
+
+        clock["now"] += 600
+        self.assertEqual(sender.dispatch_due(), 1)
+        self.assertEqual(evolution.sent, [("inst", "5511@s.whatsapp.net", "hello")])
+        self.assertEqual(sender.queue_depths(), {})
+        self.assertEqual(redis_client.hashes[outbound_queue.JOBS_KEY], {})
+        self.assertEqual(redis_client.zsets[outbound_queue.INFLIGHT_KEY], {})
+
+    def test_claimed_job_is_requeued_when_its_lease_expires(self) -> None:
+        clock = {"now": 1000.0}
+        redis_client = _FakeRedis()
+        evolution = _FakeEvolution()
+        sender = OutboundSender(evolution, redis_client, lease_seconds=60, clock=lambda: clock["now"])
+        redis_client.token_waits = [1.0]
+        sender.send_text("inst", "5511@s.whatsapp.net", "hello")
+
+        # Dispatcher reivindica e morre antes de enviar.
+        clock["now"] += 2
+        claimed = sender._claim(keys=[outbound_queue.DUE_KEY, outbound_queue.INFLIGHT_KEY], args=[clock["now"], 10, 60])
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(redis_client.zset, {})
+        self.assertEqual(sender.dispatch_due(), 0)
+
+        clock["now"] += 61
+        self.assertEqual(sender.dispatch_due(), 1)
+        self.assertEqual(evolution.sent, [("inst", "5511@s.whatsapp.net", "hello")])
+        self.assertEqual(sender.queue_depths(), {})
+
+    def test_messages_to_the_same_recipient_keep_fifo_order_across_retries(self) -> None:
+        clock = {"now": 1000.0}
+        redis_client = _FakeRedis()
+        evolution = _FakeEvolution(failures=[EvolutionError("too many", status_code=429)])
+        sender = OutboundSender(evolution, redis_client, max_attempts=3, clock=lambda: clock["now"])
+
+        # Primeira falha com 429 e vai para retry; as seguintes nao podem passar na frente.
+        sender.send_text("inst", "5511@s.whatsapp.net", "first")
+        sender.send_text("inst", "5511@s.whatsapp.net", "second")
+        sender.send_text("inst", "5522@s.whatsapp.net", "other contact")
+        redis_client.token_waits = [0, 5.0]
+        sender.send_text("inst", "5511@s.whatsapp.net", "third")
+
+        self.assertEqual(evolution.sent, [("inst", "5522@s.whatsapp.net", "other contact")])
+        for _ in range(10):
+            clock["now"] += 301
+            sender.dispatch_due()
+
+        self.assertEqual(
+            [text for _, jid, text in evolution.sent if jid == "5511@s.whatsapp.net"],
+            ["first", "second", "third"],
+        )
+        self.assertEqual(sender.queue_depths(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import sys
+import types
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+if "mutagen" not in sys.modules:
+    mutagen_stub = types.ModuleType("mutagen")
+    mutagen_stub.File = lambda *args, **kwargs: None
+    sys.modules["mutagen"] = mutagen_stub
+
+from summi_worker.analysis import analyze_single_chat
+from summi_worker.openai_client import ChatJsonResult, OpenAIUsage
+from summi_worker.prompt_budget import (
+    PromptSection,
+    PromptTooLargeError,
+    estimate_tokens,
+    fit_prompt,
+    model_input_limit,
+)
+
+
+class _CapturingClient:
+    def __init__(self) -> None:
+        self.user = ""
+
+    def chat_json_response(self, model, system, user, temperature=0.2):
+        self.user = user
+        return ChatJsonResult(data={"Prioridade": "1", "Contexto": "ok"}, usage=None)
+
+
+class PromptBudgetTest(unittest.TestCase):
+    def test_estimator_and_model_limits(self) -> None:
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("oi, tudo bem?"), 5)
+        self.assertGreater(estimate_tokens("orçamento"), estimate_tokens("orcamento"))
+        self.assertEqual(model_input_limit("gpt-4o-mini"), 128_000)
+        self.assertEqual(model_input_limit("gemini-2.5-flash-lite"), 1_048_576)
+
+    def test_lowest_priority_section_is_trimmed_first(self) -> None:
+        sections = [
+            PromptSection("fixo", "", label="Instrucoes fixas.\n"),
+            PromptSection("temas", "vendas " * 50, priority=50, trim="head", min_tokens=10),
+            PromptSection("conversa", "msg " * 2000, priority=10, trim="tail", min_tokens=100),
+        ]
+
+        fitted = fit_prompt(sections, model="gpt-4o-mini", name="t", max_input_tokens=300)
+
+        self.assertLessEqual(fitted.tokens, 300)
+        self.assertEqual(fitted.trimmed, ("conversa",))
+        self.assertIn("vendas " * 50, fitted.text)
+        self.assertTrue(fitted.text.startswith("Instrucoes fixas.\n"))
+
+    def test_untrimmable_prompt_fails_before_the_call(self) -> None:
+        with self.assertRaises(PromptTooLargeError) as ctx:
+            fit_prompt(
+                [PromptSection("fixo", "palavra " * 500)],
+                model="gpt-4o-mini",
+                name="t",
+                max_input_tokens=100,
+            )
+        self.assertEqual(ctx.exception.limit, 100)
+
+    def test_analysis_keeps_tail_of_long_conversation(self) -> None:
+        conversa = [{"text": f"mensagem numero {i}"} for i in range(3000)]
+        client = _CapturingClient()
+
+        analyze_single_chat(
+            client,
+            "gpt-4o-mini",
+            chat_id="c1",
+            conversa=conversa,
+            nome="Ana",
+            remote_jid="5511999999999",
+            criado_em=None,
+            modificado_em=None,
+            temas_urgentes="prazo",
+            temas_importantes=None,
+            blacklist=None,
+            max_input_tokens=1500,
+        )
+
+        self.assertLessEqual(estimate_tokens(client.user), 1500)
+        self.assertIn("[CONVERSA_TRUNCADA_TOTAL=", client.user)
+        self.assertIn("mensagem numero 2999", client.user)
+        self.assertNotIn("mensagem numero 10\"", client.user)
+        self.assertIn("Quem Mandou: Ana", client.user)
+
+    def test_analysis_prompt_starts_with_identical_static_prefix(self) -> None:
+        prompts = []
+        for nome, temas in (("Ana", "prazo, boleto"), ("Bruno", "contrato")):
+            client = _CapturingClient()
+            analyze_single_chat(
+                client,
+                "gemini-2.5-flash-lite",
+                chat_id=nome,
+                conversa=[{"text": f"oi, aqui e {nome}"}],
+                nome=nome,
+                remote_jid="5511999999999",
+                criado_em=None,
+                modificado_em=None,
+                temas_urgentes=temas,
+                temas_importantes=None,
+                blacklist=None,
+            )
+            prompts.append(client.user)
+
+        prefix = prompts[0][: prompts[0].index("CONTEXTO DE URGÊNCIA")]
+        self.assertTrue(prompts[1].startswith(prefix))
+        self.assertNotIn("prazo", prefix)
+        self.assertGreater(len(prefix), 1500)
+
+    def test_analysis_logs_cached_tokens_from_usage(self) -> None:
+        class _CachedClient(_CapturingClient):
+            def chat_json_response(self, model, system, user, temperature=0.2):
+                self.user = user
+                usage = OpenAIUsage(prompt_tokens=1400, completion_tokens=40, total_tokens=1440, cached_tokens=1152)
+                return ChatJsonResult(data={"Prioridade": "1", "Contexto": "ok"}, usage=usage)
+
+        with self.assertLogs("summi_worker.analysis", level="DEBUG") as logs:
+            _, usage = analyze_single_chat(
+                _CachedClient(),
+                "gpt-4o-mini",
+                chat_id="c1",
+                conversa=[{"text": "oi"}],
+                nome="Ana",
+                remote_jid="5511999999999",
+                criado_em=None,
+                modificado_em=None,
+                temas_urgentes=None,
+                temas_importantes=None,
+                blacklist=None,
+            )
+
+        self.assertEqual(usage.cached_tokens, 1152)
+        self.assertIn("cached_tokens=1152", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
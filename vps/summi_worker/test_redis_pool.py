@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import json
+import sys
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from summi_worker import budget_guard, vision_cache
+from summi_worker.budget_guard import get_budget_counter
+from summi_worker.cost_ledger import CostLedger
+from summi_worker.redis_pool import LATENCY, LatencyHistogram, get_redis
+from summi_worker.redis_queue import RedisQueueClient
+from summi_worker.vision_cache import VisionCache, get_vision_cache
+
+
+class _ScriptFake:
+    def __init__(self, redis_fake: "_RedisFake") -> None:
+        self._redis = redis_fake
+
+    def __call__(self, keys, args):
+        # Mesma semantica do DEDUPE_AND_ENQUEUE_SCRIPT.
+        self._redis.round_trips += 1
+        dedupe_key, queue_name = keys
+        if dedupe_key in self._redis.values:
+            return 0
+        self._redis.values[dedupe_key] = "1"
+        self._redis.lists.setdefault(queue_name, []).append(args[1])
+        return 1
+
+
+class _PipelineFake:
+    def __init__(self, redis_fake: "_RedisFake") -> None:
+        self._redis = redis_fake
+        self._ops = []
+
+    def set(self, key, value, ex=None):
+        self._ops.append(lambda: self._redis.values.__setitem__(key, value))
+
+    def rpush(self, name, value):
+        self._ops.append(lambda: self._redis.lists.setdefault(name, []).append(value))
+
+    def execute(self):
+        self._redis.round_trips += 1
+        for op in self._ops:
+            op()
+
+
+class _RedisFake:
+    def __init__(self) -> None:
+        self.values: dict[str, str] = {}
+        self.lists: dict[str, list[str]] = {}
+        self.round_trips = 0
+
+    def blpop(self, name, timeout=0):
+        items = self.lists.get(name) or []
+        return (name, items.pop(0)) if items else None
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def register_script(self, script: str) -> _ScriptFake:
+        return _ScriptFake(self)
+
+    def pipeline(self, transaction: bool = True) -> _PipelineFake:
+        return _PipelineFake(self)
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_snapshot_reports_buckets_and_quantiles(self) -> None:
+        histogram = LatencyHistogram((1.0, 5.0, 10.0))
+        for elapsed_ms in (0.4, 0.8, 3.0, 4.0, 50.0):
+            histogram.observe("dedupe.set_nx", elapsed_ms)
+
+        snapshot = histogram.snapshot()["dedupe.set_nx"]
+
+        self.assertEqual(snapshot["count"], 5)
+        self.assertEqual(snapshot["buckets"], {"le_1ms": 2, "le_5ms": 2, "gt_max": 1})
+        self.assertEqual(snapshot["p50_ms"], 5.0)
+        self.assertIsNone(snapshot["p99_ms"])
+
+
+class RedisQueueClientTest(unittest.TestCase):
+    def test_enqueue_once_collapses_repeated_jobs(self) -> None:
+        redis_fake = _RedisFake()
+        queue = RedisQueueClient(redis=redis_fake)
+
+        first = queue.enqueue_once("summi:analysis:queued:u1:5511", 30, "summi:queue:analysis", {"user_id": "u1"})
+        second = queue.enqueue_once("summi:analysis:queued:u1:5511", 30, "summi:queue:analysis", {"user_id": "u1"})
+
+        self.assertTrue(first)
+        self.assertFalse(second)
+        self.assertEqual(
+            [json.loads(raw) for raw in redis_fake.lists["summi:queue:analysis"]],
+            [{"user_id": "u1", "dedupe_key": "summi:analysis:queued:u1:5511"}],
+        )
+
+    def test_dequeue_releases_dedupe_key_for_later_messages(self) -> None:
+        redis_fake = _RedisFake()
+        queue = RedisQueueClient(redis=redis_fake)
+        key = "summi:analysis:queued:u1:5511"
+
+        self.assertTrue(queue.enqueue_once(key, 30, "summi:queue:analysis", {"message_id": "A1"}))
+        self.assertFalse(queue.enqueue_once(key, 30, "summi:queue:analysis", {"message_id": "A2"}))
+        job = queue.dequeue_blocking("summi:queue:analysis")
+
+        self.assertEqual(job["message_id"], "A1")
+        self.assertNotIn(key, redis_fake.values)
+        # Mensagem que chega com o job ja em execucao gera um novo job.
+        self.assertTrue(queue.enqueue_once(key, 30, "summi:queue:analysis", {"message_id": "A3"}))
+
+    def test_set_json_and_enqueue_uses_one_round_trip(self) -> None:
+        redis_fake = _RedisFake()
+        queue = RedisQueueClient(redis=redis_fake)
+
+        queue.set_json_and_enqueue("summi:run_now:result:j1", {"status": "processing"}, 600, "summi:queue:summary", {"job_id": "j1"})
+
+        self.assertEqual(redis_fake.round_trips, 1)
+        self.assertEqual(json.loads(redis_fake.values["summi:run_now:result:j1"]), {"status": "processing"})
+        self.assertEqual(len(redis_fake.lists["summi:queue:summary"]), 1)
+
+    def test_get_redis_shares_client_per_url(self) -> None:
+        self.assertIsNone(get_redis(""))
+        client = get_redis("redis://localhost:6399/0")
+        self.assertIs(get_redis("redis://localhost:6399/0"), client)
+
+    def test_webhook_path_redis_users_share_the_pooled_client(self) -> None:
+        url = "redis://localhost:6399/1"
+        settings = SimpleNamespace(
+            redis_url=url,
+            enable_vision_cache=True,
+            vision_cache_ttl_seconds=3600,
+            enable_budget_counter=True,
+            budget_counter_reconcile_seconds=900,
+            enable_cost_ledger=True,
+            supabase_url="https://example.supabase.co",
+            supabase_service_role_key="key",
+        )
+        client = get_redis(url)
+
+        # Caches de processo isolados: o contador ativo nao vaza para outros testes.
+        with patch.dict(vision_cache._CACHES, clear=True), patch.dict(budget_guard._COUNTERS, clear=True), patch.object(
+            budget_guard, "_ACTIVE_COUNTER", None
+        ):
+            self.assertIs(get_vision_cache(settings)._client, client)
+            self.assertIs(get_budget_counter(settings).client, client)
+            self.assertIs(CostLedger.from_settings(settings)._client, client)
+
+    def test_vision_cache_lookups_are_timed(self) -> None:
+        LATENCY.reset()
+        redis_fake = _RedisFake()
+        redis_fake.get = redis_fake.values.get
+        cache = VisionCache(redis_fake)
+
+        self.assertIsNone(cache.get("gpt-4o-mini", b"png"))
+
+        self.assertEqual(LATENCY.snapshot()["vision_cache.get"]["count"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
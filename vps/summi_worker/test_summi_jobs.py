@@ -18,24 +18,30 @@ if "mutagen" not in sys.modules:
 try:
     from .summi_jobs import (
         analyze_user_chats,
+        pending_daily_summary_shards,
         _build_summary_items,
         _chat_has_new_event_since_analysis,
         _summary_chat_filters,
         _summary_is_due,
         _within_business_hours,
         _unique_active_user_ids,
+        _daily_summary_shard,
+        run_daily_summary_job,
         run_hourly_job,
         run_user_summi_now,
     )
 except ImportError:
     from summi_jobs import (
         analyze_user_chats,
+        pending_daily_summary_shards,
         _build_summary_items,
         _chat_has_new_event_since_analysis,
         _summary_chat_filters,
         _summary_is_due,
         _within_business_hours,
         _unique_active_user_ids,
+        _daily_summary_shard,
+        run_daily_summary_job,
         run_hourly_job,
         run_user_summi_now,
     )
@@ -229,6 +235,56 @@ class SummiJobsTest(unittest.TestCase):
         )
         self.assertTrue(any(table == "cost_logs" for table, _rows in supabase.insert_calls))
 
+    def test_analyze_user_chats_uses_candidates_rpc_in_one_round_trip(self) -> None:
+        settings = SimpleNamespace(ignore_remote_jid="556293984600", openai_model_analysis="gpt-4o-mini")
+        chat = {
+            "id": "chat-1",
+            "id_usuario": "user-1",
+            "remote_jid": "5562911111111",
+            "nome": "Contato",
+            "analisado_em": "2026-03-05T09:00:00+00:00",
+            "ultimo_evento_em": "2026-03-05T09:10:00+00:00",
+            "conversa": [{"text": "oi"}],
+        }
+
+        class _SupabaseFake:
+            def __init__(self) -> None:
+                self.rpc_calls = []
+
+            def select(self, table, select="*", filters=None, order=None, limit=None):
+                if table == "profiles":
+                    return [{"id": "user-1"}]
+                raise AssertionError(f"unexpected select on {table}")
+
+            def rpc(self, fn, payload):
+                self.rpc_calls.append((fn, payload))
+                return [chat] if fn == "chats_needing_analysis" else None
+
+            def patch(self, table, data, filters=None):
+                return None
+
+            def insert(self, table, rows):
+                return rows
+
+        supabase = _SupabaseFake()
+        analyzed = []
+
+        def _analyze(*args, **kwargs):
+            analyzed.append(kwargs["chat_id"])
+            return (
+                SimpleNamespace(chat_id="chat-1", prioridade="1", nome="Contato", telefone="", contexto="", horario=None),
+                None,
+            )
+
+        with patch.dict(analyze_user_chats.__globals__, {"analyze_single_chat": _analyze}):
+            analyze_user_chats(settings, supabase, openai=object(), user_id="user-1", remote_jids=["5562911111111"])
+
+        fn, payload = supabase.rpc_calls[0]
+        self.assertEqual(fn, "chats_needing_analysis")
+        self.assertEqual(payload["p_remote_jids"], ["5562911111111"])
+        self.assertEqual(payload["p_ignore_remote_jid"], "556293984600")
+        self.assertEqual(analyzed, ["chat-1"])
+
     def test_within_business_hours_uses_configured_timezone(self) -> None:
         settings = SimpleNamespace(
             business_hours_start=8,
@@ -408,6 +464,150 @@ class SummiJobsTest(unittest.TestCase):
         self.assertEqual(evolution.sent_text, 0)
         self.assertEqual(released, [])
 
+    def test_run_hourly_job_uses_due_index_without_scanning_subscribers(self) -> None:
+        settings = SimpleNamespace(
+            ignore_remote_jid="556293984600",
+            business_hours_start=8,
+            business_hours_end=18,
+            business_hours_timezone="America/Sao_Paulo",
+            summi_sender_instance="Summi",
+            redis_url="redis://example",
+        )
+        due_profile = {
+            "id": "user-1",
+            "numero": "5562999999999",
+            "summi_frequencia": "1h",
+            "ultimo_summi_em": "2026-03-05T09:00:00+00:00",
+            "onboarding_completed": True,
+            "apenas_horario_comercial": True,
+        }
+
+        class _SupabaseFake:
+            def __init__(self) -> None:
+                self.rpc_calls = []
+                self.patch_calls = []
+
+            def select(self, table, select="*", filters=None, order=None, limit=None):
+                raise AssertionError(f"unexpected select on {table}")
+
+            def patch(self, table, data, filters=None):
+                self.patch_calls.append((table, data, filters))
+
+            def rpc(self, fn, payload):
+                self.rpc_calls.append(fn)
+                return [due_profile]
+
+        supabase = _SupabaseFake()
+        now_outside_hours = datetime.datetime(2026, 3, 5, 23, 30, tzinfo=datetime.timezone.utc)
+
+        class _FrozenDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return now_outside_hours
+
+        with patch.dict(
+            run_hourly_job.__globals__,
+            {
+                "RedisDedupe": lambda _url: SimpleNamespace(seen_or_mark=lambda *a: False, release=lambda key: None),
+                "dt": SimpleNamespace(datetime=_FrozenDatetime, timezone=datetime.timezone, timedelta=datetime.timedelta),
+            },
+        ):
+            result = run_hourly_job(settings, supabase, openai=object(), evolution=object())
+
+        self.assertTrue(result["due_index"])
+        self.assertEqual(result["unique_subscribers"], 1)
+        self.assertEqual(result["skipped_outside_business_hours"], 1)
+        self.assertEqual(supabase.rpc_calls, ["summi_due_profiles"])
+        # 20:30 em Sao Paulo -> proxima janela as 08:00 locais (11:00 UTC) do dia seguinte.
+        self.assertEqual(
+            supabase.patch_calls,
+            [("profiles", {"proximo_summi_em": "2026-03-06T11:00:00+00:00"}, [("id", "eq.user-1")])],
+        )
+
+    def test_load_due_profiles_pages_with_keyset_cursor(self) -> None:
+        pages = [
+            [
+                {"id": "u1", "proximo_summi_em": None},
+                {"id": "u2", "proximo_summi_em": "2026-03-05T08:00:00+00:00"},
+            ],
+            [{"id": "u3", "proximo_summi_em": "2026-03-05T09:00:00+00:00"}],
+        ]
+        payloads = []
+
+        class _SupabaseFake:
+            def rpc(self, fn, payload):
+                payloads.append(dict(payload))
+                return pages[len(payloads) - 1]
+
+        now = datetime.datetime(2026, 3, 5, 14, 0, tzinfo=datetime.timezone.utc)
+        with patch.dict(run_hourly_job.__globals__, {"DUE_PROFILES_BATCH_LIMIT": 2}):
+            profiles = run_hourly_job.__globals__["_load_due_profiles"](_SupabaseFake(), now_utc=now)
+
+        self.assertEqual([p["id"] for p in profiles], ["u1", "u2", "u3"])
+        self.assertNotIn("p_after_id", payloads[0])
+        self.assertEqual(payloads[1]["p_after_id"], "u2")
+        self.assertEqual(payloads[1]["p_after_due"], "2026-03-05T08:00:00+00:00")
+
+    def test_run_hourly_job_defers_due_users_skipped_without_send(self) -> None:
+        settings = SimpleNamespace(
+            ignore_remote_jid="556293984600",
+            business_hours_start=8,
+            business_hours_end=18,
+            business_hours_timezone="America/Sao_Paulo",
+            summi_sender_instance="Summi",
+            redis_url="redis://example",
+        )
+        due_profiles = [
+            {
+                "id": "no-items",
+                "numero": "5562999999999",
+                "summi_frequencia": "3h",
+                "ultimo_summi_em": None,
+                "onboarding_completed": True,
+            },
+            {"id": "no-number", "numero": "", "summi_frequencia": "1h", "onboarding_completed": True},
+        ]
+
+        class _SupabaseFake:
+            def __init__(self) -> None:
+                self.patch_calls = []
+
+            def select(self, table, select="*", filters=None, order=None, limit=None):
+                return []
+
+            def patch(self, table, data, filters=None):
+                self.patch_calls.append((data, filters))
+
+            def rpc(self, fn, payload):
+                return due_profiles
+
+        supabase = _SupabaseFake()
+        now = datetime.datetime(2026, 3, 5, 14, 0, tzinfo=datetime.timezone.utc)
+
+        class _FrozenDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return now
+
+        with patch.dict(
+            run_hourly_job.__globals__,
+            {
+                "analyze_user_chats": lambda *args, **kwargs: None,
+                "RedisDedupe": lambda _url: SimpleNamespace(seen_or_mark=lambda *a: False, release=lambda key: None),
+                "dt": SimpleNamespace(datetime=_FrozenDatetime, timezone=datetime.timezone, timedelta=datetime.timedelta),
+            },
+        ):
+            result = run_hourly_job(settings, supabase, openai=object(), evolution=object())
+
+        self.assertEqual(result["skipped_no_priority_items"], 1)
+        self.assertEqual(
+            sorted(supabase.patch_calls, key=lambda call: call[1][0][1]),
+            [
+                ({"proximo_summi_em": "2026-03-05T17:00:00+00:00"}, [("id", "eq.no-items")]),
+                ({"proximo_summi_em": "2026-03-05T15:00:00+00:00"}, [("id", "eq.no-number")]),
+            ],
+        )
+
     def test_run_hourly_job_records_analyze_error_reason_and_releases_lock(self) -> None:
         settings = SimpleNamespace(
             ignore_remote_jid="556293984600",
@@ -559,6 +759,61 @@ class SummiJobsTest(unittest.TestCase):
             )
         )
 
+    def test_run_hourly_job_marks_send_before_job_finishes(self) -> None:
+        settings = SimpleNamespace(
+            ignore_remote_jid="556293984600",
+            business_hours_start=8,
+            business_hours_end=18,
+            business_hours_timezone="America/Sao_Paulo",
+            summi_sender_instance="Summi",
+            redis_url="redis://example",
+        )
+        profile = {
+            "id": "user-1",
+            "numero": "5562999999999",
+            "summi_frequencia": "1h",
+            "ultimo_summi_em": None,
+            "onboarding_completed": False,
+        }
+        chat = {"id": "chat-1", "nome": "Contato", "remote_jid": "5562911111111", "prioridade": "3", "contexto": "Responder"}
+        patches = []
+
+        class _SupabaseFake:
+            def select(self, table, select="*", filters=None, order=None, limit=None):
+                if table == "subscribers":
+                    return [{"user_id": "user-1", "subscription_end": "2099-01-01T00:00:00+00:00", "subscribed": True}]
+                if table == "profiles":
+                    return [profile]
+                return [chat] if table == "chats" else []
+
+            def patch(self, table, data, filters=None):
+                patches.append(data)
+
+            def rpc(self, *args, **kwargs):
+                return None
+
+        def _crash(*args, **kwargs):
+            raise KeyboardInterrupt()
+
+        with patch.dict(
+            run_hourly_job.__globals__,
+            {
+                "analyze_user_chats": lambda *args, **kwargs: None,
+                "send_onboarding_messages": lambda *args, **kwargs: None,
+                "get_user_budget_state": lambda *args, **kwargs: SimpleNamespace(plan_kind="paid"),
+                "build_summary_text": lambda *args, **kwargs: "Resumo",
+                "_within_business_hours": lambda *args, **kwargs: True,
+                "_should_send_summi_audio": _crash,
+                "RedisDedupe": lambda _url: SimpleNamespace(seen_or_mark=lambda *a: False, release=lambda key: None),
+            },
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                run_hourly_job(settings, _SupabaseFake(), openai=object(), evolution=SimpleNamespace(send_text=lambda *a: None))
+
+        # Processo "caiu" depois do envio: os marcadores ja estavam gravados.
+        self.assertEqual(patches[0], {"onboarding_completed": True})
+        self.assertIn("ultimo_summi_em", patches[1])
+
     def test_run_hourly_job_records_summary_error_and_releases_lock(self) -> None:
         settings = SimpleNamespace(
             ignore_remote_jid="556293984600",
@@ -645,6 +900,150 @@ class SummiJobsTest(unittest.TestCase):
             )
         )
 
+    def test_run_daily_summary_job_processes_only_its_shard_and_skips_checkpointed_users(self) -> None:
+        settings = SimpleNamespace(
+            ignore_remote_jid="556293984600",
+            summi_sender_instance="Summi",
+            redis_url="redis://example",
+            daily_summary_concurrency=2,
+        )
+        user_ids = [f"user-{i}" for i in range(12)]
+        shard_users = [uid for uid in user_ids if _daily_summary_shard(uid, 3) == 1]
+        checkpointed = shard_users[0]
+        processed = []
+
+        class _SupabaseFake:
+            def select(self, table, select="*", filters=None, order=None, limit=None):
+                if table == "subscribers":
+                    return [{"user_id": uid} for uid in user_ids]
+                raise AssertionError(f"unexpected select on {table}")
+
+        marked = []
+
+        def _fake_send(*args, user_id, now_utc, **kwargs):
+            processed.append(user_id)
+            return "sent"
+
+        with patch.dict(
+            run_daily_summary_job.__globals__,
+            {
+                "_send_daily_summary_for_user": _fake_send,
+                "RedisDedupe": lambda _url: SimpleNamespace(
+                    exists=lambda key: key.endswith(f":{checkpointed}"),
+                    seen_or_mark=lambda key, ttl: marked.append(key) or False,
+                    release=lambda key: None,
+                ),
+            },
+        ):
+            result = run_daily_summary_job(settings, _SupabaseFake(), object(), object(), shard_index=1, shard_count=3)
+
+        self.assertEqual(sorted(processed), sorted(shard_users[1:]))
+        self.assertEqual(result["unique_subscribers"], len(shard_users))
+        self.assertEqual(result["sent"], len(shard_users) - 1)
+        self.assertEqual(result["skipped_checkpointed"], 1)
+        self.assertEqual(len([k for k in marked if k.startswith("summi:daily:done:")]), len(shard_users) - 1)
+        self.assertEqual([k for k in marked if k.startswith("summi:daily:shard_done:")][-1].split(":")[-1], "1/3")
+
+    def test_run_daily_summary_job_leaves_shard_pending_when_a_user_fails(self) -> None:
+        settings = SimpleNamespace(
+            ignore_remote_jid="556293984600",
+            summi_sender_instance="Summi",
+            redis_url="redis://example",
+            daily_summary_hour_utc=19,
+            daily_summary_timezone="UTC",
+            daily_summary_shards=1,
+            daily_summary_window_minutes=0,
+        )
+        user_ids = ["user-1", "user-2", "user-3"]
+        keys = set()
+        fake_checkpoint = SimpleNamespace(
+            enabled=True,
+            exists=lambda key: key in keys,
+            seen_or_mark=lambda key, ttl: key in keys or keys.add(key) or False,
+            release=lambda key: keys.discard(key),
+        )
+        failing = {"user-2"}
+        processed = []
+
+        class _SupabaseFake:
+            def select(self, table, select="*", filters=None, order=None, limit=None):
+                if table == "subscribers":
+                    return [{"user_id": uid} for uid in user_ids]
+                raise AssertionError(f"unexpected select on {table}")
+
+        def _fake_send(*args, user_id, now_utc, **kwargs):
+            processed.append(user_id)
+            if user_id in failing:
+                raise RuntimeError("evolution offline")
+            return "sent"
+
+        now = datetime.datetime(2026, 3, 10, 19, 30, tzinfo=datetime.timezone.utc)
+        with patch.dict(
+            run_daily_summary_job.__globals__,
+            {"_send_daily_summary_for_user": _fake_send, "RedisDedupe": lambda _url: fake_checkpoint},
+        ):
+            first = run_daily_summary_job(
+                settings, _SupabaseFake(), object(), object(), shard_index=0, shard_count=1, day="2026-03-10"
+            )
+            pending = pending_daily_summary_shards(settings, now_utc=now)
+            failing.clear()
+            processed.clear()
+            second = run_daily_summary_job(
+                settings, _SupabaseFake(), object(), object(), shard_index=0, shard_count=1, day="2026-03-10"
+            )
+            after_retry = pending_daily_summary_shards(settings, now_utc=now)
+
+        self.assertEqual(first["errors"], 1)
+        self.assertEqual(pending, [(0, "2026-03-10")])
+        self.assertEqual(processed, ["user-2"])
+        self.assertEqual(second["sent"], 1)
+        self.assertEqual(second["skipped_checkpointed"], 2)
+        self.assertEqual(after_retry, [])
+
+    def test_pending_daily_summary_shards_resumes_shards_without_completion_checkpoint(self) -> None:
+        settings = SimpleNamespace(
+            redis_url="redis://example",
+            daily_summary_hour_utc=19,
+            daily_summary_timezone="UTC",
+            daily_summary_shards=3,
+            daily_summary_window_minutes=60,
+        )
+        done = {"summi:daily:shard_done:2026-03-10:0/3"}
+        fake_checkpoint = SimpleNamespace(enabled=True, exists=lambda key: key in done)
+
+        with patch.dict(pending_daily_summary_shards.__globals__, {"RedisDedupe": lambda _url: fake_checkpoint}):
+            # 19:30: shard 0 (19:00) concluiu, shard 1 (19:20) caiu no meio, shard 2 (19:40) ainda nao disparou.
+            during = pending_daily_summary_shards(
+                settings, now_utc=datetime.datetime(2026, 3, 10, 19, 30, tzinfo=datetime.timezone.utc)
+            )
+            # Processo voltou 23:00 (ainda dentro da janela de retomada).
+            after_restart = pending_daily_summary_shards(
+                settings, now_utc=datetime.datetime(2026, 3, 10, 23, 0, tzinfo=datetime.timezone.utc)
+            )
+            next_morning = pending_daily_summary_shards(
+                settings, now_utc=datetime.datetime(2026, 3, 11, 9, 0, tzinfo=datetime.timezone.utc)
+            )
+
+        self.assertEqual(during, [(1, "2026-03-10")])
+        self.assertEqual(after_restart, [(1, "2026-03-10"), (2, "2026-03-10")])
+        self.assertEqual(next_morning, [])
+
+    def test_pending_daily_summary_shards_without_redis_resumes_nothing(self) -> None:
+        settings = SimpleNamespace(
+            redis_url=None,
+            daily_summary_hour_utc=19,
+            daily_summary_timezone="UTC",
+            daily_summary_shards=2,
+            daily_summary_window_minutes=60,
+        )
+
+        self.assertEqual(
+            pending_daily_summary_shards(
+                settings, now_utc=datetime.datetime(2026, 3, 10, 19, 45, tzinfo=datetime.timezone.utc)
+            ),
+            [],
+        )
+
     def test_run_user_summi_now_skips_without_active_subscription(self) -> None:
         settings = SimpleNamespace(
             ignore_remote_jid="556293984600",
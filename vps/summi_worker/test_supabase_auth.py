@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import sys
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker.supabase_auth import SupabaseJwtVerifier, SupabaseTokenError, TokenUserCache
+
+try:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+except Exception:  # pragma: no cover
+    ec = None
+
+
+SUPABASE_URL = "https://ref.supabase.co"
+NOW = 1_700_000_000
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _claims(**overrides: object) -> dict:
+    claims = {
+        "sub": "user-1",
+        "role": "authenticated",
+        "aud": "authenticated",
+        "iss": f"{SUPABASE_URL}/auth/v1",
+        "exp": NOW + 3600,
+    }
+    claims.update(overrides)
+    return claims
+
+
+def _hs256_token(secret: str, claims: dict) -> str:
+    header = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    payload = _b64(json.dumps(claims).encode())
+    signature = hmac.new(secret.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{_b64(signature)}"
+
+
+class _Response:
+    def __init__(self, body: dict) -> None:
+        self.ok = True
+        self.status_code = 200
+        self._body = body
+
+    def json(self) -> dict:
+        return self._body
+
+
+class SupabaseJwtVerifierTest(unittest.TestCase):
+    def test_hs256_token_is_verified_locally(self) -> None:
+        verifier = SupabaseJwtVerifier(SUPABASE_URL, jwt_secret="secret", clock=lambda: NOW)
+
+        claims = verifier.verify(_hs256_token("secret", _claims()))
+
+        self.assertEqual(claims["sub"], "user-1")
+
+    def test_hs256_rejects_bad_signature_and_expired_tokens(self) -> None:
+        verifier = SupabaseJwtVerifier(SUPABASE_URL, jwt_secret="secret", clock=lambda: NOW)
+
+        with self.assertRaises(SupabaseTokenError):
+            verifier.verify(_hs256_token("other", _claims()))
+        with self.assertRaises(SupabaseTokenError):
+            verifier.verify(_hs256_token("secret", _claims(exp=NOW - 120)))
+        with self.assertRaises(SupabaseTokenError):
+            verifier.verify(_hs256_token("secret", _claims(role="service_role")))
+
+    def test_without_secret_returns_none_so_caller_can_fall_back(self) -> None:
+        verifier = SupabaseJwtVerifier(SUPABASE_URL, clock=lambda: NOW)
+
+        self.assertIsNone(verifier.verify(_hs256_token("secret", _claims())))
+
+    @unittest.skipIf(ec is None, "cryptography not installed")
+    def test_es256_refetches_jwks_when_kid_rotates(self) -> None:
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        numbers = private_key.public_key().public_numbers()
+        jwk = {
+            "kty": "EC",
+            "crv": "P-256",
+            "kid": "key-2",
+            "x": _b64(numbers.x.to_bytes(32, "big")),
+            "y": _b64(numbers.y.to_bytes(32, "big")),
+        }
+        fetches: list[str] = []
+        jwks_by_call = [{"keys": []}, {"keys": [jwk]}]
+
+        def http_get(url: str, timeout: int) -> _Response:
+            fetches.append(url)
+            return _Response(jwks_by_call[min(len(fetches), len(jwks_by_call)) - 1])
+
+        clock = {"now": NOW}
+        verifier = SupabaseJwtVerifier(SUPABASE_URL, http_get=http_get, clock=lambda: clock["now"])
+
+        header = _b64(json.dumps({"alg": "ES256", "kid": "key-2"}).encode())
+        payload = _b64(json.dumps(_claims()).encode())
+        der = private_key.sign(f"{header}.{payload}".encode(), ec.ECDSA(hashes.SHA256()))
+        r, s = decode_dss_signature(der)
+        token = f"{header}.{payload}.{_b64(r.to_bytes(32, 'big') + s.to_bytes(32, 'big'))}"
+
+        self.assertIsNone(verifier.verify(token))
+        clock["now"] += 60
+        claims = verifier.verify(token)
+
+        self.assertEqual(claims["sub"], "user-1")
+        self.assertEqual(len(fetches), 2)
+        self.assertTrue(fetches[0].endswith("/auth/v1/.well-known/jwks.json"))
+
+        verifier.verify(token)
+        self.assertEqual(len(fetches), 2)
+
+
+class TokenUserCacheTest(unittest.TestCase):
+    def test_entries_expire_at_ttl_or_token_exp(self) -> None:
+        clock = {"now": 1000.0}
+        cache = TokenUserCache(60, clock=lambda: clock["now"])
+
+        cache.put("token-a", "user-a")
+        cache.put("token-b", "user-b", token_exp=1010.0)
+
+        self.assertEqual(cache.get("token-a"), "user-a")
+        self.assertEqual(cache.get("token-b"), "user-b")
+        clock["now"] = 1011.0
+        self.assertEqual(cache.get("token-a"), "user-a")
+        self.assertIsNone(cache.get("token-b"))
+        clock["now"] = 1061.0
+        self.assertIsNone(cache.get("token-a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
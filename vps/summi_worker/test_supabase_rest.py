@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker.supabase_rest import (
+    Projection,
+    SupabaseError,
+    SupabaseRest,
+    to_postgrest_filter_contains,
+    to_postgrest_filter_in,
+)
+
+
+REQUESTS_GET_TARGET = f"{SupabaseRest.__module__}.requests.get"
+REQUESTS_PATCH_TARGET = f"{SupabaseRest.__module__}.requests.patch"
+
+
+class _FakeResponse:
+    def __init__(self, status_code: int = 200, text: str = "[]") -> None:
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 300
+        self.text = text
+        self.content = text.encode("utf-8")
+
+    def json(self):
+        import json
+
+        return json.loads(self.text)
+
+
+def _query(call) -> dict:
+    return parse_qs(urlparse(call.args[0]).query)
+
+
+class SupabaseRestSelectTest(unittest.TestCase):
+    def test_projection_quotes_legacy_columns(self) -> None:
+        projection = Projection("p", ("id", "Summi em Audio?"))
+        client = SupabaseRest("https://x.supabase.co", "key")
+
+        with patch(REQUESTS_GET_TARGET, return_value=_FakeResponse(text='[{"id": "u1"}]')) as get:
+            rows = client.select("profiles", select=projection, limit=1)
+
+        self.assertEqual(rows, [{"id": "u1"}])
+        self.assertEqual(_query(get.call_args)["select"], ['id,"Summi em Audio?"'])
+
+    def test_missing_column_falls_back_to_star(self) -> None:
+        client = SupabaseRest("https://x.supabase.co", "key")
+        responses = [
+            _FakeResponse(400, '{"code":"42703","message":"column profiles.nova does not exist"}'),
+            _FakeResponse(text='[{"id": "u1"}]'),
+        ]
+
+        with patch(REQUESTS_GET_TARGET, side_effect=responses) as get:
+            rows = client.select("profiles", select=Projection("p", ("id", "nova")))
+
+        self.assertEqual(rows, [{"id": "u1"}])
+        self.assertEqual(_query(get.call_args_list[1])["select"], ["*"])
+
+    def test_audit_logs_response_size_per_call_site(self) -> None:
+        client = SupabaseRest("https://x.supabase.co", "key", audit_response_sizes=True)
+
+        with patch(REQUESTS_GET_TARGET, return_value=_FakeResponse(text='[{"id": "c1"}]')):
+            with self.assertLogs("summi_worker.supabase_rest", level="INFO") as logs:
+                client.select("chats", select=Projection("chat_audio_precheck", ("id",)))
+                client.select("chats", select="id")
+
+        self.assertIn("site=chat_audio_precheck bytes=14 rows=1", logs.output[0])
+        self.assertIn("site=test_supabase_rest.py:", logs.output[1])
+
+    def test_contains_filter_serializes_compact_json(self) -> None:
+        self.assertEqual(
+            to_postgrest_filter_contains("conversa", [{"message_id": "ABC", "audio_transcribed": True}]),
+            ("conversa", 'cs.[{"message_id":"ABC","audio_transcribed":true}]'),
+        )
+
+
+    def test_in_filter_quotes_reserved_characters(self) -> None:
+        self.assertEqual(
+            to_postgrest_filter_in("id", ["u1", "a,b", 'x"y']),
+            ("id", 'in.(u1,"a,b","x\\"y")'),
+        )
+
+
+class SupabaseRestBulkTest(unittest.TestCase):
+    def test_select_all_pages_with_range_header(self) -> None:
+        client = SupabaseRest("https://x.supabase.co", "key")
+        responses = [
+            _FakeResponse(text='[{"id": 1}, {"id": 2}]'),
+            _FakeResponse(text='[{"id": 3}]'),
+            _FakeResponse(text="[]"),
+        ]
+
+        with patch(REQUESTS_GET_TARGET, side_effect=responses) as get:
+            rows = client.select_all("subscribers", select="id", order="id.asc", page_size=2)
+
+        self.assertEqual([row["id"] for row in rows], [1, 2, 3])
+        self.assertEqual(
+            [call.kwargs["headers"]["Range"] for call in get.call_args_list],
+            ["0-1", "2-3", "3-4"],
+        )
+        self.assertNotIn("limit", _query(get.call_args_list[0]))
+
+    def test_select_all_treats_416_as_end(self) -> None:
+        client = SupabaseRest("https://x.supabase.co", "key")
+        responses = [
+            _FakeResponse(text='[{"id": 1}, {"id": 2}]'),
+            _FakeResponse(416, '{"code":"PGRST103"}'),
+        ]
+
+        with patch(REQUESTS_GET_TARGET, side_effect=responses):
+            rows = client.select_all("subscribers", select="id", page_size=2)
+
+        self.assertEqual(len(rows), 2)
+
+    def test_select_all_keeps_paging_past_server_max_rows(self) -> None:
+        client = SupabaseRest("https://x.supabase.co", "key")
+        # PostgREST com max-rows=2: pede 3 por pagina e recebe 2.
+        responses = [
+            _FakeResponse(text='[{"id": 1}, {"id": 2}]'),
+            _FakeResponse(text='[{"id": 3}, {"id": 4}]'),
+            _FakeResponse(text='[{"id": 5}]'),
+            _FakeResponse(416, '{"code":"PGRST103"}'),
+        ]
+
+        with patch(REQUESTS_GET_TARGET, side_effect=responses) as get:
+            rows = client.select_all("subscribers", select="id", order="id.asc", page_size=3)
+
+        self.assertEqual([row["id"] for row in rows], [1, 2, 3, 4, 5])
+        self.assertEqual(
+            [call.kwargs["headers"]["Range"] for call in get.call_args_list],
+            ["0-2", "2-4", "4-6", "5-7"],
+        )
+
+    def test_patch_many_groups_rows_into_one_rpc_per_column_set(self) -> None:
+        client = SupabaseRest("https://x.supabase.co", "key")
+        rows = [
+            {"id": "c1", "prioridade": "2", "contexto": "a"},
+            {"id": "c2", "prioridade": "0", "contexto": "b"},
+            {"id": "c3", "analisado_em": "2026-03-14T09:00:00+00:00"},
+        ]
+
+        with patch.object(client, "rpc", side_effect=[2, 1]) as rpc:
+            updated = client.patch_many("chats", rows)
+
+        self.assertEqual(updated, 3)
+        self.assertEqual(rpc.call_count, 2)
+        first_payload = rpc.call_args_list[0].args[1]
+        self.assertEqual(first_payload["p_table"], "chats")
+        self.assertEqual([row["id"] for row in first_payload["p_rows"]], ["c1", "c2"])
+
+    def test_patch_many_falls_back_to_row_patches_without_rpc(self) -> None:
+        client = SupabaseRest("https://x.supabase.co", "key")
+        rows = [{"id": "u1", "ultimo_summi_em": "t1"}, {"id": "u2", "ultimo_summi_em": "t2"}]
+
+        with patch.object(client, "rpc", side_effect=SupabaseError("rpc failed: 404")):
+            with patch(REQUESTS_PATCH_TARGET, return_value=_FakeResponse(204, "")) as patch_call:
+                with self.assertLogs("summi_worker.supabase_rest", level="WARNING"):
+                    updated = client.patch_many("profiles", rows)
+
+        self.assertEqual(updated, 2)
+        self.assertEqual([_query(call)["id"] for call in patch_call.call_args_list], [["eq.u1"], ["eq.u2"]])
+        self.assertEqual(patch_call.call_args_list[0].kwargs["data"], b'{"ultimo_summi_em":"t1"}')
+
+    def test_patch_many_raises_rpc_errors_other_than_missing_function(self) -> None:
+        client = SupabaseRest("https://x.supabase.co", "key")
+        rows = [{"id": "u1", "ultimo_summi_em": "t1"}]
+
+        with patch.object(client, "rpc", side_effect=SupabaseError("rpc failed: 503 service unavailable")):
+            with patch(REQUESTS_PATCH_TARGET) as patch_call:
+                with self.assertRaises(SupabaseError):
+                    client.patch_many("profiles", rows)
+
+        patch_call.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
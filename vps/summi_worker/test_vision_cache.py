@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import sys
+import types
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+if "mutagen" not in sys.modules:
+    mutagen_stub = types.ModuleType("mutagen")
+    mutagen_stub.File = lambda *args, **kwargs: None
+    sys.modules["mutagen"] = mutagen_stub
+
+from summi_worker.openai_client import OpenAIUsage, VisionResult
+from summi_worker.vision_cache import VisionCache, _LocalLru, image_cache_key
+
+
+class _RedisFake:
+    def __init__(self) -> None:
+        self.values: dict[str, str] = {}
+        self.ttls: dict[str, int] = {}
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+    def set(self, key: str, value: str, ex: int | None = None):
+        self.values[key] = value
+        self.ttls[key] = ex
+        return True
+
+
+class VisionCacheTest(unittest.TestCase):
+    def test_hit_is_shared_across_processes_and_has_no_usage(self) -> None:
+        redis_fake = _RedisFake()
+        usage = OpenAIUsage(prompt_tokens=1300, completion_tokens=80, total_tokens=1380)
+        VisionCache(redis_fake, ttl_seconds=3600).put("gpt-4o-mini", b"sticker-bytes", VisionResult(text="Figurinha de gato", usage=usage))
+
+        other_process = VisionCache(redis_fake)
+        hit = other_process.get("gpt-4o-mini", b"sticker-bytes")
+
+        self.assertIsNotNone(hit)
+        self.assertEqual(hit.text, "Figurinha de gato")
+        self.assertIsNone(hit.usage)
+        self.assertEqual(redis_fake.ttls[image_cache_key("gpt-4o-mini", b"sticker-bytes")], 3600)
+        self.assertIsNone(other_process.get("gemini-2.5-flash", b"sticker-bytes"))
+        self.assertIsNone(other_process.get("gpt-4o-mini", b"other-bytes"))
+
+    def test_local_lru_evicts_oldest_entries_past_byte_limit(self) -> None:
+        lru = _LocalLru(max_entries=10, max_bytes=10)
+        lru.put("a", "aaaa")
+        lru.put("b", "bbbb")
+        lru.get("a")
+        lru.put("c", "cccc")
+
+        self.assertEqual(lru.get("a"), "aaaa")
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("c"), "cccc")
+        self.assertEqual(len(lru), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+import unittest
+from pathlib import Path
+from typing import AsyncIterator, List
+
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from summi_worker.webhook_prefilter import UnmonitoredGroupCache, read_and_prefilter
+from summi_worker.webhook_samples import sample_payloads
+
+
+SAMPLES = dict(sample_payloads())
+SUMMI_JID = "556293984600"
+
+
+class _Chunks:
+    def __init__(self, body: bytes, size: int) -> None:
+        self.pieces: List[bytes] = [body[index : index + size] for index in range(0, len(body), size)]
+        self.consumed = 0
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        for piece in self.pieces:
+            self.consumed += 1
+            yield piece
+
+
+def _scan(body: bytes, *, size: int = 1024, unmonitored: UnmonitoredGroupCache | None = None, prefix_bytes: int = 4096):
+    chunks = _Chunks(body, size)
+    scanned = asyncio.run(
+        read_and_prefilter(chunks.stream(), ignore_remote_jid=SUMMI_JID, unmonitored=unmonitored, prefix_bytes=prefix_bytes)
+    )
+    return scanned, chunks
+
+
+def _body(payload: object) -> bytes:
+    return json.dumps(payload).encode("utf-8")
+
+
+class ReadAndPrefilterTest(unittest.TestCase):
+    def test_ignored_event_stops_after_prefix(self) -> None:
+        payload = {"event": "PRESENCE_UPDATE", "instance": "x", "data": {"blob": "A" * 50_000}}
+        scanned, chunks = _scan(_body(payload))
+
+        self.assertEqual(scanned.reason, "ignored_event")
+        self.assertEqual(scanned.hint.event_norm, "presence.update")
+        self.assertLess(chunks.consumed, len(chunks.pieces))
+
+    def test_upsert_passes_with_complete_body(self) -> None:
+        body = _body(SAMPLES["audio_n8n_body"])
+        scanned, _ = _scan(body, size=700)
+
+        self.assertIsNone(scanned.reason)
+        self.assertEqual(scanned.body, body)
+        self.assertEqual(scanned.hint.instance_name, "lucasborges_5286")
+        self.assertEqual(scanned.hint.remote_jid, "120363000000@g.us")
+
+    def test_update_without_reaction_is_dropped_and_reaction_split_across_chunks_passes(self) -> None:
+        status = {"event": "messages.update", "instance": "x", "data": {"key": {"remoteJid": "5511@s.whatsapp.net"}, "status": "READ"}}
+        scanned, _ = _scan(_body(status))
+        self.assertEqual(scanned.reason, "ignored_update_event")
+
+        reaction = _body({"event": "messages.update", "pad": "B" * 5000, **{"data": SAMPLES["reaction_update"]["data"]}})
+        marker_at = reaction.index(b'"reactionMessage"')
+        scanned, _ = _scan(reaction, size=marker_at + 5)
+        self.assertIsNone(scanned.reason)
+        self.assertEqual(scanned.body, reaction)
+
+    def test_internal_thread_uses_lid_alt_jid(self) -> None:
+        payload = {
+            "event": "messages.upsert",
+            "instance": "x",
+            "data": {"key": {"remoteJid": "2600@lid", "remoteJidAlt": f"{SUMMI_JID}@s.whatsapp.net", "id": "A"}},
+        }
+        scanned, _ = _scan(_body(payload))
+        self.assertEqual(scanned.reason, "internal_summi_thread")
+
+    def test_unknown_or_escaped_fields_are_not_rejected(self) -> None:
+        scanned, _ = _scan(b'{"event":"presence\\u002eupdate","data":{}}')
+        self.assertIsNone(scanned.reason)
+        scanned, _ = _scan(b"")
+        self.assertIsNone(scanned.reason)
+        self.assertEqual(scanned.body, b"")
+
+
+class UnmonitoredGroupCacheTest(unittest.TestCase):
+    def test_cached_group_drops_messages_but_not_reactions_until_ttl(self) -> None:
+        now = [100.0]
+        cache = UnmonitoredGroupCache(60, clock=lambda: now[0])
+        cache.add("LucasBorges_5286", "120363000000@g.us")
+        text = {
+            "event": "messages.upsert",
+            "instance": "lucasborges_5286",
+            "data": {"key": {"remoteJid": "120363000000@g.us", "id": "G1"}, "message": {"conversation": "oi"}},
+        }
+
+        scanned, _ = _scan(_body(text), unmonitored=cache)
+        self.assertEqual(scanned.reason, "group_not_monitored")
+
+        reaction = dict(text, data=dict(text["data"], message={"reactionMessage": {"key": {"id": "X"}, "text": "⚡"}}))
+        scanned, _ = _scan(_body(reaction), unmonitored=cache)
+        self.assertIsNone(scanned.reason)
+
+        now[0] += 61
+        scanned, _ = _scan(_body(text), unmonitored=cache)
+        self.assertIsNone(scanned.reason)
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+vision_cache.py — Cache de descricoes de imagem por conteudo.
+
+Figurinhas, memes, flyers encaminhados e fotos de catalogo se repetem entre
+chats e usuarios com os mesmos bytes. A chave e o SHA-256 da imagem + modelo
+de visao; o valor e so o texto da descricao (hit nao gera custo de IA).
+
+Dois niveis: LRU local limitado por entradas e por bytes de texto, na frente
+de um Redis compartilhado com TTL.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .openai_client import VisionResult
+from .redis_pool import get_redis, timed
+
+
+logger = logging.getLogger("summi_worker.vision_cache")
+
+KEY_PREFIX = "summi:vision:"
+LOCAL_MAX_ENTRIES = 2000
+LOCAL_MAX_BYTES = 4 * 1024 * 1024
+MAX_CACHED_TEXT_CHARS = 4000
+
+
+def image_cache_key(model: str, image_bytes: bytes) -> str:
+    return f"{KEY_PREFIX}{model}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+
+class _LocalLru:
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self._items: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._max_entries = max(1, int(max_entries))
+        self._max_bytes = max(1, int(max_bytes))
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous.encode("utf-8"))
+            self._items[key] = value
+            self._bytes += size
+            while len(self._items) > self._max_entries or self._bytes > self._max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted.encode("utf-8"))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class VisionCache:
+    def __init__(
+        self,
+        client: Any = None,
+        *,
+        ttl_seconds: int = 7 * 24 * 3600,
+        local_max_entries: int = LOCAL_MAX_ENTRIES,
+        local_max_bytes: int = LOCAL_MAX_BYTES,
+    ):
+        self._client = client
+        self._ttl = max(60, int(ttl_seconds))
+        self._local = _LocalLru(local_max_entries, local_max_bytes)
+
+    def get(self, model: str, image_bytes: bytes) -> Optional[VisionResult]:
+        key = image_cache_key(model, image_bytes)
+        text = self._local.get(key)
+        if text is None and self._client is not None:
+            try:
+                with timed("vision_cache.get"):
+                    text = self._client.get(key)
+            except Exception as exc:
+                logger.warning("vision_cache.redis_get_failed error=%s", exc)
+                text = None
+            if text is not None:
+                self._local.put(key, text)
+        if text is None:
+            return None
+        return VisionResult(text=text, usage=None)
+
+    def put(self, model: str, image_bytes: bytes, result: VisionResult) -> None:
+        text = (result.text or "").strip()
+        if not text or len(text) > MAX_CACHED_TEXT_CHARS:
+            return
+        key = image_cache_key(model, image_bytes)
+        self._local.put(key, text)
+        if self._client is not None:
+            try:
+                with timed("vision_cache.set"):
+                    self._client.set(key, text, ex=self._ttl)
+            except Exception as exc:
+                logger.warning("vision_cache.redis_set_failed error=%s", exc)
+
+
+_CACHES: Dict[Tuple[str, int], VisionCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_vision_cache(settings: Any) -> Optional[VisionCache]:
+    """
+    Cache do processo (None quando ENABLE_VISION_CACHE=false). Sem Redis, so o LRU local.
+    """
+    if not getattr(settings, "enable_vision_cache", False):
+        return None
+    redis_url = str(getattr(settings, "redis_url", None) or "")
+    key = (redis_url, int(getattr(settings, "vision_cache_ttl_seconds", 7 * 24 * 3600)))
+    with _CACHES_LOCK:
+        cache = _CACHES.get(key)
+        if cache is None:
+            cache = VisionCache(get_redis(redis_url), ttl_seconds=key[1])
+            _CACHES[key] = cache
+        return cache
@@ -0,0 +1,257 @@
+"""
+webhook_prefilter.py — Descarte de eventos ignorados antes do parse do JSON.
+
+Grande parte do trafego do /webhooks/evolution e ruido (presence, chats.*,
+contacts.*, updates de status, a thread interna da Summi, grupos nao
+monitorados) e alguns corpos trazem megabytes de base64. Aqui o corpo e lido
+do stream em pedacos: os primeiros PREFIX_BYTES sao classificados por regex
+sobre bytes (event, instance, key.remoteJid/remoteJidAlt) e, quando o evento
+com certeza seria descartado, o handler responde sem ler o resto nem montar o
+dict.
+
+Regra: so descarta quando a resposta e certa. Campo ausente, escapado ou fora
+do prefixo -> None, e o evento segue para o parse completo de sempre.
+"""
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .prompt_builders import is_internal_summi_thread
+
+
+logger = logging.getLogger("summi_worker.webhook_prefilter")
+
+PREFIX_BYTES = 16 * 1024
+ALLOWED_EVENTS = ("messages.upsert", "messages.update")
+REACTION_MARKER = b'"reactionMessage"'
+GROUP_CACHE_MAX_ENTRIES = 50_000
+
+# Strings sem escape: valor com \" ou \uXXXX nao casa e o campo fica None.
+_EVENT_RE = re.compile(rb'"event"\s*:\s*"([^"\\]*)"')
+_INSTANCE_RE = re.compile(rb'"instance(?:Name)?"\s*:\s*"([^"\\]*)"')
+# Objeto key da mensagem e plano (remoteJid, fromMe, id, participant...).
+_KEY_RE = re.compile(rb'"key"\s*:\s*\{([^{}]*)\}')
+_REMOTE_JID_RE = re.compile(rb'"remoteJid"\s*:\s*"([^"\\]*)"')
+_REMOTE_JID_ALT_RE = re.compile(rb'"remoteJidAlt"\s*:\s*"([^"\\]*)"')
+
+
+def _match(pattern: "re.Pattern[bytes]", data: bytes) -> Optional[str]:
+    found = pattern.search(data)
+    if found is None:
+        return None
+    value = found.group(1).decode("utf-8", "replace").strip()
+    return value or None
+
+
+def normalize_event_name(event: Optional[str]) -> str:
+    # "MESSAGES_UPSERT" -> "messages.upsert" (mesma regra do handler).
+    return str(event or "").strip().lower().replace("_", ".")
+
+
+class PrefilterHint:
+    """
+    O que da para saber do prefixo do corpo sem parse. Campos None = desconhecido.
+    """
+
+    __slots__ = ("event", "instance_name", "remote_jid", "remote_jid_alt", "complete", "has_reaction")
+
+    def __init__(self, prefix: bytes, *, complete: bool) -> None:
+        self.event = _match(_EVENT_RE, prefix)
+        self.instance_name = _match(_INSTANCE_RE, prefix)
+        key = _KEY_RE.search(prefix)
+        key_body = key.group(1) if key is not None else b""
+        self.remote_jid = _match(_REMOTE_JID_RE, key_body)
+        self.remote_jid_alt = _match(_REMOTE_JID_ALT_RE, key_body)
+        self.complete = complete
+        # So e conclusivo quando o corpo inteiro foi visto (complete=True).
+        self.has_reaction = REACTION_MARKER in prefix
+
+    @property
+    def event_norm(self) -> str:
+        return normalize_event_name(self.event)
+
+    @property
+    def is_group(self) -> bool:
+        return bool(self.remote_jid and self.remote_jid.endswith("@g.us"))
+
+    @property
+    def chat_remote_jid(self) -> Optional[str]:
+        if not self.remote_jid:
+            return None
+        if self.remote_jid.endswith("@lid") and self.remote_jid_alt:
+            return self.remote_jid_alt
+        return self.remote_jid
+
+
+def classify_prefix(prefix: bytes, *, complete: bool) -> PrefilterHint:
+    return PrefilterHint(prefix, complete=complete)
+
+
+def reject_reason(hint: PrefilterHint, *, ignore_remote_jid: Optional[str]) -> Optional[str]:
+    """
+    Motivo de descarte decidido so pelo prefixo (sem olhar o tipo da mensagem).
+    """
+    event_norm = hint.event_norm
+    if event_norm and event_norm not in ALLOWED_EVENTS:
+        return "ignored_event"
+    if hint.chat_remote_jid and is_internal_summi_thread(hint.chat_remote_jid, ignore_remote_jid):
+        return "internal_summi_thread"
+    return None
+
+
+def needs_reaction_scan(hint: PrefilterHint, unmonitored: Optional["UnmonitoredGroupCache"]) -> Optional[str]:
+    """
+    Motivo que vale se o corpo nao tiver reacao: update que nao e reacao, ou
+    grupo que o handler ja viu como nao monitorado (reacoes em grupo passam).
+    """
+    if hint.has_reaction:
+        return None
+    if hint.event_norm == "messages.update":
+        return "ignored_update_event"
+    if (
+        unmonitored is not None
+        and hint.is_group
+        and hint.instance_name
+        and unmonitored.contains(hint.instance_name, hint.remote_jid or "")
+    ):
+        return "group_not_monitored"
+    return None
+
+
+class ScannedBody:
+    """
+    Resultado da leitura: `body` e o corpo completo quando o evento segue para o
+    parse; com `reason` preenchido o evento foi descartado e `body` pode ser so o
+    prefixo.
+    """
+
+    __slots__ = ("body", "hint", "reason", "bytes_read")
+
+    def __init__(self, body: bytes, hint: Optional[PrefilterHint], reason: Optional[str], bytes_read: int) -> None:
+        self.body = body
+        self.hint = hint
+        self.reason = reason
+        self.bytes_read = bytes_read
+
+
+async def read_and_prefilter(
+    chunks: AsyncIterator[bytes],
+    *,
+    ignore_remote_jid: Optional[str],
+    unmonitored: Optional["UnmonitoredGroupCache"] = None,
+    prefix_bytes: int = PREFIX_BYTES,
+) -> ScannedBody:
+    """
+    Le o stream do corpo. Descarte pelo prefixo nao le o restante; descarte que
+    depende de "nao e reacao" continua lendo, mas so procura REACTION_MARKER nos
+    pedacos (sem parse). Se a reacao aparecer, devolve o corpo completo.
+    """
+    parts: List[bytes] = []
+    size = 0
+    iterator = chunks.__aiter__()
+    exhausted = False
+    while size < prefix_bytes:
+        try:
+            chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            exhausted = True
+            break
+        if chunk:
+            parts.append(chunk)
+            size += len(chunk)
+    prefix = b"".join(parts)
+    hint = classify_prefix(prefix, complete=exhausted)
+
+    reason = reject_reason(hint, ignore_remote_jid=ignore_remote_jid)
+    if reason:
+        return ScannedBody(prefix, hint, reason, size)
+
+    pending = needs_reaction_scan(hint, unmonitored)
+    has_reaction = REACTION_MARKER in prefix
+    tail = prefix[-(len(REACTION_MARKER) - 1):]
+    if not exhausted:
+        async for chunk in iterator:
+            if not chunk:
+                continue
+            parts.append(chunk)
+            size += len(chunk)
+            if pending and not has_reaction:
+                # tail cobre o marcador partido entre dois pedacos.
+                window = tail + chunk
+                has_reaction = REACTION_MARKER in window
+                tail = window[-(len(REACTION_MARKER) - 1):]
+    body = b"".join(parts) if len(parts) > 1 else prefix
+    if pending and not has_reaction:
+        return ScannedBody(body, hint, pending, size)
+    return ScannedBody(body, hint, None, size)
+
+
+class UnmonitoredGroupCache:
+    """
+    Grupos que o handler ja consultou e achou fora de monitored_whatsapp_groups,
+    por (instance, group_jid), com TTL curto: um grupo ativado no painel volta a
+    ser processado em ate `ttl_seconds`.
+    """
+
+    def __init__(self, ttl_seconds: float, *, max_entries: int = GROUP_CACHE_MAX_ENTRIES, clock: Any = time.monotonic) -> None:
+        self._ttl = float(ttl_seconds)
+        self._max_entries = max(1, int(max_entries))
+        self._clock = clock
+        self._items: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(instance_name: str, group_jid: str) -> Tuple[str, str]:
+        return (instance_name.strip().lower(), group_jid.strip())
+
+    def add(self, instance_name: str, group_jid: str) -> None:
+        now = self._clock()
+        with self._lock:
+            if len(self._items) >= self._max_entries:
+                self._items = {key: expires for key, expires in self._items.items() if expires > now}
+                if len(self._items) >= self._max_entries:
+                    self._items.pop(next(iter(self._items)))
+            self._items[self._key(instance_name, group_jid)] = now + self._ttl
+
+    def discard(self, instance_name: str, group_jid: str) -> None:
+        with self._lock:
+            self._items.pop(self._key(instance_name, group_jid), None)
+
+    def contains(self, instance_name: str, group_jid: str) -> bool:
+        key = self._key(instance_name, group_jid)
+        with self._lock:
+            expires = self._items.get(key)
+            if expires is None:
+                return False
+            if expires <= self._clock():
+                self._items.pop(key, None)
+                return False
+            return True
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_GROUP_CACHES: Dict[float, UnmonitoredGroupCache] = {}
+_GROUP_CACHES_LOCK = threading.Lock()
+
+
+def get_unmonitored_group_cache(settings: Any) -> Optional[UnmonitoredGroupCache]:
+    """
+    Cache do processo (None com WEBHOOK_PREFILTER_GROUP_TTL_SECONDS=0 ou prefiltro desligado).
+    """
+    if not getattr(settings, "enable_webhook_prefilter", False):
+        return None
+    ttl = float(getattr(settings, "webhook_prefilter_group_ttl_seconds", 0) or 0)
+    if ttl <= 0:
+        return None
+    with _GROUP_CACHES_LOCK:
+        cache = _GROUP_CACHES.get(ttl)
+        if cache is None:
+            cache = UnmonitoredGroupCache(ttl)
+            _GROUP_CACHES[ttl] = cache
+        return cache
@@ -0,0 +1,48 @@
+"""
+webhook_samples.py — Payloads de exemplo do /webhooks/evolution (formatos v2,
+corpo embrulhado pelo n8n e update de reacao com @lid), usados pelos testes e
+pelos benchmarks em vps/benchmarks.
+"""
+from __future__ import annotations
+
+from typing import Any, List, Tuple
+
+
+def sample_payloads() -> List[Tuple[str, Any]]:
+    text_v2 = {
+        "event": "messages.upsert",
+        "instance": "lucasborges_5286",
+        "data": {
+            "key": {"remoteJid": "556299999999@s.whatsapp.net", "fromMe": False, "id": "3EB0C7A1"},
+            "pushName": "Contato",
+            "message": {"conversation": "Bom dia, o pedido ja saiu?"},
+            "messageType": "conversation",
+            "messageTimestamp": 1709000000,
+            "owner": "lucasborges_5286",
+            "source": "android",
+        },
+        "sender": "551188888888@s.whatsapp.net",
+    }
+    audio_n8n = {
+        "body": {
+            "event": "messages.upsert",
+            "instance": "lucasborges_5286",
+            "sender": "551188888888@s.whatsapp.net",
+            "data": {
+                "key": {"remoteJid": "120363000000@g.us", "fromMe": False, "id": "ABCD", "participant": "5562777@s.whatsapp.net"},
+                "pushName": "Grupo",
+                "message": {"audioMessage": {"seconds": 42, "ptt": True}, "base64": "T2dnUw==" * 2000},
+                "messageType": "audioMessage",
+                "messageTimestamp": 1709000001,
+            },
+        }
+    }
+    reaction_update = {
+        "event": "MESSAGES_UPDATE",
+        "instance": "lucasborges_5286",
+        "data": {
+            "key": {"remoteJid": "26000000000@lid", "remoteJidAlt": "556299999999@s.whatsapp.net", "fromMe": True, "id": "R1"},
+            "update": {"message": {"reactionMessage": {"key": {"id": "ABCD"}, "text": "⚡"}}},
+        },
+    }
+    return [("text_v2", text_v2), ("audio_n8n_body", audio_n8n), ("reaction_update", reaction_update)]